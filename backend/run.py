@@ -1,60 +1,49 @@
 """
 Convenience script to run the complete backend pipeline
+Brings data and models up to date with the stage orchestrator (only stages
+whose inputs changed rerun), then starts the API server
 """
 
-import sys
-import subprocess
-from pathlib import Path
-
-def run_command(cmd, description):
-    """Run a command and handle errors"""
-    print(f"\n{'='*60}")
-    print(f"🚀 {description}")
-    print(f"{'='*60}\n")
-    
-    try:
-        result = subprocess.run(cmd, shell=True, check=True, text=True)
-        print(f"✅ {description} completed successfully!\n")
-        return True
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Error during {description}")
-        print(f"Error: {e}\n")
-        return False
+import argparse
+
+import uvicorn
+import yaml
+
+from src.orchestrator import StageOrchestrator
+
 
 def main():
+    parser = argparse.ArgumentParser(description="CongestionAI backend setup & run")
+    parser.add_argument('--config', default="configs/params.yaml")
+    parser.add_argument('--targets', nargs='+', help="'global' and/or region keys (default: pipeline.targets)")
+    parser.add_argument('--force', nargs='+', default=[], help="Stages to rerun regardless of the cache")
+    parser.add_argument('--no-serve', action='store_true', help="Only run the pipeline")
+    parser.add_argument('--reload', action='store_true', help="Restart the server on code changes (development)")
+    args = parser.parse_args()
+
     print("""
     ╔══════════════════════════════════════════════════════════╗
     ║          CongestionAI Backend Setup & Run                ║
     ╚══════════════════════════════════════════════════════════╝
     """)
-    
-    # Check if model exists
-    model_path = Path("models/model.pkl")
-    data_path = Path("data/processed/train_ready.csv")
-    
-    if not data_path.exists():
-        print("📊 No processed data found. Running data pipeline...")
-        if not run_command("python -m src.data_pipeline", "Data Pipeline"):
-            sys.exit(1)
-    else:
-        print("✅ Processed data found, skipping data pipeline")
-    
-    if not model_path.exists():
-        print("\n🤖 No trained model found. Training model...")
-        if not run_command("python -m src.train_model", "Model Training"):
-            sys.exit(1)
-    else:
-        print("✅ Trained model found, skipping training")
-    
+
+    orchestrator = StageOrchestrator(args.config)
+    targets = args.targets or orchestrator.config.get('pipeline', {}).get('targets', ['global'])
+    orchestrator.run(targets, force=args.force)
+
+    if args.no_serve:
+        return
+
+    with open(args.config, 'r') as f:
+        api_config = yaml.safe_load(f)['api']
+
     print("\n🌐 Starting API server...")
-    print("API will be available at: http://localhost:8000")
-    print("API docs available at: http://localhost:8000/docs")
+    print(f"API will be available at: http://localhost:{api_config['port']}")
+    print(f"API docs available at: http://localhost:{api_config['port']}/docs")
     print("\nPress Ctrl+C to stop the server\n")
-    
-    try:
-        subprocess.run("uvicorn src.api:app --reload --host 0.0.0.0 --port 8000", shell=True)
-    except KeyboardInterrupt:
-        print("\n\n👋 Server stopped. Goodbye!")
+
+    uvicorn.run("src.api:app", host=api_config['host'], port=api_config['port'], reload=args.reload)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,162 @@
+"""
+Admission control for CongestionAI
+Per-endpoint concurrency limits with bounded queues. When the service is
+overloaded, requests that have a cheap fallback are answered from the
+lookup-table model (lookup_table.py) instead of joining the backlog, and the
+rest are rejected with 503, so latency stays bounded for everyone.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+
+class OverloadedError(Exception):
+    """No free slot, no queue space and no fallback (the API answers 503)"""
+
+    def __init__(self, endpoint: str, retry_after: int):
+        super().__init__(f"{endpoint} is overloaded; retry in {retry_after}s")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class EndpointGate:
+    """Concurrent full-model requests for one endpoint, and the bounded queue in front of them"""
+
+    def __init__(self, concurrency: int, queue: int):
+        self.concurrency = concurrency
+        self.queue = queue
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.counts = {'admitted': 0, 'queued': 0, 'degraded': 0, 'rejected': 0}
+
+    def stats(self) -> Dict:
+        return {
+            'concurrency': self.concurrency,
+            'queue': self.queue,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            **self.counts,
+        }
+
+
+class Ticket:
+    """
+    Outcome of admission: degraded (answer from the fallback) or a held slot,
+    released exactly once when the response is done
+    """
+
+    def __init__(self, controller: 'AdmissionController', gate: Optional[EndpointGate], degraded: bool):
+        self.controller = controller
+        self.gate = gate
+        self.degraded = degraded
+        self.holds_slot = gate is not None and not degraded
+
+    def release(self):
+        if self.holds_slot:
+            self.holds_slot = False
+            self.gate.in_flight -= 1
+            self.gate.semaphore.release()
+            self.controller.update_mode()
+
+
+class AdmissionController:
+    def __init__(self, config: Optional[Dict] = None):
+        """
+        Gates from admission.endpoints. Load is the share of slots and queue
+        places in use at the busiest endpoint (all endpoints share the same
+        CPUs); degraded mode starts at degrade_at and ends once load falls back
+        to recover_at, so it does not flap.
+        """
+        config = config or {}
+        self.enabled = config.get('enabled', False)
+        self.degrade_at = config.get('degrade_at', 0.5)
+        self.recover_at = config.get('recover_at', 0.25)
+        self.max_wait = config.get('max_wait', 1.0)
+        self.retry_after = config.get('retry_after', 1)
+        self.max_batch_locations = config.get('max_batch_locations', 10000)
+        self.gates = {
+            name: EndpointGate(limits['concurrency'], limits['queue'])
+            for name, limits in config.get('endpoints', {}).items()
+        }
+        self.degraded = False
+        self.transitions = 0
+
+    @property
+    def load(self) -> float:
+        return max(
+            ((gate.in_flight + gate.waiting) / (gate.concurrency + gate.queue) for gate in self.gates.values()),
+            default=0.0
+        )
+
+    def update_mode(self):
+        load = self.load
+        if not self.degraded and load >= self.degrade_at:
+            self.degraded = True
+            self.transitions += 1
+            print(f"[WARNING] Load {load:.0%}: answering from the lookup table where possible")
+        elif self.degraded and load <= self.recover_at:
+            self.degraded = False
+            print(f"[INFO] Load {load:.0%}: back to full model forecasts")
+
+    async def enter(self, endpoint: str, fallback: bool) -> Ticket:
+        """
+        Admit a request. fallback says whether a degraded answer is available
+        for it. In degraded mode such requests skip the queue entirely; others
+        wait up to max_wait for a slot. Raises OverloadedError when a request
+        can neither get a slot nor fall back.
+        """
+        gate = self.gates.get(endpoint)
+        if not self.enabled or gate is None:
+            return Ticket(self, None, False)
+
+        self.update_mode()
+        if fallback and self.degraded:
+            gate.counts['degraded'] += 1
+            return Ticket(self, gate, True)
+
+        if await self._acquire(gate):
+            gate.counts['admitted'] += 1
+            return Ticket(self, gate, False)
+
+        if fallback:
+            gate.counts['degraded'] += 1
+            return Ticket(self, gate, True)
+        gate.counts['rejected'] += 1
+        raise OverloadedError(endpoint, self.retry_after)
+
+    async def _acquire(self, gate: EndpointGate) -> bool:
+        if gate.semaphore.locked():
+            if gate.waiting >= gate.queue:
+                return False
+            gate.counts['queued'] += 1
+
+        gate.waiting += 1
+        self.update_mode()
+        try:
+            await asyncio.wait_for(gate.semaphore.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            gate.waiting -= 1
+        gate.in_flight += 1
+        return True
+
+    @asynccontextmanager
+    async def admit(self, endpoint: str, fallback: bool):
+        """enter() for a request whose work ends with the handler; yields the ticket"""
+        ticket = await self.enter(endpoint, fallback)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'degraded': self.degraded,
+            'load': round(self.load, 3),
+            'transitions': self.transitions,
+            'endpoints': {name: gate.stats() for name, gate in self.gates.items()},
+        }
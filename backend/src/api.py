@@ -3,15 +3,48 @@ FastAPI Application for CongestionAI
 RESTful API for traffic congestion predictions
 """
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Tuple
 from datetime import datetime, timedelta
+import asyncio
+import h3
 import numpy as np
+import os
+import yaml
 from pathlib import Path
 
+from .admission import AdmissionController, OverloadedError, Ticket
+from .approximate import ApproximateScorer
+from .capture import CaptureMiddleware, RequestRecorder, request_now
+from .cluster import HOP_HEADER, MODEL_HEADER, ShardRouter, encode_array
+from .drift import untracked
+from .http_cache import etag_matches, forecast_etag, forecast_max_age, hour_bucket
 from .infer import CongestionPredictor
+from .jobs import JobError, JobManager, TooManyJobsError, columnar_page, forecast_inputs, route_inputs, time_range
+from .lookup_table import LookupTableProvider
+from .routing import load_router
+from .spatial import AreaTooLargeError, area_id, bbox_to_polygon, cover_polygon
+from .serialization import (
+    ARROW_MEDIA_TYPE,
+    NDJSON_MEDIA_TYPE,
+    NPY_MEDIA_TYPE,
+    ChunkStreamEncoder,
+    UnsupportedMediaTypeError,
+    build_columnar_batch,
+    decode_batch_request,
+    encode_response,
+    negotiate_encoding,
+)
+from .subscriptions import SubscriptionHub
+
+# Load configuration (CONFIG_PATH points a node at another file, e.g. for python -m src.cluster local)
+with open(os.getenv('CONFIG_PATH', "configs/params.yaml"), 'r') as f:
+    config = yaml.safe_load(f)
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -29,22 +62,152 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize predictor (lazy loading)
+# Initialize predictor and road-graph router (lazy loading)
 predictor = None
+router = None
+router_checked = False
 
 def get_predictor():
     """Get or initialize predictor"""
     global predictor
     if predictor is None:
-        model_path = Path("models/model.pkl")
+        # MODEL_PATH pins another model file (e.g. for python -m src.replay)
+        model_path = Path(os.getenv('MODEL_PATH', "models/model.pkl"))
         if not model_path.exists():
             raise HTTPException(
                 status_code=503,
                 detail="Model not found. Please train the model first using: python -m src.train_model"
             )
-        predictor = CongestionPredictor(str(model_path))
+        predictor = CongestionPredictor(
+            str(model_path),
+            cache_config=config.get('cache'),
+            weather_config=config.get('weather'),
+            router_config=config.get('model_router'),
+            regions=config.get('regions'),
+            drift_config=config.get('drift')
+        )
+        if predictor.weather_prefetcher is not None:
+            predictor.weather_prefetcher.start()
+        if admission.enabled:
+            # Distil (or load) the fallback table now, not under the first overload
+            lookup_tables.get(predictor)
     return predictor
 
+# Live area feeds shared by all WebSocket/SSE subscribers
+subscription_hub = SubscriptionHub(get_predictor, config.get('subscriptions'))
+
+def get_router():
+    """Get the road-graph router, or None when no graph is available"""
+    global router, router_checked
+    if not router_checked:
+        router = load_router(get_predictor(), config)
+        router_checked = True
+    return router
+
+# Load shedding: per-endpoint limits, and the lookup table answering requests that are shed
+admission = AdmissionController(config.get('admission'))
+lookup_tables = LookupTableProvider(config.get('lookup_table', {}), config.get('regions', {}))
+
+# Opt-in sampling of incoming requests to capture files (played back by python -m src.replay)
+recorder = RequestRecorder(
+    config.get('capture'),
+    version=lambda: predictor.models_version if predictor is not None else None
+)
+app.add_middleware(
+    CaptureMiddleware,
+    recorder=recorder,
+    replay_clock=config.get('capture', {}).get('replay_clock', False)
+)
+# Uvicorn stops on SIGTERM without running atexit handlers
+app.router.add_event_handler("shutdown", recorder.close)
+
+# Cluster mode: this node's H3 shards, and the peers owning the others
+shard_router = ShardRouter(config.get('cluster'))
+
+# Asynchronous jobs (/jobs): chunks scored in a process pool, results in part files
+job_manager = JobManager(config)
+app.router.add_event_handler("shutdown", job_manager.close)
+
+# Parts a degraded (lookup-table) answer can carry; the rest need features and the model
+LOOKUP_FIELDS = ('score', 'risk', 'interval', 'h3_cell')
+DEGRADED_HEADERS = {"X-Forecast-Source": "lookup-table", "Cache-Control": "no-store"}
+
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError):
+    """503 with Retry-After when a request can neither be admitted nor answered from the lookup table"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+def fallback_table(pred):
+    """Lookup table for degraded answers, or None (admission disabled or table not built yet)"""
+    return lookup_tables.get(pred) if admission.enabled else None
+
+def degraded_parts(pred, table, lats, lons, timestamp, fields: Tuple[str, ...]) -> Tuple[dict, Tuple[str, ...]]:
+    """(parts, fields served) from the lookup table; parts that need the model are left out"""
+    served = tuple(f for f in fields if f in LOOKUP_FIELDS)
+    parts = pred.compute_fields(None, lats, lons, served, bands=table.lookup(lats, lons, timestamp))
+    return parts, served
+
+def degraded_response(payload: dict, fields: Tuple[str, ...], encoding: str = "json",
+                      headers: Optional[dict] = None) -> Response:
+    """
+    Flag a lookup-table answer in the body and headers. It must not be cached
+    or revalidated under the full forecast's ETag.
+    """
+    payload["degraded"] = True
+    omitted = [f for f in fields if f not in LOOKUP_FIELDS]
+    if omitted:
+        payload["omitted_fields"] = omitted
+    headers = {k: v for k, v in (headers or {}).items() if k != "ETag"}
+    headers.update(DEGRADED_HEADERS)
+    response = encode_response(payload, encoding)
+    response.headers.update(headers)
+    return response
+
+FIELDS_DESCRIPTION = (
+    "Comma-separated response parts to compute: "
+    "score, risk, interval, h3_cell, factors, recommendations, explanations"
+)
+
+# Columnar payload column for each optional field
+FIELD_COLUMNS = {
+    'h3_cell': 'h3_cell',
+    'factors': 'top_factors',
+    'recommendations': 'recommendations',
+    'explanations': 'shap_factors',
+}
+
+def parse_fields(fields: Optional[str], default: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Validate a fields query parameter (400 on unknown fields)"""
+    try:
+        return CongestionPredictor.parse_fields(fields, default)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def interval_columns(bands: np.ndarray) -> dict:
+    """Columnar interval bounds (NaN for models without an interval)"""
+    return {
+        'congestion_lower': np.round(bands[:, 0].astype(np.float32), 3),
+        'congestion_upper': np.round(bands[:, 2].astype(np.float32), 3),
+    }
+
+def columnar_from_parts(pred, lats, lons, parts: dict, fields: Tuple[str, ...], timestamp_iso: str) -> dict:
+    """Columnar payload holding only the requested fields"""
+    extra_columns = interval_columns(parts['bands']) if 'interval' in fields else {}
+    extra_columns.update({FIELD_COLUMNS[f]: parts[f] for f in fields if f in FIELD_COLUMNS})
+    return build_columnar_batch(
+        lats, lons,
+        parts['score'] if 'score' in fields else None,
+        risk_codes=parts['risk_codes'] if 'risk' in fields else None,
+        risk_levels=pred.RISK_LEVELS,
+        timestamp=timestamp_iso,
+        confidence=parts['confidence'],
+        extra_columns=extra_columns
+    )
+
 
 # Pydantic models for request/response
 class LocationRequest(BaseModel):
@@ -56,6 +219,41 @@ class BatchLocationRequest(BaseModel):
     locations: List[dict] = Field(..., description="List of {latitude, longitude} objects")
     timestamp: Optional[str] = Field(None, description="ISO format timestamp")
 
+class ColumnarBatchRequest(BaseModel):
+    latitudes: List[float] = Field(..., description="Latitude of each location")
+    longitudes: List[float] = Field(..., description="Longitude of each location")
+    timestamps: Optional[List[str]] = Field(None, description="Optional ISO timestamp per location")
+    timestamp: Optional[str] = Field(None, description="ISO format timestamp shared by all locations")
+
+class AreaRequest(BaseModel):
+    bbox: Optional[List[float]] = Field(
+        None, min_length=4, max_length=4,
+        description="Bounding box [min_lat, min_lon, max_lat, max_lon]"
+    )
+    polygon: Optional[List[List[float]]] = Field(
+        None, description="Polygon outer ring as [[lat, lon], ...]"
+    )
+    resolution: Optional[int] = Field(None, ge=0, le=15, description="H3 resolution (overrides zoom)")
+    zoom: Optional[float] = Field(None, ge=0, le=22, description="Map zoom level used to pick a resolution")
+    timestamp: Optional[str] = Field(None, description="ISO format timestamp")
+
+class AreaSubscription(BaseModel):
+    bbox: Optional[List[float]] = Field(
+        None, min_length=4, max_length=4,
+        description="Bounding box [min_lat, min_lon, max_lat, max_lon]"
+    )
+    polygon: Optional[List[List[float]]] = Field(
+        None, description="Polygon outer ring as [[lat, lon], ...]"
+    )
+    resolution: Optional[int] = Field(None, ge=0, le=15, description="H3 resolution (overrides zoom)")
+    zoom: Optional[float] = Field(None, ge=0, le=22, description="Map zoom level used to pick a resolution")
+    hours_ahead: int = Field(3, ge=0, le=168, description="Forecast horizon in hours (0-168)")
+
+class ObservationRequest(BaseModel):
+    observations: List[dict] = Field(
+        ..., description="List of {h3_cell or latitude/longitude, plus a value per neighbour state column}"
+    )
+
 class RouteRequest(BaseModel):
     start_lat: float = Field(..., ge=-90, le=90)
     start_lon: float = Field(..., ge=-180, le=180)
@@ -69,6 +267,28 @@ class TimeseriesRequest(BaseModel):
     start_time: Optional[str] = Field(None, description="ISO format timestamp")
     hours_ahead: int = Field(72, ge=3, le=168, description="Hours to forecast (3-168)")
 
+class JobRequest(BaseModel):
+    kind: str = Field(..., pattern="^(forecast|timeseries|route)$", description="forecast, timeseries or route")
+    locations: Optional[List[dict]] = Field(
+        None, description="[{latitude, longitude, timestamp (optional, forecast only)}, ...]"
+    )
+    bbox: Optional[List[float]] = Field(
+        None, min_length=4, max_length=4,
+        description="Bounding box [min_lat, min_lon, max_lat, max_lon] (forecast: every H3 cell covering it)"
+    )
+    polygon: Optional[List[List[float]]] = Field(None, description="Polygon outer ring as [[lat, lon], ...]")
+    resolution: Optional[int] = Field(None, ge=0, le=15, description="H3 resolution (overrides zoom)")
+    zoom: Optional[float] = Field(None, ge=0, le=22, description="Map zoom level used to pick a resolution")
+    timestamp: Optional[str] = Field(None, description="ISO format timestamp of a single-time forecast")
+    start_time: Optional[str] = Field(None, description="ISO format timestamp of the first time point")
+    hours_ahead: Optional[int] = Field(None, ge=0, le=744, description="Time points up to this many hours after start_time")
+    step_hours: Optional[int] = Field(None, ge=1, le=24, description="Hours between time points")
+    routes: Optional[List[RouteRequest]] = Field(None, description="Routes to simulate (route jobs)")
+
+class CellBandsRequest(BaseModel):
+    cells: List[str] = Field(..., description="H3 cells owned by the receiving cluster node")
+    timestamp: str = Field(..., description="ISO format timestamp")
+
 
 # API Endpoints
 @app.get("/")
@@ -81,9 +301,18 @@ async def root():
         "endpoints": {
             "forecast": "/forecast",
             "batch_forecast": "/batch_forecast",
+            "area_forecast": "/area_forecast",
             "route_simulate": "/route_simulate",
             "timeseries": "/timeseries",
-            "insights": "/insights"
+            "forecast_cell": "/forecast/cell/{h3_cell} (GET, cacheable)",
+            "forecast_area_tile": "/forecast/area/{h3_cell} (GET, cacheable)",
+            "timeseries_cell": "/timeseries/cell/{h3_cell} (GET, cacheable)",
+            "insights": "/insights",
+            "drift": "/drift",
+            "jobs": "/jobs",
+            "observations": "/observations",
+            "subscribe_area": "/subscribe/area (SSE)",
+            "ws_area": "/ws/area (WebSocket)"
         }
     }
 
@@ -95,7 +324,19 @@ async def health_check():
         return {
             "status": "healthy",
             "model_loaded": pred.model is not None,
-            "features_count": len(pred.feature_names) if pred.feature_names else 0
+            "model_version": pred.model_version,
+            "models_version": pred.models_version,
+            "features_count": len(pred.feature_names) if pred.feature_names else 0,
+            "quantiles": pred.quantiles,
+            "forecast_cache": pred.forecast_cache.stats(),
+            "weather": pred.weather_prefetcher.stats() if pred.weather_prefetcher else None,
+            "regional_models": pred.model_router.stats() if pred.model_router else None,
+            "subscriptions": subscription_hub.stats(),
+            "admission": admission.stats(),
+            "lookup_table": lookup_tables.stats() if admission.enabled else None,
+            "capture": recorder.stats() if recorder.enabled else None,
+            "cluster": shard_router.stats() if shard_router.enabled else None,
+            "jobs": job_manager.stats() if job_manager.enabled else None
         }
     except Exception as e:
         return {
@@ -104,12 +345,18 @@ async def health_check():
         }
 
 @app.post("/forecast")
-async def forecast_single(request: LocationRequest):
+async def forecast_single(
+    request: LocationRequest,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+):
     """
     Predict congestion for a single location and time
     
     Returns congestion score, risk level, contributing factors, and recommendations
+    (by default; use fields to choose exactly which parts are computed)
     """
+    selected = parse_fields(fields, CongestionPredictor.DEFAULT_SINGLE_FIELDS)
+    
     try:
         pred = get_predictor()
         
@@ -117,30 +364,386 @@ async def forecast_single(request: LocationRequest):
         if request.timestamp:
             timestamp = datetime.fromisoformat(request.timestamp.replace('Z', '+00:00'))
         else:
-            timestamp = datetime.now() + timedelta(hours=3)
+            timestamp = request_now() + timedelta(hours=3)
         
-        # Get prediction
-        result = pred.predict_single(
-            lat=request.latitude,
-            lon=request.longitude,
-            timestamp=timestamp
-        )
+        table = fallback_table(pred)
+        async with admission.admit('forecast', table is not None) as ticket:
+            if ticket.degraded:
+                lats, lons = [request.latitude], [request.longitude]
+                parts, served = degraded_parts(pred, table, lats, lons, timestamp, selected)
+                result = pred.format_rows(lats, lons, timestamp, parts, served)[0]
+                return degraded_response({"success": True, "data": result}, selected)
+            
+            # Get prediction (off the event loop, so queued requests keep being admitted or shed)
+            result = await run_in_threadpool(
+                pred.predict_single, request.latitude, request.longitude, timestamp, None, selected
+            )
         
         return {
             "success": True,
             "data": result
         }
     
+    except (HTTPException, OverloadedError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/batch_forecast")
-async def forecast_batch(request: BatchLocationRequest):
+# Request body formats accepted by /batch_forecast (documented for OpenAPI; decoded manually)
+BATCH_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {
+                "schema": {
+                    "oneOf": [
+                        BatchLocationRequest.model_json_schema(),
+                        ColumnarBatchRequest.model_json_schema(),
+                    ]
+                }
+            },
+            NPY_MEDIA_TYPE: {
+                "schema": {"type": "string", "format": "binary",
+                           "description": "(n, 2) float [latitude, longitude] rows, or structured "
+                                          "latitude/longitude[/timestamp] fields"}
+            },
+            ARROW_MEDIA_TYPE: {
+                "schema": {"type": "string", "format": "binary",
+                           "description": "Arrow IPC with latitude, longitude[, timestamp] columns"}
+            },
+        }
+    }
+}
+
+@app.post("/batch_forecast", openapi_extra=BATCH_REQUEST_BODY)
+async def forecast_batch(
+    http_request: Request,
+    response_format: str = Query(
+        "rows",
+        alias="format",
+        pattern="^(rows|columnar)$",
+        description="rows: one object per location (default); columnar: parallel arrays"
+    ),
+    stream: bool = Query(False, description="Stream results chunk by chunk as NDJSON / chunked binary"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION + " (default: score, risk)"),
+    timestamp: Optional[str] = Query(None, description="Shared ISO timestamp for bodies without one (binary uploads)"),
+    approximate: bool = Query(False, description="Score coarse H3 cells and anchor hours, then interpolate"),
+    approx_resolution: Optional[int] = Query(
+        None, ge=5, le=10, description="H3 resolution of the coarse cells (default: approximate.resolution)"
+    ),
+    anchor_hours: Optional[int] = Query(
+        None, ge=1, le=24, description="Hours between scored times (default: approximate.anchor_hours)"
+    )
+):
     """
     Predict congestion for multiple locations at the same time
     
-    Useful for generating heatmaps
+    Useful for generating heatmaps. The request body is JSON rows
+    ({locations: [...]}), JSON columns ({latitudes, longitudes, timestamps?}),
+    a NumPy .npy array or an Arrow IPC table, chosen by Content-Type.
+    The response encoding is chosen from the Accept header: application/json
+    (default), application/msgpack or application/vnd.apache.arrow.stream.
+    Binary encodings are always columnar.
+    With stream=true (or Accept: application/x-ndjson) locations are scored in
+    fixed-size chunks and each chunk is sent as soon as it is ready.
+    fields adds per-location parts (h3_cell, factors, ...), computed vectorized
+    over the batch.
+    With approximate=true, scores and intervals are interpolated from coarse
+    cells and anchor hours (see python -m src.approximate report for the error).
+    """
+    selected = parse_fields(fields, CongestionPredictor.DEFAULT_BATCH_FIELDS) if fields else None
+    if approximate and stream:
+        raise HTTPException(status_code=400, detail="approximate is not available for streamed responses")
+    encoding = negotiate_encoding(http_request.headers.get("accept"))
+    if encoding is None:
+        raise HTTPException(
+            status_code=406,
+            detail="Supported media types: application/json, application/msgpack, "
+                   "application/vnd.apache.arrow.stream"
+        )
+    
+    # Decode the body straight into coordinate arrays (no per-location models)
+    body = await http_request.body()
+    try:
+        batch = decode_batch_request(body, http_request.headers.get("content-type"))
+    except UnsupportedMediaTypeError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    lats, lons = batch['latitude'], batch['longitude']
+    if len(lats) > admission.max_batch_locations:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {admission.max_batch_locations} locations per request; split the batch"
+        )
+    
+    ticket = None
+    try:
+        pred = get_predictor()
+        
+        # Parse timestamp (per-row timestamps take precedence)
+        shared_timestamp = batch['timestamp'] or timestamp
+        if shared_timestamp:
+            timestamp = datetime.fromisoformat(shared_timestamp.replace('Z', '+00:00'))
+        else:
+            timestamp = request_now() + timedelta(hours=3)
+        row_times = batch['timestamps'] if batch['timestamps'] is not None else timestamp
+        
+        table = fallback_table(pred)
+        ticket = await admission.enter('batch_forecast', table is not None)
+        if ticket.degraded:
+            return await run_in_threadpool(
+                degraded_batch, pred, table, lats, lons, row_times, timestamp,
+                selected, response_format, encoding, stream
+            )
+        
+        if (stream or encoding == "ndjson") and not approximate:
+            # The stream holds its admission slot until the last chunk is sent
+            response = stream_batch_forecast(
+                pred, lats, lons, row_times, http_request, response_format, encoding, selected, ticket
+            )
+            ticket = None
+            return response
+        
+        approx_settings = None
+        if approximate:
+            approx_settings = ApproximateScorer(pred, config.get('approximate')).settings(approx_resolution, anchor_hours)
+        bands = None
+        if shard_router.active and HOP_HEADER not in http_request.headers:
+            # Each node scores the locations of its own shards
+            bands = await shard_router.point_bands(
+                lats, lons, row_times, lambda rows: batch_bands(pred, lats, lons, row_times, approx_settings, rows),
+                pred.models_version, approx_query(approx_settings)
+            )
+        return await run_in_threadpool(
+            batch_response, pred, lats, lons, row_times, timestamp, selected, response_format, encoding,
+            approx_settings, bands
+        )
+    
+    except (HTTPException, OverloadedError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if ticket is not None:
+            ticket.release()
+
+def batch_response(pred, lats, lons, row_times, timestamp: datetime, selected, response_format: str, encoding: str,
+                   approximate: Optional[dict] = None, bands: Optional[np.ndarray] = None):
+    """
+    /batch_forecast payload (rows) or encoded response (columnar, or NDJSON
+    for approximate requests). With approximate settings, bands come from
+    ApproximateScorer; with bands given (scored by the cluster), they are
+    used as is. Either way features are only built for factors,
+    recommendations and explanations.
+    """
+    if bands is None and approximate is not None:
+        bands = batch_bands(pred, lats, lons, row_times, approximate)
+    
+    fields = selected or CongestionPredictor.DEFAULT_BATCH_FIELDS
+    
+    def compute_parts():
+        if bands is None:
+            needs_features = pred.needs_features(fields)
+        else:
+            needs_features = any(f in fields for f in ('factors', 'recommendations', 'explanations'))
+        features_df = pred.build_features(lats, lons, row_times) if needs_features else None
+        return pred.compute_fields(features_df, lats, lons, fields, bands=bands)
+    
+    if response_format == "columnar" or encoding not in ("json", "ndjson"):
+        if selected or bands is not None:
+            payload = columnar_from_parts(pred, lats, lons, compute_parts(), fields, timestamp.isoformat())
+        else:
+            bands = pred.predict_intervals(lats, lons, row_times)
+            payload = build_columnar_batch(
+                lats, lons, bands[:, 1],
+                risk_codes=pred.get_risk_codes(bands[:, 1]),
+                risk_levels=pred.RISK_LEVELS,
+                timestamp=timestamp.isoformat(),
+                confidence=pred.calculate_confidence(bands),
+                extra_columns=interval_columns(bands)
+            )
+        if approximate is not None:
+            payload["approximate"] = approximate
+        return encode_response(with_row_timestamps(payload, pred, row_times), encoding)
+    
+    # Get predictions
+    if bands is None:
+        results = pred.predict_batch_arrays(lats, lons, row_times, selected)
+    elif selected:
+        results = pred.format_rows(lats, lons, row_times, compute_parts(), selected)
+    else:
+        results = pred.format_batch_rows(lats, lons, bands, row_times)
+    
+    if encoding == "ndjson":
+        return Response(content=ChunkStreamEncoder("ndjson").encode_rows(results), media_type=NDJSON_MEDIA_TYPE)
+    
+    payload = {
+        "success": True,
+        "count": len(results),
+        "timestamp": timestamp.isoformat() if isinstance(row_times, datetime) else None,
+        "data": results
+    }
+    if approximate is not None:
+        payload["approximate"] = approximate
+    return payload
+
+def batch_bands(pred, lats, lons, row_times, approximate: Optional[dict] = None,
+                rows: Optional[np.ndarray] = None) -> np.ndarray:
+    """(lower, score, upper) per location, for the given row indices only (all rows when None)"""
+    if rows is not None:
+        lats, lons = lats[rows], lons[rows]
+        if not isinstance(row_times, datetime):
+            row_times = row_times[rows]
+    if approximate is not None:
+        scorer = ApproximateScorer(pred, config.get('approximate'))
+        return scorer.predict_bands(lats, lons, row_times, approximate['resolution'], approximate['anchor_hours'])
+    return pred.predict_intervals(lats, lons, row_times)
+
+def approx_query(approximate: Optional[dict]) -> dict:
+    """/batch_forecast query parameters selecting the same approximate settings"""
+    if approximate is None:
+        return {}
+    return {
+        "approximate": "true",
+        "approx_resolution": approximate['resolution'],
+        "anchor_hours": approximate['anchor_hours'],
+    }
+
+def degraded_batch(pred, table, lats, lons, row_times, timestamp: datetime, selected,
+                   response_format: str, encoding: str, stream: bool) -> Response:
+    """/batch_forecast answered from the lookup table, in the requested layout and encoding"""
+    fields = selected or CongestionPredictor.DEFAULT_BATCH_FIELDS
+    parts, served = degraded_parts(pred, table, lats, lons, row_times, fields)
+    columnar = response_format == "columnar" or encoding not in ("json", "ndjson")
+    
+    if columnar:
+        payload = columnar_from_parts(pred, lats, lons, parts, served, timestamp.isoformat())
+        payload = with_row_timestamps(payload, pred, row_times)
+    elif selected:
+        rows = pred.format_rows(lats, lons, row_times, parts, served)
+    else:
+        rows = pred.format_batch_rows(lats, lons, parts['bands'], row_times)
+    
+    if stream or encoding == "ndjson":
+        # Cheap enough to send as a single chunk; the stream format is unchanged
+        encoder = ChunkStreamEncoder(encoding)
+        body = encoder.encode_chunk({**payload, 'offset': 0, 'degraded': True}) if columnar else encoder.encode_rows(rows)
+        body += encoder.finish()
+        return Response(content=body, media_type=encoder.media_type, headers=DEGRADED_HEADERS)
+    
+    if not columnar:
+        payload = {
+            "success": True,
+            "count": len(rows),
+            "timestamp": timestamp.isoformat() if isinstance(row_times, datetime) else None,
+            "data": rows
+        }
+    return degraded_response(payload, fields, encoding)
+
+def with_row_timestamps(payload: dict, pred, row_times) -> dict:
+    """Columnar payloads with per-row timestamps carry them as a column instead of one shared value"""
+    if not isinstance(row_times, datetime):
+        payload["timestamp"] = None
+        payload["data"]["timestamp"] = pred.timestamp_strings(row_times, payload["count"])
+    return payload
+
+def stream_batch_forecast(
+    pred: CongestionPredictor,
+    lats: np.ndarray,
+    lons: np.ndarray,
+    row_times,
+    http_request: Request,
+    response_format: str,
+    encoding: str,
+    fields: Optional[Tuple[str, ...]] = None,
+    ticket: Optional[Ticket] = None
+) -> StreamingResponse:
+    """
+    Stream a batch forecast chunk by chunk. Only one chunk of results exists at
+    a time, and work stops as soon as the client disconnects. The admission
+    ticket is released when the stream ends, however it ends.
+    """
+    chunk_size = config['streaming']['batch_chunk_size']
+    encoder = ChunkStreamEncoder(encoding)
+    columnar = response_format == "columnar" or encoding not in ("json", "ndjson")
+    timestamp_iso = row_times.isoformat() if isinstance(row_times, datetime) else None
+    
+    async def generate():
+        try:
+            chunks = pred.iter_field_chunks(
+                lats, lons, row_times, fields or CongestionPredictor.DEFAULT_BATCH_FIELDS, chunk_size
+            )
+            offset = 0
+            while True:
+                if await http_request.is_disconnected():
+                    print(f"Client disconnected, stopping batch stream at row {offset}/{len(lats)}")
+                    return
+                
+                # Inference runs off the event loop so other requests keep being served
+                chunk = await run_in_threadpool(next, chunks, None)
+                if chunk is None:
+                    break
+                chunk_lats, chunk_lons, chunk_times, parts = chunk
+                
+                if columnar:
+                    payload = columnar_from_parts(
+                        pred, chunk_lats, chunk_lons, parts,
+                        fields or CongestionPredictor.DEFAULT_BATCH_FIELDS, timestamp_iso
+                    )
+                    payload['offset'] = offset
+                    yield encoder.encode_chunk(with_row_timestamps(payload, pred, chunk_times))
+                elif fields:
+                    yield encoder.encode_rows(
+                        pred.format_rows(chunk_lats, chunk_lons, chunk_times, parts, fields)
+                    )
+                else:
+                    yield encoder.encode_rows(
+                        pred.format_batch_rows(chunk_lats, chunk_lons, parts['bands'], chunk_times)
+                    )
+                offset += len(chunk_lats)
+            
+            tail = encoder.finish()
+            if tail:
+                yield tail
+        finally:
+            if ticket is not None:
+                ticket.release()
+    
+    # Also released after the response, in case the stream never started
+    background = BackgroundTask(ticket.release) if ticket is not None else None
+    return StreamingResponse(generate(), media_type=encoder.media_type, background=background)
+
+@app.post("/area_forecast")
+async def forecast_area(
+    request: AreaRequest,
+    http_request: Request,
+    response_format: str = Query(
+        "rows",
+        alias="format",
+        pattern="^(rows|columnar)$",
+        description="rows: one object per cell (default); columnar: parallel arrays"
+    ),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION + " (default: score, risk)")
+):
+    """
+    Predict congestion for every H3 cell covering a bounding box or polygon
+    
+    Cells are enumerated server-side, so the same area always maps to the same
+    canonical cell IDs and their scores are shared across users via the
+    (cell, hour) forecast cache. Cells always carry their h3_cell and center.
     """
+    selected = parse_fields(fields, CongestionPredictor.DEFAULT_BATCH_FIELDS)
+    cells, resolution = resolve_area(request.bbox, request.polygon, request.resolution, request.zoom)
+    
+    encoding = negotiate_encoding(http_request.headers.get("accept"))
+    if encoding is None or encoding == "ndjson":
+        raise HTTPException(
+            status_code=406,
+            detail="Supported media types: application/json, application/msgpack, "
+                   "application/vnd.apache.arrow.stream"
+        )
+    
     try:
         pred = get_predictor()
         
@@ -148,33 +751,507 @@ async def forecast_batch(request: BatchLocationRequest):
         if request.timestamp:
             timestamp = datetime.fromisoformat(request.timestamp.replace('Z', '+00:00'))
         else:
-            timestamp = datetime.now() + timedelta(hours=3)
+            timestamp = request_now() + timedelta(hours=3)
         
-        # Extract locations
-        locations = [
-            (loc['latitude'], loc['longitude']) 
-            for loc in request.locations
-        ]
+        table = fallback_table(pred)
+        async with admission.admit('area_forecast', table is not None) as ticket:
+            if ticket.degraded:
+                return await area_response(
+                    pred, cells, resolution, timestamp, selected, response_format, encoding, table
+                )
+            bands = await cluster_cell_bands(pred, cells, timestamp, selected, http_request)
+            return await area_response(
+                pred, cells, resolution, timestamp, selected, response_format, encoding, bands=bands
+            )
+    
+    except (HTTPException, OverloadedError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def area_response(
+    pred: CongestionPredictor,
+    cells: List[str],
+    resolution: int,
+    timestamp: datetime,
+    selected: Tuple[str, ...],
+    response_format: str,
+    encoding: str,
+    table=None,
+    bands: Optional[np.ndarray] = None
+):
+    """
+    Area forecast payload (rows or columnar) for canonical cells; with a
+    lookup table, a degraded response from the table instead. bands are the
+    cells' bands when already scored (by the cluster).
+    """
+    centers = np.array([h3.cell_to_latlng(cell) for cell in cells])
+    requested = selected
+    if table is not None:
+        parts, selected = degraded_parts(pred, table, centers[:, 0], centers[:, 1], timestamp, selected)
+    else:
+        parts = await run_in_threadpool(area_fields, pred, cells, centers, timestamp, selected, bands)
+    
+    metadata = {
+        "area_id": area_id(cells, resolution),
+        "resolution": resolution,
+        "model_version": pred.model_version,
+    }
+    
+    if response_format == "columnar" or encoding != "json":
+        payload = columnar_from_parts(
+            pred, centers[:, 0], centers[:, 1], parts,
+            tuple(f for f in selected if f != 'h3_cell'), timestamp.isoformat()
+        )
+        payload.update(metadata)
+        payload["data"]["h3_cell"] = cells
+        if table is not None:
+            return degraded_response(payload, requested, encoding)
+        return encode_response(payload, encoding)
+    
+    scores = np.round(parts['score'], 3).tolist() if 'score' in selected else None
+    risk_levels = pred.get_risk_levels(parts['score']) if 'risk' in selected else None
+    if 'interval' in selected:
+        lower, upper = pred.nullable(parts['bands'][:, 0]), pred.nullable(parts['bands'][:, 2])
+    rows = []
+    for i, (cell, lat, lon) in enumerate(zip(cells, centers[:, 0].tolist(), centers[:, 1].tolist())):
+        row = {"h3_cell": cell, "latitude": lat, "longitude": lon}
+        if scores is not None:
+            row["congestion_score"] = scores[i]
+        if risk_levels is not None:
+            row["risk_level"] = risk_levels[i]
+        if 'interval' in selected:
+            row["congestion_lower"] = lower[i]
+            row["congestion_upper"] = upper[i]
+        for field in ('factors', 'recommendations', 'explanations'):
+            if field in selected:
+                row[FIELD_COLUMNS[field]] = parts[field][i]
+        rows.append(row)
+    
+    payload = {
+        "success": True,
+        **metadata,
+        "count": len(cells),
+        "timestamp": timestamp.isoformat(),
+        "data": rows
+    }
+    if table is not None:
+        return degraded_response(payload, requested)
+    return payload
+
+def resolve_area(bbox, polygon, resolution, zoom) -> Tuple[List[str], int]:
+    """Canonical H3 cells covering a bbox or polygon (400 for invalid or oversized areas)"""
+    if (bbox is None) == (polygon is None):
+        raise HTTPException(status_code=400, detail="Provide exactly one of bbox or polygon")
+    try:
+        return cover_polygon(bbox_to_polygon(bbox) if bbox else polygon, resolution, zoom, config['area'])
+    except AreaTooLargeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid area: {e}")
+
+# Area fields computed from the cells' bands
+BAND_FIELDS = ('score', 'risk', 'interval', 'recommendations')
+
+def area_fields(pred, cells: List[str], centers: np.ndarray, timestamp: datetime, fields: Tuple[str, ...],
+                bands: Optional[np.ndarray] = None) -> dict:
+    """
+    Requested parts for area cells. Scores and intervals come from the
+    (cell, hour) forecast cache unless bands are given; features are only
+    built when factors/recommendations/explanations are asked for.
+    """
+    if bands is None and any(f in fields for f in BAND_FIELDS):
+        bands = pred.predict_cell_bands(cells, timestamp)
+    
+    features_df = None
+    if any(f in fields for f in ('factors', 'recommendations', 'explanations')):
+        bucket_time = timestamp.replace(minute=0, second=0, microsecond=0)
+        features_df = pred.build_features(centers[:, 0], centers[:, 1], bucket_time)
+    
+    # h3_cell is already known for every row
+    computed = tuple(f for f in fields if f != 'h3_cell')
+    return pred.compute_fields(features_df, centers[:, 0], centers[:, 1], computed, bands=bands)
+
+async def cluster_cell_bands(pred, cells: List[str], timestamp: datetime, selected: Tuple[str, ...],
+                             http_request: Request) -> Optional[np.ndarray]:
+    """
+    Bands for area cells from the forecast caches of the nodes owning them,
+    or None outside cluster mode (area_fields then scores them here)
+    """
+    if not shard_router.active or HOP_HEADER in http_request.headers:
+        return None
+    if not any(f in selected for f in BAND_FIELDS):
+        return None
+    
+    def local(rows):
+        return pred.predict_cell_bands(cells if rows is None else [cells[i] for i in rows.tolist()], timestamp)
+    
+    return await shard_router.cell_bands(cells, timestamp, local, pred.models_version)
+
+HOUR_DESCRIPTION = "Hour bucket as ISO time, e.g. 2024-01-15T08 (later minutes are floored)"
+
+def parse_cell(h3_cell: str) -> Tuple[float, float]:
+    """Center of a valid H3 cell (400 otherwise)"""
+    if not h3.is_valid_cell(h3_cell):
+        raise HTTPException(status_code=400, detail=f"Invalid H3 cell: {h3_cell}")
+    return h3.cell_to_latlng(h3_cell)
+
+def parse_hour(hour: Optional[str], default_offset: float) -> Tuple[datetime, bool]:
+    try:
+        return hour_bucket(hour, default_offset, now=request_now())
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid hour: {hour}")
+
+def conditional_get(
+    http_request: Request,
+    pred: CongestionPredictor,
+    hour: datetime,
+    explicit_hour: bool,
+    hour_param: str = "hour",
+    encoding: str = "json"
+) -> Tuple[dict, Optional[Response]]:
+    """
+    Cache headers for a GET forecast, plus a 304 response when If-None-Match
+    already holds its ETag. The ETag only depends on what is known before
+    computing (model and input-state versions, hour bucket, path and query),
+    so revalidation never runs the model.
+    """
+    query = "&".join(
+        f"{key}={value}" for key, value in sorted(http_request.query_params.multi_items()) if key != hour_param
+    )
+    etag = forecast_etag(pred.cache_version, hour, f"{http_request.url.path}?{query}|{encoding}")
+    
+    cache_config = config.get('http_cache', {})
+    max_age = forecast_max_age(
+        cache_config.get('max_age', 300), pred.weather_prefetcher, hour_from_clock=not explicit_hour
+    )
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}, "
+                         f"stale-while-revalidate={cache_config.get('stale_while_revalidate', 60)}",
+        "Vary": "Accept",
+    }
+    if etag_matches(http_request.headers.get("if-none-match"), etag):
+        return headers, Response(status_code=304, headers=headers)
+    return headers, None
+
+@app.get("/forecast/cell/{h3_cell}")
+async def forecast_cell(
+    h3_cell: str,
+    http_request: Request,
+    hour: Optional[str] = Query(None, description=HOUR_DESCRIPTION + " (default: now + 3h)"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+):
+    """
+    Cacheable single forecast for an H3 cell (at its center) and hour
+    
+    Same result as POST /forecast, addressed by canonical cell and hour bucket
+    so HTTP caches can share it. Carries an ETag and Cache-Control;
+    If-None-Match with the current ETag returns 304.
+    """
+    selected = parse_fields(fields, CongestionPredictor.DEFAULT_SINGLE_FIELDS)
+    lat, lon = parse_cell(h3_cell)
+    timestamp, explicit_hour = parse_hour(hour, 3)
+    
+    try:
+        pred = get_predictor()
+        headers, not_modified = conditional_get(http_request, pred, timestamp, explicit_hour)
+        if not_modified is not None:
+            return not_modified
         
-        # Get predictions
-        results = pred.predict_batch(locations, timestamp)
+        table = fallback_table(pred)
+        async with admission.admit('forecast', table is not None) as ticket:
+            if ticket.degraded:
+                parts, served = degraded_parts(pred, table, [lat], [lon], timestamp, selected)
+                result = pred.format_rows([lat], [lon], timestamp, parts, served)[0]
+                return degraded_response(
+                    {"success": True, "h3_cell": h3_cell, "hour": timestamp.isoformat(), "data": result},
+                    selected, headers=headers
+                )
+            result = await run_in_threadpool(pred.predict_single, lat, lon, timestamp, None, selected)
+        return JSONResponse(
+            {"success": True, "h3_cell": h3_cell, "hour": timestamp.isoformat(), "data": result},
+            headers=headers
+        )
+    
+    except (HTTPException, OverloadedError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/forecast/area/{h3_cell}")
+async def forecast_area_tile(
+    h3_cell: str,
+    http_request: Request,
+    resolution: Optional[int] = Query(
+        None, ge=0, le=15,
+        description="Resolution of the returned cells (default: area.default_resolution, at least one finer than the tile)"
+    ),
+    hour: Optional[str] = Query(None, description=HOUR_DESCRIPTION + " (default: now + 3h)"),
+    response_format: str = Query(
+        "rows",
+        alias="format",
+        pattern="^(rows|columnar)$",
+        description="rows: one object per cell (default); columnar: parallel arrays"
+    ),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION + " (default: score, risk)")
+):
+    """
+    Cacheable area forecast for every child cell of an H3 tile
+    
+    Clients cover their viewport with coarse tiles (e.g. resolution 5-6) and
+    fetch each tile's children, so overlapping viewports share cached tiles.
+    Same payload as POST /area_forecast.
+    """
+    selected = parse_fields(fields, CongestionPredictor.DEFAULT_BATCH_FIELDS)
+    parse_cell(h3_cell)
+    timestamp, explicit_hour = parse_hour(hour, 3)
+    
+    tile_resolution = h3.get_resolution(h3_cell)
+    if resolution is None:
+        resolution = max(config['area']['default_resolution'], tile_resolution + 1)
+    if resolution <= tile_resolution:
+        raise HTTPException(
+            status_code=400,
+            detail=f"resolution must be finer than the tile's ({tile_resolution})"
+        )
+    if h3.cell_to_children_size(h3_cell, resolution) > config['area']['max_cells']:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tile has more than {config['area']['max_cells']} cells at resolution {resolution}; "
+                   "use a finer tile or a coarser resolution"
+        )
+    
+    encoding = negotiate_encoding(http_request.headers.get("accept"))
+    if encoding is None or encoding == "ndjson":
+        raise HTTPException(
+            status_code=406,
+            detail="Supported media types: application/json, application/msgpack, "
+                   "application/vnd.apache.arrow.stream"
+        )
+    
+    try:
+        pred = get_predictor()
+        headers, not_modified = conditional_get(http_request, pred, timestamp, explicit_hour, encoding=encoding)
+        if not_modified is not None:
+            return not_modified
         
-        return {
+        cells = sorted(h3.cell_to_children(h3_cell, resolution))
+        table = fallback_table(pred)
+        async with admission.admit('area_forecast', table is not None) as ticket:
+            if ticket.degraded:
+                # Flagged and uncacheable: the cache headers belong to the full forecast
+                return await area_response(
+                    pred, cells, resolution, timestamp, selected, response_format, encoding, table
+                )
+            bands = await cluster_cell_bands(pred, cells, timestamp, selected, http_request)
+            response = await area_response(
+                pred, cells, resolution, timestamp, selected, response_format, encoding, bands=bands
+            )
+        if isinstance(response, Response):
+            response.headers.update(headers)
+            return response
+        return JSONResponse(response, headers=headers)
+    
+    except (HTTPException, OverloadedError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/timeseries/cell/{h3_cell}")
+async def forecast_timeseries_cell(
+    h3_cell: str,
+    http_request: Request,
+    start: Optional[str] = Query(None, description=HOUR_DESCRIPTION + " (default: current hour)"),
+    hours_ahead: int = Query(72, ge=3, le=168, description="Hours to forecast (3-168)"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+):
+    """
+    Cacheable timeseries for an H3 cell (at its center) from an hour bucket
+    
+    Same points as POST /timeseries, with an ETag and Cache-Control.
+    """
+    selected = parse_fields(fields, CongestionPredictor.DEFAULT_SINGLE_FIELDS)
+    lat, lon = parse_cell(h3_cell)
+    start_time, explicit_hour = parse_hour(start, 0)
+    
+    try:
+        pred = get_predictor()
+        headers, not_modified = conditional_get(http_request, pred, start_time, explicit_hour, hour_param="start")
+        if not_modified is not None:
+            return not_modified
+        
+        payload = {
             "success": True,
-            "count": len(results),
-            "timestamp": timestamp.isoformat(),
-            "data": results
+            "h3_cell": h3_cell,
+            "location": {"latitude": lat, "longitude": lon},
+            "start_time": start_time.isoformat(),
+            "hours_ahead": hours_ahead,
         }
+        table = fallback_table(pred)
+        async with admission.admit('timeseries', table is not None) as ticket:
+            if ticket.degraded:
+                payload["data"] = degraded_timeseries(pred, table, lat, lon, start_time, hours_ahead, selected)
+                return degraded_response(payload, selected, headers=headers)
+            payload["data"] = await run_in_threadpool(
+                pred.predict_timeseries, lat, lon, start_time, hours_ahead, selected
+            )
+        return JSONResponse(payload, headers=headers)
     
+    except (HTTPException, OverloadedError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def subscribe_feed(subscription: AreaSubscription):
+    """Join the live feed for an area and horizon; returns (feed, queue)"""
+    cells, resolution = resolve_area(
+        subscription.bbox, subscription.polygon, subscription.resolution, subscription.zoom
+    )
+    centers = np.array([h3.cell_to_latlng(cell) for cell in cells])
+    return await subscription_hub.subscribe(
+        area_id(cells, resolution), cells, centers, resolution, subscription.hours_ahead
+    )
+
+@app.websocket("/ws/area")
+async def subscribe_area_ws(websocket: WebSocket):
+    """
+    Live congestion for an area over WebSocket
+    
+    Send {"bbox" or "polygon", "zoom" or "resolution", "hours_ahead"} to
+    subscribe, and again to switch area or horizon on the same connection.
+    The server replies with a snapshot of every cell, then pushes deltas
+    holding only the cells whose score changed.
+    """
+    await websocket.accept()
+    subscription = None
+    sender = None
+    
+    async def forward(queue: asyncio.Queue):
+        while True:
+            frame = await queue.get()
+            await websocket.send_text(frame.text)
+    
+    try:
+        while True:
+            message = await websocket.receive_text()
+            try:
+                feed, queue = await subscribe_feed(AreaSubscription.model_validate_json(message))
+            except ValidationError as e:
+                await websocket.send_json({"type": "error", "detail": e.errors(include_url=False, include_context=False)})
+                continue
+            except HTTPException as e:
+                await websocket.send_json({"type": "error", "detail": e.detail})
+                continue
+            
+            if subscription is not None:
+                subscription_hub.unsubscribe(*subscription)
+                sender.cancel()
+            subscription = (feed, queue)
+            sender = asyncio.create_task(forward(queue))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if subscription is not None:
+            subscription_hub.unsubscribe(*subscription)
+            sender.cancel()
+
+@app.get("/subscribe/area")
+async def subscribe_area_sse(
+    bbox: str = Query(..., description="Bounding box min_lat,min_lon,max_lat,max_lon"),
+    zoom: Optional[float] = Query(None, ge=0, le=22),
+    resolution: Optional[int] = Query(None, ge=0, le=15),
+    hours_ahead: int = Query(3, ge=0, le=168)
+):
+    """
+    Live congestion for an area as Server-Sent Events
+    
+    Same messages as /ws/area: a "snapshot" event, then "delta" events with
+    only the changed cells. Change area or horizon by opening a new stream.
+    """
+    try:
+        box = [float(v) for v in bbox.split(',')]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be four comma-separated numbers")
+    if len(box) != 4:
+        raise HTTPException(status_code=400, detail="bbox must be four comma-separated numbers")
+    
+    feed, queue = await subscribe_feed(
+        AreaSubscription(bbox=box, zoom=zoom, resolution=resolution, hours_ahead=hours_ahead)
+    )
+    heartbeat = config.get('subscriptions', {}).get('heartbeat', 15)
+    
+    async def events():
+        try:
+            while True:
+                try:
+                    frame = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+                    yield frame.sse
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+        finally:
+            subscription_hub.unsubscribe(feed, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/observations")
+async def record_observations(request: ObservationRequest, http_request: Request):
+    """
+    Record live observations (latest values per H3 cell) for neighbour features
+    
+    Forecasts computed afterwards use them, and live area subscribers are
+    pushed the cells whose scores changed. In cluster mode each observation
+    also goes to the nodes whose shards have its cell as a neighbour.
+    """
+    pred = get_predictor()
+    if pred.neighbour_index is None and pred.model_router is None:
+        raise HTTPException(status_code=409, detail="No model uses neighbour state")
+    
+    # Cells at the neighbour index resolution, values in the configured state column order
+    columns = config['features']['neighbour_features']['columns']
+    resolution = config['spatial']['h3_resolution']
+    cells = []
+    values = np.empty((len(request.observations), len(columns)), dtype=np.float32)
+    try:
+        for i, row in enumerate(request.observations):
+            cell = row.get('h3_cell') or h3.latlng_to_cell(float(row['latitude']), float(row['longitude']), resolution)
+            cells.append(cell)
+            values[i] = [float(row[column]) for column in columns]
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Observation {len(cells)}: needs h3_cell or latitude/longitude and {', '.join(columns)} ({e})"
+        )
+    
+    count = len(cells)
+    if shard_router.active and HOP_HEADER not in http_request.headers:
+        rings = max(config['features']['neighbour_features']['rings'])
+        rows = await shard_router.forward_observations(cells, values, columns, rings)
+        cells, values = [cells[i] for i in rows.tolist()], values[rows]
+    
+    if cells:
+        await run_in_threadpool(pred.update_neighbour_state, cells, values)
+    subscription_hub.notify()
+    
+    return {
+        "success": True,
+        "count": count,
+        "state_version": pred.state_version
+    }
+
 @app.post("/route_simulate")
 async def simulate_route(request: RouteRequest):
     """
     Simulate route risk from start to end location
     
-    Returns overall route risk, waypoint predictions, and optimal departure time
+    Returns overall route risk, waypoint predictions, and optimal departure time.
+    With a road graph loaded and both ends within routing.max_snap_km of it,
+    the route is the fastest path under forecast congestion; otherwise
+    waypoints are interpolated along a straight line.
     """
     try:
         pred = get_predictor()
@@ -183,90 +1260,175 @@ async def simulate_route(request: RouteRequest):
         if request.departure_time:
             departure = datetime.fromisoformat(request.departure_time.replace('Z', '+00:00'))
         else:
-            departure = datetime.now()
+            departure = request_now()
         
-        # Generate waypoints along route (simplified - linear interpolation)
-        num_waypoints = 10
-        waypoints = []
+        async with admission.admit('route_simulate', False):
+            road_router = get_router()
+            if road_router is not None and road_router.covers(
+                request.start_lat, request.start_lon, request.end_lat, request.end_lon
+            )[0]:
+                return await run_in_threadpool(simulate_road_route, pred, road_router, request, departure)
+            return await run_in_threadpool(simulate_straight_route, pred, request, departure)
+    
+    except (HTTPException, OverloadedError):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def simulate_straight_route(pred, request: RouteRequest, departure: datetime):
+    """/route_simulate without a road graph: waypoints interpolated along a straight line"""
+    # Generate waypoints along route (simplified - linear interpolation)
+    num_waypoints = 10
+    waypoints = []
+    
+    for i in range(num_waypoints + 1):
+        t = i / num_waypoints
+        lat = request.start_lat + t * (request.end_lat - request.start_lat)
+        lon = request.start_lon + t * (request.end_lon - request.start_lon)
         
-        for i in range(num_waypoints + 1):
-            t = i / num_waypoints
-            lat = request.start_lat + t * (request.end_lat - request.start_lat)
-            lon = request.start_lon + t * (request.end_lon - request.start_lon)
-            
-            # Estimate time to reach this waypoint (assume 60 km/h average)
-            distance_km = t * 20  # Assume 20km total route
-            hours_offset = distance_km / 60
-            waypoint_time = departure + timedelta(hours=hours_offset)
-            
-            # Predict congestion
-            prediction = pred.predict_single(lat, lon, waypoint_time)
-            
-            waypoints.append({
-                'latitude': lat,
-                'longitude': lon,
-                'congestion_score': prediction['congestion_score'],
-                'risk_level': prediction['risk_level'],
-                'eta_minutes': int(hours_offset * 60)
-            })
-        
-        # Calculate overall route risk
-        avg_congestion = np.mean([w['congestion_score'] for w in waypoints])
-        max_congestion = max([w['congestion_score'] for w in waypoints])
-        
-        overall_risk = pred.get_risk_level(avg_congestion)
-        
-        # Find optimal departure time (test ±3 hours)
-        optimal_departure = departure
-        min_congestion = avg_congestion
-        
-        for hour_offset in range(-3, 4):
-            test_time = departure + timedelta(hours=hour_offset)
-            test_predictions = [
-                pred.predict_single(w['latitude'], w['longitude'], test_time)
-                for w in waypoints[::2]  # Sample every other waypoint
-            ]
-            test_avg = np.mean([p['congestion_score'] for p in test_predictions])
-            
-            if test_avg < min_congestion:
-                min_congestion = test_avg
-                optimal_departure = test_time
+        # Estimate time to reach this waypoint (assume 60 km/h average)
+        distance_km = t * 20  # Assume 20km total route
+        hours_offset = distance_km / 60
+        waypoint_time = departure + timedelta(hours=hours_offset)
         
-        # Calculate time savings
-        time_shift_hours = (optimal_departure - departure).total_seconds() / 3600
+        # Predict congestion
+        prediction = pred.predict_single(lat, lon, waypoint_time)
         
-        return {
-            "success": True,
-            "data": {
-                "route": {
-                    "start": {"latitude": request.start_lat, "longitude": request.start_lon},
-                    "end": {"latitude": request.end_lat, "longitude": request.end_lon},
-                    "waypoints": waypoints
-                },
-                "risk_analysis": {
-                    "average_congestion": round(float(avg_congestion), 3),
-                    "max_congestion": round(float(max_congestion), 3),
-                    "overall_risk": overall_risk
-                },
-                "optimization": {
-                    "requested_departure": departure.isoformat(),
-                    "optimal_departure": optimal_departure.isoformat(),
-                    "time_shift_hours": round(time_shift_hours, 1),
-                    "potential_savings": f"{abs(time_shift_hours)} hours" if time_shift_hours != 0 else "No change recommended"
-                }
+        waypoints.append({
+            'latitude': lat,
+            'longitude': lon,
+            'congestion_score': prediction['congestion_score'],
+            'risk_level': prediction['risk_level'],
+            'eta_minutes': int(hours_offset * 60)
+        })
+    
+    # Calculate overall route risk
+    avg_congestion = np.mean([w['congestion_score'] for w in waypoints])
+    max_congestion = max([w['congestion_score'] for w in waypoints])
+    
+    overall_risk = pred.get_risk_level(avg_congestion)
+    
+    # Find optimal departure time (test ±3 hours)
+    optimal_departure = departure
+    min_congestion = avg_congestion
+    
+    for hour_offset in range(-3, 4):
+        test_time = departure + timedelta(hours=hour_offset)
+        test_predictions = [
+            pred.predict_single(w['latitude'], w['longitude'], test_time)
+            for w in waypoints[::2]  # Sample every other waypoint
+        ]
+        test_avg = np.mean([p['congestion_score'] for p in test_predictions])
+        
+        if test_avg < min_congestion:
+            min_congestion = test_avg
+            optimal_departure = test_time
+    
+    # Calculate time savings
+    time_shift_hours = (optimal_departure - departure).total_seconds() / 3600
+    
+    return {
+        "success": True,
+        "data": {
+            "route": {
+                "start": {"latitude": request.start_lat, "longitude": request.start_lon},
+                "end": {"latitude": request.end_lat, "longitude": request.end_lon},
+                "waypoints": waypoints
+            },
+            "risk_analysis": {
+                "average_congestion": round(float(avg_congestion), 3),
+                "max_congestion": round(float(max_congestion), 3),
+                "overall_risk": overall_risk
+            },
+            "optimization": {
+                "requested_departure": departure.isoformat(),
+                "optimal_departure": optimal_departure.isoformat(),
+                "time_shift_hours": round(time_shift_hours, 1),
+                "potential_savings": f"{abs(time_shift_hours)} hours" if time_shift_hours != 0 else "No change recommended"
             }
         }
+    }
+
+def simulate_road_route(pred, road_router, request: RouteRequest, departure: datetime):
+    """/route_simulate over the road graph: fastest path now and for departures within ±3 hours"""
+    result = road_router.route(request.start_lat, request.start_lon, request.end_lat, request.end_lon, departure)
+    if result is None:
+        raise HTTPException(status_code=404, detail="No road route between start and end")
     
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    # Sample waypoints evenly along the path; each carries the score of the edge leaving it
+    n_edges = len(result['edge_scores'])
+    num_waypoints = config['routing']['waypoints']
+    positions = np.unique(np.linspace(0, n_edges, num_waypoints + 1).round().astype(int))
+    edge_scores = np.append(result['edge_scores'], result['edge_scores'][-1] if n_edges else 0.0)
+    
+    waypoints = [
+        {
+            'latitude': round(float(result['latitudes'][i]), 6),
+            'longitude': round(float(result['longitudes'][i]), 6),
+            'congestion_score': round(float(edge_scores[i]), 3),
+            'risk_level': pred.get_risk_level(edge_scores[i]),
+            'eta_minutes': int(result['node_times_s'][i] // 60)
+        }
+        for i in positions.tolist()
+    ]
+    
+    # Optimal departure: shortest forecast travel time within ±3 hours
+    optimal_departure = departure
+    optimal_duration = result['duration_s']
+    for hour_offset in range(-3, 4):
+        if hour_offset == 0:
+            continue
+        test_time = departure + timedelta(hours=hour_offset)
+        test_result = road_router.route(request.start_lat, request.start_lon, request.end_lat, request.end_lon, test_time)
+        if test_result is not None and test_result['duration_s'] < optimal_duration:
+            optimal_duration = test_result['duration_s']
+            optimal_departure = test_time
+    
+    time_shift_hours = (optimal_departure - departure).total_seconds() / 3600
+    minutes_saved = (result['duration_s'] - optimal_duration) / 60
+    
+    return {
+        "success": True,
+        "data": {
+            "route": {
+                "start": {"latitude": request.start_lat, "longitude": request.start_lon},
+                "end": {"latitude": request.end_lat, "longitude": request.end_lon},
+                "waypoints": waypoints,
+                "geometry": np.column_stack([result['latitudes'], result['longitudes']]).round(6).tolist(),
+                "distance_km": round(result['distance_m'] / 1000, 2),
+                "duration_minutes": round(result['duration_s'] / 60, 1),
+                "freeflow_minutes": round(result['freeflow_s'] / 60, 1),
+                "routing": "road_graph"
+            },
+            "risk_analysis": {
+                "average_congestion": round(result['average_congestion'], 3),
+                "max_congestion": round(result['max_congestion'], 3),
+                "overall_risk": pred.get_risk_level(result['average_congestion'])
+            },
+            "optimization": {
+                "requested_departure": departure.isoformat(),
+                "optimal_departure": optimal_departure.isoformat(),
+                "time_shift_hours": round(time_shift_hours, 1),
+                "potential_savings": f"{minutes_saved:.0f} minutes" if time_shift_hours != 0 else "No change recommended"
+            }
+        }
+    }
 
 @app.post("/timeseries")
-async def forecast_timeseries(request: TimeseriesRequest):
+async def forecast_timeseries(
+    request: TimeseriesRequest,
+    http_request: Request,
+    stream: bool = Query(False, description="Stream time points as NDJSON while they are computed"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)
+):
     """
     Predict congestion timeseries for a location over multiple hours
     
     Useful for trend analysis and charts
     """
+    selected = parse_fields(fields, CongestionPredictor.DEFAULT_SINGLE_FIELDS)
+    
+    ticket = None
     try:
         pred = get_predictor()
         
@@ -274,17 +1436,10 @@ async def forecast_timeseries(request: TimeseriesRequest):
         if request.start_time:
             start_time = datetime.fromisoformat(request.start_time.replace('Z', '+00:00'))
         else:
-            start_time = datetime.now()
-        
-        # Get timeseries predictions
-        results = pred.predict_timeseries(
-            lat=request.latitude,
-            lon=request.longitude,
-            start_time=start_time,
-            hours_ahead=request.hours_ahead
-        )
+            start_time = request_now()
         
-        return {
+        stream = stream or negotiate_encoding(http_request.headers.get("accept")) == "ndjson"
+        payload = {
             "success": True,
             "location": {
                 "latitude": request.latitude,
@@ -292,11 +1447,94 @@ async def forecast_timeseries(request: TimeseriesRequest):
             },
             "start_time": start_time.isoformat(),
             "hours_ahead": request.hours_ahead,
-            "data": results
         }
+        
+        table = fallback_table(pred)
+        ticket = await admission.enter('timeseries', table is not None)
+        if ticket.degraded:
+            points = degraded_timeseries(
+                pred, table, request.latitude, request.longitude, start_time, request.hours_ahead, selected
+            )
+            if stream:
+                encoder = ChunkStreamEncoder("ndjson")
+                return Response(content=encoder.encode_rows(points), media_type=encoder.media_type,
+                                headers=DEGRADED_HEADERS)
+            payload["data"] = points
+            return degraded_response(payload, selected)
+        
+        if stream:
+            # The stream holds its admission slot until the last point is sent
+            response = stream_timeseries(pred, request, http_request, start_time, selected, ticket)
+            ticket = None
+            return response
+        
+        # Get timeseries predictions
+        payload["data"] = await run_in_threadpool(
+            pred.predict_timeseries,
+            request.latitude, request.longitude, start_time, request.hours_ahead, selected
+        )
+        return payload
     
+    except (HTTPException, OverloadedError):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if ticket is not None:
+            ticket.release()
+
+def degraded_timeseries(pred, table, lat: float, lon: float, start_time: datetime, hours_ahead: int,
+                        fields: Tuple[str, ...]) -> List[dict]:
+    """Timeseries points (every 3 hours, as predict_timeseries) from the lookup table"""
+    hours = list(range(0, hours_ahead + 1, 3))
+    timestamps = [start_time + timedelta(hours=hour) for hour in hours]
+    row_times = np.array([t.replace(tzinfo=None) for t in timestamps], dtype='datetime64[us]')
+    lats = np.full(len(hours), lat, dtype=np.float64)
+    lons = np.full(len(hours), lon, dtype=np.float64)
+    
+    parts, served = degraded_parts(pred, table, lats, lons, row_times, fields)
+    rows = pred.format_rows(lats, lons, row_times, parts, served)
+    for hour, timestamp, row in zip(hours, timestamps, rows):
+        row['timestamp'] = timestamp.isoformat()
+        row['hours_ahead'] = hour
+    return rows
+
+def stream_timeseries(
+    pred: CongestionPredictor,
+    request: TimeseriesRequest,
+    http_request: Request,
+    start_time: datetime,
+    fields: Tuple[str, ...],
+    ticket: Optional[Ticket] = None
+) -> StreamingResponse:
+    """
+    Stream timeseries points as NDJSON in small chunks, stopping on disconnect.
+    The admission ticket is released when the stream ends.
+    """
+    chunk_size = config['streaming']['timeseries_chunk_size']
+    encoder = ChunkStreamEncoder("ndjson")
+    points = pred.iter_timeseries(request.latitude, request.longitude, start_time, request.hours_ahead, fields)
+    
+    def next_chunk():
+        return [point for _, point in zip(range(chunk_size), points)]
+    
+    async def generate():
+        try:
+            while True:
+                if await http_request.is_disconnected():
+                    print("Client disconnected, stopping timeseries stream")
+                    return
+                
+                chunk = await run_in_threadpool(next_chunk)
+                if not chunk:
+                    break
+                yield encoder.encode_rows(chunk)
+        finally:
+            if ticket is not None:
+                ticket.release()
+    
+    background = BackgroundTask(ticket.release) if ticket is not None else None
+    return StreamingResponse(generate(), media_type=encoder.media_type, background=background)
 
 @app.get("/insights")
 async def get_insights():
@@ -327,13 +1565,15 @@ async def get_insights():
         ]
         
         sample_predictions = []
-        current_time = datetime.now()
+        current_time = request_now()
         
-        for lat, lon in sample_locations:
-            for hours in [3, 12, 24, 48, 72]:
-                pred_time = current_time + timedelta(hours=hours)
-                result = pred.predict_single(lat, lon, pred_time)
-                sample_predictions.append(result)
+        # Fixed sample locations are not live traffic for drift monitoring
+        with untracked():
+            for lat, lon in sample_locations:
+                for hours in [3, 12, 24, 48, 72]:
+                    pred_time = current_time + timedelta(hours=hours)
+                    result = pred.predict_single(lat, lon, pred_time)
+                    sample_predictions.append(result)
         
         # Calculate statistics
         congestion_scores = [p['congestion_score'] for p in sample_predictions]
@@ -382,6 +1622,291 @@ async def get_insights():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/drift")
+async def get_drift():
+    """
+    Drift of live model inputs and scores from the training data profile
+    
+    Per feature and for the scores: PSI and KS distance over the training
+    histogram bins, out-of-range share, mean shift and live vs training
+    quantiles, over the recent window and since start.
+    """
+    pred = get_predictor()
+    if pred.drift_config is None:
+        raise HTTPException(status_code=404, detail="Drift monitoring is off (drift.enabled in params.yaml)")
+    
+    return {
+        "success": True,
+        "data": await run_in_threadpool(pred.drift_report)
+    }
+
+# Asynchronous jobs
+def job_tenant(http_request: Request) -> str:
+    return http_request.headers.get(config.get('jobs', {}).get('tenant_header', 'x-tenant-id'), 'default')
+
+def tenant_job(job_id: str, http_request: Request) -> dict:
+    """The caller's job (404 for unknown IDs and other tenants' jobs)"""
+    if not job_manager.enabled:
+        raise HTTPException(status_code=404, detail="Jobs are off (jobs.enabled in params.yaml)")
+    job = job_manager.get(job_id, job_tenant(http_request))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+def job_inputs(request: JobRequest) -> Tuple[dict, int, dict]:
+    """(input arrays, rows, summary) of a job request (400 when invalid)"""
+    if request.kind == 'route':
+        if not request.routes:
+            raise HTTPException(status_code=400, detail="Route jobs need routes")
+        inputs, rows = route_inputs([route.model_dump() for route in request.routes], request_now())
+        return inputs, rows, {"routes": rows}
+    
+    summary = {}
+    cells = None
+    if request.bbox is not None or request.polygon is not None:
+        if request.kind != 'forecast' or request.locations:
+            raise HTTPException(status_code=400, detail="Areas are for forecast jobs without locations")
+        area_config = dict(config['area'], max_cells=config.get('jobs', {}).get('max_cells', 200000))
+        polygon = bbox_to_polygon(request.bbox) if request.bbox else request.polygon
+        try:
+            cells, resolution = cover_polygon(polygon, request.resolution, request.zoom, area_config)
+        except AreaTooLargeError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except (ValueError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid area: {e}")
+        centers = np.array([h3.cell_to_latlng(cell) for cell in cells])
+        lats, lons = centers[:, 0], centers[:, 1]
+        summary.update(cells=len(cells), resolution=resolution, area_id=area_id(cells, resolution))
+    elif request.locations:
+        try:
+            lats = np.array([float(row['latitude']) for row in request.locations])
+            lons = np.array([float(row['longitude']) for row in request.locations])
+        except (KeyError, TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Locations need latitude and longitude ({e})")
+        summary['locations'] = len(lats)
+    else:
+        raise HTTPException(status_code=400, detail="Provide locations, or a bbox or polygon")
+    
+    def parse_time(value: Optional[str], default: datetime) -> datetime:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')) if value else default
+    
+    try:
+        if request.kind == 'forecast' and request.locations and all(row.get('timestamp') for row in request.locations):
+            timestamps = np.array([parse_time(row['timestamp'], None).replace(tzinfo=None) for row in request.locations],
+                                  dtype='M8[s]')
+            inputs, rows = forecast_inputs(lats, lons, timestamps=timestamps)
+            return inputs, rows, summary
+        if request.kind == 'timeseries' or request.hours_ahead is not None:
+            # Timeseries defaults match POST /timeseries: 72 hours, every 3 hours
+            start = parse_time(request.start_time, request_now())
+            hours_ahead = request.hours_ahead if request.hours_ahead is not None else 72
+            step_hours = request.step_hours or (3 if request.kind == 'timeseries' else 1)
+            times, hours = time_range(start, hours_ahead, step_hours)
+            summary.update(start_time=start.isoformat(), hours_ahead=hours_ahead, step_hours=step_hours)
+        else:
+            timestamp = parse_time(request.timestamp, request_now() + timedelta(hours=3))
+            times, hours = np.array([timestamp.replace(tzinfo=None)], dtype='M8[s]'), None
+            summary['timestamp'] = timestamp.isoformat()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid time: {e}")
+    
+    inputs, rows = forecast_inputs(lats, lons, cells, times=times, hours_ahead=hours)
+    summary['times'] = len(times)
+    return inputs, rows, summary
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest, http_request: Request):
+    """
+    Submit a large forecast, timeseries or route job
+    
+    Forecast jobs cover locations or every H3 cell of an area, at one time or
+    every step_hours up to hours_ahead; timeseries jobs do the same for
+    locations. Returns the job's status; poll GET /jobs/{id} and fetch the
+    results when it is done.
+    """
+    if not job_manager.enabled:
+        raise HTTPException(status_code=404, detail="Jobs are off (jobs.enabled in params.yaml)")
+    inputs, rows, summary = job_inputs(request)
+    try:
+        status = await run_in_threadpool(
+            job_manager.submit, request.kind, inputs, rows, job_tenant(http_request), summary
+        )
+    except JobError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except TooManyJobsError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    
+    return JSONResponse(
+        status_code=202,
+        content={"success": True, "data": status},
+        headers={"Location": f"/jobs/{status['id']}"}
+    )
+
+@app.get("/jobs")
+async def list_jobs(http_request: Request):
+    """The caller's jobs, newest first"""
+    if not job_manager.enabled:
+        raise HTTPException(status_code=404, detail="Jobs are off (jobs.enabled in params.yaml)")
+    return {"success": True, "data": job_manager.list_jobs(job_tenant(http_request))}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, http_request: Request):
+    """Status and progress of a job"""
+    return {"success": True, "data": job_manager.status(tenant_job(job_id, http_request))}
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, http_request: Request):
+    """Stop a queued or running job (its finished chunks are kept for a resume)"""
+    return {"success": True, "data": job_manager.cancel(tenant_job(job_id, http_request))}
+
+@app.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: str, http_request: Request):
+    """Queue a failed or cancelled job again, from its finished chunks"""
+    return {"success": True, "data": job_manager.resume(tenant_job(job_id, http_request))}
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str, http_request: Request):
+    """Cancel a job and delete its inputs and results"""
+    await run_in_threadpool(job_manager.delete, tenant_job(job_id, http_request))
+    return {"success": True}
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(
+    job_id: str,
+    http_request: Request,
+    offset: int = Query(0, ge=0, description="First result row"),
+    limit: Optional[int] = Query(None, ge=1, description="Rows per page (default: jobs.page_rows)"),
+    stream: bool = Query(False, description="Stream every row from offset, one chunk per part file")
+):
+    """
+    Results of a finished job as columns (one entry per row)
+    
+    Pages of limit rows carry next_offset for the following page. With
+    stream=true (or Accept: application/x-ndjson) all rows are streamed part
+    by part as NDJSON / chunked binary.
+    """
+    job = tenant_job(job_id, http_request)
+    if job['status'] != 'done':
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}; results are available when it is done")
+    encoding = negotiate_encoding(http_request.headers.get("accept"))
+    if encoding is None:
+        raise HTTPException(
+            status_code=406,
+            detail="Supported media types: application/json, application/msgpack, "
+                   "application/vnd.apache.arrow.stream"
+        )
+    risk_levels = list(CongestionPredictor.RISK_LEVELS)
+    
+    if stream or encoding == "ndjson":
+        encoder = ChunkStreamEncoder(encoding)
+        frames = job_manager.iter_results(job, offset, limit)
+        
+        async def generate():
+            position = offset
+            while True:
+                if await http_request.is_disconnected():
+                    return
+                frame = await run_in_threadpool(next, frames, None)
+                if frame is None:
+                    break
+                yield encoder.encode_chunk({
+                    "job_id": job['id'],
+                    "offset": position,
+                    "count": len(frame),
+                    "risk_levels": risk_levels,
+                    "data": columnar_page(frame, risk_levels),
+                })
+                position += len(frame)
+            tail = encoder.finish()
+            if tail:
+                yield tail
+        
+        return StreamingResponse(generate(), media_type=encoder.media_type)
+    
+    jobs_config = config.get('jobs', {})
+    limit = min(limit or jobs_config.get('page_rows', 10000), jobs_config.get('max_page_rows', 100000))
+    frame = await run_in_threadpool(job_manager.read_results, job, offset, limit)
+    next_offset = offset + len(frame)
+    return encode_response({
+        "success": True,
+        "job_id": job['id'],
+        "format": "columnar",
+        "offset": offset,
+        "count": len(frame),
+        "total": job['rows'],
+        "next_offset": next_offset if next_offset < job['rows'] else None,
+        "risk_levels": risk_levels,
+        "data": columnar_page(frame, risk_levels),
+    }, encoding)
+
+@app.get("/jobs/{job_id}/parts/{index}")
+async def get_job_part(job_id: str, index: int, http_request: Request):
+    """One result part file of a finished chunk, as written (Parquet or CSV)"""
+    job = tenant_job(job_id, http_request)
+    if str(index) not in job['completed']:
+        raise HTTPException(status_code=404, detail=f"Part {index} is not finished")
+    path = job_manager.part_path(job, index)
+    media_type = "application/vnd.apache.parquet" if job['output_format'] == 'parquet' else "text/csv"
+    return FileResponse(path, media_type=media_type, filename=path.name)
+
+# Cluster peer endpoints: rows another node routed here because this node owns their shards
+def peer_predictor(http_request: Request) -> CongestionPredictor:
+    """Predictor for a peer request; 409 when the sender scores with another model version"""
+    pred = get_predictor()
+    version = http_request.headers.get(MODEL_HEADER)
+    if version is not None and version != pred.models_version:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Node serves model {pred.models_version}, the request was for {version}"
+        )
+    return pred
+
+@app.post("/cluster/bands", include_in_schema=False)
+async def peer_bands(
+    http_request: Request,
+    timestamp: Optional[str] = Query(None),
+    approximate: bool = Query(False),
+    approx_resolution: Optional[int] = Query(None, ge=5, le=10),
+    anchor_hours: Optional[int] = Query(None, ge=1, le=24)
+):
+    """(lower, score, upper) as an (n, 3) .npy array for a /batch_forecast body"""
+    pred = peer_predictor(http_request)
+    try:
+        batch = decode_batch_request(await http_request.body(), http_request.headers.get("content-type"))
+    except (UnsupportedMediaTypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    shared_timestamp = batch['timestamp'] or timestamp
+    if batch['timestamps'] is not None:
+        row_times = batch['timestamps']
+    elif shared_timestamp:
+        row_times = datetime.fromisoformat(shared_timestamp.replace('Z', '+00:00'))
+    else:
+        raise HTTPException(status_code=400, detail="Peer requests carry their timestamps")
+    approx_settings = None
+    if approximate:
+        approx_settings = ApproximateScorer(pred, config.get('approximate')).settings(approx_resolution, anchor_hours)
+    
+    shard_router.counts['received_rows'] += len(batch['latitude'])
+    async with admission.admit('batch_forecast', False):
+        bands = await run_in_threadpool(
+            batch_bands, pred, batch['latitude'], batch['longitude'], row_times, approx_settings
+        )
+    return Response(content=encode_array(bands), media_type=NPY_MEDIA_TYPE)
+
+@app.post("/cluster/cell_bands", include_in_schema=False)
+async def peer_cell_bands(request: CellBandsRequest, http_request: Request):
+    """(lower, score, upper) as an (n, 3) .npy array for H3 cells, from this node's forecast cache"""
+    pred = peer_predictor(http_request)
+    if not all(h3.is_valid_cell(cell) for cell in request.cells):
+        raise HTTPException(status_code=400, detail="Invalid H3 cell")
+    timestamp = datetime.fromisoformat(request.timestamp.replace('Z', '+00:00'))
+    
+    shard_router.counts['received_rows'] += len(request.cells)
+    async with admission.admit('area_forecast', False):
+        bands = await run_in_threadpool(pred.predict_cell_bands, request.cells, timestamp)
+    return Response(content=encode_array(bands), media_type=NPY_MEDIA_TYPE)
+
 
 if __name__ == "__main__":
     import uvicorn
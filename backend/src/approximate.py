@@ -0,0 +1,310 @@
+"""
+Coarse-to-fine approximate scoring for CongestionAI
+Instead of evaluating the model at every requested point and time, score a
+coarse set of H3 cells (each point's cell and its neighbours, through the
+(cell, hour) forecast cache) at anchor hours, then interpolate: inverse-distance
+weighting between cell centers in space, linear between anchors in time.
+Speedups grow with point density (many points per coarse cell).
+
+Speedup vs error report: python -m src.approximate report
+"""
+
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import h3
+import numpy as np
+import pandas as pd
+import yaml
+
+from .spatial import lattice_cells
+
+RING_SIZE = 7  # a cell and its six neighbours (pentagons have five)
+
+
+def anchor_times(timestamp, n: int, anchor_hours: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (anchor at or before each row's hour, weight of the following anchor).
+    The model sees whole hours, so times are floored to the hour first and
+    only hours between anchors are interpolated. Anchors are every
+    anchor_hours hours on the wall clock; UTC offsets are dropped, as for the
+    API's timestamps.
+    """
+    if isinstance(timestamp, datetime):
+        times = np.full(n, np.datetime64(timestamp.replace(tzinfo=None), 'h'))
+    else:
+        index = pd.DatetimeIndex(timestamp)
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        times = index.to_numpy().astype('datetime64[h]')
+
+    hours = times.astype(np.int64)
+    start = hours // anchor_hours * anchor_hours
+    return start.astype('datetime64[h]'), (hours - start) / anchor_hours
+
+
+def idw_weights(lats: np.ndarray, lons: np.ndarray, centers: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Inverse squared-distance weights (n, RING_SIZE) of each point to its candidate cell centers"""
+    dlat = centers[..., 0] - lats[:, None]
+    dlon = (centers[..., 1] - lons[:, None]) * np.cos(np.radians(lats))[:, None]
+    weights = mask / (dlat ** 2 + dlon ** 2 + 1e-12)
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+class ApproximateScorer:
+    def __init__(self, predictor, config: Optional[Dict] = None):
+        """
+        Defaults from the approximate config section: H3 resolution of the
+        coarse cells and hours between time anchors
+        """
+        config = config or {}
+        self.predictor = predictor
+        self.resolution = config.get('resolution', 7)
+        self.anchor_hours = config.get('anchor_hours', 1)
+        self.precision = config.get('lookup_precision', 3)
+        self.tolerance = config.get('tolerance', 0.03)
+
+    def settings(self, resolution: Optional[int] = None, anchor_hours: Optional[int] = None) -> Dict:
+        """Per-request overrides merged with the defaults"""
+        return {
+            'resolution': resolution or self.resolution,
+            'anchor_hours': anchor_hours or self.anchor_hours,
+        }
+
+    def predict_bands(
+        self,
+        lats,
+        lons,
+        timestamp,
+        resolution: Optional[int] = None,
+        anchor_hours: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Approximate (lower, score, upper) rows for locations at a shared
+        datetime or per-row timestamps. Interpolating already sorted bands
+        keeps lower <= score <= upper.
+        """
+        settings = self.settings(resolution, anchor_hours)
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        n = len(lats)
+        if n == 0:
+            return np.empty((0, 3))
+
+        candidates, weights, cells, centers = self.cell_support(lats, lons, settings['resolution'])
+        starts, next_weight = anchor_times(timestamp, n, settings['anchor_hours'])
+        step = np.timedelta64(settings['anchor_hours'], 'h')
+
+        # Anchors actually needed: the one before every row, the one after only where it has weight
+        later = next_weight > 0
+        anchors, anchor_index = np.unique(np.concatenate([starts, starts[later] + step]), return_inverse=True)
+        before = anchor_index[:n]
+        after = np.full(n, -1)
+        after[later] = anchor_index[n:]
+
+        values = self.score_cells(cells, centers, anchors, candidates, before, after)
+        bands = np.einsum('nk,nkb->nb', weights, values[before[:, None], candidates])
+        if later.any():
+            next_bands = np.einsum('nk,nkb->nb', weights[later], values[after[later][:, None], candidates[later]])
+            w = next_weight[later][:, None]
+            bands[later] = (1 - w) * bands[later] + w * next_bands
+        return bands
+
+    def cell_support(self, lats: np.ndarray, lons: np.ndarray, resolution: int):
+        """
+        (candidate cells per point: its cell and neighbours, IDW weights, the
+        distinct candidate cells, their centers). Points are mapped to cells
+        through a lattice, so there is one h3 call per distinct lattice point.
+        """
+        lattice, lattice_index = lattice_cells(lats, lons, resolution, self.precision)
+        unique, lattice_unique = np.unique(lattice, return_inverse=True)
+        inverse = lattice_unique.reshape(-1)[lattice_index]
+
+        rings = [[cell] + [c for c in h3.grid_disk(cell, 1) if c != cell] for cell in unique.tolist()]
+        cells = sorted({c for ring in rings for c in ring})
+        position = {cell: i for i, cell in enumerate(cells)}
+        ring_index = np.array([
+            [position[c] for c in ring] + [position[ring[0]]] * (RING_SIZE - len(ring)) for ring in rings
+        ])
+        ring_mask = np.array([[1.0] * len(ring) + [0.0] * (RING_SIZE - len(ring)) for ring in rings])
+        centers = np.array([h3.cell_to_latlng(cell) for cell in cells])
+
+        candidates = ring_index[inverse]
+        weights = idw_weights(lats, lons, centers[candidates], ring_mask[inverse])
+        return candidates, weights, cells, centers
+
+    def score_cells(self, cells: List[str], centers: np.ndarray, anchors: np.ndarray,
+                    candidates: np.ndarray, before: np.ndarray, after: np.ndarray) -> np.ndarray:
+        """
+        (anchors, cells, 3) bands for the cells each anchor needs (NaN
+        elsewhere). Shares the (cell, hour) forecast cache with area
+        forecasts; misses across all anchors are scored in one model call.
+        """
+        cache = self.predictor.forecast_cache
+        cache_version = self.predictor.cache_version
+        values = np.full((len(anchors), len(cells), 3), np.nan)
+
+        buckets = [cache.hour_bucket(pd.Timestamp(anchor).to_pydatetime()) for anchor in anchors]
+        miss_anchor, miss_cell = [], []
+        for a, bucket in enumerate(buckets):
+            support = np.unique(candidates[(before == a) | (after == a)])
+            values[a, support], missing = cache.get_many(cache_version, [cells[i] for i in support.tolist()], bucket)
+            miss_anchor.append(np.full(len(missing), a))
+            miss_cell.append(support[missing])
+
+        miss_anchor, miss_cell = np.concatenate(miss_anchor), np.concatenate(miss_cell)
+        if len(miss_cell):
+            # One batch with per-row timestamps, at cell centers like predict_cell_bands
+            new_bands = self.predictor.predict_intervals(
+                centers[miss_cell, 0], centers[miss_cell, 1], anchors[miss_anchor].astype('datetime64[us]')
+            )
+            values[miss_anchor, miss_cell] = new_bands
+            for a in np.unique(miss_anchor).tolist():
+                rows = miss_anchor == a
+                cache.put_many(cache_version, [cells[i] for i in miss_cell[rows].tolist()], buckets[a], new_bands[rows])
+        return values
+
+
+# --- Report --------------------------------------------------------------------
+
+def sample_viewports(regions: Dict, viewports: int, points: int, span: float, hours: int,
+                     per_row_times: bool = False, seed: int = 0) -> List[Tuple[np.ndarray, np.ndarray, object]]:
+    """
+    Map-view requests: points spread over a span x span degree box around a
+    random spot in a region's data areas, at a random minute within the next
+    hours (so neither cells nor hours line up with the anchors). With
+    per_row_times every point gets its own time, as for long-horizon batches.
+    """
+    rng = np.random.default_rng(seed)
+    areas = np.array([bbox for region in regions.values() for bbox in region.get('data_areas', [])])
+    now = datetime.now().replace(second=0, microsecond=0)
+    requests = []
+    for _ in range(viewports):
+        bbox = areas[rng.integers(len(areas))]
+        center_lat, center_lon = rng.uniform(bbox[0], bbox[2]), rng.uniform(bbox[1], bbox[3])
+        lats = center_lat + rng.uniform(-span / 2, span / 2, points)
+        lons = center_lon + rng.uniform(-span / 2, span / 2, points)
+        if per_row_times:
+            offsets = rng.integers(hours * 60, size=points).astype('timedelta64[m]')
+            requests.append((lats, lons, np.datetime64(now, 'm') + offsets))
+        else:
+            requests.append((lats, lons, now + timedelta(minutes=int(rng.integers(hours * 60)))))
+    return requests
+
+
+def run_report(predictor, config: Dict, resolutions: List[int], anchor_hours: List[int],
+               viewports: int, points: int, span: float, hours: int, per_row_times: bool = False) -> List[Dict]:
+    """
+    Exact vs approximate scoring of the same map-view requests for every
+    (resolution, anchor hours) pair. The forecast cache is cleared before
+    each setting, so timings include scoring the coarse cells.
+    """
+    approx_config = config.get('approximate', {})
+    scorer = ApproximateScorer(predictor, approx_config)
+    requests = sample_viewports(config.get('regions', {}), viewports, points, span, hours, per_row_times)
+
+    started = time.perf_counter()
+    exact = [predictor.predict_intervals(lats, lons, timestamp) for lats, lons, timestamp in requests]
+    exact_ms = (time.perf_counter() - started) * 1000 / len(requests)
+    exact_scores = np.concatenate([bands[:, 1] for bands in exact])
+    exact_risk = predictor.get_risk_codes(exact_scores)
+
+    rows = []
+    for resolution in resolutions:
+        for step in anchor_hours:
+            predictor.forecast_cache.clear()
+            started = time.perf_counter()
+            approx = [
+                scorer.predict_bands(lats, lons, timestamp, resolution, step)
+                for lats, lons, timestamp in requests
+            ]
+            approx_ms = (time.perf_counter() - started) * 1000 / len(requests)
+
+            scores = np.concatenate([bands[:, 1] for bands in approx])
+            error = np.abs(scores - exact_scores)
+            rows.append({
+                'resolution': resolution,
+                'anchor_hours': step,
+                'exact_ms': round(exact_ms, 2),
+                'approx_ms': round(approx_ms, 2),
+                'speedup': round(exact_ms / approx_ms, 2),
+                'mean_error': round(float(error.mean()), 4),
+                'p95_error': round(float(np.percentile(error, 95)), 4),
+                'max_error': round(float(error.max()), 4),
+                'risk_agreement': round(float(np.mean(predictor.get_risk_codes(scores) == exact_risk)), 4),
+                'within_tolerance': bool(np.percentile(error, 95) <= scorer.tolerance),
+            })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CongestionAI approximate (coarse-to-fine) scoring")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    report = sub.add_parser('report', help="Speedup and error vs exact scoring at several resolutions")
+    report.add_argument('--config', default="configs/params.yaml")
+    report.add_argument('--resolutions', nargs='+', type=int, help="H3 resolutions (default: approximate.report_resolutions)")
+    report.add_argument('--anchor-hours', nargs='+', type=int, help="Hours between anchors (default: approximate.report_anchor_hours)")
+    report.add_argument('--viewports', type=int, default=20)
+    report.add_argument('--points', type=int, default=5000, help="Points per viewport")
+    report.add_argument('--span', type=float, default=0.1, help="Viewport size in degrees")
+    report.add_argument('--hours', type=int, default=72, help="Request times fall within this many hours")
+    report.add_argument('--per-row-times', action='store_true', help="One time per point instead of per viewport")
+    report.add_argument('--output', help="Write the JSON report here")
+
+    validate = sub.add_parser('validate', help="Check the configured resolution and anchors against the tolerance")
+    validate.add_argument('--config', default="configs/params.yaml")
+    validate.add_argument('--viewports', type=int, default=20)
+    validate.add_argument('--points', type=int, default=5000)
+    args = parser.parse_args()
+
+    from .infer import CongestionPredictor
+
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+    approx_config = config.get('approximate', {})
+    predictor = CongestionPredictor(
+        config['model']['save_path'],
+        cache_config=config.get('cache'),
+        router_config=config.get('model_router'),
+        regions=config.get('regions')
+    )
+    predictor.weather_api_key = ''
+
+    if args.command == 'validate':
+        scorer = ApproximateScorer(predictor, approx_config)
+        [row] = run_report(predictor, config, [scorer.resolution], [scorer.anchor_hours],
+                           args.viewports, args.points, 0.1, 72)
+        print(f"resolution {row['resolution']}, anchors every {row['anchor_hours']}h: "
+              f"p95 error {row['p95_error']} (tolerance {scorer.tolerance}), {row['speedup']}x")
+        if not row['within_tolerance']:
+            print("[WARNING] Approximate scoring exceeds the tolerance; use a finer resolution or closer anchors")
+            raise SystemExit(1)
+        print("[OK] Within tolerance")
+        return
+
+    resolutions = args.resolutions or approx_config.get('report_resolutions', [6, 7, 8, 9])
+    anchor_hours = args.anchor_hours or approx_config.get('report_anchor_hours', [1, 3, 6])
+    print(f"{args.viewports} viewports x {args.points} points ({args.span} deg), "
+          f"{'per-point' if args.per_row_times else 'shared'} times within {args.hours}h")
+    rows = run_report(predictor, config, resolutions, anchor_hours,
+                      args.viewports, args.points, args.span, args.hours, args.per_row_times)
+
+    print(f"\n{'res':>4}{'anchor h':>10}{'exact ms':>10}{'approx ms':>11}{'speedup':>9}"
+          f"{'mean err':>10}{'p95 err':>9}{'max err':>9}{'risk agr':>10}")
+    for row in rows:
+        print(f"{row['resolution']:>4}{row['anchor_hours']:>10}{row['exact_ms']:>10.1f}{row['approx_ms']:>11.1f}"
+              f"{row['speedup']:>8.2f}x{row['mean_error']:>10.4f}{row['p95_error']:>9.4f}{row['max_error']:>9.4f}"
+              f"{row['risk_agreement']:>10.1%}{'' if row['within_tolerance'] else '  over tolerance'}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
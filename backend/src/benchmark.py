@@ -0,0 +1,532 @@
+"""
+Benchmark Suite for CongestionAI
+Times inference, API and pipeline hot paths against a deterministic synthetic model
+and gates on regressions relative to a stored baseline
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import yaml
+
+
+class BenchmarkSuite:
+    GROUPS = ['inference', 'api', 'serialization', 'request_decode', 'pipeline', 'training', 'quantiles']
+
+    def __init__(self, config_path: str = "configs/params.yaml", repeats: Optional[int] = None):
+        """Initialize benchmark suite with configuration"""
+        with open(config_path, 'r') as f:
+            self.config = yaml.safe_load(f)
+
+        self.bench_config = self.config['benchmark']
+        self.repeats = repeats or self.bench_config['repeats']
+        self.reference_time = datetime.fromisoformat(self.bench_config['reference_time'])
+        self.results = {}
+
+        self.workdir = Path(tempfile.mkdtemp(prefix="congestionai_bench_"))
+        self.bench_config_path = self._write_bench_config()
+        self.predictor = None
+        self.training_frame = None
+
+    def _write_bench_config(self) -> str:
+        """Write a copy of the config that keeps all artifacts inside the work dir"""
+        config = copy.deepcopy(self.config)
+        config['data']['raw_path'] = str(self.workdir / "raw")
+        config['data']['processed_path'] = str(self.workdir / "processed")
+        config['model']['save_path'] = str(self.workdir / "model.pkl")
+
+        config_path = self.workdir / "params.yaml"
+        with open(config_path, 'w') as f:
+            yaml.safe_dump(config, f)
+        return str(config_path)
+
+    # ------------------------------------------------------------------
+    # Measurement helpers
+    # ------------------------------------------------------------------
+
+    def measure(
+        self,
+        name: str,
+        fn: Callable,
+        setup: Optional[Callable] = None,
+        rows: int = 1,
+        repeats: Optional[int] = None,
+        extra: Optional[Dict] = None
+    ) -> Dict:
+        """
+        Time fn over several repeats and record latency percentiles and peak memory.
+        setup() runs outside the timed region and its return value is passed to fn.
+        extra is merged into the recorded result (e.g. payload sizes).
+        """
+        repeats = repeats or self.repeats
+
+        def call():
+            arg = setup() if setup else None
+            start = time.perf_counter()
+            fn(arg) if setup else fn()
+            return time.perf_counter() - start
+
+        # Warm-up (lazy imports, caches, allocator)
+        call()
+
+        timings = np.array([call() for _ in range(repeats)])
+
+        # Peak Python-heap memory of a single call, measured separately so
+        # tracemalloc overhead does not distort the timings
+        arg = setup() if setup else None
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+        fn(arg) if setup else fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        p50 = float(np.percentile(timings, 50))
+        result = {
+            'repeats': repeats,
+            'rows': rows,
+            'ops_per_sec': round(1.0 / p50, 3) if p50 > 0 else None,
+            'rows_per_sec': round(rows / p50, 3) if p50 > 0 else None,
+            'mean_ms': round(float(timings.mean()) * 1000, 4),
+            'p50_ms': round(p50 * 1000, 4),
+            'p99_ms': round(float(np.percentile(timings, 99)) * 1000, 4),
+            'peak_memory_kb': round(peak / 1024, 1),
+            **(extra or {}),
+        }
+        self.results[name] = result
+
+        print(f"  {name:<40} p50={result['p50_ms']:>10.3f}ms  p99={result['p99_ms']:>10.3f}ms  "
+              f"ops/s={result['ops_per_sec']:>10}  peak={result['peak_memory_kb']:>9}KB")
+        return result
+
+    # ------------------------------------------------------------------
+    # Fixtures
+    # ------------------------------------------------------------------
+
+    def synthetic_data(self, n_samples: Optional[int] = None):
+        """Deterministic synthetic raw dataset"""
+        from .data_pipeline import DataPipeline
+
+        pipeline = DataPipeline(self.bench_config_path)
+        return pipeline, pipeline.generate_synthetic_data(
+            n_samples=n_samples or self.bench_config['n_samples'],
+            end_date=self.reference_time
+        )
+
+    def train_predictor(self, model_path: Path, quantiles: Optional[List[float]] = None):
+        """
+        Train a deterministic synthetic model to model_path and load it.
+        quantiles overrides model.quantiles ([] for a point model)
+        """
+        from .infer import CongestionPredictor
+        from .train_model import ModelTrainer
+
+        if self.training_frame is None:
+            pipeline, df = self.synthetic_data()
+            self.training_frame = pipeline.process_data(df)
+            pipeline.save_neighbour_index(self.training_frame)
+
+        trainer = ModelTrainer(self.bench_config_path)
+        trainer.model_path = model_path
+        if quantiles is not None:
+            trainer.config['model']['quantiles'] = trainer.quantiles = sorted(quantiles)
+        X, y = trainer.prepare_features(self.training_frame)
+        n_val = max(1, len(X) // 7)
+        trainer.train_model(X.iloc[n_val:], y.iloc[n_val:], X.iloc[:n_val], y.iloc[:n_val])
+        trainer.save_model()
+
+        predictor = CongestionPredictor(str(model_path))
+        # Never touch the network while benchmarking
+        predictor.weather_api_key = ''
+        return predictor
+
+    def build_model(self):
+        """Train and load the deterministic synthetic benchmark model"""
+        if self.predictor is None:
+            print("Building deterministic synthetic model...")
+            self.predictor = self.train_predictor(self.workdir / "model.pkl")
+        return self.predictor
+
+    def sample_locations(self, n: int) -> List[tuple]:
+        """Deterministic Bay Area locations"""
+        rng = np.random.default_rng(7)
+        lats = rng.uniform(37.3, 38.0, n)
+        lons = rng.uniform(-122.5, -121.8, n)
+        return list(zip(lats.tolist(), lons.tolist()))
+
+    # ------------------------------------------------------------------
+    # Benchmark groups
+    # ------------------------------------------------------------------
+
+    def bench_inference(self):
+        """CongestionPredictor hot paths"""
+        predictor = self.build_model()
+        lat, lon = self.sample_locations(1)[0]
+        ts = self.reference_time
+
+        self.measure(
+            'inference.predict_single',
+            lambda: predictor.predict_single(lat, lon, ts)
+        )
+
+        for size in self.bench_config['batch_sizes']:
+            locations = self.sample_locations(size)
+            self.measure(
+                f'inference.predict_batch[{size}]',
+                lambda: predictor.predict_batch(locations, ts),
+                rows=size,
+                repeats=max(3, self.repeats // max(1, size // 100))
+            )
+
+        if predictor.neighbour_rings:
+            # Neighbour features alone, to show their per-row share of predict_batch
+            locations = self.sample_locations(1000)
+            lats = np.array([loc[0] for loc in locations])
+            lons = np.array([loc[1] for loc in locations])
+            base = predictor.feature_engineer.prepare_batch_features(lats, lons, ts)
+            self.measure(
+                'inference.neighbour_features[1000]',
+                lambda df: predictor.add_neighbour_features(df, lats, lons),
+                setup=base.copy,
+                rows=1000
+            )
+
+        self.measure(
+            'inference.predict_timeseries[72h]',
+            lambda: predictor.predict_timeseries(lat, lon, ts, hours_ahead=72),
+            rows=25,
+            repeats=max(3, self.repeats // 3)
+        )
+
+    def bench_api(self):
+        """FastAPI handlers called directly (no HTTP stack)"""
+        from . import api
+
+        api.predictor = self.build_model()
+        # Straight-line route simulation, independent of any local road graph
+        api.router, api.router_checked = None, True
+        request = api.RouteRequest(
+            start_lat=37.7749, start_lon=-122.4194,
+            end_lat=37.8044, end_lon=-122.2712,
+            departure_time=self.reference_time.isoformat()
+        )
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.measure(
+                'api.route_simulate',
+                lambda: loop.run_until_complete(api.simulate_route(request)),
+                repeats=max(3, self.repeats // 3)
+            )
+        finally:
+            loop.close()
+
+    def bench_serialization(self, n_rows: int = 10000):
+        """Batch forecast response encodings: payload size and encode time"""
+        from fastapi.encoders import jsonable_encoder
+        from fastapi.responses import JSONResponse
+
+        from . import serialization
+
+        predictor = self.build_model()
+        locations = self.sample_locations(n_rows)
+        lats = np.array([loc[0] for loc in locations])
+        lons = np.array([loc[1] for loc in locations])
+        ts = self.reference_time
+
+        rows_payload = {
+            'success': True,
+            'count': n_rows,
+            'timestamp': ts.isoformat(),
+            'data': predictor.predict_batch(locations, ts)
+        }
+        bands = predictor.predict_intervals(lats, lons, ts)
+        columnar_payload = serialization.build_columnar_batch(
+            lats, lons, bands[:, 1],
+            risk_codes=predictor.get_risk_codes(bands[:, 1]),
+            risk_levels=predictor.RISK_LEVELS,
+            timestamp=ts.isoformat(),
+            confidence=predictor.calculate_confidence(bands),
+            extra_columns={'congestion_lower': bands[:, 0].astype(np.float32),
+                           'congestion_upper': bands[:, 2].astype(np.float32)}
+        )
+
+        # What FastAPI does for a plain dict return value
+        def rows_default_json():
+            return JSONResponse(jsonable_encoder(rows_payload)).body
+
+        encoders = {
+            f'serialization.rows_fastapi_json[{n_rows}]': rows_default_json,
+            f'serialization.columnar_json[{n_rows}]': lambda: serialization.encode_json(columnar_payload),
+        }
+        if serialization.MSGPACK_AVAILABLE:
+            encoders[f'serialization.columnar_msgpack[{n_rows}]'] = \
+                lambda: serialization.encode_msgpack(columnar_payload)
+        if serialization.ARROW_AVAILABLE:
+            encoders[f'serialization.columnar_arrow[{n_rows}]'] = \
+                lambda: serialization.encode_arrow(columnar_payload)
+
+        repeats = max(3, self.repeats // 3)
+        for name, encode in encoders.items():
+            self.measure(name, encode, rows=n_rows, repeats=repeats,
+                         extra={'payload_bytes': len(encode())})
+
+    def bench_request_decode(self, sizes: Optional[List[int]] = None):
+        """
+        /batch_forecast body decoding into coordinate arrays: the original
+        List[dict] schema (json + pydantic + per-location tuples) against
+        columnar JSON, .npy and Arrow bodies
+        """
+        import io
+        import json
+
+        from . import serialization
+        from .api import BatchLocationRequest
+
+        repeats = max(3, self.repeats // 3)
+        for n in sizes or [10000, 100000]:
+            rng = np.random.default_rng(0)
+            lats = rng.uniform(37.3, 38.0, n)
+            lons = rng.uniform(-122.5, -121.8, n)
+            ts = self.reference_time.isoformat()
+
+            rows_body = json.dumps({
+                'locations': [{'latitude': lat, 'longitude': lon} for lat, lon in zip(lats.tolist(), lons.tolist())],
+                'timestamp': ts
+            }).encode()
+            columns_body = json.dumps({'latitudes': lats.tolist(), 'longitudes': lons.tolist(), 'timestamp': ts}).encode()
+            npy_buffer = io.BytesIO()
+            np.save(npy_buffer, np.column_stack([lats, lons]))
+
+            # What the endpoint did before: FastAPI json parse, pydantic model, tuple list, arrays
+            def decode_rows_pydantic():
+                request = BatchLocationRequest.model_validate(json.loads(rows_body))
+                locations = [(loc['latitude'], loc['longitude']) for loc in request.locations]
+                return (np.fromiter((loc[0] for loc in locations), dtype=np.float64, count=len(locations)),
+                        np.fromiter((loc[1] for loc in locations), dtype=np.float64, count=len(locations)))
+
+            decoders = {
+                f'request_decode.rows_pydantic[{n}]': (decode_rows_pydantic, rows_body),
+                f'request_decode.rows_json[{n}]':
+                    (lambda: serialization.decode_batch_request(rows_body, 'application/json'), rows_body),
+                f'request_decode.columnar_json[{n}]':
+                    (lambda: serialization.decode_batch_request(columns_body, 'application/json'), columns_body),
+                f'request_decode.npy[{n}]':
+                    (lambda: serialization.decode_batch_request(npy_buffer.getvalue(), serialization.NPY_MEDIA_TYPE),
+                     npy_buffer.getvalue()),
+            }
+            if serialization.ARROW_AVAILABLE:
+                arrow_body = serialization.encode_arrow({'data': {'latitude': lats, 'longitude': lons}})
+                decoders[f'request_decode.arrow[{n}]'] = \
+                    (lambda: serialization.decode_batch_request(arrow_body, serialization.ARROW_MEDIA_TYPE), arrow_body)
+
+            for name, (decode, body) in decoders.items():
+                self.measure(name, decode, rows=n, repeats=repeats, extra={'payload_bytes': len(body)})
+
+    def bench_pipeline(self):
+        """Each DataPipeline stage on the synthetic dataset"""
+        pipeline, raw = self.synthetic_data()
+        n = len(raw)
+
+        with_h3 = pipeline.encode_h3(raw.copy())
+        with_time = pipeline.add_time_features(with_h3.copy())
+        with_lag = pipeline.add_lag_features(with_time.copy())
+        with_rolling = pipeline.add_rolling_features(with_lag.copy())
+
+        repeats = max(3, self.repeats // 10)
+        self.measure('pipeline.generate_synthetic_data',
+                     lambda: pipeline.generate_synthetic_data(n, end_date=self.reference_time),
+                     rows=n, repeats=repeats)
+        self.measure('pipeline.encode_h3', pipeline.encode_h3,
+                     setup=raw.copy, rows=n, repeats=repeats)
+        self.measure('pipeline.add_time_features', pipeline.add_time_features,
+                     setup=with_h3.copy, rows=n, repeats=repeats)
+        self.measure('pipeline.add_lag_features', pipeline.add_lag_features,
+                     setup=with_time.copy, rows=n, repeats=repeats)
+        self.measure('pipeline.add_rolling_features', pipeline.add_rolling_features,
+                     setup=with_lag.copy, rows=n, repeats=repeats)
+        self.measure('pipeline.add_neighbour_features', pipeline.add_neighbour_features,
+                     setup=with_rolling.copy, rows=n, repeats=repeats)
+        self.measure('pipeline.process_data', pipeline.process_data,
+                     setup=raw.copy, rows=n, repeats=repeats)
+
+    def bench_training(self):
+        """ModelTrainer fit time on the synthetic dataset"""
+        from .train_model import ModelTrainer
+
+        pipeline, df = self.synthetic_data()
+        df = pipeline.process_data(df)
+
+        trainer = ModelTrainer(self.bench_config_path)
+        X, y = trainer.prepare_features(df)
+        n_val = max(1, len(X) // 7)
+        X_train, y_train = X.iloc[n_val:], y.iloc[n_val:]
+        X_val, y_val = X.iloc[:n_val], y.iloc[:n_val]
+
+        self.measure(
+            'training.fit',
+            lambda: trainer.train_model(X_train, y_train, X_val, y_val),
+            rows=len(X_train),
+            repeats=3
+        )
+
+    def bench_quantiles(self):
+        """
+        Point-estimate model vs the multi-quantile model (score plus interval
+        from one predict call), on the same data: booster time alone and
+        end-to-end predict_batch
+        """
+        quantiles = self.config['model'].get('quantiles') or [0.1, 0.5, 0.9]
+        predictors = {
+            'point': self.train_predictor(self.workdir / "point_model.pkl", quantiles=[]),
+            'interval': self.train_predictor(self.workdir / "quantile_model.pkl", quantiles=quantiles),
+        }
+
+        comparison = {}
+        for size in self.bench_config['batch_sizes']:
+            locations = self.sample_locations(size)
+            lats = np.array([loc[0] for loc in locations])
+            lons = np.array([loc[1] for loc in locations])
+            repeats = max(3, self.repeats // max(1, size // 100))
+            for name, predictor in predictors.items():
+                X = predictor.add_neighbour_features(
+                    predictor.build_features(lats, lons, self.reference_time), lats, lons
+                )[predictor.feature_names]
+                trees = len(predictor.model.get_booster().get_dump())
+                booster = self.measure(f'quantiles.{name}.model_predict[{size}]',
+                                       lambda: predictor.model.predict(X),
+                                       rows=size, repeats=repeats, extra={'trees': trees})
+                batch = self.measure(f'quantiles.{name}.predict_batch[{size}]',
+                                     lambda: predictor.predict_batch(locations, self.reference_time),
+                                     rows=size, repeats=repeats, extra={'trees': trees})
+                comparison.setdefault(size, {})[name] = (booster['p50_ms'], batch['p50_ms'])
+
+        print(f"\n  {'rows':>6} {'booster point':>14} {'interval':>10} {'ratio':>6}   "
+              f"{'batch point':>12} {'interval':>10} {'ratio':>6}")
+        for size, timings in comparison.items():
+            (point_model, point_batch), (interval_model, interval_batch) = timings['point'], timings['interval']
+            print(f"  {size:>6} {point_model:>12.3f}ms {interval_model:>8.3f}ms {interval_model / point_model:>5.2f}x   "
+                  f"{point_batch:>10.3f}ms {interval_batch:>8.3f}ms {interval_batch / point_batch:>5.2f}x")
+
+    # ------------------------------------------------------------------
+    # Baseline comparison
+    # ------------------------------------------------------------------
+
+    def compare(self, baseline: Dict, threshold: float) -> List[Dict]:
+        """Return benchmarks whose p50 latency regressed beyond threshold"""
+        regressions = []
+        baseline_results = baseline.get('results', {})
+
+        print(f"\n=== Comparison against baseline (threshold +{threshold:.0%}) ===")
+        for name, current in self.results.items():
+            if name not in baseline_results:
+                print(f"  {name:<40} (new, no baseline)")
+                continue
+
+            base_p50 = baseline_results[name]['p50_ms']
+            change = (current['p50_ms'] - base_p50) / base_p50 if base_p50 > 0 else 0.0
+            status = "REGRESSION" if change > threshold else "ok"
+            print(f"  {name:<40} {base_p50:>10.3f}ms -> {current['p50_ms']:>10.3f}ms  "
+                  f"({change:+.1%}) {status}")
+
+            if change > threshold:
+                regressions.append({
+                    'name': name,
+                    'baseline_p50_ms': base_p50,
+                    'current_p50_ms': current['p50_ms'],
+                    'change': round(change, 4)
+                })
+
+        return regressions
+
+    def environment(self) -> Dict:
+        """Describe the machine the numbers came from"""
+        import os
+        import pandas as pd
+        import xgboost
+
+        return {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'xgboost': xgboost.__version__,
+        }
+
+    def run(self, groups: Optional[List[str]] = None) -> Dict:
+        """Run the selected benchmark groups"""
+        print("=" * 60)
+        print("CongestionAI Benchmarks")
+        print("=" * 60)
+
+        for group in groups or self.GROUPS:
+            print(f"\n[{group}]")
+            getattr(self, f"bench_{group}")()
+
+        return {
+            'created_at': datetime.now().isoformat(),
+            'environment': self.environment(),
+            'results': self.results
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CongestionAI benchmark suite")
+    parser.add_argument('--config', default="configs/params.yaml")
+    parser.add_argument('--groups', nargs='+', choices=BenchmarkSuite.GROUPS,
+                        help="Benchmark groups to run (default: all)")
+    parser.add_argument('--repeats', type=int, help="Override repeats per benchmark")
+    parser.add_argument('--output', help="Where to write machine-readable results")
+    parser.add_argument('--baseline', help="Baseline results to compare against")
+    parser.add_argument('--threshold', type=float, help="Allowed fractional p50 regression")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Store this run as the new baseline instead of comparing")
+    args = parser.parse_args()
+
+    suite = BenchmarkSuite(args.config, repeats=args.repeats)
+    report = suite.run(args.groups)
+
+    output_path = Path(args.output or suite.bench_config['results_path'])
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output_path}")
+
+    baseline_path = Path(args.baseline or suite.bench_config['baseline_path'])
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {baseline_path}")
+        return
+
+    if not baseline_path.exists():
+        print(f"No baseline at {baseline_path}; run with --save-baseline to create one")
+        return
+
+    with open(baseline_path, 'r') as f:
+        baseline = json.load(f)
+
+    threshold = args.threshold if args.threshold is not None else suite.bench_config['regression_threshold']
+    regressions = suite.compare(baseline, threshold)
+
+    if regressions:
+        print(f"\n[FAIL] {len(regressions)} benchmark(s) regressed beyond +{threshold:.0%}")
+        sys.exit(1)
+
+    print("\n[OK] No regressions against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""
+Offline bulk scoring for CongestionAI
+Scores large (latitude, longitude, timestamp) files with CongestionPredictor
+across a process pool. Input is read in chunks, each chunk is scored by a
+worker and written as its own output part, and a checkpoint records finished
+parts so an interrupted job resumes where it stopped.
+
+Run with: python -m src.bulk_score run --input data/bulk/input.parquet --output data/bulk/scores
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from .orchestrator import file_hash
+from .serialization import parse_timestamps
+
+try:
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+INPUT_SUFFIXES = ('.parquet', '.csv')
+CHECKPOINT_FILE = '_checkpoint.json'
+# Files a job writes, including temporary names left by an interrupted write
+OUTPUT_FILE = re.compile(r"\.?(part-\d+-\d+\.(parquet|csv)|_checkpoint\.json|_SUCCESS)(\.\d+)?(\.tmp)?")
+
+# Set in each worker process by init_worker
+_predictor = None
+_columns = None
+
+
+def input_files(path: str) -> List[Path]:
+    """A single file, or every Parquet/CSV file under a directory (e.g. date=.../part-*.parquet)"""
+    path = Path(path)
+    if path.is_file():
+        return [path]
+    files = sorted(p for p in path.rglob('*') if p.suffix in INPUT_SUFFIXES and not p.name.startswith(('.', '_')))
+    if not files:
+        raise FileNotFoundError(f"No {'/'.join(INPUT_SUFFIXES)} files under {path}")
+    return files
+
+
+def read_chunks(files: List[Path], chunk_rows: int) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """(part name, rows) for every chunk of every input file, in a fixed order"""
+    for file_index, path in enumerate(files):
+        if path.suffix == '.parquet':
+            if not PARQUET_AVAILABLE:
+                raise RuntimeError("Reading Parquet needs pyarrow")
+            batches = (batch.to_pandas() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows))
+        else:
+            batches = pd.read_csv(path, chunksize=chunk_rows)
+        for chunk_index, chunk in enumerate(batches):
+            yield f"part-{file_index:05d}-{chunk_index:05d}", chunk
+
+
+def wall_clock(values) -> np.ndarray:
+    """Timestamp column -> datetime64 wall-clock times (UTC offsets dropped, as in the API)"""
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        return values.dt.tz_localize(None).to_numpy()
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.to_numpy()
+    return parse_timestamps(values)
+
+
+def init_worker(config: Dict, columns: Dict, threads: int):
+    """Load the predictor once per worker process"""
+    global _predictor, _columns
+    # One scoring thread per process unless configured otherwise, so workers do not oversubscribe cores
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+
+    from .infer import CongestionPredictor
+
+    _predictor = CongestionPredictor(
+        config['model']['save_path'],
+        router_config=config.get('model_router'),
+        regions=config.get('regions')
+    )
+    _columns = columns
+
+
+def add_score_columns(result: pd.DataFrame, predictor, bands: np.ndarray) -> pd.DataFrame:
+    """Score, risk level and (for quantile models) interval columns from (lower, score, upper) bands"""
+    scores = bands[:, 1]
+    result['congestion_score'] = scores.astype(np.float32)
+    result['risk_level'] = pd.Categorical.from_codes(
+        predictor.get_risk_codes(scores), categories=predictor.RISK_LEVELS
+    )
+    if predictor.quantiles:
+        result['congestion_lower'] = bands[:, 0].astype(np.float32)
+        result['congestion_upper'] = bands[:, 2].astype(np.float32)
+    return result
+
+
+def write_part(result: pd.DataFrame, path: Path, output_format: str):
+    """
+    Written under a temporary name first, so a part file on disk is always
+    complete. The name is per process: two writers of one part never share it.
+    """
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    if output_format == 'parquet':
+        result.to_parquet(tmp_path, index=False)
+    else:
+        result.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def clear_output(output_dir: Path):
+    """Delete what a job wrote (parts, checkpoint, _SUCCESS), leaving any other files alone"""
+    for path in output_dir.iterdir():
+        if path.is_file() and OUTPUT_FILE.fullmatch(path.name):
+            path.unlink()
+
+
+def score_chunk(part: str, chunk: pd.DataFrame, output_dir: str, output_format: str) -> Tuple[str, int, float]:
+    """Score one chunk and write it as <output_dir>/<part>.<format>; returns (part, rows, seconds)"""
+    started = time.perf_counter()
+    lats = chunk[_columns['latitude']].to_numpy(dtype=np.float64)
+    lons = chunk[_columns['longitude']].to_numpy(dtype=np.float64)
+    timestamps = wall_clock(chunk[_columns['timestamp']])
+
+    bands = _predictor.predict_intervals(lats, lons, timestamps)
+    result = add_score_columns(chunk.copy(), _predictor, bands)
+    write_part(result, Path(output_dir) / f"{part}.{output_format}", output_format)
+    return part, len(result), time.perf_counter() - started
+
+
+def model_files(config: Dict) -> List[Path]:
+    """Global model plus any regional models the predictor would route to"""
+    files = [Path(config['model']['save_path'])]
+    router_config = config.get('model_router') or {}
+    if router_config.get('enabled'):
+        files += sorted(Path(router_config.get('models_dir', 'models/regions')).glob('*/model.pkl'))
+    return files
+
+
+class BulkScorer:
+    """
+    Runs a scoring job: the parent process reads chunks and hands them to
+    `workers` scoring processes, keeping at most two chunks per worker in
+    flight. The checkpoint in the output directory records the job signature
+    (input files, chunking, models) and the finished parts; rerunning the
+    same job skips them.
+    """
+
+    def __init__(self, config_path: str = "configs/params.yaml", bulk_config: Optional[Dict] = None):
+        with open(config_path, 'r') as f:
+            self.config = yaml.safe_load(f)
+        bulk_config = {**self.config.get('bulk_scoring', {}), **(bulk_config or {})}
+
+        self.chunk_rows = bulk_config.get('chunk_rows', 100000)
+        self.workers = bulk_config.get('workers') or os.cpu_count() or 1
+        self.threads_per_worker = bulk_config.get('threads_per_worker', 1)
+        self.output_format = bulk_config.get('output_format', 'parquet')
+        self.columns = {
+            'latitude': 'latitude',
+            'longitude': 'longitude',
+            'timestamp': 'timestamp',
+            **bulk_config.get('columns', {}),
+        }
+        if self.output_format not in ('parquet', 'csv'):
+            raise ValueError(f"output_format must be parquet or csv, not {self.output_format}")
+        if self.output_format == 'parquet' and not PARQUET_AVAILABLE:
+            raise RuntimeError("Parquet output needs pyarrow; set bulk_scoring.output_format to csv")
+
+    def job_signature(self, files: List[Path]) -> str:
+        """Identifies a job: same inputs, chunking, output layout and models -> same parts"""
+        signature = hashlib.sha256()
+        for path in files:
+            stat = path.stat()
+            signature.update(f"{path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        signature.update(f"{self.chunk_rows}:{self.output_format}:{sorted(self.columns.items())}".encode())
+        for path in model_files(self.config):
+            signature.update(file_hash(path).encode())
+        return signature.hexdigest()[:16]
+
+    def load_checkpoint(self, output_dir: Path, signature: str, restart: bool) -> Dict[str, int]:
+        """Finished parts (part -> rows) of an earlier run of this job"""
+        path = output_dir / CHECKPOINT_FILE
+        if not path.exists() or restart:
+            return {}
+        with open(path, 'r') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('signature') != signature:
+            raise ValueError(
+                f"{output_dir} holds output of a different job (inputs, chunking or models changed); "
+                "use --restart to overwrite it"
+            )
+        return {
+            part: rows for part, rows in checkpoint['completed'].items()
+            if (output_dir / f"{part}.{self.output_format}").exists()
+        }
+
+    @staticmethod
+    def save_checkpoint(output_dir: Path, checkpoint: Dict):
+        tmp_path = output_dir / f".{CHECKPOINT_FILE}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f, indent=2)
+        os.replace(tmp_path, output_dir / CHECKPOINT_FILE)
+
+    def run(self, input_path: str, output_dir: str, restart: bool = False, quiet: bool = False) -> Dict:
+        """Score every input chunk not yet in the checkpoint; returns a summary"""
+        files = input_files(input_path)
+        output_dir = Path(output_dir)
+        signature = self.job_signature(files)
+        if restart and output_dir.exists():
+            clear_output(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        completed = self.load_checkpoint(output_dir, signature, restart)
+        checkpoint = {'signature': signature, 'inputs': [str(p) for p in files], 'completed': completed}
+        if completed and not quiet:
+            print(f"[INFO] Resuming: {len(completed)} parts ({sum(completed.values()):,} rows) already scored")
+
+        print(f"Scoring {len(files)} file(s) in chunks of {self.chunk_rows:,} rows with {self.workers} workers...")
+        started = time.perf_counter()
+        rows_scored = 0
+        worker_seconds = 0.0
+        failed = []
+
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=init_worker,
+            initargs=(self.config, self.columns, self.threads_per_worker)
+        ) as pool:
+            pending = {}
+
+            def collect(done):
+                nonlocal rows_scored, worker_seconds
+                for future in done:
+                    part = pending.pop(future)
+                    try:
+                        _, rows, seconds = future.result()
+                    except Exception as e:
+                        print(f"[WARNING] {part} failed: {e}")
+                        failed.append(part)
+                        continue
+                    rows_scored += rows
+                    worker_seconds += seconds
+                    completed[part] = rows
+                    self.save_checkpoint(output_dir, checkpoint)
+                    if not quiet:
+                        elapsed = time.perf_counter() - started
+                        print(f"  {part}: {rows:,} rows ({rows_scored / elapsed:,.0f} rows/s overall)")
+
+            for part, chunk in read_chunks(files, self.chunk_rows):
+                if part in completed:
+                    continue
+                while len(pending) >= 2 * self.workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                future = pool.submit(score_chunk, part, chunk, str(output_dir), self.output_format)
+                pending[future] = part
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        elapsed = time.perf_counter() - started
+        summary = {
+            'rows': rows_scored,
+            'rows_total': sum(completed.values()),
+            'parts': len(completed),
+            'failed': failed,
+            'workers': self.workers,
+            'seconds': round(elapsed, 2),
+            'rows_per_second': round(rows_scored / elapsed) if elapsed > 0 else 0,
+            'rows_per_second_per_worker': round(rows_scored / worker_seconds) if worker_seconds > 0 else 0,
+        }
+        if not failed:
+            (output_dir / '_SUCCESS').touch()
+        status = "[WARNING]" if failed else "[OK]"
+        print(f"{status} Scored {rows_scored:,} rows in {elapsed:.1f}s ({summary['rows_per_second']:,} rows/s, "
+              f"{summary['parts']} parts in {output_dir}{f', {len(failed)} failed' if failed else ''})")
+        return summary
+
+
+def scaling_report(config_path: str, input_path: str, worker_counts: List[int], bulk_config: Dict) -> List[Dict]:
+    """Run the same job with each worker count (into scratch directories) and compare throughput"""
+    results = []
+    for workers in worker_counts:
+        scorer = BulkScorer(config_path, {**bulk_config, 'workers': workers})
+        with tempfile.TemporaryDirectory(prefix='bulk_score_') as scratch:
+            summary = scorer.run(input_path, scratch, restart=True, quiet=True)
+        results.append(summary)
+
+    base = results[0]['rows_per_second'] / worker_counts[0]
+    print("\n=== Scaling ===")
+    print(f"{'workers':>8} {'rows/s':>12} {'speedup':>8} {'efficiency':>11}")
+    for workers, summary in zip(worker_counts, results):
+        speedup = summary['rows_per_second'] / base if base else 0.0
+        summary['speedup'] = round(speedup, 2)
+        summary['efficiency'] = round(speedup / workers, 2)
+        print(f"{workers:>8} {summary['rows_per_second']:>12,} {speedup:>7.2f}x {summary['efficiency']:>10.0%}")
+    print(f"({os.cpu_count()} CPUs available; speedup is relative to one worker's throughput)")
+    return results
+
+
+def make_sample(config_path: str, output: str, rows: int, seed: int = 0):
+    """Random rows inside the configured regions over the next 30 days, for trying the scorer"""
+    with open(config_path, 'r') as f:
+        config = yaml.safe_load(f)
+    rng = np.random.default_rng(seed)
+    bboxes = np.array([region['bbox'] for region in config['regions'].values()], dtype=np.float64)
+    which = rng.integers(0, len(bboxes), rows)
+    box = bboxes[which]
+    start = np.datetime64(pd.Timestamp.now().floor('h').to_datetime64(), 'h')
+
+    sample = pd.DataFrame({
+        'id': np.arange(rows, dtype=np.int64),
+        'latitude': rng.uniform(box[:, 0], box[:, 2]),
+        'longitude': rng.uniform(box[:, 1], box[:, 3]),
+        'timestamp': start + rng.integers(0, 30 * 24, rows).astype('timedelta64[h]'),
+    })
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    if output.suffix == '.parquet':
+        sample.to_parquet(output, index=False)
+    else:
+        sample.to_csv(output, index=False)
+    print(f"[OK] Wrote {rows:,} sample rows to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CongestionAI offline bulk scoring")
+    parser.add_argument('--config', default="configs/params.yaml")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help="Score a file or directory of Parquet/CSV files")
+    run.add_argument('--input', required=True)
+    run.add_argument('--output', required=True, help="Directory for part files and the checkpoint")
+    run.add_argument('--workers', type=int)
+    run.add_argument('--chunk-rows', type=int)
+    run.add_argument('--format', choices=['parquet', 'csv'])
+    run.add_argument('--restart', action='store_true', help="Delete earlier part files, checkpoint and _SUCCESS (other files are kept)")
+
+    scaling = sub.add_parser('scaling', help="Compare throughput across worker counts")
+    scaling.add_argument('--input', required=True)
+    scaling.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    scaling.add_argument('--chunk-rows', type=int)
+
+    sample = sub.add_parser('sample', help="Write random input rows")
+    sample.add_argument('--output', default="data/bulk/input.parquet")
+    sample.add_argument('--rows', type=int, default=1000000)
+
+    args = parser.parse_args()
+
+    if args.command == 'sample':
+        make_sample(args.config, args.output, args.rows)
+        return
+
+    overrides = {'chunk_rows': args.chunk_rows}
+    if args.command == 'scaling':
+        scaling_report(args.config, args.input, args.workers, {k: v for k, v in overrides.items() if v})
+        return
+
+    overrides.update(workers=args.workers, output_format=args.format)
+    scorer = BulkScorer(args.config, {k: v for k, v in overrides.items() if v})
+    summary = scorer.run(args.input, args.output, restart=args.restart)
+    if summary['failed']:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Calendar features for CongestionAI
+Precomputed hourly table of time features and per-region holiday flags,
+shared by the training pipeline and inference
+"""
+
+from datetime import date, datetime
+from typing import Dict, Optional
+
+import holidays
+import numpy as np
+import pandas as pd
+
+# Used when the config has no regions section (e.g. models trained before it existed)
+DEFAULT_REGIONS = {
+    'us': {'country': 'US', 'bbox': [24.0, -125.0, 50.0, -66.0]},
+    'in': {'country': 'IN', 'bbox': [6.0, 68.0, 36.0, 98.0]},
+}
+
+# Model feature order of the calendar columns
+TIME_FEATURES = [
+    'hour', 'day_of_week', 'day_of_month', 'month',
+    'is_weekend', 'is_holiday',
+    'hour_sin', 'hour_cos', 'dow_sin', 'dow_cos',
+]
+
+
+class CalendarTable:
+    """
+    One row per hour from `start` to `end`. Time features are looked up by
+    hour offset from the start, so a batch needs one integer index per row
+    instead of per-row datetime arithmetic and holiday lookups.
+
+    Holiday flags are stored per region and per day: is_holiday for a row is
+    holiday[region, hour_offset // 24]. Regions are matched to locations by
+    bounding box, first match wins; locations outside every box use the
+    default region.
+
+    The table is fixed once built and shared across threads. Rows outside it
+    (far history or horizon) get their features computed per call.
+    """
+
+    TIME_COLUMNS = [
+        'hour', 'day_of_week', 'day_of_month', 'month', 'is_weekend',
+        'hour_sin', 'hour_cos', 'dow_sin', 'dow_cos'
+    ]
+
+    def __init__(self, regions: Dict[str, Dict], default_region: str, start: date, end: date):
+        """Build the table for whole days from start to end (inclusive)"""
+        self.regions = regions
+        self.region_names = list(regions)
+        self.default_code = self.region_names.index(default_region)
+        self.bboxes = np.array([regions[name]['bbox'] for name in self.region_names], dtype=np.float64)
+        self._build(start, end)
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict] = None, today: Optional[date] = None) -> 'CalendarTable':
+        """Table covering calendar.years_back years of history and calendar.years_ahead of horizon"""
+        config = config or {}
+        calendar_config = config.get('calendar', {})
+        regions = config.get('regions') or DEFAULT_REGIONS
+        today = today or date.today()
+
+        start = date(today.year - calendar_config.get('years_back', 2), 1, 1)
+        end = date(today.year + calendar_config.get('years_ahead', 1), 12, 31)
+        return cls(regions, calendar_config.get('default_region', next(iter(regions))), start, end)
+
+    def _build(self, start: date, end: date):
+        """Compute every column for [start, end]; holiday years are expanded eagerly here"""
+        self.start = start
+        self.end = end
+        self.base = np.datetime64(start, 'h')
+        self.base_datetime = datetime(start.year, start.month, start.day)
+        hours = np.arange(self.base, np.datetime64(end, 'h') + 24)
+        self.n_hours = len(hours)
+        self.columns = self.time_columns(hours)
+
+        days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+        self.holiday = np.stack([self.holiday_flags(days, code) for code in range(len(self.region_names))])
+
+    @staticmethod
+    def time_columns(hours: np.ndarray) -> Dict[str, np.ndarray]:
+        """TIME_COLUMNS of datetime64[h] values"""
+        days = hours.astype('datetime64[D]')
+        months = days.astype('datetime64[M]')
+        hour = hours.astype(np.int64) % 24
+        dow = (days.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+        return {
+            'hour': hour,
+            'day_of_week': dow,
+            'day_of_month': (days - months).astype(np.int64) + 1,
+            'month': months.astype(np.int64) % 12 + 1,
+            'is_weekend': (dow >= 5).astype(np.int64),
+            'hour_sin': np.sin(2 * np.pi * hour / 24),
+            'hour_cos': np.cos(2 * np.pi * hour / 24),
+            'dow_sin': np.sin(2 * np.pi * dow / 7),
+            'dow_cos': np.cos(2 * np.pi * dow / 7),
+        }
+
+    def holiday_flags(self, days: np.ndarray, code: int) -> np.ndarray:
+        """is_holiday of datetime64[D] values in one region"""
+        region = self.regions[self.region_names[code]]
+        years = sorted(set(days.astype('datetime64[Y]').astype(np.int64) + 1970))
+        calendar = holidays.country_holidays(region['country'], subdiv=region.get('subdiv'), years=years)
+        holiday_days = np.array(sorted(calendar.keys()), dtype='datetime64[D]')
+        return np.isin(days, holiday_days).astype(np.int64)
+
+    def compute(self, hours: np.ndarray, region_codes: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Time features of rows outside the table, computed directly. The table
+        itself never grows, so a far-off timestamp costs one batch of
+        arithmetic rather than memory held for the life of the process.
+        """
+        features = self.time_columns(hours)
+        days = hours.astype('datetime64[D]')
+        is_holiday = np.zeros(len(hours), dtype=np.int64)
+        for code in np.unique(region_codes).tolist():
+            rows = region_codes == code
+            is_holiday[rows] = self.holiday_flags(days[rows], code)
+        features['is_holiday'] = is_holiday
+        return features
+
+    @staticmethod
+    def to_hours(timestamps) -> np.ndarray:
+        """Wall-clock datetime64[h] values for a datetime or a sequence of timestamps"""
+        if isinstance(timestamps, datetime):
+            return np.array([np.datetime64(timestamps.replace(tzinfo=None), 'h')])
+        index = pd.DatetimeIndex(timestamps)
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        return index.to_numpy().astype('datetime64[h]')
+
+    def region_codes(self, lats, lons) -> np.ndarray:
+        """Region index per location (default region outside every bounding box)"""
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        codes = np.full(len(lats), self.default_code, dtype=np.int64)
+
+        # Reverse order so the first matching region is assigned last and wins
+        for code in range(len(self.region_names) - 1, -1, -1):
+            min_lat, min_lon, max_lat, max_lon = self.bboxes[code]
+            inside = (lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+            codes[inside] = code
+        return codes
+
+    def region_code(self, lat: float, lon: float) -> int:
+        """Scalar region_codes for single-location requests"""
+        for code, (min_lat, min_lon, max_lat, max_lon) in enumerate(self.bboxes.tolist()):
+            if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                return code
+        return self.default_code
+
+    def lookup(self, timestamp: datetime, region_code: int) -> Dict:
+        """Time features of a single timestamp as Python scalars"""
+        offset = int((timestamp.replace(tzinfo=None) - self.base_datetime).total_seconds() // 3600)
+        if offset < 0 or offset >= self.n_hours:
+            features = self.compute(self.to_hours(timestamp), np.array([region_code]))
+            return {name: values[0].item() for name, values in features.items()}
+
+        features = {name: self.columns[name][offset].item() for name in self.TIME_COLUMNS}
+        features['is_holiday'] = self.holiday[region_code, offset // 24].item()
+        return features
+
+    def gather(self, timestamps, region_codes: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Time features for each row. timestamps is a single datetime (shared by
+        every row) or one timestamp per row; region_codes has one entry per row.
+        """
+        region_codes = np.asarray(region_codes, dtype=np.int64)
+        hours = self.to_hours(timestamps)
+        if len(hours) == 1 and len(region_codes) != 1:
+            hours = np.broadcast_to(hours, region_codes.shape)
+        offsets = (hours - self.base).astype(np.int64)
+        outside = (offsets < 0) | (offsets >= self.n_hours)
+        if outside.any():
+            inside = ~outside
+            features = {}
+            for name, values in self.compute(hours[outside], region_codes[outside]).items():
+                features[name] = np.empty(len(offsets), dtype=values.dtype)
+                features[name][outside] = values
+            for name in self.TIME_COLUMNS:
+                features[name][inside] = self.columns[name][offsets[inside]]
+            features['is_holiday'][inside] = self.holiday[region_codes[inside], offsets[inside] // 24]
+            return features
+
+        features = {name: self.columns[name][offsets] for name in self.TIME_COLUMNS}
+        features['is_holiday'] = self.holiday[region_codes, offsets // 24]
+        return features
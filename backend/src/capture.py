@@ -0,0 +1,275 @@
+"""
+Traffic capture for CongestionAI
+An opt-in ASGI middleware that records a sample of incoming requests (method,
+path, query, body, arrival time, status, latency and serving model version)
+to rotating gzip NDJSON files. The request path only decides whether to
+sample and hands the record to a queue; a writer thread does the encoding,
+compression and file rotation. python -m src.replay plays captures back.
+
+Also the request clock: request_now() is datetime.now(), except while a
+replay pins it to the recorded arrival time (X-Replay-Time header).
+"""
+
+import atexit
+import base64
+import gzip
+import json
+import os
+import queue
+import random
+import threading
+import time
+import zlib
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+# Request headers kept in a record (they change what the API answers)
+RECORDED_HEADERS = ('content-type', 'accept', 'if-none-match')
+REPLAY_TIME_HEADER = 'x-replay-time'
+
+_replay_time: ContextVar[Optional[datetime]] = ContextVar('replay_time', default=None)
+
+
+def request_now() -> datetime:
+    """Wall-clock time of the current request (the pinned time during a replay)"""
+    pinned = _replay_time.get()
+    return pinned if pinned is not None else datetime.now()
+
+
+class RequestRecorder:
+    def __init__(self, config: Optional[Dict] = None, version: Optional[Callable[[], Optional[str]]] = None):
+        """
+        Settings from the capture config section. version returns the model
+        version serving requests (None before the model is loaded).
+        """
+        config = config or {}
+        env = os.getenv('CAPTURE_ENABLED')  # 1/0 overrides capture.enabled
+        self.enabled = env == '1' if env is not None else config.get('enabled', False)
+        self.sample_rate = config.get('sample_rate', 0.05)
+        self.dir = Path(config.get('dir', 'captures'))
+        self.max_file_bytes = int(config.get('max_file_mb', 16) * 1024 * 1024)
+        self.max_files = config.get('max_files', 20)
+        self.max_body_bytes = int(config.get('max_body_kb', 1024) * 1024)
+        self.flush_interval = config.get('flush_interval', 5.0)
+        self.exclude_paths = set(config.get('exclude_paths', []))
+        self.version = version or (lambda: None)
+        self.rng = random.Random()
+
+        self.queue = queue.Queue(maxsize=config.get('queue_size', 10000))
+        self.counts = {'sampled': 0, 'written': 0, 'dropped': 0, 'too_large': 0, 'files': 0}
+        self.current_file = None
+        self._file = None
+        self._raw = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def sample(self, path: str) -> bool:
+        """Whether to record a request (the only per-request cost when it is not recorded)"""
+        return (
+            self.enabled
+            and path not in self.exclude_paths
+            and self.rng.random() < self.sample_rate
+        )
+
+    def submit(self, record: Dict):
+        """Queue a finished request for the writer thread; dropped when the queue is full"""
+        self.counts['sampled'] += 1
+        self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.counts['dropped'] += 1
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="capture-writer", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.close)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = None
+            if record is StopIteration:
+                break
+            if record is not None:
+                self._write(record)
+            if self._file is not None and time.monotonic() - last_flush >= self.flush_interval:
+                # Sync flush: a reader (or a crash) sees every record up to here
+                self._file.flush(zlib.Z_SYNC_FLUSH)
+                last_flush = time.monotonic()
+        self._close_file()
+
+    def _write(self, record: Dict):
+        body = record.pop('body')
+        if body:
+            try:
+                record['body'] = body.decode('utf-8')
+            except UnicodeDecodeError:
+                record['body_b64'] = base64.b64encode(body).decode('ascii')
+        line = json.dumps(record, separators=(',', ':')).encode() + b'\n'
+
+        if self._file is None or self._raw.tell() >= self.max_file_bytes:
+            self._rotate()
+        self._file.write(line)
+        self.counts['written'] += 1
+
+    def _rotate(self):
+        self._close_file()
+        self.dir.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%dT%H%M%S')
+        self.current_file = self.dir / f"capture-{stamp}-{self.counts['files']:05d}.ndjson.gz"
+        self._raw = open(self.current_file, 'wb')
+        self._file = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=6)
+        self.counts['files'] += 1
+
+        # Keep the newest max_files files
+        files = sorted(self.dir.glob('capture-*.ndjson.gz'))
+        for old in files[:max(0, len(files) - self.max_files)]:
+            old.unlink(missing_ok=True)
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._raw.close()
+            self._file = self._raw = None
+
+    def close(self):
+        """Write out queued records and finish the current file"""
+        if self._thread is not None:
+            self.queue.put(StopIteration)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'queued': self.queue.qsize(),
+            'current_file': str(self.current_file) if self.current_file else None,
+            **self.counts,
+        }
+
+
+class CaptureMiddleware:
+    """
+    Pure ASGI middleware (streamed responses pass through untouched). Records
+    sampled HTTP requests, and pins request_now() to X-Replay-Time when
+    replay_clock is on.
+    """
+
+    def __init__(self, app, recorder: RequestRecorder, replay_clock: bool = False):
+        self.app = app
+        self.recorder = recorder
+        self.replay_clock = replay_clock or os.getenv('REPLAY_CLOCK') == '1'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        token = None
+        if self.replay_clock:
+            pinned = _header(scope, REPLAY_TIME_HEADER.encode())
+            if pinned:
+                token = _replay_time.set(datetime.fromisoformat(pinned.decode()))
+        try:
+            if not self.recorder.sample(scope['path']):
+                await self.app(scope, receive, send)
+                return
+            await self._record(scope, receive, send)
+        finally:
+            if token is not None:
+                _replay_time.reset(token)
+
+    async def _record(self, scope, receive, send):
+        arrived = time.time()
+        started = time.perf_counter()
+        chunks = []
+        size = 0
+        status = None
+
+        async def receive_body():
+            nonlocal size
+            message = await receive()
+            if message['type'] == 'http.request':
+                size += len(message.get('body', b''))
+                if size <= self.recorder.max_body_bytes:
+                    chunks.append(message.get('body', b''))
+            return message
+
+        async def send_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive_body, send_status)
+        finally:
+            if size > self.recorder.max_body_bytes:
+                self.recorder.counts['too_large'] += 1
+            else:
+                headers = {}
+                for name in RECORDED_HEADERS:
+                    value = _header(scope, name.encode())
+                    if value is not None:
+                        headers[name] = value.decode('latin-1')
+                self.recorder.submit({
+                    't': round(arrived, 6),
+                    'method': scope['method'],
+                    'path': scope['path'],
+                    'query': scope.get('query_string', b'').decode('latin-1'),
+                    'headers': headers,
+                    'body': b''.join(chunks),
+                    'status': status,
+                    'ms': round((time.perf_counter() - started) * 1000, 3),
+                    'model_version': self.recorder.version(),
+                })
+
+
+def _header(scope, name: bytes) -> Optional[bytes]:
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value
+    return None
+
+
+def read_capture(paths: List[Path]) -> List[Dict]:
+    """
+    Records of capture files (or directories of them) in arrival order; a
+    file cut short by a crash yields every record up to its last flush
+    """
+    files = []
+    for path in paths:
+        path = Path(path)
+        files.extend(sorted(path.glob('capture-*.ndjson.gz')) if path.is_dir() else [path])
+
+    records = []
+    for path in files:
+        # A raw zlib stream rather than gzip.open: a file still being written (or cut
+        # off by a crash) has no gzip trailer, and gzip would drop its flushed records
+        decompressor = zlib.decompressobj(wbits=31)
+        pending = b''
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                try:
+                    lines = (pending + decompressor.decompress(block)).split(b'\n')
+                except zlib.error:
+                    break
+                pending = lines.pop()
+                records.extend(json.loads(line) for line in lines if line)
+    records.sort(key=lambda record: record['t'])
+    for record in records:
+        if 'body_b64' in record:
+            record['body'] = base64.b64decode(record.pop('body_b64'))
+        else:
+            record['body'] = record.get('body', '').encode('utf-8')
+    return records
@@ -0,0 +1,528 @@
+"""
+Cluster mode for CongestionAI
+Nodes own shards of H3 cells (parents at cluster.shard_resolution), assigned
+by consistent hashing over a static member list (cluster.members_file). A
+node scoring a batch or an area scores its own shards' rows and sends the
+others to their owners concurrently, then merges the results in row order.
+Each node's forecast cache, neighbour state and weather lookups therefore
+only cover its shards, instead of every node holding a copy of everything.
+Observations go to each node whose shards have the observed cell as a
+neighbour.
+
+Try a local cluster with: python -m src.cluster local --nodes 1 2 3
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import h3
+import httpx
+import numpy as np
+import yaml
+
+from .serialization import JSON_MEDIA_TYPE, NPY_MEDIA_TYPE
+from .spatial import lattice_cells
+
+# Set on requests between nodes: the receiver serves them from its own shards
+HOP_HEADER = 'x-cluster-hop'
+# Model version the sender scores with; a peer serving another model answers 409
+MODEL_HEADER = 'x-cluster-model'
+
+
+def mix64(values: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer: spreads H3 cell ints (which share their high bits) over the ring"""
+    x = values.astype(np.uint64)
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xbf58476d1ce4e5b9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94d049bb133111eb)
+    x ^= x >> np.uint64(31)
+    return x
+
+
+class HashRing:
+    """
+    Consistent hashing: each node takes virtual_nodes points on a 64-bit ring
+    and a key belongs to the first point clockwise of its hash. Adding or
+    removing a node only moves the keys next to its points.
+    """
+
+    def __init__(self, names: List[str], virtual_nodes: int = 64):
+        points, owners = [], []
+        for index, name in enumerate(names):
+            for replica in range(virtual_nodes):
+                digest = hashlib.blake2b(f"{name}#{replica}".encode(), digest_size=8).digest()
+                points.append(int.from_bytes(digest, 'big'))
+                owners.append(index)
+        points = np.array(points, dtype=np.uint64)
+        order = np.argsort(points)
+        self.points = points[order]
+        self.owners = np.array(owners, dtype=np.int64)[order]
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Node index owning each key"""
+        positions = np.searchsorted(self.points, mix64(keys), side='left') % len(self.points)
+        return self.owners[positions]
+
+
+def encode_array(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def decode_array(body: bytes) -> np.ndarray:
+    return np.load(io.BytesIO(body), allow_pickle=False)
+
+
+class ShardRouter:
+    def __init__(self, config: Optional[Dict] = None):
+        """
+        Settings from the cluster config section. CLUSTER_NODE (or
+        cluster.node) names this node in the member list; CLUSTER_MEMBERS
+        overrides cluster.members_file. Without a node name, or with a single
+        member, every request is served locally.
+        """
+        config = config or {}
+        self.node = os.getenv('CLUSTER_NODE') or config.get('node')
+        self.enabled = bool(self.node) and (config.get('enabled', False) or 'CLUSTER_NODE' in os.environ)
+        self.resolution = config.get('shard_resolution', 5)
+        self.precision = config.get('lookup_precision', 2)
+        self.timeout = config.get('timeout', 10)
+        self.names, self.urls = [], []
+        self.index = 0
+        self.counts = {
+            'local_rows': 0, 'forwarded_rows': 0, 'received_rows': 0,
+            'fanouts': 0, 'peer_errors': 0, 'fallback_rows': 0,
+        }
+        self._client = None
+
+        if self.enabled:
+            members_path = os.getenv('CLUSTER_MEMBERS') or config.get('members_file', 'configs/cluster.yaml')
+            with open(members_path, 'r') as f:
+                members = yaml.safe_load(f)['nodes']
+            self.names = [member['name'] for member in members]
+            self.urls = [member['url'].rstrip('/') for member in members]
+            if self.node not in self.names:
+                raise ValueError(f"Cluster node '{self.node}' is not a member in {members_path}")
+            self.index = self.names.index(self.node)
+            self.ring = HashRing(self.names, config.get('virtual_nodes', 64))
+            print(f"[INFO] Cluster node '{self.node}' of {len(self.names)} (shards at H3 resolution {self.resolution})")
+
+    @property
+    def active(self) -> bool:
+        """Whether requests can have rows owned by other nodes"""
+        return self.enabled and len(self.names) > 1
+
+    def point_owners(self, lats, lons) -> np.ndarray:
+        """Owning node per location (shard cells computed once per lattice point)"""
+        cells, inverse = lattice_cells(lats, lons, self.resolution, self.precision)
+        keys = np.fromiter((h3.str_to_int(cell) for cell in cells), dtype=np.uint64, count=len(cells))
+        return self.ring.lookup(keys)[inverse]
+
+    def shard_of(self, cell: str) -> str:
+        resolution = h3.get_resolution(cell)
+        if resolution >= self.resolution:
+            return h3.cell_to_parent(cell, self.resolution)
+        return h3.cell_to_parent(h3.cell_to_center_child(cell, self.resolution + 1), self.resolution)
+
+    def cell_owners(self, cells: List[str]) -> np.ndarray:
+        """Owning node per H3 cell"""
+        keys = np.fromiter((h3.str_to_int(self.shard_of(cell)) for cell in cells), dtype=np.uint64, count=len(cells))
+        return self.ring.lookup(keys)
+
+    def halo_owners(self, cells: List[str], rings: int) -> List[np.ndarray]:
+        """Per node, the indices of the cells that some cell of its shards has within `rings` steps"""
+        shards = {}
+        members = [set() for _ in self.names]
+        for i, cell in enumerate(cells):
+            for neighbour in h3.grid_disk(cell, rings):
+                shard = self.shard_of(neighbour)
+                if shard not in shards:
+                    shards[shard] = int(self.ring.lookup(np.array([h3.str_to_int(shard)], dtype=np.uint64))[0])
+                members[shards[shard]].add(i)
+        return [np.array(sorted(rows), dtype=np.int64) for rows in members]
+
+    @staticmethod
+    def partition(owners: np.ndarray) -> List[Tuple[int, Optional[np.ndarray]]]:
+        """(node, row indices) per node present; indices are None when one node owns every row"""
+        present = np.unique(owners)
+        if len(present) == 1:
+            return [(int(present[0]), None)]
+        order = np.argsort(owners, kind='stable')
+        bounds = np.searchsorted(owners[order], present)
+        return list(zip(present.tolist(), np.split(order, bounds[1:])))
+
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        return self._client
+
+    async def scatter(
+        self,
+        owners: np.ndarray,
+        local: Callable[[Optional[np.ndarray]], np.ndarray],
+        request: Callable[[np.ndarray], Tuple[str, bytes, str, Dict]],
+        model_version: str
+    ) -> np.ndarray:
+        """
+        (lower, score, upper) rows: this node's rows from local(rows), every
+        other node's from a concurrent POST to it, built by request(rows) ->
+        (path, body, content type, query). Rows of a peer that fails are
+        scored locally instead.
+        """
+        from fastapi.concurrency import run_in_threadpool
+
+        groups = self.partition(owners)
+        if len(groups) > 1:
+            self.counts['fanouts'] += 1
+
+        async def score(node: int, rows: Optional[np.ndarray]) -> np.ndarray:
+            n = len(owners) if rows is None else len(rows)
+            if node == self.index:
+                self.counts['local_rows'] += n
+                return await run_in_threadpool(local, rows)
+            if rows is None:
+                rows = np.arange(len(owners))
+            path, body, content_type, params = request(rows)
+            headers = {
+                HOP_HEADER: self.node, MODEL_HEADER: model_version,
+                'content-type': content_type, 'accept': NPY_MEDIA_TYPE,
+            }
+            try:
+                response = await self.client().post(
+                    self.urls[node] + path, content=body, params=params, headers=headers
+                )
+                response.raise_for_status()
+                bands = decode_array(response.content)
+                if bands.shape != (n, 3):
+                    raise ValueError(f"expected {n} rows, got {bands.shape}")
+                self.counts['forwarded_rows'] += n
+                return bands
+            except (httpx.HTTPError, ValueError) as e:
+                self.counts['peer_errors'] += 1
+                self.counts['fallback_rows'] += n
+                print(f"[WARNING] Cluster peer '{self.names[node]}' failed ({e}); scoring {n} rows locally")
+                return await run_in_threadpool(local, rows)
+
+        results = await asyncio.gather(*(score(node, rows) for node, rows in groups))
+        if len(groups) == 1:
+            return results[0]
+        bands = np.empty((len(owners), 3))
+        for (_, rows), result in zip(groups, results):
+            bands[rows] = result
+        return bands
+
+    async def point_bands(
+        self,
+        lats: np.ndarray,
+        lons: np.ndarray,
+        row_times,
+        local: Callable[[Optional[np.ndarray]], np.ndarray],
+        model_version: str,
+        params: Optional[Dict] = None
+    ) -> np.ndarray:
+        """Bands for locations, each scored by the node owning it (see POST /cluster/bands)"""
+        per_row = not isinstance(row_times, datetime)
+
+        def request(rows: np.ndarray) -> Tuple[str, bytes, str, Dict]:
+            fields = [('latitude', 'f8'), ('longitude', 'f8')] + ([('timestamp', 'M8[us]')] if per_row else [])
+            body = np.empty(len(rows), dtype=fields)
+            body['latitude'], body['longitude'] = lats[rows], lons[rows]
+            query = dict(params or {})
+            if per_row:
+                body['timestamp'] = np.asarray(row_times)[rows]
+            else:
+                query['timestamp'] = row_times.isoformat()
+            return '/cluster/bands', encode_array(body), NPY_MEDIA_TYPE, query
+
+        return await self.scatter(self.point_owners(lats, lons), local, request, model_version)
+
+    async def cell_bands(
+        self,
+        cells: List[str],
+        timestamp: datetime,
+        local: Callable[[Optional[np.ndarray]], np.ndarray],
+        model_version: str
+    ) -> np.ndarray:
+        """Bands for H3 cells at their centers, each from its owner's forecast cache (see POST /cluster/cell_bands)"""
+        def request(rows: np.ndarray) -> Tuple[str, bytes, str, Dict]:
+            body = {'cells': [cells[i] for i in rows.tolist()], 'timestamp': timestamp.isoformat()}
+            return '/cluster/cell_bands', json.dumps(body).encode(), JSON_MEDIA_TYPE, {}
+
+        return await self.scatter(self.cell_owners(cells), local, request, model_version)
+
+    async def forward_observations(self, cells: List[str], values: np.ndarray, columns: List[str], rings: int) -> np.ndarray:
+        """
+        Send observations to the other nodes whose shards use them as
+        neighbour state; returns the rows this node keeps
+        """
+        targets = self.halo_owners(cells, rings)
+
+        async def send(node: int, rows: np.ndarray):
+            observations = [
+                {'h3_cell': cells[i], **dict(zip(columns, values[i].tolist()))} for i in rows.tolist()
+            ]
+            try:
+                response = await self.client().post(
+                    self.urls[node] + '/observations', json={'observations': observations},
+                    headers={HOP_HEADER: self.node}
+                )
+                response.raise_for_status()
+                self.counts['forwarded_rows'] += len(rows)
+            except httpx.HTTPError as e:
+                self.counts['peer_errors'] += 1
+                print(f"[WARNING] Cluster peer '{self.names[node]}' did not take {len(rows)} observations ({e})")
+
+        await asyncio.gather(*(
+            send(node, rows) for node, rows in enumerate(targets) if node != self.index and len(rows)
+        ))
+        return targets[self.index]
+
+    def stats(self) -> Dict:
+        return {
+            'node': self.node,
+            'members': self.names,
+            'shard_resolution': self.resolution,
+            **self.counts,
+        }
+
+
+# ----------------------------------------------------------------------
+# Local test cluster: python -m src.cluster local
+# ----------------------------------------------------------------------
+
+def tile_universe(rings: int, tile_resolution: int, hours: int, start: datetime) -> List[Tuple[str, str]]:
+    """(tile, hour) pairs requested by the local test: tiles around the dashboard areas, for a few hours"""
+    from .loadtest import AREA_CENTERS
+
+    tiles = sorted({
+        tile for lat, lon in AREA_CENTERS
+        for tile in h3.grid_disk(h3.latlng_to_cell(lat, lon, tile_resolution), rings)
+    })
+    hour_keys = [(start + timedelta(hours=i)).strftime('%Y-%m-%dT%H') for i in range(hours)]
+    return [(tile, hour) for tile in tiles for hour in hour_keys]
+
+
+class LocalCluster:
+    def __init__(self, size: int, sharded: bool, config_path: str, cache_entries: int,
+                 workdir: Path, model_path: Optional[str] = None, startup_timeout: float = 120):
+        """
+        size API processes on free local ports, sharing one config: a small
+        forecast cache per node, admission control off. Sharded nodes form a
+        cluster; replicated ones are independent copies (as behind a plain
+        load balancer).
+        """
+        from .replay import ReplayTarget, free_port
+
+        with open(config_path, 'r') as f:
+            config = yaml.safe_load(f)
+        ports = [free_port() for _ in range(size)]
+        names = [f"node{i}" for i in range(size)]
+
+        members_path = workdir / f"cluster-{size}.yaml"
+        with open(members_path, 'w') as f:
+            yaml.safe_dump({'nodes': [
+                {'name': name, 'url': f"http://127.0.0.1:{port}"} for name, port in zip(names, ports)
+            ]}, f)
+        config['cluster'] = dict(config.get('cluster') or {}, enabled=sharded, members_file=str(members_path))
+        config['cache'] = dict(config.get('cache') or {}, max_entries=cache_entries)
+        config['admission'] = dict(config.get('admission') or {}, enabled=False)
+        node_config = workdir / f"params-{'sharded' if sharded else 'replicated'}-{size}.yaml"
+        with open(node_config, 'w') as f:
+            yaml.safe_dump(config, f)
+
+        self.nodes = []
+        for name, port in zip(names, ports):
+            env = {'CONFIG_PATH': str(node_config)}
+            if sharded:
+                env['CLUSTER_NODE'] = name
+            self.nodes.append(ReplayTarget(
+                str(Path.cwd()), model_path=model_path, startup_timeout=startup_timeout, port=port, env=env
+            ))
+
+    @property
+    def urls(self) -> List[str]:
+        return [node.url for node in self.nodes]
+
+    def start(self):
+        try:
+            for node in self.nodes:
+                node.start()
+        except Exception:
+            self.stop()
+            raise
+
+    def stop(self):
+        for node in self.nodes:
+            node.stop()
+
+    def counters(self) -> Dict[str, int]:
+        """Forecast cache and routing counters summed over the nodes"""
+        totals = {'hits': 0, 'misses': 0, 'entries': 0, 'local_rows': 0, 'forwarded_rows': 0}
+        for url in self.urls:
+            health = httpx.get(f"{url}/health", timeout=30).json()
+            cache = health['forecast_cache']
+            cluster = health.get('cluster') or {}
+            totals['hits'] += cache['hits']
+            totals['misses'] += cache['misses']
+            totals['entries'] += cache['entries']
+            totals['local_rows'] += cluster.get('local_rows', 0)
+            totals['forwarded_rows'] += cluster.get('forwarded_rows', 0)
+        return totals
+
+
+async def drive_tiles(urls: List[str], requests: List[Tuple[str, str]], resolution: int,
+                      concurrency: int, duration: Optional[float] = None, seed: int = 0) -> Tuple[List, float]:
+    """
+    GET /forecast/area/{tile} round-robin over the nodes (a client-side load
+    balancer). With duration, random (tile, hour) pairs until it is up;
+    otherwise each pair of requests once. Returns (latency, ok) samples and
+    the elapsed seconds.
+    """
+    rng = random.Random(seed)
+    queue = list(requests)
+    samples = []
+    sent = 0
+    started = time.perf_counter()
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal sent
+        while True:
+            if duration is not None:
+                if time.perf_counter() - started >= duration:
+                    return
+                tile, hour = rng.choice(requests)
+            elif queue:
+                tile, hour = queue.pop()
+            else:
+                return
+            url = urls[sent % len(urls)]
+            sent += 1
+            t0 = time.perf_counter()
+            try:
+                response = await client.get(
+                    f"{url}/forecast/area/{tile}", params={'hour': hour, 'resolution': resolution}
+                )
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            samples.append((time.perf_counter() - t0, ok))
+
+    async with httpx.AsyncClient(timeout=120) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    return samples, time.perf_counter() - started
+
+
+def run_local(
+    config_path: str,
+    sizes: List[int],
+    modes: List[str],
+    duration: float,
+    concurrency: int,
+    cache_entries: Optional[int] = None,
+    model_path: Optional[str] = None
+) -> List[Dict]:
+    """
+    Throughput, latency and aggregate forecast cache hit rate of local
+    clusters of each size, replicated (independent nodes) and sharded. Every
+    node first gets one pass over the (tile, hour) universe, so each run is
+    measured in steady state.
+    """
+    with open(config_path, 'r') as f:
+        settings = (yaml.safe_load(f).get('cluster') or {}).get('local', {})
+    cache_entries = cache_entries or settings.get('cache_entries', 6000)
+    resolution = settings.get('resolution', 8)
+    start = datetime.now().replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    universe = tile_universe(
+        settings.get('rings', 2), settings.get('tile_resolution', 6), settings.get('hours', 4), start
+    )
+    cells = len(universe) * h3.cell_to_children_size(universe[0][0], resolution)
+    print(f"[INFO] {len(universe)} (tile, hour) pairs, {cells} (cell, hour) forecasts; "
+          f"{cache_entries} cache entries per node")
+
+    runs = []
+    with tempfile.TemporaryDirectory(prefix='congestion-cluster-') as workdir:
+        for size in sizes:
+            for mode in (['single'] if size == 1 else modes):
+                print(f"[INFO] {mode} x{size}: starting nodes")
+                cluster = LocalCluster(
+                    size, mode == 'sharded', config_path, cache_entries, Path(workdir), model_path,
+                    settings.get('startup_timeout', 120)
+                )
+                cluster.start()
+                try:
+                    for i, url in enumerate(cluster.urls):
+                        shuffled = random.Random(i).sample(universe, len(universe))
+                        asyncio.run(drive_tiles([url], shuffled, resolution, concurrency))
+                    before = cluster.counters()
+                    samples, elapsed = asyncio.run(drive_tiles(
+                        cluster.urls, universe, resolution, concurrency, duration=duration
+                    ))
+                    after = cluster.counters()
+                finally:
+                    cluster.stop()
+
+                delta = {key: after[key] - before[key] for key in before}
+                lookups = delta['hits'] + delta['misses']
+                routed = delta['local_rows'] + delta['forwarded_rows']
+                lat_ms = np.array([sample[0] for sample in samples]) * 1000
+                run = {
+                    'mode': mode,
+                    'nodes': size,
+                    'requests': len(samples),
+                    'errors': sum(1 for sample in samples if not sample[1]),
+                    'throughput_rps': round(len(samples) / elapsed, 2),
+                    'p50_ms': round(float(np.percentile(lat_ms, 50)), 2),
+                    'p95_ms': round(float(np.percentile(lat_ms, 95)), 2),
+                    'cache_hit_rate': round(delta['hits'] / lookups, 4) if lookups else 0.0,
+                    'cache_entries': after['entries'],
+                    'forwarded_share': round(delta['forwarded_rows'] / routed, 4) if routed else 0.0,
+                }
+                runs.append(run)
+                print(f"[OK] {mode} x{size}: {run['throughput_rps']} rps, hit rate {run['cache_hit_rate']:.1%}")
+    return runs
+
+
+def print_local(runs: List[Dict]):
+    print(f"\n{'mode':<12}{'nodes':>6}{'reqs':>8}{'err':>6}{'rps':>9}{'p50ms':>9}{'p95ms':>9}"
+          f"{'hit%':>8}{'entries':>9}{'fwd%':>7}")
+    for run in runs:
+        print(f"{run['mode']:<12}{run['nodes']:>6}{run['requests']:>8}{run['errors']:>6}{run['throughput_rps']:>9.1f}"
+              f"{run['p50_ms']:>9.1f}{run['p95_ms']:>9.1f}{run['cache_hit_rate'] * 100:>8.1f}"
+              f"{run['cache_entries']:>9}{run['forwarded_share'] * 100:>7.1f}")
+    print(f"\n[INFO] Throughput scales only with CPUs to spread the nodes over ({os.cpu_count()} here)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CongestionAI cluster mode")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    local_parser = subparsers.add_parser('local', help="Start local clusters and compare them under the same tile load")
+    local_parser.add_argument('--config', default="configs/params.yaml")
+    local_parser.add_argument('--nodes', nargs='+', type=int, default=[1, 2, 3], help="Cluster sizes to run")
+    local_parser.add_argument('--modes', nargs='+', choices=['replicated', 'sharded'], default=['replicated', 'sharded'])
+    local_parser.add_argument('--duration', type=float, default=20, help="Seconds measured per run")
+    local_parser.add_argument('--concurrency', type=int, default=8)
+    local_parser.add_argument('--cache-entries', type=int, help="Forecast cache size per node (default: cluster.local.cache_entries)")
+    local_parser.add_argument('--model', help="Model file every node loads (MODEL_PATH)")
+    local_parser.add_argument('--output', help="Write the runs as JSON")
+
+    args = parser.parse_args()
+
+    runs = run_local(args.config, args.nodes, args.modes, args.duration, args.concurrency, args.cache_entries, args.model)
+    print_local(runs)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(runs, f, indent=2)
+        print(f"\n[OK] Runs saved to {args.output}")
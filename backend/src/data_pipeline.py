@@ -3,22 +3,61 @@ Data Pipeline for CongestionAI
 Loads historical data, processes features, and prepares training dataset
 """
 
+import argparse
 import pandas as pd
 import numpy as np
 import h3
+from h3.api import numpy_int as h3_int
 import yaml
 import os
 from pathlib import Path
 from datetime import datetime, timedelta
-import holidays
-from typing import Tuple, List
+from typing import Tuple, List, Optional
+
+from .calendar_table import TIME_FEATURES, CalendarTable
+from .memory_profile import MemoryProfiler
+from .spatial import NeighbourIndex
+
+# Synthetic data area when no region is given (San Francisco Bay Area example)
+DEFAULT_DATA_AREAS = [[37.3, -122.5, 38.0, -121.8]]
+
+
+def downcast_frame(df: pd.DataFrame, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Memory-lean dtypes, one column at a time (so at most one extra column is
+    alive): float64 to float32, integers to the smallest type that holds them
+    """
+    for col in columns if columns is not None else df.columns:
+        series = df[col]
+        if series.dtype == np.float64:
+            df[col] = series.astype(np.float32)
+        elif pd.api.types.is_integer_dtype(series.dtype) and series.dtype.itemsize > 1:
+            df[col] = pd.to_numeric(series, downcast='integer')
+    return df
+
 
 class DataPipeline:
-    def __init__(self, config_path: str = "configs/params.yaml"):
-        """Initialize data pipeline with configuration"""
+    def __init__(
+        self,
+        config_path: str = "configs/params.yaml",
+        region: Optional[str] = None,
+        lean: Optional[bool] = None,
+        profile: Optional[bool] = None
+    ):
+        """
+        Initialize data pipeline with configuration. With a region, data is
+        generated in that region's data_areas and saved under processed_path/<region>.
+        lean and profile override memory.lean and memory.profile.
+        """
         with open(config_path, 'r') as f:
             self.config = yaml.safe_load(f)
         
+        self.region = region
+        self.data_areas = DEFAULT_DATA_AREAS
+        if region is not None:
+            self.data_areas = self.config['regions'][region]['data_areas']
+            self.config['data']['processed_path'] = str(Path(self.config['data']['processed_path']) / region)
+        
         self.raw_path = Path(self.config['data']['raw_path'])
         self.processed_path = Path(self.config['data']['processed_path'])
         self.h3_resolution = self.config['spatial']['h3_resolution']
@@ -27,10 +66,17 @@ class DataPipeline:
         self.raw_path.mkdir(parents=True, exist_ok=True)
         self.processed_path.mkdir(parents=True, exist_ok=True)
         
-        # US holidays
-        self.us_holidays = holidays.US()
+        # Hourly time features and per-region holiday flags
+        self.calendar = CalendarTable.from_config(self.config)
+        
+        # Built by add_neighbour_features, saved with the processed data
+        self.neighbour_index = None
+        
+        # Memory-lean mode: float32/int8 columns, categorical h3_cell, no full-frame copies
+        self.lean = self.config.get('memory', {}).get('lean', False) if lean is None else lean
+        self.profiler = MemoryProfiler.from_config(self.config, enabled=profile)
     
-    def generate_synthetic_data(self, n_samples: int = 50000) -> pd.DataFrame:
+    def generate_synthetic_data(self, n_samples: int = 50000, end_date: datetime = None) -> pd.DataFrame:
         """
         Generate synthetic traffic data for demonstration
         In production, replace with real data sources
@@ -39,15 +85,18 @@ class DataPipeline:
         
         np.random.seed(42)
         
-        # Time range: last 6 months
-        end_date = datetime.now()
+        # Time range: 6 months up to end_date (default: now)
+        if end_date is None:
+            end_date = datetime.now()
         start_date = end_date - timedelta(days=180)
         
         timestamps = pd.date_range(start=start_date, end=end_date, periods=n_samples)
         
-        # Geographic bounds (San Francisco Bay Area example)
-        lat_min, lat_max = 37.3, 38.0
-        lon_min, lon_max = -122.5, -121.8
+        # Geographic bounds: each sample falls in one of the data areas [min_lat, min_lon, max_lat, max_lon]
+        areas = np.array(self.data_areas, dtype=np.float64)
+        if len(areas) > 1:
+            areas = areas[np.random.randint(len(areas), size=n_samples)]
+        lat_min, lon_min, lat_max, lon_max = areas.T
         
         data = {
             'timestamp': timestamps,
@@ -88,12 +137,27 @@ class DataPipeline:
         congestion += np.random.normal(0, 0.05, n_samples)
         df['congestion_score'] = np.clip(congestion, 0, 1)
         
+        if self.lean:
+            # Coordinates stay float64 so H3 cells match the standard mode exactly
+            downcast_frame(df, [col for col in df.columns if col not in ('latitude', 'longitude')])
+        
         return df
     
     def encode_h3(self, df: pd.DataFrame) -> pd.DataFrame:
         """Encode latitude/longitude to H3 hexagonal cells"""
         print("Encoding geographic coordinates with H3...")
         
+        if self.lean:
+            # 64-bit cell ids, then one string per distinct cell as categorical codes
+            cells = np.fromiter(
+                (h3_int.latlng_to_cell(lat, lon, self.h3_resolution)
+                 for lat, lon in zip(df['latitude'].tolist(), df['longitude'].tolist())),
+                dtype=np.uint64, count=len(df)
+            )
+            codes, uniques = pd.factorize(cells)
+            df['h3_cell'] = pd.Categorical.from_codes(codes, [h3_int.int_to_str(cell) for cell in uniques])
+            return df
+        
         df['h3_cell'] = df.apply(
             lambda row: h3.latlng_to_cell(row['latitude'], row['longitude'], self.h3_resolution),
             axis=1
@@ -107,20 +171,14 @@ class DataPipeline:
         
         df['timestamp'] = pd.to_datetime(df['timestamp'])
         
-        df['hour'] = df['timestamp'].dt.hour
-        df['day_of_week'] = df['timestamp'].dt.dayofweek
-        df['day_of_month'] = df['timestamp'].dt.day
-        df['month'] = df['timestamp'].dt.month
-        df['is_weekend'] = (df['day_of_week'] >= 5).astype(int)
-        df['is_holiday'] = df['timestamp'].dt.date.apply(lambda x: int(x in self.us_holidays))
-        
-        # Cyclical encoding for hour
-        df['hour_sin'] = np.sin(2 * np.pi * df['hour'] / 24)
-        df['hour_cos'] = np.cos(2 * np.pi * df['hour'] / 24)
+        # One gather from the calendar table (holidays follow each row's region)
+        region_codes = self.calendar.region_codes(df['latitude'].to_numpy(), df['longitude'].to_numpy())
+        time_features = self.calendar.gather(df['timestamp'], region_codes)
+        for name in TIME_FEATURES:
+            df[name] = time_features[name]
         
-        # Cyclical encoding for day of week
-        df['dow_sin'] = np.sin(2 * np.pi * df['day_of_week'] / 7)
-        df['dow_cos'] = np.cos(2 * np.pi * df['day_of_week'] / 7)
+        if self.lean:
+            downcast_frame(df, TIME_FEATURES)
         
         return df
     
@@ -128,12 +186,14 @@ class DataPipeline:
         """Add lag features for time series"""
         print("Adding lag features...")
         
-        df = df.sort_values('timestamp')
+        df = self.sort_by_time(df)
         
         # Group by H3 cell for spatial consistency
         for window in self.config['features']['lag_features']['windows']:
-            df[f'incident_lag_{window}h'] = df.groupby('h3_cell')['incident_count'].shift(window)
-            df[f'congestion_lag_{window}h'] = df.groupby('h3_cell')['congestion_score'].shift(window)
+            df[f'incident_lag_{window}h'] = df.groupby('h3_cell', observed=True)['incident_count'].shift(window)
+            df[f'congestion_lag_{window}h'] = df.groupby('h3_cell', observed=True)['congestion_score'].shift(window)
+            if self.lean:
+                downcast_frame(df, [f'incident_lag_{window}h', f'congestion_lag_{window}h'])
         
         return df
     
@@ -141,38 +201,119 @@ class DataPipeline:
         """Add rolling window statistics"""
         print("Adding rolling features...")
         
-        df = df.sort_values('timestamp')
+        df = self.sort_by_time(df)
         
         for window in self.config['features']['rolling_features']['windows']:
-            df[f'incident_rolling_mean_{window}h'] = df.groupby('h3_cell')['incident_count'].transform(
+            df[f'incident_rolling_mean_{window}h'] = df.groupby('h3_cell', observed=True)['incident_count'].transform(
                 lambda x: x.rolling(window=window, min_periods=1).mean()
             )
-            df[f'incident_rolling_std_{window}h'] = df.groupby('h3_cell')['incident_count'].transform(
+            df[f'incident_rolling_std_{window}h'] = df.groupby('h3_cell', observed=True)['incident_count'].transform(
                 lambda x: x.rolling(window=window, min_periods=1).std()
             )
+            if self.lean:
+                downcast_frame(df, [f'incident_rolling_mean_{window}h', f'incident_rolling_std_{window}h'])
         
         return df
     
+    def add_neighbour_features(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add neighbourhood-aggregated lag/rolling features: for each row, the mean
+        over H3 neighbours (distance 1..k) of their latest values before the row's time
+        """
+        nbr_config = self.config['features'].get('neighbour_features', {})
+        if not nbr_config.get('enabled', False):
+            return df
+        
+        print("Adding neighbour features...")
+        
+        rings = nbr_config['rings']
+        columns = nbr_config['columns']
+        if isinstance(df['h3_cell'].dtype, pd.CategoricalDtype):
+            # Look up each distinct cell once and gather by category code
+            categories = df['h3_cell'].cat.categories
+            self.neighbour_index = NeighbourIndex(categories, k_max=max(rings))
+            cell_idx = self.neighbour_index.lookup(categories)[df['h3_cell'].cat.codes.to_numpy()]
+        else:
+            self.neighbour_index = NeighbourIndex(df['h3_cell'].unique(), k_max=max(rings))
+            cell_idx = self.neighbour_index.lookup(df['h3_cell'].to_numpy())
+        
+        times = df['timestamp'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+        values = {col: np.nan_to_num(df[col].to_numpy(dtype=np.float64)) for col in columns}
+        
+        for k in rings:
+            aggregated = self.neighbour_index.aggregate_asof(
+                cell_idx, times, values, k,
+                chunk_rows=self.config.get('memory', {}).get('chunk_rows') if self.lean else None
+            )
+            for name, feature in aggregated.items():
+                df[f'nbr{k}_{name}'] = feature.astype(np.float32) if self.lean else feature
+        
+        return df
+    
+    def save_neighbour_index(self, df: pd.DataFrame):
+        """Save the neighbour index with each cell's latest state for inference"""
+        if self.neighbour_index is None:
+            return
+        
+        nbr_config = self.config['features']['neighbour_features']
+        columns = nbr_config['columns']
+        latest = df.sort_values('timestamp').groupby('h3_cell', sort=False).tail(1)
+        self.neighbour_index.set_state(
+            columns,
+            latest['h3_cell'].to_numpy(),
+            np.nan_to_num(latest[columns].to_numpy(dtype=np.float64))
+        )
+        
+        index_path = self.processed_path / nbr_config['index_file']
+        self.neighbour_index.save(index_path)
+        print(f"Saved neighbour index ({len(self.neighbour_index)} cells) to {index_path}")
+    
+    def sort_by_time(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Rows in timestamp order (the lean mode skips the copy when they already are)"""
+        if self.lean and df['timestamp'].is_monotonic_increasing:
+            return df
+        return df.sort_values('timestamp')
+    
+    def fill_missing(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Zero-fill NaN values from lag/rolling features (column by column in the lean mode)"""
+        if not self.lean:
+            return df.fillna(0)
+        
+        for col in df.columns:
+            if pd.api.types.is_float_dtype(df[col].dtype) and df[col].hasnans:
+                df[col] = df[col].fillna(0)
+        return df
+    
     def process_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """Complete data processing pipeline"""
-        print("Starting data processing pipeline...")
+        print(f"Starting data processing pipeline{' (memory-lean)' if self.lean else ''}...")
+        stage = self.profiler.stage
         
         # Encode spatial features
-        df = self.encode_h3(df)
+        with stage('encode_h3'):
+            df = self.encode_h3(df)
         
         # Add time features
-        df = self.add_time_features(df)
+        with stage('add_time_features'):
+            df = self.add_time_features(df)
         
         # Add lag features
-        df = self.add_lag_features(df)
+        with stage('add_lag_features'):
+            df = self.add_lag_features(df)
         
         # Add rolling features
-        df = self.add_rolling_features(df)
+        with stage('add_rolling_features'):
+            df = self.add_rolling_features(df)
+        
+        # Add neighbourhood features
+        with stage('add_neighbour_features'):
+            df = self.add_neighbour_features(df)
         
         # Fill NaN values from lag/rolling features
-        df = df.fillna(0)
+        with stage('fill_missing'):
+            df = self.fill_missing(df)
         
-        print(f"Processing complete. Final shape: {df.shape}")
+        print(f"Processing complete. Final shape: {df.shape} ({df.memory_usage(deep=True).sum() / 1024 ** 2:.1f}MB)")
         return df
     
     def save_processed_data(self, df: pd.DataFrame):
@@ -181,6 +322,8 @@ class DataPipeline:
         df.to_csv(output_path, index=False)
         print(f"Saved processed data to {output_path}")
         
+        self.save_neighbour_index(df)
+        
         # Print summary statistics
         print("\n=== Data Summary ===")
         print(f"Total samples: {len(df)}")
@@ -189,25 +332,36 @@ class DataPipeline:
         print(f"\nCongestion score distribution:")
         print(df['congestion_score'].describe())
     
-    def run(self):
+    def run(self, n_samples: int = 50000):
         """Execute the complete pipeline"""
         print("=" * 60)
         print("CongestionAI Data Pipeline")
         print("=" * 60)
         
         # Generate or load data
-        df = self.generate_synthetic_data(n_samples=50000)
+        with self.profiler.stage('generate'):
+            df = self.generate_synthetic_data(n_samples=n_samples)
         
         # Process data
         df = self.process_data(df)
         
         # Save processed data
-        self.save_processed_data(df)
+        with self.profiler.stage('save'):
+            self.save_processed_data(df)
         
+        self.profiler.report("Data pipeline memory")
         print("\n[OK] Data pipeline completed successfully!")
         return df
 
 
 if __name__ == "__main__":
-    pipeline = DataPipeline()
+    parser = argparse.ArgumentParser(description="CongestionAI data pipeline")
+    parser.add_argument('--region', help="Build training data for a regional model (a key of regions in params.yaml)")
+    parser.add_argument('--lean', action='store_true', default=None,
+                        help="Memory-lean mode (memory.lean): float32/int8 columns, categorical h3_cell")
+    parser.add_argument('--profile-memory', action='store_true', default=None,
+                        help="Print a per-stage peak memory report (memory.profile)")
+    args = parser.parse_args()
+    
+    pipeline = DataPipeline(region=args.region, lean=args.lean, profile=args.profile_memory)
     pipeline.run()
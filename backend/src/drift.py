@@ -0,0 +1,495 @@
+"""
+Drift monitoring for CongestionAI
+Live model inputs and scores are compared with the training data profile
+that ModelTrainer saves with the model. Memory is fixed whatever the
+traffic: per feature, a histogram over the training bin edges, a mergeable
+quantile sketch (KLL) and running moments, kept for the current and the
+previous window and since start. Rows are staged in a fixed buffer, so
+scoring only pays for a row copy; the sketches are updated per buffer.
+
+Check with: python -m src.drift check --shift temperature=15
+"""
+
+import argparse
+import math
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import yaml
+
+PREDICTION = 'prediction'
+PROFILE_QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+REPORT_QUANTILES = (0.05, 0.5, 0.95)
+
+_tracking = ContextVar('drift_tracking', default=True)
+
+
+@contextmanager
+def untracked():
+    """Scoring inside the block is not live traffic (e.g. lookup-table distillation)"""
+    token = _tracking.set(False)
+    try:
+        yield
+    finally:
+        _tracking.reset(token)
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 4) if value is not None else None
+
+
+def bin_codes(edges: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    Histogram slot per value: 0 below the first edge, i for [edges[i-1], edges[i]),
+    len(edges) for values equal to the last edge, len(edges) + 1 above it
+    """
+    codes = np.searchsorted(edges, values, side='right')
+    if len(edges):
+        codes += values > edges[-1]
+    return codes
+
+
+def profile_column(values: np.ndarray, bins: int) -> Dict:
+    """Training profile of one feature: quantile bin edges and their fractions, quantiles, moments"""
+    values = np.asarray(values, dtype=np.float64)
+    finite = values[~np.isnan(values)]
+    edges = np.unique(np.quantile(finite, np.linspace(0, 1, bins + 1))) if len(finite) else np.empty(0)
+    counts = np.bincount(bin_codes(edges, finite), minlength=len(edges) + 2)
+    return {
+        'count': int(len(values)),
+        'nan_rate': float(1 - len(finite) / len(values)) if len(values) else 0.0,
+        'edges': edges.tolist(),
+        'fractions': (counts / max(len(finite), 1)).tolist(),
+        'quantiles': dict(zip(
+            (str(q) for q in PROFILE_QUANTILES),
+            np.quantile(finite, PROFILE_QUANTILES).tolist() if len(finite) else [None] * len(PROFILE_QUANTILES)
+        )),
+        'mean': float(finite.mean()) if len(finite) else None,
+        'std': float(finite.std()) if len(finite) else None,
+    }
+
+
+def build_profile(X: pd.DataFrame, scores: np.ndarray, bins: int = 20) -> Dict:
+    """Data profile saved with a model: every feature column of X, and the model's scores"""
+    return {
+        'rows': int(len(X)),
+        'bins': bins,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'features': {column: profile_column(X[column].to_numpy(), bins) for column in X.columns},
+        PREDICTION: profile_column(scores, bins),
+    }
+
+
+class QuantileSketch:
+    """
+    KLL sketch: levels of sampled values, a value at level h standing for 2**h
+    inputs. A full level is sorted and every other value moves up, so the
+    sketch keeps about 3k values however many it has seen. Mergeable.
+    """
+
+    def __init__(self, k: int = 200, rng: Optional[np.random.Generator] = None):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self.rng = rng or np.random.default_rng()
+
+    def capacities(self) -> List[int]:
+        """Values each level may hold: k at the top, shrinking by 2/3 per level below"""
+        height = len(self.levels)
+        return [max(2, math.ceil(self.k * (2 / 3) ** (height - level - 1))) for level in range(height)]
+
+    def update(self, values: np.ndarray, presorted: bool = False):
+        """Add values; a batch of more than k values is compacted (halved) before it lands"""
+        self.n += len(values)
+        level = 0
+        if len(values) > self.k:
+            values = values if presorted else np.sort(values)
+            while len(values) > self.k:
+                values = values[self.rng.integers(2)::2]
+                level += 1
+        while len(self.levels) <= level:
+            self.levels.append(np.empty(0))
+        self.levels[level] = np.concatenate([self.levels[level], values])
+        self.compress()
+
+    def merge(self, other: 'QuantileSketch'):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self.compress()
+
+    def compress(self):
+        # One pass bottom-up settles every level, unless a new top level shrank the capacities
+        height = 0
+        while height != len(self.levels):
+            height = len(self.levels)
+            for level, capacity in enumerate(self.capacities()):
+                items = self.levels[level]
+                if len(items) <= capacity:
+                    continue
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                odd = len(items) % 2
+                self.levels[level] = items[:odd]
+                self.levels[level + 1] = np.concatenate(
+                    [self.levels[level + 1], items[odd + self.rng.integers(2)::2]]
+                )
+
+    def quantiles(self, qs) -> List[Optional[float]]:
+        if not self.n:
+            return [None] * len(qs)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(values), 2.0 ** level) for level, values in enumerate(self.levels)])
+        order = np.argsort(items)
+        cumulative = np.cumsum(weights[order])
+        index = np.searchsorted(cumulative, np.asarray(qs) * cumulative[-1], side='left')
+        return items[order][np.minimum(index, len(items) - 1)].tolist()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(items.nbytes for items in self.levels)
+
+
+class FeatureSketch:
+    """Histogram over the reference bin edges, quantile sketch and moments of one live feature"""
+
+    def __init__(self, edges: np.ndarray, k: int, rng: np.random.Generator):
+        self.edges = edges
+        self.counts = np.zeros(len(edges) + 2, dtype=np.int64)
+        self.quantile_sketch = QuantileSketch(k, rng)
+        self.count = 0
+        self.nans = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+
+    def update(self, finite: np.ndarray, count: int):
+        """Add the sorted non-NaN values of `count` rows"""
+        self.count += count
+        self.nans += count - len(finite)
+        if len(self.edges):
+            # Slot boundaries in the sorted values (the slots of bin_codes)
+            bounds = np.searchsorted(finite, self.edges, side='left')
+            last = np.searchsorted(finite, self.edges[-1], side='right')
+            self.counts += np.diff(np.concatenate(([0], bounds, [last, len(finite)])))
+        else:
+            self.counts[0] += len(finite)
+        self.quantile_sketch.update(finite, presorted=True)
+        self.total += float(finite.sum())
+        self.total_squares += float(np.square(finite).sum())
+
+    def merge(self, other: 'FeatureSketch'):
+        self.count += other.count
+        self.nans += other.nans
+        self.counts += other.counts
+        self.quantile_sketch.merge(other.quantile_sketch)
+        self.total += other.total
+        self.total_squares += other.total_squares
+
+    def compare(self, reference: Dict) -> Dict:
+        """Drift statistics of the live values against a profile_column() reference"""
+        finite = self.count - self.nans
+        stats = {'rows': self.count, 'nan_rate': round(self.nans / self.count, 4) if self.count else None}
+        if not finite:
+            return stats
+
+        # Population stability index and Kolmogorov-Smirnov distance over the reference bins
+        expected = np.clip(np.asarray(reference['fractions']), 1e-4, None)
+        observed = np.clip(self.counts / finite, 1e-4, None)
+        expected, observed = expected / expected.sum(), observed / observed.sum()
+        mean = self.total / finite
+        std = np.sqrt(max(self.total_squares / finite - mean ** 2, 0.0))
+        live_quantiles = self.quantile_sketch.quantiles(REPORT_QUANTILES)
+
+        stats.update({
+            'psi': round(float(np.sum((observed - expected) * np.log(observed / expected))), 4),
+            'ks': round(float(np.max(np.abs(np.cumsum(observed) - np.cumsum(expected)))), 4),
+            'out_of_range': round(float((self.counts[0] + self.counts[-1]) / finite), 4),
+            'mean': round(mean, 4),
+            'std': round(float(std), 4),
+            'mean_shift': (
+                round((mean - reference['mean']) / reference['std'], 3) if reference.get('std') else None
+            ),
+            'quantiles': {
+                str(q): {
+                    'training': _round(reference['quantiles'].get(str(q))),
+                    'live': round(live, 4),
+                }
+                for q, live in zip(REPORT_QUANTILES, live_quantiles)
+            },
+        })
+        return stats
+
+    @property
+    def nbytes(self) -> int:
+        return self.edges.nbytes + self.counts.nbytes + self.quantile_sketch.nbytes
+
+
+class LiveProfile:
+    """A FeatureSketch per feature and for the scores"""
+
+    def __init__(self, names: List[str], edges: Dict[str, np.ndarray], k: int, rng: np.random.Generator):
+        self.names = names
+        self.sketches = [FeatureSketch(edges[name], k, rng) for name in names]
+        self.started = time.time()
+
+    def update(self, columns: np.ndarray):
+        """Add a (feature, row) block: one sort for all features, NaN sorted last"""
+        ordered = np.sort(columns, axis=1)
+        finite = columns.shape[1] - np.isnan(columns).sum(axis=1)
+        for values, n, sketch in zip(ordered, finite, self.sketches):
+            sketch.update(values[:n], columns.shape[1])
+
+    def merge(self, other: 'LiveProfile'):
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+
+    @property
+    def rows(self) -> int:
+        return self.sketches[-1].count
+
+    @property
+    def nbytes(self) -> int:
+        return sum(sketch.nbytes for sketch in self.sketches)
+
+
+class DriftMonitor:
+    def __init__(self, feature_names: List[str], profile: Optional[Dict], config: Optional[Dict] = None, name: str = 'global'):
+        """
+        Live sketches of one model's inputs (feature_names) and scores against
+        its training profile. Without a profile (models trained before profiles
+        were saved) only live statistics are reported.
+        """
+        config = config or {}
+        self.name = name
+        self.profile = profile
+        self.k = config.get('sketch_k', 200)
+        self.window_seconds = config.get('window_seconds', 3600)
+        self.min_rows = config.get('min_rows', 500)
+        self.psi_warning = config.get('psi_warning', 0.1)
+        self.psi_drift = config.get('psi_drift', 0.25)
+        self.rng = np.random.default_rng()
+
+        self.names = list(feature_names) + [PREDICTION]
+        references = (profile or {}).get('features', {})
+        self.references = {name: references.get(name) for name in feature_names}
+        self.references[PREDICTION] = (profile or {}).get(PREDICTION)
+        # Live histograms share the training bin edges (a single bin without a reference)
+        self.edges = {
+            name: np.asarray(reference['edges'] if reference else [], dtype=np.float64)
+            for name, reference in self.references.items()
+        }
+
+        # Staged rows, feature-major so each feature's values are contiguous
+        self.buffer = np.empty((len(self.names), config.get('buffer_rows', 4096)), dtype=np.float64)
+        self.buffered = 0
+        self.current = self._new_profile()
+        self.previous = None
+        self.earlier = None  # windows that have left the recent view, merged
+        self.window_started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def update(self, X: pd.DataFrame, scores: np.ndarray):
+        """Stage model inputs and their scores (O(1) per row; the sketches are updated per full buffer)"""
+        if not _tracking.get() or not len(X):
+            return
+        values = X.to_numpy(dtype=np.float64)
+
+        with self._lock:
+            if time.monotonic() - self.window_started >= self.window_seconds:
+                self._flush()
+                self._rotate()
+            start = 0
+            while start < len(values):
+                taken = min(self.buffer.shape[1] - self.buffered, len(values) - start)
+                self.buffer[:-1, self.buffered:self.buffered + taken] = values[start:start + taken].T
+                self.buffer[-1, self.buffered:self.buffered + taken] = scores[start:start + taken]
+                self.buffered += taken
+                start += taken
+                if self.buffered == self.buffer.shape[1]:
+                    self._flush()
+
+    def _flush(self):
+        if self.buffered:
+            self.current.update(self.buffer[:, :self.buffered])
+            self.buffered = 0
+
+    def _new_profile(self) -> LiveProfile:
+        return LiveProfile(self.names, self.edges, self.k, self.rng)
+
+    def _rotate(self):
+        """Start a new window; the previous one is kept for the recent view"""
+        if self.previous is not None:
+            if self.earlier is None:
+                self.earlier = self._new_profile()
+                self.earlier.started = self.previous.started
+            self.earlier.merge(self.previous)
+        self.previous = self.current
+        self.current = self._new_profile()
+        self.window_started = time.monotonic()
+
+    def flush(self):
+        """Update the sketches with the staged rows"""
+        with self._lock:
+            self._flush()
+
+    def status(self, stats: Dict) -> str:
+        if stats['rows'] < self.min_rows or 'psi' not in stats:
+            return 'insufficient_data'
+        if stats['psi'] >= self.psi_drift:
+            return 'drift'
+        return 'warning' if stats['psi'] >= self.psi_warning else 'ok'
+
+    def compare(self, live: LiveProfile) -> Dict:
+        """Per-feature and score drift statistics of a live profile, most drifted feature first"""
+        features = {}
+        for name, sketch in zip(live.names, live.sketches):
+            reference = self.references.get(name)
+            if reference is None:
+                stats = {'rows': sketch.count, 'quantiles': dict(zip(
+                    (str(q) for q in REPORT_QUANTILES), map(_round, sketch.quantile_sketch.quantiles(REPORT_QUANTILES))
+                ))}
+            else:
+                stats = sketch.compare(reference)
+                stats['status'] = self.status(stats)
+            features[name] = stats
+
+        prediction = features.pop(PREDICTION)
+        ranked = sorted(features.items(), key=lambda item: item[1].get('psi', -1), reverse=True)
+        return {
+            'rows': live.rows,
+            'since': datetime.fromtimestamp(live.started).isoformat(timespec='seconds'),
+            'drifted': [name for name, stats in ranked if stats.get('status') == 'drift'],
+            'warnings': [name for name, stats in ranked if stats.get('status') == 'warning'],
+            'prediction': prediction,
+            'features': dict(ranked),
+        }
+
+    def merged(self, windows: List[Optional[LiveProfile]]) -> LiveProfile:
+        """One profile of several windows (oldest first; None entries skipped)"""
+        windows = [window for window in windows if window is not None]
+        profile = self._new_profile()
+        profile.started = windows[0].started
+        for window in windows:
+            profile.merge(window)
+        return profile
+
+    def report(self) -> Dict:
+        """Drift over the recent window (this and the previous one) and since start"""
+        with self._lock:
+            self._flush()
+            return {
+                'model': self.name,
+                'profile': {
+                    'rows': self.profile['rows'], 'created_at': self.profile.get('created_at')
+                } if self.profile else None,
+                'window_seconds': self.window_seconds,
+                'memory_bytes': self.nbytes,
+                'recent': self.compare(self.merged([self.previous, self.current])),
+                'total': self.compare(self.merged([self.earlier, self.previous, self.current])),
+            }
+
+    @property
+    def nbytes(self) -> int:
+        profiles = (self.earlier, self.previous, self.current)
+        return self.buffer.nbytes + sum(profile.nbytes for profile in profiles if profile is not None)
+
+
+def check(config_path: str, model_path: str, source: str, requests: int, rows: int, shifts: Dict[str, float]):
+    """
+    Score `requests` batches of `rows` rows with a drift monitor and print its
+    summary, then again with features shifted (feature=delta). source 'data'
+    takes the rows from the processed training file, so only the shift should
+    drift; 'requests' builds features for random locations in the configured
+    regions as the API does, which shows how served inputs differ from training.
+    """
+    from .infer import CongestionPredictor
+
+    with open(config_path, 'r') as f:
+        config = yaml.safe_load(f)
+    drift_config = dict(config.get('drift', {}), enabled=True)
+    predictor = CongestionPredictor(model_path)
+    if predictor.data_profile is None:
+        print("[WARNING] The model has no training data profile (retrain it); live statistics only")
+    rng = np.random.default_rng(0)
+
+    if source == 'data':
+        data_path = Path(config['data']['processed_path']) / config['data']['train_file']
+        data = pd.read_csv(data_path, usecols=predictor.feature_names, nrows=requests * rows * 4)
+        batches = [data.iloc[index] for index in np.array_split(rng.permutation(len(data))[:requests * rows], requests)]
+    else:
+        bboxes = [region['bbox'] for region in (config.get('regions') or {}).values()]
+        start = datetime.now().replace(minute=0, second=0, microsecond=0)
+        batches = []
+        for i in range(requests):
+            south, west, north, east = bboxes[i % len(bboxes)]
+            lats, lons = rng.uniform(south, north, rows), rng.uniform(west, east, rows)
+            features_df = predictor.build_features(
+                lats, lons, start + timedelta(hours=int(rng.integers(0, 168))), weather_data={}
+            )
+            batches.append(predictor.add_neighbour_features(features_df, lats, lons)[predictor.feature_names])
+
+    for label, shift in [("As is", {})] + ([("Shifted " + ', '.join(
+        f"{name}{delta:+g}" for name, delta in shifts.items()
+    ), shifts)] if shifts else []):
+        predictor.drift_monitor = DriftMonitor(predictor.feature_names, predictor.data_profile, drift_config)
+        started = time.perf_counter()
+        for X in batches:
+            if shift:
+                X = X.assign(**{name: X[name] + delta for name, delta in shift.items()})
+            predictor.predict_bands(X)
+        seconds = time.perf_counter() - started
+        print_summary(f"{label}: {len(batches)} x {rows} {source} rows scored in {seconds:.2f}s",
+                      predictor.drift_monitor.report())
+
+
+def print_summary(title: str, report: Dict, top: int = 8):
+    """Score drift and the most drifted features of a report (since start)"""
+    total = report['total']
+    print(f"\n=== {title} ===")
+    print(f"rows {total['rows']}, sketch memory {report['memory_bytes'] / 1024:.0f}KB")
+    print(f"{'feature':<32} {'status':<18} {'psi':>8} {'ks':>7} {'shift':>7} {'p50 train':>10} {'p50 live':>10}")
+
+    def number(value, width: int, digits: int) -> str:
+        return f"{value:>{width}.{digits}f}" if value is not None else f"{'-':>{width}}"
+
+    for name, stats in [(PREDICTION, total['prediction'])] + list(total['features'].items())[:top]:
+        median = stats.get('quantiles', {}).get('0.5')
+        if not isinstance(median, dict):
+            median = {'training': None, 'live': median}
+        print(f"{name:<32} {stats.get('status', '-'):<18} {number(stats.get('psi'), 8, 3)} "
+              f"{number(stats.get('ks'), 7, 3)} {number(stats.get('mean_shift'), 7, 2)} "
+              f"{number(median['training'], 10, 3)} {number(median['live'], 10, 3)}")
+    print(f"drifted: {', '.join(total['drifted']) or 'none'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CongestionAI drift monitoring")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    check_parser = subparsers.add_parser('check', help="Drift reports for random requests, plain and shifted")
+    check_parser.add_argument('--config', default="configs/params.yaml")
+    check_parser.add_argument('--model', default="models/model.pkl")
+    check_parser.add_argument('--source', choices=['data', 'requests'], default='data',
+                              help="Rows of the processed training file, or features of random requests")
+    check_parser.add_argument('--requests', type=int, default=40)
+    check_parser.add_argument('--rows', type=int, default=250, help="Rows per request")
+    check_parser.add_argument('--shift', nargs='*', default=[], metavar='FEATURE=DELTA',
+                              help="Added to a feature in the second run, e.g. temperature=15")
+
+    args = parser.parse_args()
+
+    shifts = {}
+    for item in args.shift:
+        name, _, delta = item.partition('=')
+        shifts[name] = float(delta)
+    check(args.config, args.model, args.source, args.requests, args.rows, shifts)
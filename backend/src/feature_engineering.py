@@ -6,29 +6,50 @@ import pandas as pd
 import numpy as np
 import h3
 from datetime import datetime, timedelta
-import holidays
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
+
+from .calendar_table import TIME_FEATURES, CalendarTable
+from .weather import WEATHER_DEFAULTS
+
+# Human-readable congestion factors: (factor, impact, icon, vectorized condition)
+CONGESTION_FACTORS = [
+    # Time-based factors
+    ('Morning Rush Hour', 0.3, '🌅', lambda f: (f['hour'] >= 7) & (f['hour'] <= 9)),
+    ('Evening Rush Hour', 0.35, '🌆', lambda f: (f['hour'] >= 17) & (f['hour'] <= 19)),
+    # Weather factors
+    ('Heavy Precipitation', 0.2, '🌧️', lambda f: f['precipitation'] > 5),
+    ('Low Visibility', 0.15, '🌫️', lambda f: f['visibility'] < 8),
+    ('Freezing Temperature', 0.1, '❄️', lambda f: f['temperature'] < 0),
+    # Day factors
+    ('Weekday Traffic', 0.1, '📅', lambda f: f['is_weekend'] == 0),
+    ('Holiday Period', 0.15, '🎉', lambda f: f['is_holiday'] == 1),
+]
+
+# Values assumed for columns a feature set does not have
+FACTOR_DEFAULTS = {
+    'hour': 0,
+    'precipitation': 0,
+    'visibility': 10,
+    'temperature': 20,
+    'is_weekend': 0,
+    'is_holiday': 0,
+}
 
 class FeatureEngineer:
-    def __init__(self, h3_resolution: int = 8):
+    def __init__(self, h3_resolution: int = 8, calendar: Optional[CalendarTable] = None):
         """Initialize feature engineer"""
         self.h3_resolution = h3_resolution
-        self.us_holidays = holidays.US()
+        self.calendar = calendar or CalendarTable.from_config()
     
-    def create_time_features(self, timestamp: datetime) -> Dict:
-        """Create time-based features from timestamp"""
-        features = {
-            'hour': timestamp.hour,
-            'day_of_week': timestamp.weekday(),
-            'day_of_month': timestamp.day,
-            'month': timestamp.month,
-            'is_weekend': int(timestamp.weekday() >= 5),
-            'is_holiday': int(timestamp.date() in self.us_holidays),
-            'hour_sin': np.sin(2 * np.pi * timestamp.hour / 24),
-            'hour_cos': np.cos(2 * np.pi * timestamp.hour / 24),
-            'dow_sin': np.sin(2 * np.pi * timestamp.weekday() / 7),
-            'dow_cos': np.cos(2 * np.pi * timestamp.weekday() / 7),
-        }
+    def create_time_features(self, timestamp: datetime, lat: float = None, lon: float = None) -> Dict:
+        """Create time-based features from timestamp (holidays of the location's region)"""
+        if lat is None or lon is None:
+            region_code = self.calendar.default_code
+        else:
+            region_code = self.calendar.region_code(lat, lon)
+        
+        time_features = self.calendar.lookup(timestamp, region_code)
+        features = {name: time_features[name] for name in TIME_FEATURES}
         return features
     
     def encode_location(self, lat: float, lon: float) -> str:
@@ -55,78 +76,65 @@ class FeatureEngineer:
         }
         return features
     
-    def calculate_congestion_factors(self, features: Dict) -> List[Dict]:
+    def factor_codes(self, features) -> np.ndarray:
         """
-        Analyze features and return top contributing factors
+        Vectorized factor detection: one bitmask per row, bit i set when
+        CONGESTION_FACTORS[i] applies. features maps column names to arrays
+        (a DataFrame or a dict); missing columns take neutral defaults.
         """
-        factors = []
-        
-        # Check time-based factors
-        hour = features.get('hour', 0)
-        if 7 <= hour <= 9:
-            factors.append({
-                'factor': 'Morning Rush Hour',
-                'impact': 0.3,
-                'icon': '🌅'
-            })
-        elif 17 <= hour <= 19:
-            factors.append({
-                'factor': 'Evening Rush Hour',
-                'impact': 0.35,
-                'icon': '🌆'
-            })
-        
-        # Check weather factors
-        if features.get('precipitation', 0) > 5:
-            factors.append({
-                'factor': 'Heavy Precipitation',
-                'impact': 0.2,
-                'icon': '🌧️'
-            })
-        
-        if features.get('visibility', 10) < 8:
-            factors.append({
-                'factor': 'Low Visibility',
-                'impact': 0.15,
-                'icon': '🌫️'
-            })
-        
-        if features.get('temperature', 20) < 0:
-            factors.append({
-                'factor': 'Freezing Temperature',
-                'impact': 0.1,
-                'icon': '❄️'
-            })
-        
-        # Check day factors
-        if features.get('is_weekend', 0) == 0:
-            factors.append({
-                'factor': 'Weekday Traffic',
-                'impact': 0.1,
-                'icon': '📅'
-            })
-        
-        if features.get('is_holiday', 0) == 1:
-            factors.append({
-                'factor': 'Holiday Period',
-                'impact': 0.15,
-                'icon': '🎉'
-            })
+        columns = {}
+        for name, default in FACTOR_DEFAULTS.items():
+            columns[name] = np.asarray(features[name]) if name in features else default
+        
+        n = len(next(iter(features.values()))) if isinstance(features, dict) else len(features)
+        codes = np.zeros(n, dtype=np.int64)
+        for bit, (_, _, _, applies) in enumerate(CONGESTION_FACTORS):
+            codes |= np.asarray(applies(columns), dtype=np.int64) << bit
+        return codes
+    
+    def factors_for_code(self, code: int) -> List[Dict]:
+        """Top contributing factors (by impact) for a factor bitmask"""
+        factors = [
+            {'factor': factor, 'impact': impact, 'icon': icon}
+            for bit, (factor, impact, icon, _) in enumerate(CONGESTION_FACTORS)
+            if code >> bit & 1
+        ]
         
         # Sort by impact and return top factors
         factors.sort(key=lambda x: x['impact'], reverse=True)
         return factors[:5]
     
+    def calculate_congestion_factors(self, features: Dict) -> List[Dict]:
+        """
+        Analyze features and return top contributing factors
+        """
+        code = self.factor_codes({name: [value] for name, value in features.items()})[0]
+        return self.factors_for_code(int(code))
+    
+    def calculate_congestion_factors_batch(self, features) -> Tuple[np.ndarray, List[List[Dict]]]:
+        """
+        calculate_congestion_factors for every row of a feature frame.
+        Returns (factor codes, factors per row); each distinct combination of
+        factors is built once and shared by the rows that have it.
+        """
+        codes = self.factor_codes(features)
+        unique_codes, inverse = np.unique(codes, return_inverse=True)
+        by_code = [self.factors_for_code(int(code)) for code in unique_codes]
+        return codes, [by_code[i] for i in inverse.tolist()]
+    
     def prepare_inference_features(
         self, 
         lat: float, 
         lon: float, 
         timestamp: datetime,
         weather_data: Dict = None,
-        historical_data: Dict = None
+        historical_data: Dict = None,
+        weather_features: Dict = None
     ) -> pd.DataFrame:
         """
-        Prepare features for model inference
+        Prepare features for model inference.
+        weather_features (already in model units, e.g. from the forecast grid)
+        take precedence over raw weather_data.
         """
         # Basic features
         features = {
@@ -139,22 +147,18 @@ class FeatureEngineer:
         # features['h3_cell'] = self.encode_location(lat, lon)
         
         # Time features
-        time_features = self.create_time_features(timestamp)
+        time_features = self.create_time_features(timestamp, lat, lon)
         features.update(time_features)
         
         # Weather features
-        if weather_data:
+        if weather_features:
+            features.update(weather_features)
+        elif weather_data:
             weather_features = self.create_weather_features(weather_data)
             features.update(weather_features)
         else:
             # Default weather values
-            features.update({
-                'temperature': 20,
-                'precipitation': 0,
-                'visibility': 10,
-                'wind_speed': 10,
-                'humidity': 50,
-            })
+            features.update(WEATHER_DEFAULTS)
         
         # Historical features (lag and rolling)
         if historical_data:
@@ -174,13 +178,57 @@ class FeatureEngineer:
         
         return df
     
+    def prepare_batch_features(
+        self,
+        lats,
+        lons,
+        timestamp,
+        weather_data: Dict = None,
+        weather_features: Dict[str, np.ndarray] = None
+    ) -> pd.DataFrame:
+        """
+        Vectorized equivalent of prepare_inference_features for many locations.
+        timestamp may be a single datetime or one timestamp per location.
+        weather_features holds one array per weather column (per-row forecasts);
+        otherwise weather_data (or the defaults) is shared by every row.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        n = len(lats)
+
+        features = {
+            'latitude': lats,
+            'longitude': lons,
+        }
+
+        # Time features: one gather from the precomputed calendar table
+        time_features = self.calendar.gather(timestamp, self.calendar.region_codes(lats, lons))
+        for name in TIME_FEATURES:
+            features[name] = time_features[name]
+
+        # Weather features: per-row forecasts, or one observation shared by every row
+        if weather_features:
+            features.update(weather_features)
+        else:
+            shared = self.create_weather_features(weather_data) if weather_data else WEATHER_DEFAULTS
+            for name, value in shared.items():
+                features[name] = np.full(n, value)
+
+        # Historical features default to zero, as in prepare_inference_features
+        zeros = np.zeros(n, dtype=np.int64)
+        for window in [1, 3, 6, 12, 24]:
+            features[f'incident_lag_{window}h'] = zeros
+            features[f'congestion_lag_{window}h'] = zeros
+
+        for window in [3, 6, 12, 24]:
+            features[f'incident_rolling_mean_{window}h'] = zeros
+            features[f'incident_rolling_std_{window}h'] = zeros
+
+        return pd.DataFrame(features)
+
     def get_feature_names(self) -> List[str]:
         """Return list of all feature names used in model"""
-        feature_names = [
-            'latitude', 'longitude',
-            'hour', 'day_of_week', 'day_of_month', 'month',
-            'is_weekend', 'is_holiday',
-            'hour_sin', 'hour_cos', 'dow_sin', 'dow_cos',
+        feature_names = ['latitude', 'longitude'] + TIME_FEATURES + [
             'temperature', 'precipitation', 'visibility', 'wind_speed', 'humidity',
         ]
         
@@ -0,0 +1,89 @@
+"""
+Forecast cache for CongestionAI
+LRU cache of forecasts (lower bound, score, upper bound) keyed by
+(model version, H3 cell, hour bucket)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+class ForecastCache:
+    def __init__(self, max_entries: int = 200000, ttl: float = 3600, width: int = 3):
+        """Initialize an empty cache; ttl is in seconds, width is the number of values per entry"""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.width = width
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def hour_bucket(timestamp: datetime) -> str:
+        """
+        Wall-clock hour a timestamp falls in. Model features only depend on the
+        local hour/day/month, so every timestamp in the bucket scores the same.
+        """
+        return timestamp.replace(minute=0, second=0, microsecond=0, tzinfo=None).isoformat()
+
+    def get_many(self, model_version: str, cells: List[str], bucket: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Look up forecasts for cells. Returns (values, missing) where values is
+        (n, width) with NaN rows for misses and missing is the index array of
+        cells that must be computed.
+        """
+        now = time.monotonic()
+        values = np.full((len(cells), self.width), np.nan)
+        found = np.zeros(len(cells), dtype=bool)
+
+        with self._lock:
+            for i, cell in enumerate(cells):
+                key = (model_version, cell, bucket)
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                row, stored_at = entry
+                if now - stored_at > self.ttl:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                values[i] = row
+                found[i] = True
+
+        # Not NaN-based: point models store NaN bounds
+        missing = np.flatnonzero(~found)
+        self.hits += len(cells) - len(missing)
+        self.misses += len(missing)
+        return values, missing
+
+    def put_many(self, model_version: str, cells: List[str], bucket: str, values: np.ndarray):
+        """Store freshly computed (n, width) forecasts, evicting least recently used entries"""
+        now = time.monotonic()
+        with self._lock:
+            for cell, row in zip(cells, np.asarray(values, dtype=np.float64).tolist()):
+                key = (model_version, cell, bucket)
+                self._entries[key] = (row, now)
+                self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
@@ -0,0 +1,273 @@
+"""
+HTTP caching for CongestionAI GET forecast endpoints
+Strong ETags derived from everything that determines a forecast (model and
+input-state versions, hour bucket, canonical resource), Cache-Control
+lifetimes aligned with forecast refreshes, and a small caching reverse proxy
+that shows how a CDN or browser cache in front of the API behaves.
+
+Demo with: python -m src.http_cache demo
+"""
+
+import argparse
+import hashlib
+import json
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+from email.message import Message
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+# Response headers passed through the proxy (hop-by-hop headers are dropped)
+FORWARDED_HEADERS = ('content-type', 'etag', 'cache-control', 'vary', 'content-encoding')
+
+
+def forecast_etag(cache_version: str, hour: datetime, resource: str) -> str:
+    """Strong ETag for a forecast representation: same inputs, same bytes"""
+    digest = hashlib.sha256(f"{cache_version}|{hour:%Y-%m-%dT%H}|{resource}".encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check (weak comparison, as RFC 9110 specifies for it)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(','))
+    return etag in (tag[2:] if tag.startswith('W/') else tag for tag in candidates)
+
+
+def forecast_max_age(max_age: int, prefetcher=None, hour_from_clock: bool = False,
+                     now: Optional[float] = None) -> int:
+    """
+    Seconds a forecast may be reused: at most max_age, and never past the next
+    weather forecast refresh. URLs without an explicit hour resolve to a
+    different bucket every hour, so they also expire on the hour.
+    """
+    now = time.time() if now is None else now
+    if prefetcher is not None and prefetcher.last_refresh is not None:
+        next_refresh = prefetcher.last_refresh + prefetcher.update_interval
+        max_age = min(max_age, max(0, int(next_refresh - now)))
+    if hour_from_clock:
+        max_age = min(max_age, 3600 - int(now) % 3600)
+    return max_age
+
+
+def hour_bucket(hour: Optional[str], default_offset: float = 0,
+                now: Optional[datetime] = None) -> Tuple[datetime, bool]:
+    """
+    (hour bucket, explicit) for an ISO hour such as 2024-01-15T08 or a full
+    timestamp (floored to the hour); without one, now (default: the clock)
+    + default_offset hours. UTC offsets are dropped, as for the POST endpoints.
+    """
+    if hour:
+        value = hour.replace('Z', '')
+        if len(value) == 13:  # YYYY-MM-DDTHH
+            value += ':00'
+        parsed = datetime.fromisoformat(value).replace(tzinfo=None)
+        return parsed.replace(minute=0, second=0, microsecond=0), True
+    parsed = (now or datetime.now()) + timedelta(hours=default_offset)
+    return parsed.replace(minute=0, second=0, microsecond=0), False
+
+
+# --- Caching proxy -------------------------------------------------------------
+
+class CachingProxyHandler(BaseHTTPRequestHandler):
+    """
+    GET-only reverse proxy with a shared cache, as a CDN would run: fresh
+    entries are served without contacting the API (HIT), stale ones are
+    revalidated with If-None-Match (REVALIDATED on 304, MISS otherwise).
+    """
+
+    def do_GET(self):
+        proxy = self.server
+        key = (self.path, self.headers.get('Accept', ''))
+        with proxy.lock:
+            entry = proxy.cache.get(key)
+
+        if entry is not None and entry['expires'] > time.monotonic():
+            proxy.stats['hits'] += 1
+            self._send(entry['status'], entry['headers'], entry['body'], 'HIT')
+            return
+
+        request = urllib.request.Request(proxy.upstream + self.path)
+        if self.headers.get('Accept'):
+            request.add_header('Accept', self.headers['Accept'])
+        if entry is not None:
+            request.add_header('If-None-Match', entry['headers']['etag'])
+
+        proxy.stats['upstream'] += 1
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                status, body = response.status, response.read()
+                headers = {k.lower(): v for k, v in response.headers.items() if k.lower() in FORWARDED_HEADERS}
+        except urllib.error.HTTPError as e:
+            if e.code == 304 and entry is not None:
+                proxy.stats['revalidated'] += 1
+                entry['expires'] = time.monotonic() + proxy.freshness(e.headers.get('Cache-Control', ''))
+                self._send(entry['status'], entry['headers'], entry['body'], 'REVALIDATED')
+                return
+            status, body = e.code, e.read()
+            headers = {k.lower(): v for k, v in e.headers.items() if k.lower() in FORWARDED_HEADERS}
+
+        proxy.stats['misses'] += 1
+        lifetime = proxy.freshness(headers.get('cache-control', ''))
+        if status == 200 and 'etag' in headers and lifetime > 0:
+            with proxy.lock:
+                proxy.cache[key] = {
+                    'status': status, 'headers': headers, 'body': body,
+                    'expires': time.monotonic() + lifetime,
+                }
+        self._send(status, headers, body, 'MISS')
+
+    def _send(self, status: int, headers: Dict, body: bytes, cache_status: str):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Cache', cache_status)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CachingProxy(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, upstream: str, max_age_cap: Optional[float] = None):
+        super().__init__(address, CachingProxyHandler)
+        self.upstream = upstream.rstrip('/')
+        self.max_age_cap = max_age_cap
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'upstream': 0}
+
+    def freshness(self, cache_control: str) -> float:
+        """Freshness lifetime from Cache-Control (0 for private/no-store responses)"""
+        directives = {d.strip().split('=')[0]: d.strip() for d in cache_control.split(',') if d.strip()}
+        if 'no-store' in directives or 'private' in directives or 'max-age' not in directives:
+            return 0.0
+        lifetime = float(directives['max-age'].split('=')[1])
+        return min(lifetime, self.max_age_cap) if self.max_age_cap is not None else lifetime
+
+
+def start_proxy(upstream: str, host: str = "127.0.0.1", port: int = 0,
+                max_age_cap: Optional[float] = None) -> Tuple[CachingProxy, str]:
+    """Serve the caching proxy on a background thread; returns (server, base URL)"""
+    server = CachingProxy((host, port), upstream, max_age_cap)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+# --- Demo ----------------------------------------------------------------------
+
+def _fetch(url: str, headers: Optional[Dict] = None, data: Optional[bytes] = None) -> Tuple[int, Message, bytes, float]:
+    """(status, headers (case-insensitive), body, milliseconds)"""
+    request = urllib.request.Request(url, data=data, headers=headers or {})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            status, response_headers, body = response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        status, response_headers, body = e.code, e.headers, e.read()
+    return status, response_headers, body, (time.perf_counter() - started) * 1000
+
+
+def demo(lat: float, lon: float, resolution: int, port: int, freshness: float):
+    """Start the API and a caching proxy in front of it, and walk through the cache states"""
+    import h3
+
+    api_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'src.api:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning']
+    )
+    try:
+        for _ in range(120):
+            try:
+                if _fetch(f"{api_url}/health")[0] == 200:
+                    break
+            except OSError:
+                pass
+            time.sleep(1)
+        else:
+            raise RuntimeError("API did not start")
+
+        # The proxy caps freshness so the demo can show revalidation without waiting max-age out
+        proxy, proxy_url = start_proxy(api_url, max_age_cap=freshness)
+        cell = h3.latlng_to_cell(lat, lon, resolution)
+        hour = (datetime.now() + timedelta(hours=3)).strftime('%Y-%m-%dT%H')
+        path = f"/forecast/cell/{cell}?hour={hour}"
+        print(f"GET {path} through a caching proxy (freshness capped at {freshness:.0f}s)\n")
+
+        def step(label: str, url: str, headers: Optional[Dict] = None):
+            status, response_headers, _, ms = _fetch(url, headers)
+            print(f"  {label:<44} {status}  {response_headers.get('X-Cache') or '-':<12}"
+                  f"{ms:8.1f} ms  ETag {(response_headers.get('ETag') or '-')[:14]}")
+            return response_headers
+
+        first = step("first request", proxy_url + path)
+        step("repeat (served by the proxy)", proxy_url + path)
+        step("direct, If-None-Match (API answers 304)", api_url + path, {'If-None-Match': first['ETag']})
+        time.sleep(freshness + 0.5)
+        step("after freshness expires (revalidated)", proxy_url + path)
+
+        # Neighbour features aggregate the surrounding cells, so observe the whole ring
+        observation = {'observations': [
+            {'h3_cell': c, 'congestion_score': 0.95, 'incident_count': 5, 'incident_rolling_mean_6h': 3.0}
+            for c in h3.grid_disk(cell, 2)
+        ]}
+        status = _fetch(f"{api_url}/observations", {'Content-Type': 'application/json'},
+                        json.dumps(observation).encode())[0]
+        print(f"\n  POST /observations for {cell} -> {status}")
+        time.sleep(freshness + 0.5)
+        latest = step("after observations (new ETag)", proxy_url + path)
+        step("repeat", proxy_url + path)
+
+        print(f"\nProxy: {proxy.stats}")
+        print("[OK] ETag changed after new observations" if latest['ETag'] != first['ETag']
+              else "[INFO] ETag unchanged: the model serving this cell does not use neighbour state")
+        proxy.shutdown()
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CongestionAI HTTP cache tools")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    proxy = sub.add_parser('proxy', help="Run a caching reverse proxy in front of the API")
+    proxy.add_argument('--upstream', default="http://127.0.0.1:8000")
+    proxy.add_argument('--host', default="127.0.0.1")
+    proxy.add_argument('--port', type=int, default=8080)
+
+    demo_parser = sub.add_parser('demo', help="Start the API behind the proxy and show hits, 304s and invalidation")
+    demo_parser.add_argument('--lat', type=float, default=37.7749)
+    demo_parser.add_argument('--lon', type=float, default=-122.4194)
+    demo_parser.add_argument('--resolution', type=int, default=8)
+    demo_parser.add_argument('--port', type=int, default=8797)
+    demo_parser.add_argument('--freshness', type=float, default=2.0, help="Seconds the proxy treats responses as fresh")
+    args = parser.parse_args()
+
+    if args.command == 'proxy':
+        server = CachingProxy((args.host, args.port), args.upstream)
+        print(f"Caching proxy on http://{args.host}:{args.port} -> {args.upstream}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+        return
+
+    demo(args.lat, args.lon, args.resolution, args.port, args.freshness)
+
+
+if __name__ == "__main__":
+    main()
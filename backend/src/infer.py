@@ -3,37 +3,106 @@ Inference Engine for CongestionAI
 Real-time prediction and weather integration
 """
 
+import hashlib
 import pickle
+import h3
 import pandas as pd
 import numpy as np
 import shap
+import xgboost as xgb
 import requests
 import os
+import threading
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional
 from dotenv import load_dotenv
 
-from .feature_engineering import FeatureEngineer
+from .calendar_table import CalendarTable
+from .drift import DriftMonitor
+from .feature_engineering import CONGESTION_FACTORS, FeatureEngineer
+from .forecast_cache import ForecastCache
+from .model_router import ModelRouter
+from .spatial import NeighbourIndex
+from .weather import WeatherPrefetcher
 
 load_dotenv()
 
 class CongestionPredictor:
-    def __init__(self, model_path: str = "models/model.pkl"):
-        """Initialize predictor with trained model"""
+    RISK_LEVELS = ['low', 'medium', 'high', 'critical']
+    POINT_CONFIDENCE = 0.85  # rows scored by a model without quantiles (no interval)
+    
+    # Response parts selectable with the fields parameter
+    FIELDS = ('score', 'risk', 'interval', 'h3_cell', 'factors', 'recommendations', 'explanations')
+    DEFAULT_SINGLE_FIELDS = ('score', 'risk', 'interval', 'h3_cell', 'factors', 'recommendations')
+    DEFAULT_BATCH_FIELDS = ('score', 'risk', 'interval')
+    
+    def __init__(
+        self,
+        model_path: str = "models/model.pkl",
+        cache_config: Optional[Dict] = None,
+        weather_config: Optional[Dict] = None,
+        router_config: Optional[Dict] = None,
+        regions: Optional[Dict] = None,
+        feature_engineer: Optional[FeatureEngineer] = None,
+        drift_config: Optional[Dict] = None
+    ):
+        """
+        Initialize predictor with trained model. With an enabled router_config
+        (model_router section), rows inside regions that have their own model
+        are scored by it; this model serves everything else. An enabled
+        drift_config (drift section) sketches the inputs and scores of every
+        model against its training data profile.
+        """
         self.model_path = Path(model_path)
         self.model = None
+        self.model_size = 0
+        self.model_version = None
         self.feature_names = None
+        self.quantiles = []  # quantile levels of a multi-quantile model ([] for point models)
+        self.interval_offset = 0.0  # calibrated widening of the outer quantiles
         self.config = None
         self.explainer = None
-        self.feature_engineer = FeatureEngineer()
+        self.feature_engineer = None
+        self.neighbour_index = None
+        self.neighbour_rings = []
+        self.state_version = 0  # bumped by every observation update
+        self.feature_engineer = feature_engineer
+        self.model_router = None
+        self.data_profile = None  # training data profile saved with the model (see drift.py)
+        self.drift_monitor = None
+        self.drift_config = drift_config if drift_config and drift_config.get('enabled') else None
+        self.drift_monitors = {}  # (name, model version) -> DriftMonitor of each loaded model
+        self._drift_lock = threading.Lock()
         
-        # Weather API configuration
+        # Per-(cell, hour) forecast cache shared by all area requests
+        cache_config = cache_config or {}
+        self.forecast_cache = ForecastCache(
+            max_entries=cache_config.get('max_entries', 200000),
+            ttl=cache_config.get('ttl', 3600)
+        )
+        
+        # Weather API configuration (WEATHER_API_URL points at e.g. the local stub server)
+        weather_config = weather_config or {}
         self.weather_api_key = os.getenv('OPENWEATHER_API_KEY', '')
+        self.weather_api_url = os.getenv('WEATHER_API_URL') or weather_config.get(
+            'api_url', "https://api.openweathermap.org/data/2.5"
+        )
         self.weather_cache = {}
-        self.cache_ttl = 3600  # 1 hour
+        self.cache_ttl = weather_config.get('cache_ttl', 3600)
+        
+        # Hourly forecast grid kept fresh in the background (started by the API)
+        self.weather_prefetcher = None
+        if weather_config.get('prefetch', {}).get('enabled') and (self.weather_api_key or os.getenv('WEATHER_API_URL')):
+            self.weather_prefetcher = WeatherPrefetcher.from_config(
+                weather_config, self.weather_api_url, self.weather_api_key
+            )
         
         self.load_model()
+        self.attach_drift_monitor(self, 'global')
+        
+        if router_config and router_config.get('enabled'):
+            self.load_model_router(router_config, regions or self.config.get('regions') or {})
     
     def load_model(self):
         """Load trained model from disk"""
@@ -43,19 +112,152 @@ class CongestionPredictor:
         print(f"Loading model from {self.model_path}...")
         
         with open(self.model_path, 'rb') as f:
-            model_data = pickle.load(f)
+            model_bytes = f.read()
+        model_data = pickle.loads(model_bytes)
+        
+        # Content hash identifies the model in cache keys
+        self.model_version = hashlib.sha256(model_bytes).hexdigest()[:12]
+        self.model_size = len(model_bytes)
         
         self.model = model_data['model']
         self.feature_names = model_data['feature_names']
+        self.quantiles = model_data.get('quantiles') or []
+        self.interval_offset = model_data.get('interval_offset', 0.0)
         self.config = model_data.get('config', {})
+        self.data_profile = model_data.get('data_profile')
+        
+        # Calendar regions come from the training config (defaults for older models)
+        if self.feature_engineer is None:
+            self.feature_engineer = FeatureEngineer(calendar=CalendarTable.from_config(self.config))
         
         # Skip SHAP explainer initialization (causes hanging with XGBoost 3.x)
         # Will calculate feature importance from model directly if needed
         self.explainer = None
         print("[INFO] SHAP explainer disabled for faster startup")
         
+        self.load_neighbour_index()
+        
         print("[OK] Model loaded successfully!")
     
+    def load_neighbour_index(self):
+        """Load the neighbour index and per-cell state if the model uses neighbour features"""
+        if not any(name.startswith('nbr') for name in self.feature_names):
+            return
+        
+        nbr_config = self.config['features']['neighbour_features']
+        self.neighbour_rings = nbr_config['rings']
+        index_path = Path(self.config['data']['processed_path']) / nbr_config['index_file']
+        
+        if not index_path.exists():
+            print(f"[WARNING] Neighbour index not found at {index_path}; neighbour features default to 0")
+            return
+        
+        self.neighbour_index = NeighbourIndex.load(str(index_path))
+        print(f"[INFO] Neighbour index loaded ({len(self.neighbour_index)} cells)")
+    
+    def load_model_router(self, router_config: Dict, regions: Dict):
+        """Route rows to regional models found under model_router.models_dir"""
+        model_router = ModelRouter(
+            regions, router_config, loader=self.load_regional_model, on_evict=self.detach_drift_monitor
+        )
+        if not len(model_router):
+            print(f"[INFO] No regional models in {model_router.models_dir}; using the global model everywhere")
+            return
+        
+        self.model_router = model_router
+        print(f"[INFO] Regional models available: {', '.join(model_router.region_names)}")
+    
+    def load_regional_model(self, model_path: str) -> 'CongestionPredictor':
+        """Regional predictor sharing this predictor's calendar and feature engineering"""
+        predictor = CongestionPredictor(model_path, feature_engineer=self.feature_engineer)
+        self.attach_drift_monitor(predictor, Path(model_path).parent.name)
+        return predictor
+    
+    def attach_drift_monitor(self, predictor: 'CongestionPredictor', name: str):
+        """Give a loaded model its drift monitor; a replaced model file's monitor is dropped"""
+        if self.drift_config is None:
+            return
+        key = (name, predictor.model_version)
+        with self._drift_lock:
+            for other in [other for other in self.drift_monitors if other[0] == name and other != key]:
+                del self.drift_monitors[other]
+            monitor = self.drift_monitors.get(key)
+            if monitor is None:
+                monitor = DriftMonitor(predictor.feature_names, predictor.data_profile, self.drift_config, name=name)
+                self.drift_monitors[key] = monitor
+        predictor.drift_monitor = monitor
+    
+    def detach_drift_monitor(self, predictor: 'CongestionPredictor'):
+        """Drop the drift monitor of a regional model the router evicted"""
+        with self._drift_lock:
+            for key in [key for key, monitor in self.drift_monitors.items() if monitor is predictor.drift_monitor]:
+                del self.drift_monitors[key]
+    
+    def drift_report(self) -> Optional[Dict]:
+        """Drift reports of the global model and of every regional model that has served rows"""
+        if self.drift_config is None:
+            return None
+        return {
+            'global': self.drift_monitor.report(),
+            'regions': {
+                name: monitor.report() for (name, _), monitor in list(self.drift_monitors.items())
+                if monitor is not self.drift_monitor
+            },
+        }
+    
+    def memory_footprint(self) -> int:
+        """Approximate bytes held by the model and its neighbour index"""
+        footprint = self.model_size
+        if self.neighbour_index is not None:
+            index = self.neighbour_index
+            arrays = list(index.indptr.values()) + list(index.indices.values()) + [index.cells]
+            arrays += [a for a in (index.state, index.state_observed) if a is not None]
+            footprint += sum(a.nbytes for a in arrays)
+        return footprint
+    
+    def update_neighbour_state(self, cells: List[str], values: np.ndarray):
+        """
+        Record live observations (rows ordered like the index's state columns)
+        so neighbour features reflect current conditions, here and in the
+        regional models
+        """
+        if self.neighbour_index is not None and self.neighbour_index.state is not None:
+            self.neighbour_index.update_state(cells, values)
+        if self.model_router is not None:
+            self.model_router.update_state(cells, values)
+        self.state_version += 1
+    
+    def add_neighbour_features(self, features_df: pd.DataFrame, lats, lons) -> pd.DataFrame:
+        """
+        Add neighbourhood-aggregated features from the live per-cell state.
+        One dict lookup per row plus vectorized gathers; no h3 neighbour queries.
+        """
+        if not self.neighbour_rings:
+            return features_df
+        
+        n = len(features_df)
+        if self.neighbour_index is None or self.neighbour_index.state is None:
+            new_features = {
+                name: np.zeros(n) for name in self.feature_names if name.startswith('nbr')
+            }
+        else:
+            resolution = h3.get_resolution(str(self.neighbour_index.cells[0]))
+            cells = [h3.latlng_to_cell(lat, lon, resolution) for lat, lon in zip(lats, lons)]
+            cell_idx = self.neighbour_index.lookup(cells)
+            
+            new_features = {}
+            for k in self.neighbour_rings:
+                for name, values in self.neighbour_index.aggregate_state(cell_idx, k).items():
+                    new_features[f'nbr{k}_{name}'] = values
+        
+        # One 2-D block and one concat instead of per-column inserts
+        block = pd.DataFrame(
+            np.column_stack(list(new_features.values())) if new_features else np.empty((n, 0)),
+            columns=list(new_features.keys()),
+            index=features_df.index
+        )
+        return pd.concat([features_df, block], axis=1)
+    
     def fetch_weather(self, lat: float, lon: float) -> Optional[Dict]:
         """Fetch weather data from OpenWeatherMap API"""
         if not self.weather_api_key:
@@ -70,7 +272,7 @@ class CongestionPredictor:
         
         # Fetch from API
         try:
-            url = f"https://api.openweathermap.org/data/2.5/weather"
+            url = f"{self.weather_api_url}/weather"
             params = {
                 'lat': lat,
                 'lon': lon,
@@ -92,182 +294,538 @@ class CongestionPredictor:
             print(f"Weather API error: {e}")
             return None
     
+    def forecast_weather(self, lats, lons, timestamp) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Per-row weather features from the prefetched forecast grid (None without
+        a prefetcher). Touched cells are marked active; cells the grid does not
+        hold yet are fetched in the background and use default weather until then.
+        """
+        if self.weather_prefetcher is None:
+            return None
+        
+        weather_features, cells = self.weather_prefetcher.grid.gather(lats, lons, timestamp)
+        self.weather_prefetcher.request(cells)
+        return weather_features
+    
+    @property
+    def models_version(self) -> str:
+        """The global model plus the set of regional model files the router loads from"""
+        if self.model_router is None:
+            return self.model_version
+        return f"{self.model_version}:r{self.model_router.version}"
+    
+    @property
+    def cache_version(self) -> str:
+        """Forecast cache key prefix: the models, observation updates and forecast grid behind the scores"""
+        version = self.model_version
+        if self.state_version:
+            version += f":s{self.state_version}"
+        if self.model_router is not None:
+            version += f":r{self.model_router.version}"
+        if self.weather_prefetcher is not None:
+            version += f":w{self.weather_prefetcher.grid.version}"
+        return version
+    
     def predict_single(
         self, 
         lat: float, 
         lon: float, 
         timestamp: datetime,
-        weather_data: Optional[Dict] = None
+        weather_data: Optional[Dict] = None,
+        fields: Optional[Tuple[str, ...]] = None
     ) -> Dict:
         """
-        Predict congestion for a single location and time
+        Predict congestion for a single location and time.
+        fields selects the response parts to compute (default: DEFAULT_SINGLE_FIELDS)
         """
-        # Fetch weather if not provided
-        if weather_data is None and self.weather_api_key:
-            weather_data = self.fetch_weather(lat, lon)
+        fields = fields or self.DEFAULT_SINGLE_FIELDS
         
         # Prepare features
-        features_df = self.feature_engineer.prepare_inference_features(
-            lat, lon, timestamp, weather_data
+        features_df = None
+        if self.needs_features(fields):
+            # Weather: forecast grid (no I/O), else current conditions if an API key is set
+            weather_features = None
+            if weather_data is None:
+                weather_features = self.forecast_weather([lat], [lon], timestamp)
+                if weather_features is not None:
+                    weather_features = {name: values[0].item() for name, values in weather_features.items()}
+                elif self.weather_api_key:
+                    weather_data = self.fetch_weather(lat, lon)
+            
+            features_df = self.feature_engineer.prepare_inference_features(
+                lat, lon, timestamp, weather_data, weather_features=weather_features
+            )
+        
+        parts = self.compute_fields(features_df, [lat], [lon], fields)
+        return self.format_rows([lat], [lon], timestamp, parts, fields)[0]
+    
+    def build_features(
+        self,
+        lats,
+        lons,
+        timestamp,
+        weather_data: Optional[Dict] = None
+    ) -> pd.DataFrame:
+        """
+        Vectorized feature frame for many locations. Neighbour features are added
+        per model when scoring (see model_inputs), since each regional model has
+        its own neighbour index. Without explicit weather_data, weather comes
+        from the forecast grid.
+        """
+        weather_features = self.forecast_weather(lats, lons, timestamp) if weather_data is None else None
+        return self.feature_engineer.prepare_batch_features(
+            lats, lons, timestamp, weather_data, weather_features=weather_features
         )
+    
+    def model_inputs(self, features_df: pd.DataFrame, lats, lons):
+        """
+        Yield (predictor, rows, model input) for each model serving the rows:
+        one group per region with a regional model, plus this model for the
+        rest. rows is None when a single model serves the whole frame.
+        """
+        if self.model_router is None:
+            groups = [(self, None)]
+        else:
+            groups = [
+                (self if code < 0 else self.model_router.get(code), rows)
+                for code, rows in self.model_router.partition(lats, lons)
+            ]
+        
+        for model, rows in groups:
+            if rows is None:
+                X = model.add_neighbour_features(features_df, lats, lons)
+            else:
+                X = model.add_neighbour_features(
+                    features_df.iloc[rows], np.asarray(lats)[rows], np.asarray(lons)[rows]
+                )
+            yield model, rows, X[model.feature_names]
+    
+    def predict_bands(self, X: pd.DataFrame) -> np.ndarray:
+        """
+        (lower, score, upper) per row from one predict call, clipped to 0-1: the
+        outer and middle quantiles of a multi-quantile model, sorted so crossing
+        quantiles cannot invert the interval and widened by the offset calibrated
+        at training time. Point models have NaN bounds.
+        """
+        raw = self.model.predict(X)
+        if raw.ndim == 1:
+            bands = np.full((len(raw), 3), np.nan)
+            bands[:, 1] = raw
+        else:
+            raw = np.sort(raw, axis=1)
+            bands = raw[:, [0, raw.shape[1] // 2, -1]]
+            bands[:, 0] -= self.interval_offset
+            bands[:, 2] += self.interval_offset
+        bands = np.clip(bands, 0, 1)
+        if self.drift_monitor is not None:
+            self.drift_monitor.update(X, bands[:, 1])
+        return bands
+    
+    def score_bands(self, features_df: pd.DataFrame, lats, lons) -> np.ndarray:
+        """predict_bands for a feature frame, each row by the model serving it, in row order"""
+        bands = np.empty((len(features_df), 3))
+        for model, rows, X in self.model_inputs(features_df, lats, lons):
+            if rows is None:
+                return model.predict_bands(X)
+            bands[rows] = model.predict_bands(X)
+        return bands
+    
+    def score_features(self, features_df: pd.DataFrame, lats, lons) -> np.ndarray:
+        """Model scores (clipped to 0-1) for a feature frame, reassembled in row order"""
+        return self.score_bands(features_df, lats, lons)[:, 1]
+    
+    def explain_features(self, features_df: pd.DataFrame, lats, lons, top_k: int = 5) -> List[List[Dict]]:
+        """explain() per row, each row explained by the model that scores it"""
+        explanations = [None] * len(features_df)
+        for model, rows, X in self.model_inputs(features_df, lats, lons):
+            if rows is None:
+                return model.explain(X, top_k)
+            for i, row_explanation in zip(rows.tolist(), model.explain(X, top_k)):
+                explanations[i] = row_explanation
+        return explanations
+    
+    def predict_scores(
+        self,
+        lats,
+        lons,
+        timestamp,
+        weather_data: Optional[Dict] = None
+    ) -> np.ndarray:
+        """
+        Vectorized congestion scores for many locations (clipped to 0-1)
+        """
+        features_df = self.build_features(lats, lons, timestamp, weather_data)
+        return self.score_features(features_df, lats, lons)
+    
+    def predict_intervals(
+        self,
+        lats,
+        lons,
+        timestamp,
+        weather_data: Optional[Dict] = None
+    ) -> np.ndarray:
+        """
+        Vectorized (lower, score, upper) rows for many locations (see predict_bands)
+        """
+        features_df = self.build_features(lats, lons, timestamp, weather_data)
+        return self.score_bands(features_df, lats, lons)
+    
+    @classmethod
+    def parse_fields(cls, fields: Optional[str], default: Tuple[str, ...]) -> Tuple[str, ...]:
+        """
+        Parse a comma-separated fields parameter (None -> default).
+        Raises ValueError for unknown or empty field lists.
+        """
+        if fields is None:
+            return tuple(default)
+        
+        requested = tuple(dict.fromkeys(f.strip() for f in fields.split(',') if f.strip()))
+        unknown = [f for f in requested if f not in cls.FIELDS]
+        if unknown or not requested:
+            raise ValueError(
+                f"Unknown fields: {', '.join(unknown) or '(none given)'}; "
+                f"choose from {', '.join(cls.FIELDS)}"
+            )
+        return requested
+    
+    @staticmethod
+    def needs_features(fields: Tuple[str, ...]) -> bool:
+        """Everything except the H3 cell is derived from the feature frame"""
+        return any(field != 'h3_cell' for field in fields)
+    
+    def compute_fields(
+        self,
+        features_df: Optional[pd.DataFrame],
+        lats,
+        lons,
+        fields: Tuple[str, ...],
+        bands: Optional[np.ndarray] = None
+    ) -> Dict:
+        """
+        Compute the requested response parts for every row, vectorized over the
+        batch. Parts nobody asked for are never computed: the model only runs
+        for score/risk/interval/recommendations (unless bands are passed in,
+        e.g. from the forecast cache), factors only for factors/recommendations.
+        The score and its interval come from the same predict call.
+        """
+        parts = {'confidence': None}
         
-        # Select only model features
-        X = features_df[self.feature_names]
+        if any(f in fields for f in ('score', 'risk', 'interval', 'recommendations')):
+            if bands is None:
+                bands = self.score_bands(features_df, lats, lons)
+            parts['bands'] = bands
+            parts['score'] = bands[:, 1]
+            parts['risk_codes'] = self.get_risk_codes(parts['score'])
+            parts['confidence'] = self.calculate_confidence(bands)
         
-        # Predict
-        congestion_score = float(self.model.predict(X)[0])
-        congestion_score = np.clip(congestion_score, 0, 1)
+        if 'h3_cell' in fields:
+            encode = self.feature_engineer.encode_location
+            parts['h3_cell'] = [encode(lat, lon) for lat, lon in zip(np.asarray(lats).tolist(), np.asarray(lons).tolist())]
         
-        # Calculate SHAP values for explainability
-        top_factors = []
-        if self.explainer is not None:
-            try:
-                shap_values = self.explainer.shap_values(X)
-                
-                # Get top contributing factors
-                feature_contributions = []
-                for i, feature in enumerate(self.feature_names):
-                    feature_contributions.append({
-                        'feature': feature,
-                        'value': float(X.iloc[0][feature]),
-                        'shap_value': float(shap_values[0][i])
-                    })
-                
-                # Sort by absolute SHAP value
-                feature_contributions.sort(key=lambda x: abs(x['shap_value']), reverse=True)
-                top_factors = feature_contributions[:5]
-            except Exception as e:
-                print(f"[WARNING] Could not calculate SHAP values: {e}")
-                # Fallback: use feature importance from model
-                top_factors = []
-        
-        # Determine risk level
-        risk_level = self.get_risk_level(congestion_score)
-        
-        # Get human-readable factors
-        readable_factors = self.feature_engineer.calculate_congestion_factors(
-            features_df.iloc[0].to_dict()
-        )
+        if 'factors' in fields or 'recommendations' in fields:
+            factor_codes, factors = self.feature_engineer.calculate_congestion_factors_batch(features_df)
+            if 'factors' in fields:
+                parts['factors'] = [row_factors[:3] for row_factors in factors]
+            if 'recommendations' in fields:
+                parts['recommendations'] = self.generate_recommendations_batch(
+                    parts['risk_codes'], factor_codes, factors
+                )
         
-        # Generate recommendations
-        recommendations = self.generate_recommendations(congestion_score, risk_level, readable_factors)
+        if 'explanations' in fields:
+            parts['explanations'] = self.explain_features(features_df, lats, lons)
         
-        # Calculate h3_cell for location info
-        h3_cell = self.feature_engineer.encode_location(lat, lon)
+        return parts
+    
+    def format_rows(
+        self,
+        lats,
+        lons,
+        timestamp: datetime,
+        parts: Dict,
+        fields: Tuple[str, ...]
+    ) -> List[Dict]:
+        """Assemble response rows (in the predict_single layout) from computed parts"""
+        timestamps = self.timestamp_strings(timestamp, len(lats))
+        lats = np.asarray(lats, dtype=np.float64).tolist()
+        lons = np.asarray(lons, dtype=np.float64).tolist()
+        scores = np.round(parts['score'].astype(np.float64), 3).tolist() if 'score' in parts else None
+        risk_codes = parts['risk_codes'].tolist() if 'risk_codes' in parts else None
+        if 'interval' in fields:
+            lower, upper = self.nullable(parts['bands'][:, 0]), self.nullable(parts['bands'][:, 2])
+        confidence = parts['confidence']
+        confidence = self.nullable(confidence) if confidence is not None else [None] * len(lats)
         
-        return {
-            'congestion_score': round(congestion_score, 3),
-            'risk_level': risk_level,
-            'timestamp': timestamp.isoformat(),
-            'location': {
-                'latitude': lat,
-                'longitude': lon,
-                'h3_cell': h3_cell
-            },
-            'top_factors': readable_factors[:3],
-            'shap_factors': [
-                {
-                    'feature': f['feature'],
-                    'impact': round(f['shap_value'], 3)
-                }
-                for f in top_factors
-            ],
-            'recommendations': recommendations,
-            'confidence': self.calculate_confidence(X)
-        }
+        rows = []
+        for i, (lat, lon) in enumerate(zip(lats, lons)):
+            row = {}
+            if 'score' in fields:
+                row['congestion_score'] = scores[i]
+            if 'risk' in fields:
+                row['risk_level'] = self.RISK_LEVELS[risk_codes[i]]
+            if 'interval' in fields:
+                row['congestion_lower'] = lower[i]
+                row['congestion_upper'] = upper[i]
+            row['timestamp'] = timestamps[i]
+            row['location'] = {'latitude': lat, 'longitude': lon}
+            if 'h3_cell' in fields:
+                row['location']['h3_cell'] = parts['h3_cell'][i]
+            if 'factors' in fields:
+                row['top_factors'] = parts['factors'][i]
+            if 'explanations' in fields:
+                row['shap_factors'] = parts['explanations'][i]
+            if 'recommendations' in fields:
+                row['recommendations'] = parts['recommendations'][i]
+            row['confidence'] = confidence[i]
+            rows.append(row)
+        return rows
+    
+    @staticmethod
+    def nullable(values: np.ndarray) -> List[Optional[float]]:
+        """Values rounded to 3 decimals as a list, None for NaN (JSON has no NaN)"""
+        return [None if v != v else v for v in np.round(values.astype(np.float64), 3).tolist()]
+    
+    @staticmethod
+    def timestamp_strings(timestamp, n: int) -> List[str]:
+        """ISO string per row for a shared datetime or per-row datetime64 timestamps"""
+        if isinstance(timestamp, datetime):
+            return [timestamp.isoformat()] * n
+        return np.datetime_as_string(np.asarray(timestamp, dtype='datetime64[s]'), unit='s').tolist()
+    
+    def explain(self, X: pd.DataFrame, top_k: int = 5) -> List[List[Dict]]:
+        """
+        Top feature contributions per row. Uses the SHAP explainer when one is
+        loaded, otherwise XGBoost's approximate (Saabas) contributions, which
+        cost about one extra prediction pass.
+        """
+        if self.explainer is not None:
+            contributions = np.asarray(self.explainer.shap_values(X))
+        else:
+            booster = self.model.get_booster()
+            contributions = booster.predict(xgb.DMatrix(X), pred_contribs=True, approx_contribs=True)
+            if contributions.ndim == 3:
+                # Multi-quantile model: explain the median output
+                contributions = contributions[:, contributions.shape[1] // 2]
+            contributions = contributions[:, :-1]
+        
+        top = np.argsort(-np.abs(contributions), axis=1)[:, :top_k]
+        impacts = np.round(np.take_along_axis(contributions, top, axis=1).astype(np.float64), 3).tolist()
+        return [
+            [
+                {'feature': self.feature_names[j], 'impact': impact}
+                for j, impact in zip(row_top, row_impacts)
+            ]
+            for row_top, row_impacts in zip(top.tolist(), impacts)
+        ]
     
     def predict_batch(
         self, 
         locations: List[Tuple[float, float]], 
-        timestamp: datetime
+        timestamp: datetime,
+        fields: Optional[Tuple[str, ...]] = None
     ) -> List[Dict]:
         """
-        Predict congestion for multiple locations (optimized batch processing)
+        Predict congestion for multiple locations (optimized batch processing).
+        Without fields, rows carry only score and risk level.
         """
-        predictions = []
+        if not locations:
+            return []
         
-        # Prepare all features at once
-        all_features = []
-        for lat, lon in locations:
-            try:
-                features_df = self.feature_engineer.prepare_inference_features(
-                    lat, lon, timestamp, None
-                )
-                all_features.append((lat, lon, features_df))
-            except Exception as e:
-                print(f"Error preparing features for ({lat}, {lon}): {e}")
-                predictions.append({
+        lats = np.fromiter((loc[0] for loc in locations), dtype=np.float64, count=len(locations))
+        lons = np.fromiter((loc[1] for loc in locations), dtype=np.float64, count=len(locations))
+        return self.predict_batch_arrays(lats, lons, timestamp, fields)
+    
+    def predict_batch_arrays(
+        self,
+        lats: np.ndarray,
+        lons: np.ndarray,
+        timestamp,
+        fields: Optional[Tuple[str, ...]] = None
+    ) -> List[Dict]:
+        """predict_batch for coordinate arrays; timestamp is shared or one per location"""
+        if len(lats) == 0:
+            return []
+        
+        try:
+            # Build all features and predict in one vectorized pass
+            if fields is None:
+                bands = self.predict_intervals(lats, lons, timestamp)
+                return self.format_batch_rows(lats, lons, bands, timestamp)
+            return self.predict_rows(lats, lons, timestamp, fields)
+        except Exception as e:
+            print(f"Batch prediction error: {e}")
+            return [
+                {
                     'error': str(e),
                     'location': {'latitude': lat, 'longitude': lon}
-                })
-        
-        # Batch predict all at once
-        if all_features:
-            try:
-                # Combine all features into one DataFrame
-                X_batch = pd.concat([f[2][self.feature_names] for f in all_features], ignore_index=True)
-                
-                # Predict all at once
-                scores = self.model.predict(X_batch)
-                scores = np.clip(scores, 0, 1)
-                
-                # Create predictions for each location (optimized for speed)
-                for i, (lat, lon, features_df) in enumerate(all_features):
-                    congestion_score = float(scores[i])
-                    risk_level = self.get_risk_level(congestion_score)
-                    
-                    # Minimal response for batch (skip expensive calculations)
-                    predictions.append({
-                        'congestion_score': round(congestion_score, 3),
-                        'risk_level': risk_level,
-                        'timestamp': timestamp.isoformat(),
-                        'location': {
-                            'latitude': lat,
-                            'longitude': lon,
-                        },
-                        'top_factors': [],  # Skip for batch performance
-                        'recommendations': [],  # Skip for batch performance
-                        'confidence': 0.85
-                    })
-            except Exception as e:
-                print(f"Batch prediction error: {e}")
-                # Fallback to individual predictions
-                for lat, lon, _ in all_features:
-                    predictions.append({
-                        'error': str(e),
-                        'location': {'latitude': lat, 'longitude': lon}
-                    })
-        
-        return predictions
+                }
+                for lat, lon in zip(np.asarray(lats).tolist(), np.asarray(lons).tolist())
+            ]
+    
+    def predict_rows(
+        self,
+        lats: np.ndarray,
+        lons: np.ndarray,
+        timestamp,
+        fields: Tuple[str, ...],
+        weather_data: Optional[Dict] = None
+    ) -> List[Dict]:
+        """Vectorized rows with exactly the requested fields"""
+        features_df = self.build_features(lats, lons, timestamp, weather_data) if self.needs_features(fields) else None
+        parts = self.compute_fields(features_df, lats, lons, fields)
+        return self.format_rows(lats, lons, timestamp, parts, fields)
+    
+    def predict_cells(self, cells: List[str], timestamp: datetime) -> np.ndarray:
+        """Score H3 cells at their centers for the hour containing timestamp"""
+        return self.predict_cell_bands(cells, timestamp)[:, 1]
+    
+    def predict_cell_bands(self, cells: List[str], timestamp: datetime) -> np.ndarray:
+        """
+        (lower, score, upper) for H3 cells at their centers for the hour containing
+        timestamp. Cached (cell, hour) forecasts are reused; only misses are
+        scored, in one batch.
+        """
+        bucket = self.forecast_cache.hour_bucket(timestamp)
+        cache_version = self.cache_version
+        bands, missing = self.forecast_cache.get_many(cache_version, cells, bucket)
+        
+        if len(missing):
+            missing_cells = [cells[i] for i in missing]
+            centers = np.array([h3.cell_to_latlng(cell) for cell in missing_cells])
+            bucket_time = timestamp.replace(minute=0, second=0, microsecond=0)
+            
+            new_bands = self.predict_intervals(centers[:, 0], centers[:, 1], bucket_time)
+            bands[missing] = new_bands
+            self.forecast_cache.put_many(cache_version, missing_cells, bucket, new_bands)
+        
+        return bands
+    
+    def format_batch_rows(
+        self,
+        lats: np.ndarray,
+        lons: np.ndarray,
+        bands: np.ndarray,
+        timestamp: datetime
+    ) -> List[Dict]:
+        """Build minimal batch response rows from vectorized (lower, score, upper) bands"""
+        scores = bands[:, 1]
+        risk_levels = self.get_risk_levels(scores)
+        timestamps = self.timestamp_strings(timestamp, len(risk_levels))
+        lower, upper = self.nullable(bands[:, 0]), self.nullable(bands[:, 2])
+        confidence = self.nullable(self.calculate_confidence(bands))
+        
+        # Minimal response for batch (skip expensive calculations)
+        return [
+            {
+                'congestion_score': round(score, 3),
+                'risk_level': risk_level,
+                'congestion_lower': row_lower,
+                'congestion_upper': row_upper,
+                'timestamp': timestamp_iso,
+                'location': {
+                    'latitude': lat,
+                    'longitude': lon,
+                },
+                'top_factors': [],  # Skip for batch performance
+                'recommendations': [],  # Skip for batch performance
+                'confidence': row_confidence
+            }
+            for lat, lon, score, risk_level, row_lower, row_upper, row_confidence, timestamp_iso in zip(
+                np.asarray(lats).tolist(), np.asarray(lons).tolist(),
+                np.asarray(scores, dtype=np.float64).tolist(), risk_levels,
+                lower, upper, confidence, timestamps
+            )
+        ]
+    
+    def iter_score_chunks(
+        self,
+        lats: np.ndarray,
+        lons: np.ndarray,
+        timestamp: datetime,
+        chunk_size: int = 5000
+    ):
+        """
+        Score locations in fixed-size chunks, yielding (lats, lons, scores) per chunk
+        so callers can stream results without holding the whole response.
+        timestamp is shared, or one per location (sliced with the chunk)
+        """
+        for start in range(0, len(lats), chunk_size):
+            chunk_lats = lats[start:start + chunk_size]
+            chunk_lons = lons[start:start + chunk_size]
+            chunk_time = timestamp if isinstance(timestamp, datetime) else timestamp[start:start + chunk_size]
+            yield chunk_lats, chunk_lons, self.predict_scores(chunk_lats, chunk_lons, chunk_time)
+    
+    def iter_field_chunks(
+        self,
+        lats: np.ndarray,
+        lons: np.ndarray,
+        timestamp: datetime,
+        fields: Tuple[str, ...],
+        chunk_size: int = 5000
+    ):
+        """iter_score_chunks with field projection, yielding (lats, lons, timestamps, parts) per chunk"""
+        for start in range(0, len(lats), chunk_size):
+            chunk_lats = lats[start:start + chunk_size]
+            chunk_lons = lons[start:start + chunk_size]
+            chunk_time = timestamp if isinstance(timestamp, datetime) else timestamp[start:start + chunk_size]
+            features_df = self.build_features(chunk_lats, chunk_lons, chunk_time) if self.needs_features(fields) else None
+            yield chunk_lats, chunk_lons, chunk_time, self.compute_fields(features_df, chunk_lats, chunk_lons, fields)
+    
+    def iter_timeseries(
+        self,
+        lat: float,
+        lon: float,
+        start_time: datetime,
+        hours_ahead: int = 72,
+        fields: Optional[Tuple[str, ...]] = None
+    ):
+        """
+        Yield timeseries predictions (every 3 hours). All time points are
+        scored in one batched pass with per-row timestamps, so each point's
+        interval comes from the same predict call as its score.
+        """
+        fields = fields or self.DEFAULT_SINGLE_FIELDS
+        hours = list(range(0, hours_ahead + 1, 3))
+        timestamps = [start_time + timedelta(hours=hour) for hour in hours]
+        row_times = np.array([t.replace(tzinfo=None) for t in timestamps], dtype='datetime64[us]')
+        lats = np.full(len(hours), lat, dtype=np.float64)
+        lons = np.full(len(hours), lon, dtype=np.float64)
+        
+        # Same weather as predict_single: forecast grid, else current conditions
+        weather_data = None
+        if self.weather_prefetcher is None and self.weather_api_key and self.needs_features(fields):
+            weather_data = self.fetch_weather(lat, lon)
+        
+        rows = self.predict_rows(lats, lons, row_times, fields, weather_data)
+        for hour, timestamp, row in zip(hours, timestamps, rows):
+            row['timestamp'] = timestamp.isoformat()
+            row['hours_ahead'] = hour
+            yield row
     
     def predict_timeseries(
         self,
         lat: float,
         lon: float,
         start_time: datetime,
-        hours_ahead: int = 72
+        hours_ahead: int = 72,
+        fields: Optional[Tuple[str, ...]] = None
     ) -> List[Dict]:
         """
         Predict congestion for multiple time points
         """
-        predictions = []
-        
-        for hour in range(0, hours_ahead + 1, 3):  # Every 3 hours
-            timestamp = start_time + timedelta(hours=hour)
-            pred = self.predict_single(lat, lon, timestamp)
-            pred['hours_ahead'] = hour
-            predictions.append(pred)
-        
-        return predictions
+        return list(self.iter_timeseries(lat, lon, start_time, hours_ahead, fields))
     
-    def get_risk_level(self, congestion_score: float) -> str:
-        """Determine risk level from congestion score"""
-        thresholds = self.config.get('prediction', {}).get('risk_thresholds', {
+    def get_risk_thresholds(self) -> Dict:
+        """Risk thresholds from the model config"""
+        return self.config.get('prediction', {}).get('risk_thresholds', {
             'low': 0.3,
             'medium': 0.6,
             'high': 0.8,
             'critical': 0.9
         })
+    
+    def get_risk_level(self, congestion_score: float) -> str:
+        """Determine risk level from congestion score"""
+        thresholds = self.get_risk_thresholds()
         
         if congestion_score >= thresholds['critical']:
             return 'critical'
@@ -278,11 +836,24 @@ class CongestionPredictor:
         else:
             return 'low'
     
-    def calculate_confidence(self, X: pd.DataFrame) -> float:
-        """Calculate prediction confidence (simplified)"""
-        # In production, use proper uncertainty quantification
-        # For now, return a fixed high confidence
-        return 0.85
+    def get_risk_codes(self, scores: np.ndarray) -> np.ndarray:
+        """Vectorized risk level as an index into RISK_LEVELS"""
+        thresholds = self.get_risk_thresholds()
+        edges = [thresholds['medium'], thresholds['high'], thresholds['critical']]
+        return np.searchsorted(edges, scores, side='right').astype(np.int8)
+    
+    def get_risk_levels(self, scores: np.ndarray) -> List[str]:
+        """Vectorized risk level names"""
+        return [self.RISK_LEVELS[code] for code in self.get_risk_codes(scores)]
+    
+    def calculate_confidence(self, bands: np.ndarray) -> np.ndarray:
+        """
+        Per-row confidence from the prediction interval: 1 - (upper - lower), so
+        a 0.2 wide interval gives 0.8. Rows without an interval (point models)
+        get POINT_CONFIDENCE.
+        """
+        confidence = np.round(np.clip(1 - (bands[:, 2] - bands[:, 0]), 0, 1), 3)
+        return np.where(np.isnan(confidence), self.POINT_CONFIDENCE, confidence)
     
     def generate_recommendations(
         self, 
@@ -291,6 +862,11 @@ class CongestionPredictor:
         factors: List[Dict]
     ) -> List[str]:
         """Generate actionable recommendations"""
+        return self.risk_recommendations(risk_level, factors)
+    
+    @staticmethod
+    def risk_recommendations(risk_level: str, factors: List[Dict]) -> List[str]:
+        """Recommendations for a risk level and its factors (they do not depend on the exact score)"""
         recommendations = []
         
         if risk_level == 'critical':
@@ -318,6 +894,24 @@ class CongestionPredictor:
                 recommendations.append("❄️ Watch for ice - reduce speed significantly")
         
         return recommendations[:5]  # Return top 5
+    
+    def generate_recommendations_batch(
+        self,
+        risk_codes: np.ndarray,
+        factor_codes: np.ndarray,
+        factors: List[List[Dict]]
+    ) -> List[List[str]]:
+        """
+        risk_recommendations for every row. Recommendations depend only on
+        (risk level, factor combination), so each distinct pair is built once.
+        """
+        keys = np.asarray(risk_codes, dtype=np.int64) << len(CONGESTION_FACTORS) | factor_codes
+        unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        by_key = [
+            self.risk_recommendations(self.RISK_LEVELS[int(key >> len(CONGESTION_FACTORS))], factors[row])
+            for key, row in zip(unique_keys.tolist(), first.tolist())
+        ]
+        return [by_key[i] for i in inverse.tolist()]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,671 @@
+"""
+Asynchronous jobs for CongestionAI
+Requests too large for one HTTP response (week-long area cubes, thousands of
+routes) run as jobs: POST /jobs stores the inputs under jobs.dir and returns
+a job ID. A dispatcher thread hands the job's chunks to a process pool, and
+each chunk is written as its own part file (Parquet, as in src/bulk_score.py).
+GET /jobs/{id} reports progress; the results are paged or streamed from the
+parts once the job is done. job.json records the finished chunks, so after a
+restart queued and running jobs carry on where they stopped.
+"""
+
+import atexit
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import secrets
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .bulk_score import PARQUET_AVAILABLE, add_score_columns, model_files, write_part
+from .orchestrator import file_hash
+
+KINDS = ('forecast', 'timeseries', 'route')
+ACTIVE = ('queued', 'running')
+JOB_FILE = 'job.json'
+INPUTS_FILE = 'inputs.npz'
+
+# Straight-line route jobs (no road graph) score waypoints as /route_simulate does
+ROUTE_WAYPOINTS = 10
+ROUTE_ASSUMED_KM = 20
+ROUTE_ASSUMED_KMH = 60
+
+# Set in each worker process by init_worker
+_predictor = None
+_config = None
+_road_router = None
+_router_checked = False
+_inputs = {}
+
+
+class JobError(ValueError):
+    """Invalid job request"""
+
+
+class TooManyJobsError(Exception):
+    """A tenant already has as many jobs waiting as it may"""
+
+
+# ----------------------------------------------------------------------
+# Inputs (built in the API process, read by the workers)
+# ----------------------------------------------------------------------
+
+def time_range(start: datetime, hours_ahead: int, step_hours: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(times, hours ahead) every step_hours from start up to start + hours_ahead"""
+    hours = np.arange(0, hours_ahead + 1, step_hours, dtype=np.int64)
+    times = np.datetime64(start.replace(tzinfo=None), 's') + hours.astype('timedelta64[h]')
+    return times, hours
+
+
+def forecast_inputs(
+    lats: np.ndarray,
+    lons: np.ndarray,
+    cells: Optional[List[str]] = None,
+    times: Optional[np.ndarray] = None,
+    hours_ahead: Optional[np.ndarray] = None,
+    timestamps: Optional[np.ndarray] = None
+) -> Tuple[Dict[str, np.ndarray], int]:
+    """
+    (arrays, rows) of a forecast or timeseries job: every location at every
+    time in times (time-major, so a chunk covers few hours), or each
+    location at its own timestamp
+    """
+    inputs = {
+        'latitude': np.asarray(lats, dtype=np.float64),
+        'longitude': np.asarray(lons, dtype=np.float64),
+    }
+    if cells is not None:
+        inputs['h3_cell'] = np.asarray(cells, dtype='U15')
+    if timestamps is not None:
+        inputs['timestamps'] = np.asarray(timestamps, dtype='M8[s]')
+        return inputs, len(lats)
+    inputs['times'] = np.asarray(times, dtype='M8[s]')
+    if hours_ahead is not None:
+        inputs['hours_ahead'] = np.asarray(hours_ahead, dtype=np.int64)
+    return inputs, len(lats) * len(times)
+
+
+def route_inputs(routes: List[Dict], default_departure: datetime) -> Tuple[Dict[str, np.ndarray], int]:
+    """(arrays, rows) of a route job: one row per route"""
+    departures = [
+        datetime.fromisoformat(route['departure_time'].replace('Z', '+00:00')).replace(tzinfo=None)
+        if route.get('departure_time') else default_departure
+        for route in routes
+    ]
+    inputs = {
+        name: np.array([route[name] for route in routes], dtype=np.float64)
+        for name in ('start_lat', 'start_lon', 'end_lat', 'end_lon')
+    }
+    inputs['departure'] = np.array(departures, dtype='M8[s]')
+    return inputs, len(routes)
+
+
+# ----------------------------------------------------------------------
+# Worker side
+# ----------------------------------------------------------------------
+
+def init_worker(config: Dict, threads: int):
+    """Load the predictor once per worker process"""
+    global _predictor, _config
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    threading.Thread(target=exit_with_parent, args=(os.getppid(),), daemon=True).start()
+
+    from .infer import CongestionPredictor
+
+    _predictor = CongestionPredictor(
+        config['model']['save_path'],
+        router_config=config.get('model_router'),
+        regions=config.get('regions')
+    )
+    _config = config
+
+
+def exit_with_parent(parent: int):
+    """A killed API process cannot stop its workers; they notice and exit"""
+    while os.getppid() == parent:
+        time.sleep(5)
+    os._exit(0)
+
+
+def get_road_router():
+    """Road-graph router of the worker (None without a graph), loaded by the first route chunk"""
+    global _road_router, _router_checked
+    if not _router_checked:
+        from .routing import load_router
+
+        _road_router = load_router(_predictor, _config)
+        _router_checked = True
+    return _road_router
+
+
+def load_inputs(job_dir: str) -> Dict[str, np.ndarray]:
+    """A job's input arrays, kept for the worker's next chunks of the same job"""
+    if job_dir not in _inputs:
+        if len(_inputs) >= 4:
+            _inputs.pop(next(iter(_inputs)))
+        with np.load(Path(job_dir) / INPUTS_FILE, allow_pickle=False) as data:
+            _inputs[job_dir] = {name: data[name] for name in data.files}
+    return _inputs[job_dir]
+
+
+def part_name(index: int, output_format: str) -> str:
+    return f"part-{index:05d}.{output_format}"
+
+
+def run_chunk(job_dir: str, kind: str, index: int, start: int, stop: int,
+              output_format: str) -> Tuple[int, int, float, str]:
+    """Score rows [start, stop) of a job and write them as one part; returns (index, rows, seconds, model version)"""
+    started = time.perf_counter()
+    inputs = load_inputs(job_dir)
+    result = route_rows(inputs, start, stop) if kind == 'route' else forecast_rows(inputs, start, stop)
+    write_part(result, Path(job_dir) / part_name(index, output_format), output_format)
+    return index, len(result), time.perf_counter() - started, _predictor.models_version
+
+
+def forecast_rows(inputs: Dict[str, np.ndarray], start: int, stop: int) -> pd.DataFrame:
+    rows = np.arange(start, stop)
+    if 'times' in inputs:
+        n = len(inputs['latitude'])
+        locations, time_index = rows % n, rows // n
+        times = inputs['times'][time_index]
+    else:
+        locations, time_index = rows, None
+        times = inputs['timestamps'][rows]
+    lats, lons = inputs['latitude'][locations], inputs['longitude'][locations]
+
+    result = pd.DataFrame({'latitude': lats, 'longitude': lons})
+    if 'h3_cell' in inputs:
+        result['h3_cell'] = inputs['h3_cell'][locations]
+    result['timestamp'] = times
+    if 'hours_ahead' in inputs:
+        result['hours_ahead'] = inputs['hours_ahead'][time_index].astype(np.int16)
+
+    bands = _predictor.predict_intervals(lats, lons, times)
+    return add_score_columns(result, _predictor, bands)
+
+
+def route_rows(inputs: Dict[str, np.ndarray], start: int, stop: int) -> pd.DataFrame:
+    """
+    Travel time and congestion per route: the fastest road-graph path, or
+    waypoints on a straight line without a graph or for routes outside it
+    (as /route_simulate)
+    """
+    window = slice(start, stop)
+    start_lat, start_lon = inputs['start_lat'][window], inputs['start_lon'][window]
+    end_lat, end_lon = inputs['end_lat'][window], inputs['end_lon'][window]
+    departures = inputs['departure'][window]
+    n = stop - start
+
+    result = pd.DataFrame({
+        'route': np.arange(start, stop, dtype=np.int64),
+        'start_lat': start_lat,
+        'start_lon': start_lon,
+        'end_lat': end_lat,
+        'end_lon': end_lon,
+        'departure': departures,
+    })
+    stats = np.full((n, 5), np.nan)  # distance km, duration min, free-flow min, average, max
+
+    routing = np.full(n, 'straight_line', dtype=object)
+    road_router = get_road_router()
+    covered = np.zeros(n, dtype=bool)
+    if road_router is not None:
+        covered = road_router.covers(start_lat, start_lon, end_lat, end_lon)
+        for i in np.flatnonzero(covered).tolist():
+            route = road_router.route(
+                start_lat[i], start_lon[i], end_lat[i], end_lon[i], pd.Timestamp(departures[i]).to_pydatetime()
+            )
+            routing[i] = 'no_route'
+            if route is not None:
+                stats[i] = [
+                    route['distance_m'] / 1000, route['duration_s'] / 60, route['freeflow_s'] / 60,
+                    route['average_congestion'], route['max_congestion'],
+                ]
+                routing[i] = 'road_graph'
+
+    straight = ~covered
+    if straight.any():
+        t = np.linspace(0, 1, ROUTE_WAYPOINTS + 1)
+        lats = start_lat[straight, None] + t * (end_lat - start_lat)[straight, None]
+        lons = start_lon[straight, None] + t * (end_lon - start_lon)[straight, None]
+        offsets = np.round(t * ROUTE_ASSUMED_KM / ROUTE_ASSUMED_KMH * 3600).astype('timedelta64[s]')
+        times = departures[straight, None] + offsets
+        scores = _predictor.predict_intervals(lats.ravel(), lons.ravel(), times.ravel())[:, 1].reshape(len(lats), -1)
+        stats[straight, 3], stats[straight, 4] = scores.mean(axis=1), scores.max(axis=1)
+
+    for column, name in enumerate(('distance_km', 'duration_minutes', 'freeflow_minutes',
+                                   'average_congestion', 'max_congestion')):
+        result[name] = stats[:, column].astype(np.float32)
+    average = np.nan_to_num(stats[:, 3])
+    result['risk_level'] = pd.Categorical.from_codes(
+        _predictor.get_risk_codes(average), categories=_predictor.RISK_LEVELS
+    )
+    result['routing'] = routing
+    return result
+
+
+# ----------------------------------------------------------------------
+# Manager (API process)
+# ----------------------------------------------------------------------
+
+class JobManager:
+    def __init__(self, config: Dict):
+        """
+        Settings from the jobs config section. Jobs left queued or running by
+        an earlier process are picked up again, keeping their finished chunks.
+        """
+        jobs_config = config.get('jobs') or {}
+        self.enabled = jobs_config.get('enabled', True)
+        self.dir = Path(jobs_config.get('dir', 'jobs'))
+        self.workers = jobs_config.get('workers') or os.cpu_count() or 1
+        self.threads_per_worker = jobs_config.get('threads_per_worker', 1)
+        self.chunk_rows = jobs_config.get('chunk_rows', 50000)
+        self.route_chunk = jobs_config.get('route_chunk', 100)
+        self.max_rows = jobs_config.get('max_rows', 50000000)
+        self.max_running = jobs_config.get('max_running_per_tenant', 2)
+        self.max_queued = jobs_config.get('max_queued_per_tenant', 20)
+        self.output_format = jobs_config.get('output_format', 'parquet')
+        if self.output_format == 'parquet' and not PARQUET_AVAILABLE:
+            print("[WARNING] pyarrow is not installed; job results are written as CSV")
+            self.output_format = 'csv'
+
+        # Workers load the model the API serves (MODEL_PATH)
+        self.worker_config = {**config, 'model': {**config['model'], 'save_path': os.getenv('MODEL_PATH', 'models/model.pkl')}}
+        self.models = None
+        self.jobs: Dict[str, Dict] = {}
+        self._todo: Dict[str, List[int]] = {}
+        self._in_flight: Dict[str, set] = {}
+        self._rates: Dict[str, Tuple[float, int]] = {}
+        self._pending = {}
+        self._pool = None
+        self._thread = None
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+
+        if self.enabled:
+            self._recover()
+
+    def models_signature(self) -> str:
+        """Identifies the models the workers load; parts scored by other models are not reused"""
+        if self.models is None:
+            signature = hashlib.sha256()
+            for path in model_files(self.worker_config):
+                signature.update(file_hash(path).encode())
+            self.models = signature.hexdigest()[:16]
+        return self.models
+
+    def _recover(self):
+        if not self.dir.exists():
+            return
+        resumed = 0
+        for path in sorted(self.dir.glob(f'*/{JOB_FILE}')):
+            try:
+                with open(path, 'r') as f:
+                    job = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[WARNING] Skipping unreadable job file {path} ({e})")
+                continue
+            self.jobs[job['id']] = job
+            if job['status'] not in ACTIVE:
+                continue
+
+            job_dir = path.parent
+            if job['models'] != self.models_signature():
+                print(f"[WARNING] Job {job['id']}: the model changed since it started; scoring it again")
+                for part in job['completed']:
+                    (job_dir / part_name(int(part), job['output_format'])).unlink(missing_ok=True)
+                job['completed'] = {}
+                job['models'] = self.models_signature()
+            job['completed'] = {
+                part: rows for part, rows in job['completed'].items()
+                if (job_dir / part_name(int(part), job['output_format'])).exists()
+            }
+            job['status'] = 'queued'
+            self._save(job)
+            resumed += 1
+        if resumed:
+            print(f"[INFO] Resuming {resumed} unfinished job(s) from {self.dir}")
+            self._start()
+
+    def job_dir(self, job: Dict) -> Path:
+        return self.dir / job['id']
+
+    def _save(self, job: Dict):
+        """Atomic rewrite of job.json (the restart point)"""
+        job_dir = self.job_dir(job)
+        tmp_path = job_dir / f".{JOB_FILE}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f, indent=2)
+        os.replace(tmp_path, job_dir / JOB_FILE)
+
+    def submit(self, kind: str, inputs: Dict[str, np.ndarray], rows: int, tenant: str,
+               request: Optional[Dict] = None) -> Dict:
+        """Store a job's inputs and queue it; returns its status"""
+        if kind not in KINDS:
+            raise JobError(f"kind must be one of {', '.join(KINDS)}")
+        if rows == 0:
+            raise JobError("The job has no rows")
+        if rows > self.max_rows:
+            raise JobError(f"The job has {rows:,} rows; at most {self.max_rows:,} per job")
+
+        with self._lock:
+            queued = sum(1 for job in self.jobs.values() if job['tenant'] == tenant and job['status'] == 'queued')
+            if queued >= self.max_queued:
+                raise TooManyJobsError(
+                    f"Tenant '{tenant}' already has {queued} queued jobs; wait for them or cancel some"
+                )
+
+            chunk_rows = self.route_chunk if kind == 'route' else self.chunk_rows
+            job = {
+                'id': secrets.token_hex(8),
+                'kind': kind,
+                'tenant': tenant,
+                'status': 'queued',
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'started_at': None,
+                'finished_at': None,
+                'rows': int(rows),
+                'chunk_rows': chunk_rows,
+                'chunks': math.ceil(rows / chunk_rows),
+                'output_format': self.output_format,
+                'completed': {},
+                'error': None,
+                'request': request or {},
+                'models': self.models_signature(),
+                'model_version': None,
+            }
+            job_dir = self.job_dir(job)
+            job_dir.mkdir(parents=True)
+            np.savez(job_dir / INPUTS_FILE, **inputs)
+            self._save(job)
+            self.jobs[job['id']] = job
+
+        self._start()
+        self._wake.set()
+        return self.status(job)
+
+    def get(self, job_id: str, tenant: str) -> Optional[Dict]:
+        """A tenant's job (None for unknown IDs and other tenants' jobs)"""
+        job = self.jobs.get(job_id)
+        return job if job is not None and job['tenant'] == tenant else None
+
+    def list_jobs(self, tenant: str) -> List[Dict]:
+        jobs = sorted(
+            (job for job in self.jobs.values() if job['tenant'] == tenant),
+            key=lambda job: job['created_at'], reverse=True
+        )
+        return [self.status(job) for job in jobs]
+
+    def cancel(self, job: Dict) -> Dict:
+        """Stop handing out a job's chunks; chunks already running finish and are kept"""
+        with self._lock:
+            if job['status'] in ACTIVE:
+                job['status'] = 'cancelled'
+                job['finished_at'] = datetime.now().isoformat(timespec='seconds')
+                self._todo.pop(job['id'], None)
+                for future, (job_id, _) in list(self._pending.items()):
+                    if job_id == job['id']:
+                        future.cancel()
+                self._save(job)
+        return self.status(job)
+
+    def resume(self, job: Dict) -> Dict:
+        """Queue a failed or cancelled job again; its finished chunks are kept"""
+        with self._lock:
+            if job['status'] in ('failed', 'cancelled'):
+                job['status'] = 'queued'
+                job['error'] = None
+                job['finished_at'] = None
+                self._save(job)
+        self._start()
+        self._wake.set()
+        return self.status(job)
+
+    def delete(self, job: Dict):
+        with self._lock:
+            self.cancel(job)
+            self.jobs.pop(job['id'], None)
+            self._in_flight.pop(job['id'], None)
+            shutil.rmtree(self.job_dir(job), ignore_errors=True)
+
+    # ------------------------------------------------------------------
+    # Dispatcher
+    # ------------------------------------------------------------------
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="job-dispatcher", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._schedule()
+                pending = list(self._pending)
+            if pending:
+                done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                with self._lock:
+                    for future in done:
+                        self._collect(future)
+            else:
+                self._wake.wait(timeout=1.0)
+                self._wake.clear()
+
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: the API process runs threads, which forked workers would inherit half-copied
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=(self.worker_config, self.threads_per_worker)
+            )
+        return self._pool
+
+    def close(self):
+        """Stop the workers after their current chunks (waiting chunks run again on restart)"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    def _schedule(self):
+        """Start queued jobs within the tenant limits, then keep two chunks per worker in flight"""
+        running = [job for job in self.jobs.values() if job['status'] == 'running']
+        per_tenant = {}
+        for job in running:
+            per_tenant[job['tenant']] = per_tenant.get(job['tenant'], 0) + 1
+        for job in sorted(self.jobs.values(), key=lambda job: job['created_at']):
+            if job['status'] != 'queued' or per_tenant.get(job['tenant'], 0) >= self.max_running:
+                continue
+            job['status'] = 'running'
+            job['started_at'] = job['started_at'] or datetime.now().isoformat(timespec='seconds')
+            # Chunks still running from before a cancel are collected as usual, not started twice
+            in_flight = self._in_flight.get(job['id'], set())
+            self._todo[job['id']] = [
+                i for i in range(job['chunks']) if str(i) not in job['completed'] and i not in in_flight
+            ]
+            self._rates[job['id']] = (time.monotonic(), self.rows_done(job))
+            per_tenant[job['tenant']] = per_tenant.get(job['tenant'], 0) + 1
+            running.append(job)
+            self._save(job)
+
+        # Round-robin over running jobs, so a long job does not hold back later ones
+        while len(self._pending) < 2 * self.workers:
+            submitted = False
+            for job in running:
+                todo = self._todo.get(job['id'])
+                if job['status'] != 'running' or not todo or len(self._pending) >= 2 * self.workers:
+                    continue
+                index = todo.pop(0)
+                start = index * job['chunk_rows']
+                stop = min(start + job['chunk_rows'], job['rows'])
+                try:
+                    future = self.pool().submit(
+                        run_chunk, str(self.job_dir(job)), job['kind'], index, start, stop, job['output_format']
+                    )
+                except Exception as e:
+                    self._fail(job, f"Chunk {index} could not be started: {e}")
+                    self._reset_pool()
+                    continue
+                self._pending[future] = (job['id'], index)
+                self._in_flight.setdefault(job['id'], set()).add(index)
+                submitted = True
+            if not submitted:
+                break
+
+        for job in running:
+            self._finish_if_done(job)
+
+    def _collect(self, future):
+        job_id, index = self._pending.pop(future)
+        self._in_flight.get(job_id, set()).discard(index)
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        try:
+            _, rows, _, model_version = future.result()
+        except CancelledError:
+            # Cancelled before it started; a resume in the meantime left it out of the queue
+            if job['status'] == 'running':
+                self._todo.setdefault(job_id, []).append(index)
+            return
+        except BrokenProcessPool as e:
+            # A worker died (e.g. out of memory): every chunk in flight is lost
+            self._fail(job, f"Chunk {index}: a worker process died ({e})")
+            self._reset_pool()
+            return
+        except Exception as e:
+            self._fail(job, f"Chunk {index}: {e}")
+            return
+
+        job['completed'][str(index)] = rows
+        job['model_version'] = job['model_version'] or model_version
+        self._finish_if_done(job)
+        self._save(job)
+
+    def _fail(self, job: Dict, message: str):
+        """Stop a running job; POST /jobs/{id}/resume continues it from its finished chunks"""
+        if job['status'] == 'running':
+            print(f"[WARNING] Job {job['id']} failed: {message}")
+            job['status'] = 'failed'
+            job['error'] = message
+            job['finished_at'] = datetime.now().isoformat(timespec='seconds')
+            self._todo.pop(job['id'], None)
+            self._save(job)
+
+    def _reset_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _finish_if_done(self, job: Dict):
+        if job['status'] == 'running' and len(job['completed']) == job['chunks']:
+            job['status'] = 'done'
+            job['finished_at'] = datetime.now().isoformat(timespec='seconds')
+            self._todo.pop(job['id'], None)
+            self._save(job)
+
+    # ------------------------------------------------------------------
+    # Progress and results
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def rows_done(job: Dict) -> int:
+        return sum(job['completed'].values())
+
+    def status(self, job: Dict) -> Dict:
+        rows_done = self.rows_done(job)
+        status = {
+            'id': job['id'],
+            'kind': job['kind'],
+            'status': job['status'],
+            'created_at': job['created_at'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at'],
+            'rows': job['rows'],
+            'rows_done': rows_done,
+            'chunks': job['chunks'],
+            'chunks_done': len(job['completed']),
+            'progress': round(rows_done / job['rows'], 4) if job['rows'] else 1.0,
+            'rows_per_second': None,
+            'eta_seconds': None,
+            'model_version': job['model_version'],
+            'output_format': job['output_format'],
+            'error': job['error'],
+            'request': job['request'],
+        }
+        if job['status'] == 'running' and job['id'] in self._rates:
+            since, rows_then = self._rates[job['id']]
+            elapsed = time.monotonic() - since
+            if elapsed > 0 and rows_done > rows_then:
+                rate = (rows_done - rows_then) / elapsed
+                status['rows_per_second'] = round(rate)
+                status['eta_seconds'] = round((job['rows'] - rows_done) / rate, 1)
+        return status
+
+    def part_path(self, job: Dict, index: int) -> Path:
+        return self.job_dir(job) / part_name(index, job['output_format'])
+
+    def iter_results(self, job: Dict, offset: int = 0, limit: Optional[int] = None) -> Iterator[pd.DataFrame]:
+        """Result rows [offset, offset + limit) of a finished job, one frame per part read"""
+        remaining = job['rows'] - offset if limit is None else min(limit, job['rows'] - offset)
+        position = 0
+        for index in range(job['chunks']):
+            rows = job['completed'][str(index)]
+            if remaining <= 0:
+                break
+            if position + rows > offset:
+                path = self.part_path(job, index)
+                frame = pd.read_parquet(path) if job['output_format'] == 'parquet' else pd.read_csv(path)
+                skip = max(0, offset - position)
+                frame = frame.iloc[skip:skip + remaining]
+                remaining -= len(frame)
+                yield frame
+            position += rows
+
+    def read_results(self, job: Dict, offset: int, limit: int) -> pd.DataFrame:
+        """One page of result rows"""
+        frames = list(self.iter_results(job, offset, limit))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def stats(self) -> Dict:
+        counts = {}
+        for job in self.jobs.values():
+            counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {
+            'workers': self.workers,
+            'chunks_in_flight': len(self._pending),
+            'jobs': counts,
+        }
+
+
+def columnar_page(frame: pd.DataFrame, risk_levels: List[str]) -> Dict:
+    """Result rows as columns: numbers stay arrays, times become ISO strings, risk levels become codes"""
+    data = {}
+    for name in frame.columns:
+        values = frame[name]
+        if name == 'risk_level':
+            data['risk_code'] = pd.Categorical(values, categories=risk_levels).codes.astype(np.int8)
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            data[name] = np.datetime_as_string(values.to_numpy(), unit='s').tolist()
+        elif values.dtype == np.float32:
+            # Scores, minutes and distances at the precision of the other endpoints
+            data[name] = np.round(values.to_numpy(), 3)
+        elif pd.api.types.is_numeric_dtype(values):
+            data[name] = np.ascontiguousarray(values.to_numpy())
+        else:
+            data[name] = values.astype(str).tolist()
+    return data
@@ -0,0 +1,417 @@
+"""
+Load Testing Harness for CongestionAI
+Drives the FastAPI app in-process (ASGI) or a running uvicorn server with a
+configurable endpoint mix and reports throughput, error rate and latency percentiles,
+plus how many requests admission control answered degraded or rejected
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+import yaml
+
+
+# Dashboard areas the frontend offers (see frontend/pages/index.js)
+AREA_CENTERS = [
+    (37.7749, -122.4194),  # San Francisco Downtown
+    (37.8044, -122.2712),  # Oakland Downtown
+    (37.3382, -121.8863),  # San Jose Downtown
+    (37.8715, -122.2730),  # Berkeley
+    (37.4419, -122.1430),  # Palo Alto
+]
+
+
+class LoadTester:
+    ENDPOINTS = ['forecast', 'batch_forecast', 'timeseries', 'route_simulate', 'insights']
+
+    def __init__(
+        self,
+        config_path: str = "configs/params.yaml",
+        base_url: Optional[str] = None,
+        mix: Optional[Dict[str, float]] = None,
+        app=None
+    ):
+        """Initialize load tester; without base_url the app is driven in-process"""
+        with open(config_path, 'r') as f:
+            self.config = yaml.safe_load(f)
+
+        self.load_config = self.config['loadtest']
+        self.base_url = base_url
+        self.app = app
+        self.mix = mix or self.load_config['mix']
+        self.timeout = self.load_config['timeout']
+        self.rng = random.Random(self.load_config.get('seed', 42))
+
+        unknown = set(self.mix) - set(self.ENDPOINTS)
+        if unknown:
+            raise ValueError(f"Unknown endpoints in mix: {sorted(unknown)}")
+
+        self._names = [name for name, weight in self.mix.items() if weight > 0]
+        self._weights = [self.mix[name] for name in self._names]
+
+    def client(self) -> httpx.AsyncClient:
+        """HTTP client bound to either the in-process app or a live server"""
+        if self.base_url:
+            return httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout)
+
+        if self.app is None:
+            from .api import app
+            self.app = app
+        return httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=self.app),
+            base_url="http://loadtest",
+            timeout=self.timeout
+        )
+
+    # ------------------------------------------------------------------
+    # Request generation
+    # ------------------------------------------------------------------
+
+    def location_grid(self, center_lat: float, center_lon: float, grid_size: int, spacing: float) -> List[Dict]:
+        """Python port of the frontend's generateLocationGrid"""
+        locations = [{'latitude': center_lat, 'longitude': center_lon}]
+        max_radius = (grid_size / 2) * spacing
+
+        for _ in range(grid_size * grid_size - 1):
+            r = math.sqrt(self.rng.random()) * max_radius
+            theta = self.rng.random() * 2 * math.pi
+            radius_jitter = (self.rng.random() - 0.5) * spacing * 0.3
+            angle_jitter = (self.rng.random() - 0.5) * 0.4
+
+            locations.append({
+                'latitude': center_lat + (r + radius_jitter) * math.cos(theta + angle_jitter),
+                'longitude': center_lon + (r + radius_jitter) * math.sin(theta + angle_jitter),
+            })
+
+        return locations
+
+    def build_request(self, endpoint: str):
+        """Return (method, path, json body) for one request of the given endpoint"""
+        lat, lon = self.rng.choice(AREA_CENTERS)
+        hours_ahead = self.rng.choice([0, 3, 6, 12, 24, 48])
+        timestamp = (datetime.now() + timedelta(hours=hours_ahead)).isoformat()
+
+        if endpoint == 'forecast':
+            return 'POST', '/forecast', {
+                'latitude': lat + self.rng.uniform(-0.02, 0.02),
+                'longitude': lon + self.rng.uniform(-0.02, 0.02),
+                'timestamp': timestamp
+            }
+
+        if endpoint == 'batch_forecast':
+            # Same two grid shapes the dashboard uses ('roads' and 'grid' views)
+            grid_size, spacing = self.rng.choice([(10, 0.006), (8, 0.02)])
+            return 'POST', '/batch_forecast', {
+                'locations': self.location_grid(lat, lon, grid_size, spacing),
+                'timestamp': timestamp
+            }
+
+        if endpoint == 'timeseries':
+            return 'POST', '/timeseries', {
+                'latitude': lat,
+                'longitude': lon,
+                'start_time': timestamp,
+                'hours_ahead': self.rng.choice([24, 72, 168])
+            }
+
+        if endpoint == 'route_simulate':
+            end_lat, end_lon = self.rng.choice(AREA_CENTERS)
+            return 'POST', '/route_simulate', {
+                'start_lat': lat, 'start_lon': lon,
+                'end_lat': end_lat, 'end_lon': end_lon,
+                'departure_time': timestamp
+            }
+
+        return 'GET', '/insights', None
+
+    def pick_endpoint(self) -> str:
+        return self.rng.choices(self._names, weights=self._weights)[0]
+
+    # ------------------------------------------------------------------
+    # Load generation
+    # ------------------------------------------------------------------
+
+    async def warmup(self, client: httpx.AsyncClient):
+        """Make sure the model is loaded before anything is timed"""
+        await client.get('/health')
+
+    async def _send(self, client: httpx.AsyncClient, samples: List, endpoint: str, scheduled: float):
+        """
+        Send one request; latency is measured from its scheduled start. Each
+        sample records whether it succeeded and how it was served: 'full',
+        'degraded' (lookup-table fallback) or 'rejected' (503 from load shedding).
+        """
+        method, path, body = self.build_request(endpoint)
+        ok, outcome = False, 'error'
+        try:
+            response = await client.request(method, path, json=body)
+            ok = response.status_code < 400
+            if response.status_code == 503:
+                outcome = 'rejected'
+            elif ok:
+                outcome = 'degraded' if response.headers.get('x-forecast-source') == 'lookup-table' else 'full'
+        except httpx.HTTPError:
+            ok = False
+        samples.append((endpoint, time.perf_counter() - scheduled, ok, outcome))
+
+    async def run_closed(self, concurrency: int, duration: float) -> Dict:
+        """Fixed concurrency: each worker issues its next request when the previous completes"""
+        samples = []
+
+        async with self.client() as client:
+            await self.warmup(client)
+            deadline = time.perf_counter() + duration
+
+            async def worker():
+                while time.perf_counter() < deadline:
+                    await self._send(client, samples, self.pick_endpoint(), time.perf_counter())
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+
+        return self.summarize(samples, elapsed, {'mode': 'closed', 'concurrency': concurrency})
+
+    async def run_open(self, rate: float, duration: float) -> Dict:
+        """
+        Open loop: Poisson arrivals at a fixed rate regardless of response times,
+        so queueing delay is included in the reported latency
+        """
+        samples = []
+        tasks = []
+
+        async with self.client() as client:
+            await self.warmup(client)
+
+            started = time.perf_counter()
+            next_arrival = started
+            while next_arrival < started + duration:
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(
+                    self._send(client, samples, self.pick_endpoint(), next_arrival)
+                ))
+                next_arrival += self.rng.expovariate(rate)
+
+            await asyncio.gather(*tasks)
+            elapsed = max(time.perf_counter() - started, duration)
+
+        return self.summarize(samples, elapsed, {'mode': 'open', 'rate': rate})
+
+    # ------------------------------------------------------------------
+    # Reporting
+    # ------------------------------------------------------------------
+
+    def _stats(self, rows: List, elapsed: float) -> Dict:
+        count = len(rows)
+        errors = sum(1 for row in rows if not row[2])
+        degraded = sum(1 for row in rows if row[3] == 'degraded')
+        rejected = sum(1 for row in rows if row[3] == 'rejected')
+        lat_ms = np.array([row[1] for row in rows]) * 1000 if count else np.zeros(1)
+        return {
+            'requests': count,
+            'errors': errors,
+            'error_rate': round(errors / count, 4) if count else 0.0,
+            'degraded_rate': round(degraded / count, 4) if count else 0.0,
+            'rejected_rate': round(rejected / count, 4) if count else 0.0,
+            'throughput_rps': round(count / elapsed, 3) if elapsed > 0 else 0.0,
+            'p50_ms': round(float(np.percentile(lat_ms, 50)), 3),
+            'p95_ms': round(float(np.percentile(lat_ms, 95)), 3),
+            'p99_ms': round(float(np.percentile(lat_ms, 99)), 3),
+        }
+
+    def summarize(self, samples: List, elapsed: float, params: Dict) -> Dict:
+        """Aggregate raw samples into overall and per-endpoint statistics"""
+        per_endpoint = {}
+        for endpoint in self._names:
+            rows = [s for s in samples if s[0] == endpoint]
+            if rows:
+                per_endpoint[endpoint] = self._stats(rows, elapsed)
+
+        return {
+            **params,
+            'duration_s': round(elapsed, 3),
+            'overall': self._stats(samples, elapsed),
+            'endpoints': per_endpoint
+        }
+
+    @staticmethod
+    def find_knee(loads: List[float], latencies: List[float]) -> Optional[int]:
+        """
+        Knee of the latency curve (Kneedle): the point furthest below the chord
+        joining the first and last normalized points of a convex increasing curve
+        """
+        if len(loads) < 3:
+            return None
+
+        x = np.asarray(loads, dtype=float)
+        y = np.asarray(latencies, dtype=float)
+        x_norm = (x - x.min()) / (x.max() - x.min())
+        y_range = y.max() - y.min()
+        if y_range == 0 or y[-1] <= y[0]:
+            return None
+        y_norm = (y - y.min()) / y_range
+
+        distance = x_norm - y_norm
+        return int(np.argmax(distance))
+
+    async def sweep(self, levels: List[float], duration: float, mode: str = 'closed') -> Dict:
+        """Run successive load levels and locate the knee of the p99 latency curve"""
+        runs = []
+        for level in levels:
+            print(f"  {mode} load level {level}...")
+            if mode == 'closed':
+                result = await self.run_closed(int(level), duration)
+            else:
+                result = await self.run_open(float(level), duration)
+            runs.append(result)
+            overall = result['overall']
+            print(f"    throughput={overall['throughput_rps']} rps  p50={overall['p50_ms']}ms  "
+                  f"p99={overall['p99_ms']}ms  errors={overall['error_rate']:.2%}")
+
+        knee = self.find_knee(levels, [r['overall']['p99_ms'] for r in runs])
+        return {
+            'mode': mode,
+            'levels': levels,
+            'runs': runs,
+            'knee': None if knee is None else {
+                'level': levels[knee],
+                'throughput_rps': runs[knee]['overall']['throughput_rps'],
+                'p99_ms': runs[knee]['overall']['p99_ms']
+            }
+        }
+
+    async def overload(self, rates: List[float], duration: float) -> Dict:
+        """
+        Open-loop runs at each rate with admission control off and then on
+        (in-process only, since it toggles the app's controller), to compare
+        latency and how much was served degraded or rejected under overload
+        """
+        from . import api
+        self.app = api.app
+        enabled = api.admission.enabled
+
+        # Degraded answers need the lookup table; wait for it to be loaded or distilled
+        pred = api.get_predictor()
+        api.admission.enabled = True
+        while api.lookup_tables.get(pred) is None:
+            if not api.lookup_tables.building:
+                raise RuntimeError("Lookup table unavailable; build it with: python -m src.lookup_table build")
+            await asyncio.sleep(1)
+
+        runs = []
+        try:
+            for rate in rates:
+                for shedding in (False, True):
+                    api.admission.enabled = shedding
+                    print(f"  rate {rate}/s, admission {'on' if shedding else 'off'}...")
+                    result = await self.run_open(float(rate), duration)
+                    result['admission'] = shedding
+                    runs.append(result)
+                    overall = result['overall']
+                    print(f"    throughput={overall['throughput_rps']} rps  p50={overall['p50_ms']}ms  "
+                          f"p99={overall['p99_ms']}ms  degraded={overall['degraded_rate']:.1%}  "
+                          f"rejected={overall['rejected_rate']:.1%}")
+        finally:
+            api.admission.enabled = enabled
+
+        return {'mode': 'overload', 'rates': rates, 'runs': runs}
+
+
+def print_overload(report: Dict):
+    """Admission off vs on at each rate"""
+    print(f"\n{'rate':>6}  {'admission':<10}{'rps':>8}{'p50ms':>10}{'p99ms':>10}{'degr%':>8}{'rej%':>8}{'err%':>8}")
+    for run in report['runs']:
+        stats = run['overall']
+        print(f"{run['rate']:>6g}  {'on' if run['admission'] else 'off':<10}{stats['throughput_rps']:>8.2f}"
+              f"{stats['p50_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['degraded_rate'] * 100:>8.2f}"
+              f"{stats['rejected_rate'] * 100:>8.2f}{stats['error_rate'] * 100:>8.2f}")
+
+
+def print_report(result: Dict):
+    """Human-readable table for a single run"""
+    print(f"\n{'endpoint':<16}{'reqs':>8}{'err%':>8}{'degr%':>8}{'rej%':>8}{'rps':>10}"
+          f"{'p50ms':>10}{'p95ms':>10}{'p99ms':>10}")
+    rows = list(result['endpoints'].items()) + [('OVERALL', result['overall'])]
+    for name, stats in rows:
+        print(f"{name:<16}{stats['requests']:>8}{stats['error_rate'] * 100:>8.2f}"
+              f"{stats['degraded_rate'] * 100:>8.2f}{stats['rejected_rate'] * 100:>8.2f}{stats['throughput_rps']:>10.2f}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+
+
+def parse_mix(values: Optional[List[str]]) -> Optional[Dict[str, float]]:
+    """Parse endpoint=weight pairs"""
+    if not values:
+        return None
+    mix = {}
+    for value in values:
+        name, _, weight = value.partition('=')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CongestionAI load tester")
+    parser.add_argument('--config', default="configs/params.yaml")
+    parser.add_argument('--url', help="Target a running server instead of the in-process app")
+    parser.add_argument('--mix', nargs='+', metavar='ENDPOINT=WEIGHT',
+                        help=f"Endpoint weights, endpoints: {', '.join(LoadTester.ENDPOINTS)}")
+    parser.add_argument('--mode', choices=['closed', 'open'], default='closed')
+    parser.add_argument('--concurrency', type=int, help="Workers for closed-loop mode")
+    parser.add_argument('--rate', type=float, help="Arrivals per second for open-loop mode")
+    parser.add_argument('--duration', type=float, help="Seconds per run / sweep level")
+    parser.add_argument('--sweep', nargs='*', type=float,
+                        help="Saturation sweep over concurrency levels (closed) or rates (open)")
+    parser.add_argument('--overload', nargs='*', type=float,
+                        help="Open-loop rates run with admission control off and on (in-process only)")
+    parser.add_argument('--output', help="Write the JSON report here")
+    args = parser.parse_args()
+
+    tester = LoadTester(args.config, base_url=args.url, mix=parse_mix(args.mix))
+    load_config = tester.load_config
+    duration = args.duration or load_config['duration']
+
+    print("=" * 60)
+    print(f"CongestionAI Load Test ({args.url or 'in-process ASGI'})")
+    print("=" * 60)
+
+    if args.overload is not None:
+        if args.url:
+            parser.error("--overload drives the in-process app; drop --url")
+        report = asyncio.run(tester.overload(args.overload or load_config['overload_rates'], duration))
+        print_overload(report)
+    elif args.sweep is not None:
+        default_levels = load_config['sweep_concurrency'] if args.mode == 'closed' else load_config['sweep_rates']
+        report = asyncio.run(tester.sweep(args.sweep or default_levels, duration, args.mode))
+        knee = report['knee']
+        if knee:
+            print(f"\nKnee at {args.mode} load {knee['level']}: "
+                  f"{knee['throughput_rps']} rps, p99 {knee['p99_ms']}ms")
+        else:
+            print("\nNo knee found (latency flat across levels)")
+    elif args.mode == 'closed':
+        report = asyncio.run(tester.run_closed(args.concurrency or load_config['concurrency'], duration))
+        print_report(report)
+    else:
+        report = asyncio.run(tester.run_open(args.rate or load_config['rate'], duration))
+        print_report(report)
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
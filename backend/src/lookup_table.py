@@ -0,0 +1,273 @@
+"""
+Lookup-table fallback model for CongestionAI
+(H3 cell x hour-of-week) forecasts distilled from the current model, served
+when the API sheds load (see admission.py). A lookup costs one H3 encoding
+per row and a gather; no features and no model call.
+
+Build with: python -m src.lookup_table build
+"""
+
+import argparse
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import h3
+import numpy as np
+import pandas as pd
+import yaml
+
+from .drift import untracked
+from .spatial import bbox_to_polygon
+
+HOURS_PER_WEEK = 168
+
+
+def table_version(predictor) -> str:
+    """The models a table was distilled from (global model and regional model files)"""
+    version = predictor.model_version
+    if predictor.model_router is not None:
+        version += f":r{predictor.model_router.version}"
+    return version
+
+
+def hour_of_week(timestamp, n: int) -> np.ndarray:
+    """Monday 00:00 = 0 ... Sunday 23:00 = 167, for a shared datetime or per-row timestamps"""
+    if isinstance(timestamp, datetime):
+        return np.full(n, timestamp.weekday() * 24 + timestamp.hour, dtype=np.int64)
+    index = pd.DatetimeIndex(timestamp)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return (index.dayofweek * 24 + index.hour).to_numpy(dtype=np.int64)
+
+
+def coverage_cells(regions: Dict, resolution: int) -> List[str]:
+    """Cells covering every region's data_areas (where the service is used)"""
+    cells = set()
+    for region in regions.values():
+        for bbox in region.get('data_areas', []):
+            cells.update(h3.polygon_to_cells(h3.LatLngPoly(bbox_to_polygon(bbox)), resolution))
+    return sorted(cells)
+
+
+class LookupTable:
+    def __init__(
+        self,
+        cells: np.ndarray,
+        values: np.ndarray,
+        resolution: int,
+        version: str,
+        week_start: str
+    ):
+        """
+        cells: sorted H3 cell integers; values: (cells, 168, 3) lower/score/upper
+        per hour of week. Rows outside the covered cells get the per-hour median
+        over all cells.
+        """
+        self.cells = cells
+        self.values = values
+        self.resolution = resolution
+        self.version = version
+        self.week_start = week_start
+        self.fallback = np.median(values, axis=0) if len(cells) else np.full((HOURS_PER_WEEK, 3), np.nan)
+        self.lookups = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    @classmethod
+    def build(cls, predictor, cells: List[str], week_start: Optional[datetime] = None) -> 'LookupTable':
+        """
+        Forecast every cell center at every hour of one week (default: the week
+        starting last Monday), one batched call per hour. Weather is left at the
+        defaults, so the table is the model's typical week for each cell.
+        """
+        if week_start is None:
+            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+            week_start = today - timedelta(days=today.weekday())
+
+        cell_ints = np.array([h3.str_to_int(cell) for cell in cells], dtype=np.uint64)
+        order = np.argsort(cell_ints)
+        cells = [cells[i] for i in order]
+        centers = np.array([h3.cell_to_latlng(cell) for cell in cells]).reshape(-1, 2)
+
+        values = np.empty((len(cells), HOURS_PER_WEEK, 3), dtype=np.float32)
+        with untracked():  # not live traffic for drift monitoring
+            for hour in range(HOURS_PER_WEEK):
+                # weather_data={}: default weather rather than the live forecast grid
+                values[:, hour] = predictor.predict_intervals(
+                    centers[:, 0], centers[:, 1], week_start + timedelta(hours=hour), weather_data={}
+                )
+
+        resolution = h3.get_resolution(cells[0]) if cells else 0
+        return cls(cell_ints[order], values, resolution, table_version(predictor), week_start.isoformat())
+
+    def save(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            path, cells=self.cells, values=self.values, resolution=self.resolution,
+            version=self.version, week_start=self.week_start
+        )
+
+    @classmethod
+    def load(cls, path: str) -> 'LookupTable':
+        with np.load(path) as data:
+            return cls(
+                data['cells'], data['values'], int(data['resolution']),
+                str(data['version']), str(data['week_start'])
+            )
+
+    def lookup(self, lats, lons, timestamp) -> np.ndarray:
+        """(lower, score, upper) rows for locations at a shared datetime or per-row timestamps"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        n = len(lats)
+        keys = np.fromiter(
+            (h3.str_to_int(h3.latlng_to_cell(lat, lon, self.resolution)) for lat, lon in zip(lats.tolist(), lons.tolist())),
+            dtype=np.uint64, count=n
+        )
+        idx = np.minimum(np.searchsorted(self.cells, keys), max(len(self.cells) - 1, 0))
+        found = self.cells[idx] == keys if len(self.cells) else np.zeros(n, dtype=bool)
+        hours = hour_of_week(timestamp, n)
+
+        bands = self.fallback[hours].astype(np.float64)
+        bands[found] = self.values[idx[found], hours[found]]
+
+        self.lookups += n
+        self.misses += int(n - found.sum())
+        return bands
+
+    def stats(self) -> Dict:
+        return {
+            'cells': len(self),
+            'resolution': self.resolution,
+            'version': self.version,
+            'week_start': self.week_start,
+            'size_mb': round((self.cells.nbytes + self.values.nbytes) / 1e6, 2),
+            'lookups': self.lookups,
+            'uncovered': self.misses,
+        }
+
+
+class LookupTableProvider:
+    """
+    The table for the serving model: loaded from disk when it was distilled
+    from the same models, otherwise rebuilt on a background thread (and saved)
+    so startup is not delayed. Until a table is ready, get() returns None.
+    """
+
+    def __init__(self, config: Dict, regions: Dict):
+        self.path = config.get('path', 'models/lookup_table.npz')
+        self.resolution = config.get('resolution', 7)
+        self.regions = regions
+        self.table = None
+        self.building = False
+        self.failed_version = None  # not retried until the models change
+        self._lock = threading.Lock()
+
+    def get(self, predictor) -> Optional['LookupTable']:
+        table = self.table
+        if table is not None and table.version == table_version(predictor):
+            return table
+
+        with self._lock:
+            if self.building or self.failed_version == table_version(predictor):
+                return None
+            if Path(self.path).exists():
+                table = LookupTable.load(self.path)
+                if table.version == table_version(predictor):
+                    self.table = table
+                    print(f"[INFO] Lookup table loaded ({len(table)} cells)")
+                    return table
+            self.building = True
+        threading.Thread(target=self._build, args=(predictor,), daemon=True).start()
+        return None
+
+    def _build(self, predictor):
+        try:
+            started = time.perf_counter()
+            print(f"[INFO] Distilling lookup table from model {table_version(predictor)}...")
+            table = LookupTable.build(predictor, coverage_cells(self.regions, self.resolution))
+            table.save(self.path)
+            self.table = table
+            print(f"[OK] Lookup table ready: {len(table)} cells x {HOURS_PER_WEEK} hours "
+                  f"in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            self.failed_version = table_version(predictor)
+            print(f"[WARNING] Lookup table build failed: {e}")
+        finally:
+            self.building = False
+
+    def stats(self) -> Optional[Dict]:
+        if self.table is None:
+            return {'ready': False, 'building': self.building}
+        return {'ready': True, 'building': self.building, **self.table.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CongestionAI lookup-table fallback model")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    build = sub.add_parser('build', help="Distill the table from the current models")
+    build.add_argument('--config', default="configs/params.yaml")
+    build.add_argument('--resolution', type=int, help="H3 resolution (default: lookup_table.resolution)")
+
+    check = sub.add_parser('check', help="Compare table lookups with model forecasts at random points")
+    check.add_argument('--config', default="configs/params.yaml")
+    check.add_argument('--samples', type=int, default=2000)
+    args = parser.parse_args()
+
+    from .infer import CongestionPredictor
+
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+    table_config = config.get('lookup_table', {})
+    predictor = CongestionPredictor(
+        config['model']['save_path'],
+        router_config=config.get('model_router'),
+        regions=config.get('regions')
+    )
+    predictor.weather_api_key = ''
+    path = table_config.get('path', 'models/lookup_table.npz')
+
+    if args.command == 'build':
+        resolution = args.resolution or table_config.get('resolution', 7)
+        cells = coverage_cells(config.get('regions', {}), resolution)
+        print(f"Distilling {len(cells)} cells x {HOURS_PER_WEEK} hours at resolution {resolution}...")
+        started = time.perf_counter()
+        table = LookupTable.build(predictor, cells)
+        table.save(path)
+        print(f"[OK] Saved {path} ({table.stats()['size_mb']} MB) in {time.perf_counter() - started:.1f}s")
+        return
+
+    # Sample points inside the covered areas at random hours of the next week
+    table = LookupTable.load(path)
+    rng = np.random.default_rng(0)
+    areas = [bbox for region in config.get('regions', {}).values() for bbox in region.get('data_areas', [])]
+    picks = rng.integers(0, len(areas), args.samples)
+    bounds = np.array(areas)[picks]
+    lats = rng.uniform(bounds[:, 0], bounds[:, 2])
+    lons = rng.uniform(bounds[:, 1], bounds[:, 3])
+    start = datetime.now().replace(minute=0, second=0, microsecond=0)
+    timestamps = np.array([start + timedelta(hours=int(h)) for h in rng.integers(0, HOURS_PER_WEEK, args.samples)],
+                          dtype='datetime64[us]')
+
+    started = time.perf_counter()
+    approx = table.lookup(lats, lons, timestamps)
+    lookup_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    exact = predictor.predict_intervals(lats, lons, timestamps, weather_data={})
+    model_ms = (time.perf_counter() - started) * 1000
+
+    error = np.abs(approx[:, 1] - exact[:, 1])
+    risk_agreement = np.mean(predictor.get_risk_codes(approx[:, 1]) == predictor.get_risk_codes(exact[:, 1]))
+    print(f"{args.samples} points: lookup {lookup_ms:.1f} ms, model {model_ms:.1f} ms")
+    print(f"Score error vs model: mean {error.mean():.4f}, p95 {np.percentile(error, 95):.4f}, max {error.max():.4f}")
+    print(f"Risk level agreement: {risk_agreement:.1%}")
+
+
+if __name__ == "__main__":
+    main()
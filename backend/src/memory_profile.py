@@ -0,0 +1,281 @@
+"""
+Memory profiling for CongestionAI
+Per-stage peak memory of the data pipeline and training: process RSS sampled
+by a background thread, and (optionally) Python heap peaks from tracemalloc,
+which also sees numpy and pandas buffers. compare runs both pipelines in the
+standard and the memory-lean mode (memory.lean) in fresh processes.
+"""
+
+import argparse
+import copy
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import yaml
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
+
+MB = 1024 * 1024
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (0 where it cannot be read)"""
+    if PSUTIL_AVAILABLE:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+class RSSSampler:
+    """Background thread recording the highest RSS seen until stop()"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def stop(self) -> int:
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+        return self.peak
+
+
+class MemoryProfiler:
+    def __init__(self, enabled: bool = False, trace: bool = False, interval: float = 0.005):
+        """
+        Records one entry per stage(). Disabled, stage() only runs the block.
+        trace adds tracemalloc heap peaks, at some cost in speed.
+        """
+        self.enabled = enabled
+        self.trace = trace
+        self.interval = interval
+        self.stages = []
+        self.baseline_rss = current_rss()
+
+    @classmethod
+    def from_config(cls, config: Dict, enabled: Optional[bool] = None) -> 'MemoryProfiler':
+        memory = config.get('memory', {})
+        return cls(
+            enabled=memory.get('profile', False) if enabled is None else enabled,
+            trace=memory.get('tracemalloc', False),
+            interval=memory.get('sample_interval', 0.005)
+        )
+
+    @contextmanager
+    def stage(self, name: str):
+        """Measure the block: wall time, RSS before/peak/after and heap peak above its start"""
+        if not self.enabled:
+            yield
+            return
+
+        started_tracing = self.trace and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if self.trace:
+            tracemalloc.reset_peak()
+            heap_start = tracemalloc.get_traced_memory()[0]
+        rss_start = current_rss()
+        sampler = RSSSampler(self.interval)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            rss_peak = sampler.stop()
+            entry = {
+                'stage': name,
+                'seconds': round(seconds, 3),
+                'rss_start_mb': round(rss_start / MB, 1),
+                'rss_peak_mb': round(rss_peak / MB, 1),
+                'rss_end_mb': round(current_rss() / MB, 1),
+            }
+            if self.trace:
+                entry['heap_peak_mb'] = round((tracemalloc.get_traced_memory()[1] - heap_start) / MB, 1)
+                if started_tracing:
+                    tracemalloc.stop()
+            self.stages.append(entry)
+
+    def peak_rss_mb(self) -> float:
+        return max((entry['rss_peak_mb'] for entry in self.stages), default=round(current_rss() / MB, 1))
+
+    def to_dict(self) -> Dict:
+        return {
+            'baseline_rss_mb': round(self.baseline_rss / MB, 1),
+            'peak_rss_mb': self.peak_rss_mb(),
+            'stages': self.stages,
+        }
+
+    def report(self, title: str = "Memory profile"):
+        """Print the per-stage table"""
+        if not self.enabled:
+            return
+        print(f"\n=== {title} (baseline RSS {self.baseline_rss / MB:.1f}MB) ===")
+        print(f"{'stage':<24} {'seconds':>8} {'rss_start':>10} {'rss_peak':>10} {'rss_end':>10} {'heap_peak':>10}")
+        for entry in self.stages:
+            heap = f"{entry['heap_peak_mb']:.1f}" if 'heap_peak_mb' in entry else '-'
+            print(f"{entry['stage']:<24} {entry['seconds']:>8.2f} {entry['rss_start_mb']:>10.1f} "
+                  f"{entry['rss_peak_mb']:>10.1f} {entry['rss_end_mb']:>10.1f} {heap:>10}")
+        print(f"Peak RSS: {self.peak_rss_mb():.1f}MB")
+
+
+def write_run_config(config_path: str, workdir: Path, lean: bool, trace: bool) -> str:
+    """Copy of the config with every artifact inside workdir"""
+    with open(config_path, 'r') as f:
+        config = yaml.safe_load(f)
+    config = copy.deepcopy(config)
+    config['data']['raw_path'] = str(workdir / "raw")
+    config['data']['processed_path'] = str(workdir / "processed")
+    config['model']['save_path'] = str(workdir / "model.pkl")
+    config['memory'] = dict(config.get('memory', {}), lean=lean, tracemalloc=trace)
+
+    run_config_path = workdir / "params.yaml"
+    with open(run_config_path, 'w') as f:
+        yaml.safe_dump(config, f)
+    return str(run_config_path)
+
+
+def run_part(config_path: str, part: str, rows: int) -> Dict:
+    """Run the data pipeline (on `rows` synthetic rows) or training in this process"""
+    # Import both first so the baseline RSS includes every library
+    from .data_pipeline import DataPipeline
+    from .train_model import ModelTrainer
+
+    if part == 'pipeline':
+        runner = DataPipeline(config_path, profile=True)
+        runner.run(n_samples=rows)
+    else:
+        runner = ModelTrainer(config_path, profile=True)
+        runner.run()
+    return runner.profiler.to_dict()
+
+
+def profile_run(config_path: str, rows: int, lean: bool, trace: bool) -> Dict:
+    """
+    Data pipeline and training on `rows` synthetic rows, each in a fresh
+    process (as the orchestrator runs them) so RSS is not inherited
+    """
+    workdir = Path(tempfile.mkdtemp(prefix="congestionai_memory_"))
+    run_config_path = write_run_config(config_path, workdir, lean, trace)
+    result = {'mode': 'lean' if lean else 'standard', 'rows': rows}
+    try:
+        for part in ('pipeline', 'training'):
+            output = workdir / f"{part}.json"
+            subprocess.run(
+                [sys.executable, '-m', 'src.memory_profile', 'run', '--config', run_config_path,
+                 '--part', part, '--rows', str(rows), '--output', str(output)],
+                check=True, stdout=subprocess.DEVNULL
+            )
+            with open(output) as f:
+                result[part] = json.load(f)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    # Working memory: peak above the process baseline (interpreter and libraries)
+    result['working_mb'] = max(
+        result[part]['peak_rss_mb'] - result[part]['baseline_rss_mb'] for part in ('pipeline', 'training')
+    )
+    result['peak_rss_mb'] = max(result[part]['peak_rss_mb'] for part in ('pipeline', 'training'))
+    return result
+
+
+def compare(config_path: str, rows: int, scale: int, trace: bool) -> List[Dict]:
+    """Standard mode at `rows`, and the lean mode at `rows` and `scale` x `rows`"""
+    runs = []
+    for lean, n in ((False, rows), (True, rows), (True, rows * scale)):
+        print(f"[INFO] Profiling the {'lean' if lean else 'standard'} mode with {n} rows...")
+        runs.append(profile_run(config_path, n, lean, trace))
+    return runs
+
+
+def print_comparison(runs: List[Dict]):
+    """Per-stage peak RSS of each run, and how the lean runs compare with the standard one"""
+    headers = [f"{run['mode']}[{run['rows']}]" for run in runs]
+    print("\n=== Peak RSS per stage (MB) ===")
+    print(f"{'stage':<32}" + ''.join(f"{header:>20}" for header in headers))
+    for part in ('pipeline', 'training'):
+        for entry in runs[0][part]['stages']:
+            peaks = [
+                next((e['rss_peak_mb'] for e in run[part]['stages'] if e['stage'] == entry['stage']), None)
+                for run in runs
+            ]
+            print(f"{part + '.' + entry['stage']:<32}" + ''.join(
+                f"{peak:>20.1f}" if peak is not None else f"{'-':>20}" for peak in peaks
+            ))
+    print(f"{'peak':<32}" + ''.join(f"{run['peak_rss_mb']:>20.1f}" for run in runs))
+    print(f"{'working (above baseline)':<32}" + ''.join(f"{run['working_mb']:>20.1f}" for run in runs))
+
+    # Fixed costs (libraries, the SHAP explainer) do not grow with the data,
+    # so compare peaks at different sizes rather than dividing by rows
+    standard = runs[0]
+    print()
+    for header, run in zip(headers[1:], runs[1:]):
+        print(f"{header}: {run['rows'] / standard['rows']:.1f}x the rows of {headers[0]} at "
+              f"{run['peak_rss_mb'] / standard['peak_rss_mb']:.0%} of its peak RSS "
+              f"({run['peak_rss_mb']:.1f}MB vs {standard['peak_rss_mb']:.1f}MB)")
+    lean = [run for run in runs if run['mode'] == 'lean']
+    if len(lean) >= 2 and lean[-1]['rows'] > lean[0]['rows']:
+        marginal = (lean[-1]['working_mb'] - lean[0]['working_mb']) * MB / (lean[-1]['rows'] - lean[0]['rows'])
+        print(f"Lean mode: {marginal:.0f} bytes of peak memory per additional row")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CongestionAI pipeline and training memory profile")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Profile the data pipeline or training in this process")
+    run_parser.add_argument('--config', default="configs/params.yaml")
+    run_parser.add_argument('--part', choices=['pipeline', 'training'], required=True)
+    run_parser.add_argument('--rows', type=int, default=50000, help="Synthetic rows (pipeline)")
+    run_parser.add_argument('--output', help="Write the stage report as JSON")
+
+    compare_parser = subparsers.add_parser('compare', help="Standard vs memory-lean mode, in fresh processes")
+    compare_parser.add_argument('--config', default="configs/params.yaml")
+    compare_parser.add_argument('--rows', type=int, default=None)
+    compare_parser.add_argument('--scale', type=int, default=None, help="The lean mode also runs with rows x scale")
+    compare_parser.add_argument('--tracemalloc', action='store_true', help="Also trace Python heap peaks (slower)")
+    compare_parser.add_argument('--output', help="Write all runs as JSON")
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        result = run_part(args.config, args.part, args.rows)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(result, f, indent=2)
+    else:
+        with open(args.config, 'r') as f:
+            memory_config = yaml.safe_load(f).get('memory', {})
+        runs = compare(
+            args.config,
+            args.rows or memory_config.get('compare_rows', 50000),
+            args.scale or memory_config.get('compare_scale', 3),
+            args.tracemalloc
+        )
+        print_comparison(runs)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(runs, f, indent=2)
+            print(f"\n[OK] Comparison saved to {args.output}")
@@ -0,0 +1,169 @@
+"""
+Regional model routing for CongestionAI
+Maps locations to regions by H3 parent cell, and keeps regional models in an
+LRU cache under a memory budget so a node can serve many regions without
+holding every model in RAM
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import h3
+import numpy as np
+
+from .spatial import bbox_to_polygon, lattice_cells
+
+
+class ModelRouter:
+    """
+    Regional models live at <models_dir>/<region>/model.pkl; only regions
+    with a model file take part. Each region's bbox is covered with H3 cells
+    at `resolution` (cells overlapping the bbox, first region wins), and a row
+    is routed by the parent cell it falls in. Rows outside every region with
+    a model are left to the global model (code -1).
+
+    Models are loaded on first use with `loader` (path -> predictor) and
+    evicted least recently used once their combined footprint exceeds
+    memory_budget_mb. The most recently used model is never evicted, so a
+    single model larger than the budget still serves. The latest observation
+    per cell is kept and replayed into models as they are (re)loaded.
+
+    A load runs outside the lock: requests for loaded regions are not held up,
+    and concurrent requests for the region being loaded wait on its future.
+    `on_evict` is called with each evicted predictor.
+    """
+
+    def __init__(
+        self,
+        regions: Dict[str, Dict],
+        router_config: Dict,
+        loader: Callable[[str], object],
+        on_evict: Optional[Callable[[object], None]] = None
+    ):
+        self.models_dir = Path(router_config.get('models_dir', 'models/regions'))
+        self.resolution = router_config.get('h3_resolution', 3)
+        self.precision = router_config.get('lookup_precision', 1)
+        self.memory_budget = router_config.get('memory_budget_mb', 1024) * 1e6
+        self.loader = loader
+        self.on_evict = on_evict
+
+        self.region_names = [
+            name for name in regions if (self.models_dir / name / 'model.pkl').exists()
+        ]
+        self.model_paths = [str(self.models_dir / name / 'model.pkl') for name in self.region_names]
+
+        # Reverse order so the first region covering a cell is assigned last and wins
+        self.cell_region = {}
+        for code in range(len(self.region_names) - 1, -1, -1):
+            shape = h3.LatLngPoly(bbox_to_polygon(regions[self.region_names[code]]['bbox']))
+            for cell in h3.polygon_to_cells_experimental(shape, self.resolution, contain='overlap'):
+                self.cell_region[cell] = code
+
+        # Identifies the set of regional model files, for forecast cache keys
+        signature = hashlib.sha256()
+        for path in self.model_paths:
+            stat = Path(path).stat()
+            signature.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        self.version = signature.hexdigest()[:12]
+
+        self._models = OrderedDict()  # code -> (predictor, footprint bytes)
+        self._loading = {}  # code -> Future of a load in progress
+        self.observations = {}  # cell -> latest neighbour state row
+        self._lock = threading.Lock()
+        self.memory_bytes = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.region_names)
+
+    def assign(self, lats, lons) -> np.ndarray:
+        """Region code per location (-1: global model)"""
+        cells, inverse = lattice_cells(lats, lons, self.resolution, self.precision)
+        get = self.cell_region.get
+        codes = np.fromiter((get(cell, -1) for cell in cells), dtype=np.int64, count=len(cells))
+        return codes[inverse]
+
+    def partition(self, lats, lons) -> List[Tuple[int, Optional[np.ndarray]]]:
+        """
+        (region code, row indices) per region present in the batch. Row indices
+        are None when every row goes to the same model, so callers can skip the
+        gather and scatter.
+        """
+        codes = self.assign(lats, lons)
+        present = np.unique(codes)
+        if len(present) == 1:
+            return [(int(present[0]), None)]
+
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], present)
+        groups = np.split(order, bounds[1:])
+        return list(zip(present.tolist(), groups))
+
+    def get(self, code: int):
+        """Predictor for a region, loading it (and evicting others) if needed"""
+        with self._lock:
+            entry = self._models.get(code)
+            if entry is not None:
+                self._models.move_to_end(code)
+                return entry[0]
+            loading = self._loading.get(code)
+            owner = loading is None
+            if owner:
+                loading = self._loading[code] = Future()
+        if not owner:
+            return loading.result()
+
+        try:
+            predictor = self.loader(self.model_paths[code])
+        except BaseException as e:
+            with self._lock:
+                del self._loading[code]
+            loading.set_exception(e)
+            raise
+
+        evicted = []
+        with self._lock:
+            # Replayed under the lock so no update_state call falls between replay and insert
+            if self.observations:
+                predictor.update_neighbour_state(list(self.observations), np.array(list(self.observations.values())))
+            footprint = predictor.memory_footprint()
+            self._models[code] = (predictor, footprint)
+            self.memory_bytes += footprint
+            self.loads += 1
+            while self.memory_bytes > self.memory_budget and len(self._models) > 1:
+                evicted_code, (evicted_predictor, size) = self._models.popitem(last=False)
+                self.memory_bytes -= size
+                self.evictions += 1
+                evicted.append((evicted_code, evicted_predictor))
+            del self._loading[code]
+        loading.set_result(predictor)
+
+        print(f"[INFO] Loaded regional model '{self.region_names[code]}' ({footprint / 1e6:.1f} MB)")
+        for evicted_code, evicted_predictor in evicted:
+            print(f"[INFO] Evicted regional model '{self.region_names[evicted_code]}'")
+            if self.on_evict is not None:
+                self.on_evict(evicted_predictor)
+        return predictor
+
+    def update_state(self, cells: List[str], values: np.ndarray):
+        """Record observations for the loaded models and for models loaded later"""
+        with self._lock:
+            self.observations.update(zip(cells, np.asarray(values, dtype=np.float32)))
+            for predictor, _ in self._models.values():
+                predictor.update_neighbour_state(cells, values)
+
+    def stats(self) -> Dict:
+        return {
+            'regions': self.region_names,
+            'loaded': [self.region_names[code] for code in self._models],
+            'memory_mb': round(self.memory_bytes / 1e6, 1),
+            'memory_budget_mb': round(self.memory_budget / 1e6, 1),
+            'loads': self.loads,
+            'evictions': self.evictions,
+            'observed_cells': len(self.observations),
+        }
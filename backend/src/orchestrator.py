@@ -0,0 +1,404 @@
+"""
+Stage orchestrator for CongestionAI
+Runs data generation -> processing -> training -> evaluation as declared
+stages, reusing outputs cached under content hashes of each stage's inputs
+
+Run with: python -m src.orchestrator [--targets global in] [--force train]
+"""
+
+import argparse
+import hashlib
+import json
+import pickle
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date, datetime
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import yaml
+
+SRC_DIR = Path(__file__).parent
+
+# Each stage declares what its outputs depend on: config keys (dotted, {target}
+# is replaced by the target name), source files, package versions and the
+# outputs of upstream stages. A change in any of them invalidates the stage.
+STAGES = {
+    'generate': {
+        'deps': [],
+        'config': ['pipeline.n_samples', 'pipeline.end_date', 'regions.{target}.data_areas', 'memory.lean'],
+        'code': ['data_pipeline.py', 'orchestrator.py'],
+        'packages': ['numpy', 'pandas'],
+    },
+    'process': {
+        'deps': ['generate'],
+        'config': ['spatial', 'regions', 'calendar', 'features', 'memory.lean'],
+        'code': ['data_pipeline.py', 'calendar_table.py', 'spatial.py', 'orchestrator.py'],
+        'packages': ['numpy', 'pandas', 'h3', 'holidays'],
+    },
+    'train': {
+        'deps': ['process'],
+        'config': ['model', 'memory.lean', 'drift.bins'],
+        'code': ['train_model.py', 'drift.py', 'orchestrator.py'],
+        'packages': ['xgboost', 'scikit-learn', 'numpy', 'pandas'],
+    },
+    'evaluate': {
+        'deps': ['process', 'train'],
+        'config': ['prediction.risk_thresholds', 'model.search.latency_budget_ms'],
+        'code': ['train_model.py', 'orchestrator.py'],
+        'packages': ['xgboost', 'scikit-learn'],
+    },
+}
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def config_value(config: Dict, dotted: str):
+    """Value at a dotted key (None when any part is missing)"""
+    value = config
+    for part in dotted.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def package_version(name: str) -> Optional[str]:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def stage_outputs(config: Dict, stage: str, target: str) -> List[str]:
+    """Canonical paths a stage writes for a target ('global' or a region key)"""
+    region_dir = '' if target == 'global' else target
+    raw = Path(config['data']['raw_path']) / region_dir
+    processed = Path(config['data']['processed_path']) / region_dir
+    if target == 'global':
+        model_path = Path(config['model']['save_path'])
+    else:
+        model_path = Path(config['model_router']['models_dir']) / target / 'model.pkl'
+
+    if stage == 'generate':
+        return [str(raw / 'synthetic.csv')]
+    if stage == 'process':
+        outputs = [str(processed / config['data']['train_file'])]
+        nbr_config = config['features'].get('neighbour_features', {})
+        if nbr_config.get('enabled', False):
+            outputs.append(str(processed / nbr_config['index_file']))
+        return outputs
+    if stage == 'train':
+        return [str(model_path), str(model_path.parent / config['model'].get('report_file', 'training_report.json'))]
+    return [str(model_path.parent / 'evaluation.json')]
+
+
+def data_end_date(config: Dict) -> datetime:
+    """End of the synthetic data window (pipeline.end_date, default: today at midnight)"""
+    end_date = config.get('pipeline', {}).get('end_date') or date.today()
+    if isinstance(end_date, str):
+        end_date = date.fromisoformat(end_date)
+    return datetime(end_date.year, end_date.month, end_date.day)
+
+
+# Stage implementations (run in worker processes)
+
+def run_generate(config_path: str, config: Dict, target: str, outputs: List[str]):
+    from .data_pipeline import DataPipeline
+
+    pipeline = DataPipeline(config_path, region=None if target == 'global' else target)
+    df = pipeline.generate_synthetic_data(
+        n_samples=config.get('pipeline', {}).get('n_samples', 50000),
+        end_date=data_end_date(config)
+    )
+    Path(outputs[0]).parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(outputs[0], index=False)
+
+
+def run_process(config_path: str, config: Dict, target: str, outputs: List[str]):
+    from .data_pipeline import DataPipeline
+
+    pipeline = DataPipeline(config_path, region=None if target == 'global' else target)
+    raw_path = stage_outputs(config, 'generate', target)[0]
+    df = pd.read_csv(raw_path, parse_dates=['timestamp'])
+    df = pipeline.process_data(df)
+    pipeline.save_processed_data(df)
+
+
+def run_train(config_path: str, config: Dict, target: str, outputs: List[str]):
+    from .train_model import ModelTrainer
+
+    trainer = ModelTrainer(config_path, region=None if target == 'global' else target)
+    trainer.run(search=config['model'].get('search', {}).get('enabled', False))
+
+
+def run_evaluate(config_path: str, config: Dict, target: str, outputs: List[str]):
+    """Holdout metrics (the trainer's test split), risk-level agreement and predict latency"""
+    from .train_model import ModelTrainer, median_prediction, split_indices
+
+    trainer = ModelTrainer(config_path, region=None if target == 'global' else target)
+    X, y = trainer.prepare_features(trainer.load_data())
+    _, _, test_idx = split_indices(len(X))
+    X_test, y_test = X.iloc[test_idx], y.iloc[test_idx]
+
+    with open(trainer.model_path, 'rb') as f:
+        model_data = pickle.load(f)
+    trainer.model, trainer.quantiles = model_data['model'], model_data.get('quantiles') or []
+    trainer.interval_offset = model_data.get('interval_offset', 0.0)
+    metrics = trainer.evaluate_model(X_test, y_test)
+
+    # Share of rows whose predicted risk level matches the actual one
+    thresholds = config['prediction']['risk_thresholds']
+    bins = [thresholds['low'], thresholds['medium'], thresholds['high']]
+    y_pred = median_prediction(trainer.model.predict(X_test))
+    risk_agreement = float(np.mean(np.digitize(y_pred, bins) == np.digitize(y_test, bins)))
+
+    budget = config['model'].get('search', {}).get('latency_budget_ms', {})
+    batch_rows = budget.get('batch_rows', 1000)
+    evaluation = {
+        'target': target,
+        'model_path': str(trainer.model_path),
+        'test_rows': len(X_test),
+        'metrics': {name: round(float(value), 4) for name, value in metrics.items()},
+        'risk_level_agreement': round(risk_agreement, 4),
+        'latency_ms': {
+            'single': round(trainer.measure_latency(trainer.model, X_test, 1, 30), 3),
+            f'batch_{batch_rows}': round(trainer.measure_latency(trainer.model, X_test, batch_rows, 30), 3),
+        },
+    }
+    with open(outputs[0], 'w') as f:
+        json.dump(evaluation, f, indent=2)
+
+
+STAGE_FUNCTIONS = {
+    'generate': run_generate,
+    'process': run_process,
+    'train': run_train,
+    'evaluate': run_evaluate,
+}
+
+
+def execute_stage(config_path: str, config: Dict, stage: str, target: str, outputs: List[str]) -> float:
+    """Run one stage in a worker process; returns its wall time"""
+    started = time.perf_counter()
+    STAGE_FUNCTIONS[stage](config_path, config, target, outputs)
+    return time.perf_counter() - started
+
+
+class StageOrchestrator:
+    """
+    Runs the stage graph for each target ('global' and region keys). Targets
+    are independent chains, so ready stages of different targets run in
+    parallel worker processes.
+
+    A stage's cache key hashes its declared inputs, including the content hash
+    of its upstream outputs. Outputs are stored under
+    <cache_dir>/<target>/<stage>/<key>/ and restored to their canonical paths
+    on a hit. Because downstream keys use output hashes, a stage that reruns
+    but produces identical files does not invalidate the stages after it.
+    """
+
+    def __init__(self, config_path: str = "configs/params.yaml"):
+        self.config_path = config_path
+        with open(config_path, 'r') as f:
+            self.config = yaml.safe_load(f)
+
+        pipeline_config = self.config.get('pipeline', {})
+        self.cache_dir = Path(pipeline_config.get('cache_dir', '.stage_cache'))
+        self.workers = pipeline_config.get('workers', 2)
+        self.keep_entries = pipeline_config.get('keep_entries', 3)
+        self.code_hashes = {}
+
+    def code_hash(self, filename: str) -> str:
+        if filename not in self.code_hashes:
+            self.code_hashes[filename] = file_hash(SRC_DIR / filename)
+        return self.code_hashes[filename]
+
+    def stage_key(self, stage: str, target: str, upstream: Dict[str, str]) -> str:
+        """Content hash of everything the stage's outputs depend on"""
+        spec = STAGES[stage]
+        inputs = {
+            'stage': stage,
+            'target': target,
+            'config': {key: config_value(self.config, key.format(target=target)) for key in spec['config']},
+            'code': {name: self.code_hash(name) for name in spec['code']},
+            'packages': {name: package_version(name) for name in spec['packages']},
+            'upstream': {dep: upstream[dep] for dep in spec['deps']},
+        }
+        if stage == 'generate':
+            inputs['end_date'] = data_end_date(self.config).isoformat()
+        encoded = json.dumps(inputs, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()[:16]
+
+    def entry_dir(self, stage: str, target: str, key: str) -> Path:
+        return self.cache_dir / target / stage / key
+
+    def cached_manifest(self, stage: str, target: str, key: str) -> Optional[Dict]:
+        """Manifest of a complete cache entry, or None on a miss"""
+        entry = self.entry_dir(stage, target, key)
+        manifest_path = entry / 'manifest.json'
+        if not manifest_path.exists():
+            return None
+
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if not all((entry / digest).exists() for digest in manifest['outputs'].values()):
+            return None
+        return manifest
+
+    def restore(self, manifest: Dict):
+        """Copy a cache entry's outputs to their canonical paths (where they differ)"""
+        entry = self.entry_dir(manifest['stage'], manifest['target'], manifest['key'])
+        for path, digest in manifest['outputs'].items():
+            cached = entry / digest
+            target_path = Path(path)
+            if not target_path.exists() or file_hash(target_path) != digest:
+                target_path.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(cached, target_path)
+
+    def store(self, stage: str, target: str, key: str, outputs: List[str], seconds: float) -> Dict:
+        """Hash a stage's fresh outputs into the cache and return the manifest"""
+        entry = self.entry_dir(stage, target, key)
+        staging = entry.with_name(f"{key}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+
+        hashes = {}
+        for path in outputs:
+            digest = file_hash(Path(path))
+            shutil.copyfile(path, staging / digest)
+            hashes[path] = digest
+        manifest = {
+            'stage': stage,
+            'target': target,
+            'key': key,
+            'outputs': hashes,
+            'output_hash': hashlib.sha256(json.dumps(hashes, sort_keys=True).encode()).hexdigest()[:16],
+            'seconds': round(seconds, 2),
+            'created': datetime.now().isoformat(timespec='seconds'),
+        }
+        with open(staging / 'manifest.json', 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        shutil.rmtree(entry, ignore_errors=True)
+        staging.rename(entry)
+        self.prune(stage, target)
+        return manifest
+
+    def prune(self, stage: str, target: str):
+        """Keep only the newest keep_entries cache entries of a stage"""
+        entries = sorted(
+            (p for p in (self.cache_dir / target / stage).iterdir() if (p / 'manifest.json').exists()),
+            key=lambda p: (p / 'manifest.json').stat().st_mtime,
+            reverse=True
+        )
+        for old in entries[self.keep_entries:]:
+            shutil.rmtree(old, ignore_errors=True)
+
+    def run(self, targets: List[str], force: Optional[List[str]] = None, dry_run: bool = False) -> List[Dict]:
+        """
+        Bring every stage of every target up to date. force lists stages to
+        rerun regardless of the cache. Returns one report row per stage.
+        """
+        force = set(force or [])
+        for target in targets:
+            if target != 'global' and target not in self.config.get('regions', {}):
+                raise ValueError(f"Unknown target '{target}': use 'global' or a key of regions")
+
+        pending = [(target, stage) for target in targets for stage in STAGES]
+        output_hashes = {}  # (target, stage) -> output hash
+        running = {}  # future -> (target, stage, key, outputs)
+        report = []
+        started = time.perf_counter()
+
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            while pending or running:
+                # Start (or restore) every stage whose upstream stages are done
+                for target, stage in list(pending):
+                    deps = STAGES[stage]['deps']
+                    if not all((target, dep) in output_hashes for dep in deps):
+                        continue
+                    pending.remove((target, stage))
+
+                    upstream = {dep: output_hashes[(target, dep)] for dep in deps}
+                    key = self.stage_key(stage, target, upstream)
+                    outputs = stage_outputs(self.config, stage, target)
+
+                    manifest = None if stage in force else self.cached_manifest(stage, target, key)
+                    if manifest is not None:
+                        if not dry_run:
+                            self.restore(manifest)
+                        output_hashes[(target, stage)] = manifest['output_hash']
+                        report.append({'target': target, 'stage': stage, 'status': 'cached',
+                                       'seconds': 0.0, 'saved_seconds': manifest['seconds'], 'key': key})
+                        continue
+
+                    if dry_run:
+                        # Outputs are unknown until the stage runs, so every downstream key misses too
+                        output_hashes[(target, stage)] = f"unknown-{key}"
+                        report.append({'target': target, 'stage': stage, 'status': 'would run',
+                                       'seconds': 0.0, 'key': key})
+                        continue
+
+                    print(f"[RUN] {target}/{stage} (key {key})")
+                    future = pool.submit(execute_stage, self.config_path, self.config, stage, target, outputs)
+                    running[future] = (target, stage, key, outputs)
+
+                if not running:
+                    continue
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    target, stage, key, outputs = running.pop(future)
+                    seconds = future.result()
+                    manifest = self.store(stage, target, key, outputs, seconds)
+                    output_hashes[(target, stage)] = manifest['output_hash']
+                    report.append({'target': target, 'stage': stage, 'status': 'ran',
+                                   'seconds': round(seconds, 2), 'key': key})
+
+        self.print_report(report, time.perf_counter() - started)
+        if not dry_run:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.cache_dir / 'last_run.json', 'w') as f:
+                json.dump(report, f, indent=2)
+        return report
+
+    @staticmethod
+    def print_report(report: List[Dict], wall_seconds: float):
+        print("\n=== Pipeline stages ===")
+        print(f"{'target':<10} {'stage':<10} {'status':<10} {'seconds':>8}  key")
+        for row in report:
+            print(f"{row['target']:<10} {row['stage']:<10} {row['status']:<10} {row['seconds']:>8.2f}  {row['key']}")
+
+        ran = [row for row in report if row['status'] == 'ran']
+        hits = [row for row in report if row['status'] == 'cached']
+        saved = sum(row.get('saved_seconds', 0) for row in hits)
+        print(f"\n{len(ran)} ran, {len(hits)} cached ({saved:.1f}s of stage time reused), "
+              f"wall time {wall_seconds:.1f}s (stage time {sum(row['seconds'] for row in ran):.1f}s)")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="CongestionAI stage orchestrator")
+    parser.add_argument('--config', default="configs/params.yaml")
+    parser.add_argument('--targets', nargs='+', help="'global' and/or region keys (default: pipeline.targets)")
+    parser.add_argument('--force', nargs='+', choices=list(STAGES), default=[], help="Stages to rerun regardless of the cache")
+    parser.add_argument('--dry-run', action='store_true', help="Only report which stages are cached")
+    args = parser.parse_args(argv)
+
+    orchestrator = StageOrchestrator(args.config)
+    targets = args.targets or orchestrator.config.get('pipeline', {}).get('targets', ['global'])
+    orchestrator.run(targets, force=args.force, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
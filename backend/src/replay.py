@@ -0,0 +1,433 @@
+"""
+Traffic replay for CongestionAI
+Plays requests recorded by the capture middleware (src/capture.py) back
+against one or more builds, at the original pace, scaled, or back to back.
+Each build is a running server (URL) or a backend directory started here
+with uvicorn. Requests carry their recorded arrival time (or a pinned clock)
+in X-Replay-Time, and builds started here load the same model (MODEL_PATH)
+without live weather, so two builds see identical inputs. Reports latency
+per endpoint and build, and response differences against the first build.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+import yaml
+
+from .capture import REPLAY_TIME_HEADER, read_capture
+from .serialization import JSON_MEDIA_TYPE, MSGPACK_AVAILABLE, MSGPACK_MEDIA_TYPE, NDJSON_MEDIA_TYPE
+
+if MSGPACK_AVAILABLE:
+    import msgpack
+
+H3_SEGMENT = re.compile(r'/[0-9a-f]{15}(?=/|$)')
+MAX_EXAMPLES = 10
+
+
+def endpoint_name(record: Dict) -> str:
+    """Method and path with H3 cells replaced by a placeholder"""
+    return f"{record['method']} {H3_SEGMENT.sub('/{h3_cell}', record['path'])}"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ReplayTarget:
+    def __init__(self, target: str, model_path: Optional[str] = None, startup_timeout: float = 120,
+                 port: Optional[int] = None, env: Optional[Dict[str, str]] = None):
+        """
+        target is a URL of a running server, or a backend directory (with
+        src/api.py) to start on port (default: a free one) for the duration
+        of the replay, with env added to its environment
+        """
+        self.name = target
+        self.model_path = model_path
+        self.startup_timeout = startup_timeout
+        self.port = port
+        self.env = env or {}
+        self.process = None
+        self.build_dir = None
+        if target.startswith(('http://', 'https://')):
+            self.url = target.rstrip('/')
+        else:
+            self.build_dir = Path(target).resolve()
+            if not (self.build_dir / 'src' / 'api.py').exists():
+                raise ValueError(f"{target} is neither a URL nor a backend directory with src/api.py")
+            self.url = None
+
+    def start(self) -> Dict:
+        """Start the build if needed and return its /health"""
+        if self.build_dir is not None:
+            env = dict(os.environ, REPLAY_CLOCK='1', CAPTURE_ENABLED='0')
+            # Live weather would make two runs see different inputs
+            env.pop('OPENWEATHER_API_KEY', None)
+            env.pop('WEATHER_API_URL', None)
+            if self.model_path:
+                env['MODEL_PATH'] = str(Path(self.model_path).resolve())
+            env.update(self.env)
+            port = self.port or free_port()
+            self.url = f"http://127.0.0.1:{port}"
+            self.process = subprocess.Popen(
+                [sys.executable, '-m', 'uvicorn', 'src.api:app', '--host', '127.0.0.1', '--port', str(port),
+                 '--log-level', 'warning'],
+                cwd=self.build_dir, env=env
+            )
+
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process is not None and self.process.poll() is not None:
+                raise RuntimeError(f"{self.name} exited during startup")
+            try:
+                response = httpx.get(f"{self.url}/health", timeout=30)
+                health = response.json()
+                if health.get('status') == 'healthy':
+                    return health
+            except (httpx.HTTPError, ValueError):
+                pass
+            time.sleep(0.5)
+        self.stop()
+        raise RuntimeError(f"{self.name} did not become healthy within {self.startup_timeout}s")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+
+class Replayer:
+    def __init__(self, config_path: str = "configs/params.yaml"):
+        """Initialize replayer with the replay config section"""
+        with open(config_path, 'r') as f:
+            self.config = yaml.safe_load(f)
+
+        self.replay_config = self.config.get('replay', {})
+        self.timeout = self.replay_config.get('timeout', 60)
+        self.tolerance = self.replay_config.get('tolerance', 1e-6)
+        self.ignore_fields = set(self.replay_config.get('ignore_fields', []))
+
+    @staticmethod
+    def replay_times(records: List[Dict], clock: Optional[datetime]) -> List[str]:
+        """
+        Wall-clock time each request sees: its recorded arrival time, or with
+        clock, the same offsets from the first request starting at clock
+        """
+        if clock is None:
+            return [datetime.fromtimestamp(record['t']).isoformat() for record in records]
+        t0 = records[0]['t']
+        return [(clock + timedelta(seconds=record['t'] - t0)).isoformat() for record in records]
+
+    async def _send(self, client: httpx.AsyncClient, record: Dict, replay_time: str, scheduled: float) -> Dict:
+        """One request; latency is measured from its scheduled start (queueing included)"""
+        headers = dict(record.get('headers', {}))
+        headers[REPLAY_TIME_HEADER] = replay_time
+        url = record['path'] + (f"?{record['query']}" if record.get('query') else '')
+        result = {'endpoint': endpoint_name(record), 'status': None, 'body': b'', 'content_type': '',
+                  'degraded': False}
+        try:
+            response = await client.request(record['method'], url, content=record['body'] or None, headers=headers)
+            result.update(
+                status=response.status_code,
+                body=response.content,
+                content_type=response.headers.get('content-type', ''),
+                degraded=response.headers.get('x-forecast-source') == 'lookup-table',
+            )
+        except httpx.HTTPError as e:
+            result['error'] = type(e).__name__
+        result['latency_ms'] = (time.perf_counter() - scheduled) * 1000
+        return result
+
+    async def replay(self, url: str, records: List[Dict], replay_times: List[str],
+                     speed: float, concurrency: int) -> Dict:
+        """
+        Send every record in arrival order. speed > 0 keeps the recorded gaps
+        divided by speed (open loop); speed 0 sends back to back with
+        `concurrency` requests in flight.
+        """
+        results = [None] * len(records)
+        async with httpx.AsyncClient(base_url=url, timeout=self.timeout) as client:
+            started = time.perf_counter()
+            if speed > 0:
+                t0 = records[0]['t']
+                tasks = []
+                for i, record in enumerate(records):
+                    scheduled = started + (record['t'] - t0) / speed
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    tasks.append(asyncio.create_task(self._send(client, record, replay_times[i], scheduled)))
+                results = await asyncio.gather(*tasks)
+            else:
+                next_index = 0
+
+                async def worker():
+                    nonlocal next_index
+                    while next_index < len(records):
+                        i = next_index
+                        next_index += 1
+                        results[i] = await self._send(client, records[i], replay_times[i], time.perf_counter())
+
+                await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+            elapsed = time.perf_counter() - started
+        return {'elapsed': elapsed, 'results': list(results)}
+
+    # ------------------------------------------------------------------
+    # Reporting
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def latency_stats(results: List[Dict], elapsed: float) -> Dict:
+        count = len(results)
+        errors = sum(1 for r in results if r['status'] is None or r['status'] >= 500)
+        lat_ms = np.array([r['latency_ms'] for r in results]) if count else np.zeros(1)
+        return {
+            'requests': count,
+            'errors': errors,
+            'degraded': sum(1 for r in results if r['degraded']),
+            'throughput_rps': round(count / elapsed, 3) if elapsed > 0 else 0.0,
+            'p50_ms': round(float(np.percentile(lat_ms, 50)), 3),
+            'p95_ms': round(float(np.percentile(lat_ms, 95)), 3),
+            'p99_ms': round(float(np.percentile(lat_ms, 99)), 3),
+        }
+
+    def summarize(self, run: Dict) -> Dict:
+        results = run['results']
+        per_endpoint = {}
+        for endpoint in sorted({r['endpoint'] for r in results}):
+            per_endpoint[endpoint] = self.latency_stats([r for r in results if r['endpoint'] == endpoint],
+                                                        run['elapsed'])
+        return {
+            'duration_s': round(run['elapsed'], 3),
+            'overall': self.latency_stats(results, run['elapsed']),
+            'endpoints': per_endpoint,
+        }
+
+    def decode_body(self, body: bytes, content_type: str):
+        """Comparable form of a response body (the raw bytes for binary encodings)"""
+        media_type = content_type.split(';')[0].strip()
+        try:
+            if media_type == JSON_MEDIA_TYPE:
+                return json.loads(body)
+            if media_type == NDJSON_MEDIA_TYPE:
+                return [json.loads(line) for line in body.splitlines() if line.strip()]
+            if media_type == MSGPACK_MEDIA_TYPE and MSGPACK_AVAILABLE:
+                return msgpack.unpackb(body)
+        except ValueError:
+            pass
+        return body
+
+    def diff_values(self, a, b, path: str = '$') -> Optional[str]:
+        """Path of the first difference between two decoded bodies (None when equal)"""
+        if isinstance(a, dict) and isinstance(b, dict):
+            for key in sorted(set(a) | set(b), key=str):
+                if key in self.ignore_fields:
+                    continue
+                if key not in a or key not in b:
+                    return f"{path}.{key}"
+                found = self.diff_values(a[key], b[key], f"{path}.{key}")
+                if found:
+                    return found
+            return None
+        if isinstance(a, list) and isinstance(b, list):
+            if len(a) != len(b):
+                return f"{path} (length {len(a)} vs {len(b)})"
+            for i, (x, y) in enumerate(zip(a, b)):
+                found = self.diff_values(x, y, f"{path}[{i}]")
+                if found:
+                    return found
+            return None
+        numbers = (int, float)
+        if isinstance(a, numbers) and isinstance(b, numbers) and not isinstance(a, bool) and not isinstance(b, bool):
+            return None if abs(a - b) <= self.tolerance else f"{path} ({a} vs {b})"
+        return None if a == b else f"{path} ({str(a)[:40]} vs {str(b)[:40]})"
+
+    def compare_outputs(self, baseline: List[Dict], other: List[Dict]) -> Dict:
+        """
+        Per-request comparison with the baseline build. Requests answered from
+        the lookup table (or not answered) on either side are skipped.
+        """
+        counts = Counter()
+        examples = []
+        for i, (a, b) in enumerate(zip(baseline, other)):
+            if a['status'] is None or b['status'] is None or a['degraded'] or b['degraded']:
+                counts['skipped'] += 1
+                continue
+            if a['status'] != b['status']:
+                difference = f"status {a['status']} vs {b['status']}"
+            elif a['body'] == b['body']:
+                difference = None
+            else:
+                difference = self.diff_values(self.decode_body(a['body'], a['content_type']),
+                                              self.decode_body(b['body'], b['content_type']))
+            if difference is None:
+                counts['identical'] += 1
+            else:
+                counts['different'] += 1
+                if len(examples) < MAX_EXAMPLES:
+                    examples.append({'index': i, 'endpoint': a['endpoint'], 'difference': difference})
+        return {**{key: counts[key] for key in ('identical', 'different', 'skipped')}, 'examples': examples}
+
+    def run(
+        self,
+        capture: List[str],
+        targets: List[str],
+        speed: float = 1.0,
+        concurrency: int = 4,
+        clock: Optional[datetime] = None,
+        model_path: Optional[str] = None,
+        model_version: Optional[str] = None,
+        endpoints: Optional[List[str]] = None,
+        limit: Optional[int] = None,
+    ) -> Dict:
+        """Replay a capture against each target in turn and compare them with the first"""
+        records = read_capture([Path(path) for path in capture])
+        if endpoints:
+            records = [r for r in records if any(endpoint_name(r).startswith(e) for e in endpoints)]
+        if limit:
+            records = records[:limit]
+        if not records:
+            raise ValueError("No records to replay")
+
+        # Pinned model: the given version, else the one that served the capture
+        captured_versions = Counter(r['model_version'] for r in records if r.get('model_version'))
+        expected_version = model_version or (captured_versions.most_common(1)[0][0] if captured_versions else None)
+        replay_times = self.replay_times(records, clock)
+        span = records[-1]['t'] - records[0]['t']
+        print(f"Replaying {len(records)} requests ({span:.1f}s recorded, "
+              f"{'back to back' if speed <= 0 else f'speed {speed:g}x'}), clock from {replay_times[0]}")
+
+        runs = []
+        for target in targets:
+            replay_target = ReplayTarget(target, model_path, self.replay_config.get('startup_timeout', 120))
+            health = replay_target.start()
+            try:
+                version = health.get('models_version') or health.get('model_version')
+                if expected_version and version != expected_version:
+                    raise RuntimeError(f"{target} serves model {version}, expected {expected_version} "
+                                       "(use --model to pin the model file, or --model-version)")
+                run = asyncio.run(self.replay(replay_target.url, records, replay_times, speed, concurrency))
+            finally:
+                replay_target.stop()
+            summary = self.summarize(run)
+            runs.append({'target': target, 'model_version': version, **summary, 'results': run['results']})
+            overall = summary['overall']
+            print(f"  {target}: p50={overall['p50_ms']}ms p99={overall['p99_ms']}ms "
+                  f"errors={overall['errors']} degraded={overall['degraded']}")
+
+        report = {
+            'capture': capture,
+            'records': len(records),
+            'speed': speed,
+            'clock': replay_times[0],
+            'model_version': expected_version,
+            'targets': [{key: value for key, value in run.items() if key != 'results'} for run in runs],
+            'diffs': {
+                run['target']: self.compare_outputs(runs[0]['results'], run['results']) for run in runs[1:]
+            },
+        }
+        return report
+
+
+def print_report(report: Dict):
+    """Latency per endpoint and target, then output diffs against the first target"""
+    targets = report['targets']
+    print(f"\n=== Replay of {report['records']} requests (model {report['model_version'] or 'unpinned'}) ===")
+    endpoints = sorted({endpoint for target in targets for endpoint in target['endpoints']})
+    header = f"{'endpoint':<32} {'target':<28} {'requests':>8} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9} {'errors':>6}"
+    print(header)
+    for endpoint in endpoints + ['overall']:
+        for i, target in enumerate(targets):
+            stats = target['overall'] if endpoint == 'overall' else target['endpoints'].get(endpoint)
+            if stats is None:
+                continue
+            label = endpoint if i == 0 else ''
+            line = (f"{label:<32} {target['target'][-28:]:<28} {stats['requests']:>8} {stats['p50_ms']:>9.2f} "
+                    f"{stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['errors']:>6}")
+            if i > 0:
+                base = targets[0]['overall'] if endpoint == 'overall' else targets[0]['endpoints'][endpoint]
+                if base['p50_ms'] > 0:
+                    line += f"  p50 {stats['p50_ms'] / base['p50_ms']:.2f}x"
+            print(line)
+
+    for target, diff in report['diffs'].items():
+        print(f"\nOutputs of {target} vs {targets[0]['target']}: {diff['identical']} identical, "
+              f"{diff['different']} different, {diff['skipped']} skipped (degraded or failed)")
+        for example in diff['examples']:
+            print(f"  #{example['index']} {example['endpoint']}: {example['difference']}")
+
+
+def print_info(records: List[Dict]):
+    """What a capture holds: time span, endpoints, model versions"""
+    if not records:
+        print("[WARNING] No records")
+        return
+    span = records[-1]['t'] - records[0]['t']
+    print(f"{len(records)} requests from {datetime.fromtimestamp(records[0]['t']).isoformat()} "
+          f"to {datetime.fromtimestamp(records[-1]['t']).isoformat()} ({span:.1f}s)")
+    for endpoint, count in Counter(endpoint_name(r) for r in records).most_common():
+        latencies = [r['ms'] for r in records if endpoint_name(r) == endpoint and r.get('ms') is not None]
+        p50 = f"{np.percentile(latencies, 50):.2f}ms" if latencies else '-'
+        print(f"  {endpoint:<32} {count:>7}  recorded p50 {p50}")
+    for version, count in Counter(r.get('model_version') for r in records).most_common():
+        print(f"  model {version}: {count}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CongestionAI traffic replay")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    info_parser = subparsers.add_parser('info', help="Summarize a capture")
+    info_parser.add_argument('capture', nargs='+', help="Capture files or directories")
+
+    run_parser = subparsers.add_parser('run', help="Replay a capture against one or more builds")
+    run_parser.add_argument('capture', nargs='+', help="Capture files or directories")
+    run_parser.add_argument('--config', default="configs/params.yaml")
+    run_parser.add_argument('--target', action='append', required=True,
+                            help="Server URL or backend directory of a build (repeat to compare; the first is the baseline)")
+    run_parser.add_argument('--speed', type=float, default=None, help="1 = recorded pace, 2 = twice as fast, 0 = back to back")
+    run_parser.add_argument('--concurrency', type=int, default=None, help="Requests in flight with --speed 0")
+    run_parser.add_argument('--clock', help="Wall-clock time of the first request, e.g. 2024-01-15T08:00 (default: as recorded)")
+    run_parser.add_argument('--model', help="Model file every started build loads (MODEL_PATH)")
+    run_parser.add_argument('--model-version', help="Model version the targets must serve (default: the capture's)")
+    run_parser.add_argument('--endpoint', action='append', help="Only these endpoints, e.g. 'POST /forecast'")
+    run_parser.add_argument('--limit', type=int, help="Replay only the first N requests")
+    run_parser.add_argument('--output', help="Write the report as JSON")
+
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        print_info(read_capture([Path(path) for path in args.capture]))
+    else:
+        replayer = Replayer(args.config)
+        report = replayer.run(
+            args.capture,
+            args.target,
+            speed=args.speed if args.speed is not None else replayer.replay_config.get('speed', 1.0),
+            concurrency=args.concurrency or replayer.replay_config.get('concurrency', 4),
+            clock=datetime.fromisoformat(args.clock) if args.clock else None,
+            model_path=args.model,
+            model_version=args.model_version,
+            endpoints=args.endpoint,
+            limit=args.limit,
+        )
+        print_report(report)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"\n[OK] Report saved to {args.output}")
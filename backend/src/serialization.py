@@ -0,0 +1,444 @@
+"""
+Serialization for CongestionAI
+Columnar batch payloads, Accept-header content negotiation (JSON, MessagePack, Arrow)
+and decoding of batch request bodies (JSON rows or columns, NumPy .npy, Arrow IPC)
+"""
+
+import io
+import json
+from typing import Dict, Optional, Union
+
+import numpy as np
+import pandas as pd
+from fastapi import Response
+
+# Optional fast/binary encoders; formats whose library is missing are not offered
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+try:
+    import pyarrow as pa
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+
+JSON_MEDIA_TYPE = "application/json"
+NPY_MEDIA_TYPE = "application/x-npy"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Accepted aliases -> canonical encoding name
+MEDIA_TYPES = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+    "application/vnd.msgpack": "msgpack",
+    "application/vnd.apache.arrow.stream": "arrow",
+    "application/vnd.apache.arrow.file": "arrow",
+}
+
+
+def available_encodings() -> Dict[str, bool]:
+    """Which response encodings this server can produce"""
+    return {
+        "json": True,
+        "ndjson": True,
+        "msgpack": MSGPACK_AVAILABLE,
+        "arrow": ARROW_AVAILABLE,
+    }
+
+
+def negotiate_encoding(accept: Optional[str]) -> Optional[str]:
+    """
+    Pick a response encoding from an Accept header.
+    Returns None when nothing acceptable can be produced (-> 406).
+    """
+    if not accept:
+        return "json"
+
+    available = available_encodings()
+    candidates = []
+    for order, part in enumerate(accept.split(",")):
+        fields = [f.strip() for f in part.split(";")]
+        media_type = fields[0].lower()
+        quality = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            candidates.append((-quality, order, media_type))
+
+    for _, _, media_type in sorted(candidates):
+        if media_type in ("*/*", "application/*"):
+            return "json"
+        encoding = MEDIA_TYPES.get(media_type)
+        if encoding and available[encoding]:
+            return encoding
+
+    return None
+
+
+def build_columnar_batch(
+    lats: np.ndarray,
+    lons: np.ndarray,
+    scores: Optional[np.ndarray],
+    risk_codes: Optional[np.ndarray],
+    risk_levels,
+    timestamp: str,
+    confidence: Union[float, np.ndarray, None],
+    extra_columns: Optional[Dict] = None
+) -> Dict:
+    """
+    Columnar batch forecast: parallel arrays instead of one dict per location.
+    Values shared by every row are stored once. scores / risk_codes may be None
+    when those fields were not requested. Per-row confidence becomes a column.
+    """
+    data = {
+        "latitude": np.ascontiguousarray(lats, dtype=np.float64),
+        "longitude": np.ascontiguousarray(lons, dtype=np.float64),
+    }
+    if scores is not None:
+        data["congestion_score"] = np.round(np.asarray(scores, dtype=np.float32), 3)
+    if risk_codes is not None:
+        data["risk_code"] = np.asarray(risk_codes, dtype=np.int8)
+    if np.ndim(confidence):
+        data["confidence"] = np.round(np.asarray(confidence, dtype=np.float32), 3)
+        confidence = None
+    data.update(extra_columns or {})
+
+    return {
+        "success": True,
+        "format": "columnar",
+        "count": int(len(data["latitude"])),
+        "timestamp": timestamp,
+        "confidence": confidence,
+        "risk_levels": list(risk_levels),
+        "data": data
+    }
+
+
+def _orjson_default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def encode_json(payload: Dict) -> bytes:
+    """Fast JSON encoding; numpy arrays are serialized natively by orjson"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY, default=_orjson_default)
+
+    def default(obj):
+        if isinstance(obj, np.ndarray):
+            if obj.dtype == np.float32:
+                # Avoid float32 -> float64 widening artifacts (0.123 -> 0.12300000339...)
+                obj = np.round(obj.astype(np.float64), 6)
+            if obj.dtype.kind == 'f':
+                # NaN (e.g. a point model's interval bounds) -> null, as orjson does
+                return [None if v != v else v for v in obj.tolist()]
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+    return json.dumps(payload, separators=(",", ":"), default=default).encode("utf-8")
+
+
+def encode_msgpack(payload: Dict) -> bytes:
+    """
+    MessagePack encoding. Arrays become {dtype, shape, data} maps holding raw
+    little-endian bytes, decodable with numpy.frombuffer
+    """
+    def default(obj):
+        if isinstance(obj, np.ndarray):
+            array = np.ascontiguousarray(obj)
+            return {
+                "dtype": array.dtype.newbyteorder("<").str,
+                "shape": list(array.shape),
+                "data": array.astype(array.dtype.newbyteorder("<"), copy=False).tobytes(),
+            }
+        if isinstance(obj, np.generic):
+            return obj.item()
+        raise TypeError(f"Type is not MessagePack serializable: {type(obj).__name__}")
+
+    return msgpack.packb(payload, default=default, use_bin_type=True)
+
+
+def _arrow_batch(payload: Dict):
+    """Record batch from a columnar payload; scalar fields travel as schema metadata"""
+    metadata = {
+        key: json.dumps(value)
+        for key, value in payload.items()
+        if key != "data"
+    }
+    return pa.RecordBatch.from_pydict(
+        {name: pa.array(values) for name, values in payload["data"].items()},
+        metadata=metadata
+    )
+
+
+def encode_arrow(payload: Dict) -> bytes:
+    """
+    Arrow IPC stream with one record batch; scalar fields travel as schema metadata
+    """
+    batch = _arrow_batch(payload)
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_ndjson(rows) -> bytes:
+    """One JSON document per line"""
+    return b"".join(encode_json(row) + b"\n" for row in rows)
+
+
+class ChunkStreamEncoder:
+    """
+    Incremental encoder for streamed responses. Each chunk is encoded as soon as
+    it is produced:
+      ndjson  - one row per line, or one columnar chunk per line
+      msgpack - concatenated columnar chunk maps (msgpack.Unpacker reads them in turn)
+      arrow   - an Arrow IPC stream with one record batch per chunk
+    """
+
+    # IPC end-of-stream marker: continuation token followed by a zero length
+    ARROW_EOS = b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self.media_type = NDJSON_MEDIA_TYPE if encoding in ("json", "ndjson") else ENCODERS[encoding][1]
+        self._schema_sent = False
+
+    def encode_rows(self, rows) -> bytes:
+        return encode_ndjson(rows)
+
+    def encode_chunk(self, payload: Dict) -> bytes:
+        if self.encoding == "msgpack":
+            return encode_msgpack(payload)
+
+        if self.encoding == "arrow":
+            # Per-chunk counters would be misleading as stream-level schema metadata
+            batch = _arrow_batch({k: v for k, v in payload.items() if k not in ("count", "offset")})
+            header = b""
+            if not self._schema_sent:
+                # Metadata of the first chunk describes the whole stream
+                header = batch.schema.serialize().to_pybytes()
+                self._schema_sent = True
+            return header + batch.serialize().to_pybytes()
+
+        return encode_json(payload) + b"\n"
+
+    def finish(self) -> bytes:
+        if self.encoding == "arrow" and self._schema_sent:
+            return self.ARROW_EOS
+        return b""
+
+
+ENCODERS = {
+    "json": (encode_json, JSON_MEDIA_TYPE),
+    "ndjson": (lambda payload: encode_ndjson([payload]), NDJSON_MEDIA_TYPE),
+    "msgpack": (encode_msgpack, MSGPACK_MEDIA_TYPE),
+    "arrow": (encode_arrow, ARROW_MEDIA_TYPE),
+}
+
+
+def encode_response(payload: Dict, encoding: str) -> Response:
+    """Encode a payload with the negotiated encoding"""
+    encoder, media_type = ENCODERS[encoding]
+    return Response(content=encoder(payload), media_type=media_type)
+
+
+class UnsupportedMediaTypeError(ValueError):
+    """Raised for request bodies in a format this server cannot decode"""
+
+
+def _json_loads(body: bytes):
+    return orjson.loads(body) if ORJSON_AVAILABLE else json.loads(body)
+
+
+def parse_timestamps(values) -> np.ndarray:
+    """ISO timestamps -> datetime64 wall-clock times (UTC offsets are dropped, as for single timestamps)"""
+    try:
+        wall_clock = pd.Index(values, dtype=str).str.replace(r"(?<=\d)(Z|[+-]\d{2}:\d{2})$", "", regex=True)
+        return pd.to_datetime(wall_clock, format="ISO8601").to_numpy()
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid timestamps: {e}")
+
+
+def _validate_batch(lats: np.ndarray, lons: np.ndarray, timestamps: Optional[np.ndarray]) -> Dict:
+    """Shape and range checks on whole arrays (no per-row Python validation)"""
+    if lats.ndim != 1 or lons.ndim != 1 or len(lats) != len(lons):
+        raise ValueError("latitudes and longitudes must be 1-D arrays of the same length")
+    if timestamps is not None and len(timestamps) != len(lats):
+        raise ValueError("timestamps must have one entry per location")
+    if not (np.all(np.abs(lats) <= 90) and np.all(np.abs(lons) <= 180)):
+        # NaN fails both comparisons, so it is rejected here too
+        raise ValueError("latitudes must be within [-90, 90] and longitudes within [-180, 180]")
+    return {"latitude": lats, "longitude": lons, "timestamps": timestamps}
+
+
+def _float_column(values) -> np.ndarray:
+    """Coordinates as float64, without copying when they already are"""
+    array = np.asarray(values)
+    if array.dtype != np.float64:
+        array = array.astype(np.float64)
+    return array
+
+
+def decode_json_batch(body: bytes) -> Dict:
+    """
+    JSON batch body, either
+      rows:    {"locations": [{"latitude": .., "longitude": ..}, ...], "timestamp": ..}
+      columns: {"latitudes": [...], "longitudes": [...], "timestamps": [...] (optional), "timestamp": ..}
+    """
+    try:
+        data = _json_loads(body)
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON body: {e}")
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+
+    if "latitudes" in data or "longitudes" in data:
+        try:
+            lats = np.asarray(data.get("latitudes"), dtype=np.float64)
+            lons = np.asarray(data.get("longitudes"), dtype=np.float64)
+        except (TypeError, ValueError):
+            raise ValueError("latitudes and longitudes must be arrays of numbers")
+        timestamps = parse_timestamps(data["timestamps"]) if data.get("timestamps") is not None else None
+    elif isinstance(data.get("locations"), list):
+        locations = data["locations"]
+        try:
+            lats = np.fromiter((loc["latitude"] for loc in locations), dtype=np.float64, count=len(locations))
+            lons = np.fromiter((loc["longitude"] for loc in locations), dtype=np.float64, count=len(locations))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("Each location must be an object with numeric latitude and longitude")
+        timestamps = None
+    else:
+        raise ValueError("Provide either locations or latitudes/longitudes")
+
+    batch = _validate_batch(lats, lons, timestamps)
+    batch["timestamp"] = data.get("timestamp")
+    return batch
+
+
+def decode_npy_batch(body: bytes) -> Dict:
+    """
+    NumPy .npy body, wrapped zero-copy with np.frombuffer. Either an (n, 2)
+    float array of [latitude, longitude] rows or a structured array with
+    latitude, longitude and optionally timestamp (datetime64) fields.
+    """
+    header = io.BytesIO(body)
+    try:
+        version = np.lib.format.read_magic(header)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(header)
+    except ValueError as e:
+        raise ValueError(f"Invalid .npy body: {e}")
+    if dtype.hasobject:
+        raise ValueError(".npy bodies must not contain Python objects")
+
+    count = int(np.prod(shape))
+    if len(body) - header.tell() < count * dtype.itemsize:
+        raise ValueError(".npy body is truncated")
+    array = np.frombuffer(body, dtype=dtype, count=count, offset=header.tell())
+    array = array.reshape(shape, order="F" if fortran_order else "C")
+
+    if dtype.names:
+        if "latitude" not in dtype.names or "longitude" not in dtype.names:
+            raise ValueError("Structured .npy bodies need latitude and longitude fields")
+        timestamps = None
+        if "timestamp" in dtype.names:
+            timestamps = array["timestamp"]
+            if timestamps.dtype.kind != "M":
+                raise ValueError("timestamp field must be datetime64")
+        return _validate_batch(_float_column(array["latitude"]), _float_column(array["longitude"]), timestamps)
+
+    if array.ndim != 2 or array.shape[1] != 2 or array.dtype.kind != "f":
+        raise ValueError("Plain .npy bodies must be float arrays of shape (n, 2) holding [latitude, longitude]")
+    return _validate_batch(_float_column(array[:, 0]), _float_column(array[:, 1]), None)
+
+
+def _arrow_column(table, name: str) -> np.ndarray:
+    """Column as numpy; zero-copy for single-chunk columns without nulls"""
+    column = table.column(name)
+    if column.null_count:
+        raise ValueError(f"{name} must not contain nulls")
+    if column.num_chunks == 1:
+        return column.chunk(0).to_numpy(zero_copy_only=False)
+    return column.to_numpy()
+
+
+def decode_arrow_batch(body: bytes) -> Dict:
+    """
+    Arrow IPC body (stream or file format) with latitude, longitude and
+    optionally timestamp columns. Buffers are read in place from the body.
+    """
+    buffer = pa.py_buffer(body)
+    try:
+        if body[:6] == b"ARROW1":
+            table = pa.ipc.open_file(buffer).read_all()
+        else:
+            table = pa.ipc.open_stream(buffer).read_all()
+    except pa.ArrowInvalid as e:
+        raise ValueError(f"Invalid Arrow body: {e}")
+
+    if "latitude" not in table.column_names or "longitude" not in table.column_names:
+        raise ValueError("Arrow bodies need latitude and longitude columns")
+
+    timestamps = None
+    if "timestamp" in table.column_names:
+        column = table.column("timestamp")
+        if pa.types.is_timestamp(column.type):
+            timestamps = _arrow_column(table, "timestamp")
+        else:
+            timestamps = parse_timestamps(column.to_pylist())
+    return _validate_batch(
+        _float_column(_arrow_column(table, "latitude")),
+        _float_column(_arrow_column(table, "longitude")),
+        timestamps
+    )
+
+
+def decode_batch_request(body: bytes, content_type: Optional[str]) -> Dict:
+    """
+    Decode a batch request body by Content-Type into
+    {latitude, longitude, timestamps (per-row datetime64 or None), timestamp (shared ISO string or None)}
+    """
+    media_type = (content_type or JSON_MEDIA_TYPE).split(";")[0].strip().lower()
+
+    if media_type == JSON_MEDIA_TYPE:
+        return decode_json_batch(body)
+
+    if media_type in (NPY_MEDIA_TYPE, "application/npy", "application/octet-stream"):
+        batch = decode_npy_batch(body)
+    elif MEDIA_TYPES.get(media_type) == "arrow" and ARROW_AVAILABLE:
+        batch = decode_arrow_batch(body)
+    else:
+        raise UnsupportedMediaTypeError(
+            f"Unsupported Content-Type {media_type}; use application/json, {NPY_MEDIA_TYPE}"
+            + (f" or {ARROW_MEDIA_TYPE}" if ARROW_AVAILABLE else "")
+        )
+
+    # Binary bodies carry no shared timestamp; it comes from the query string
+    batch["timestamp"] = None
+    return batch
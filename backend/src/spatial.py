@@ -0,0 +1,306 @@
+"""
+Spatial utilities for CongestionAI
+Server-side H3 coverage of bounding boxes and polygons, and a precomputed
+H3 neighbour index for neighbourhood-aggregated features
+"""
+
+import hashlib
+import math
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import h3
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+class AreaTooLargeError(ValueError):
+    """Raised when an area would need more cells than allowed"""
+
+
+def bbox_to_polygon(bbox: Sequence[float]) -> List[Tuple[float, float]]:
+    """[min_lat, min_lon, max_lat, max_lon] -> closed-ring (lat, lon) vertices"""
+    min_lat, min_lon, max_lat, max_lon = bbox
+    if min_lat >= max_lat or min_lon >= max_lon:
+        raise ValueError("bbox must be [min_lat, min_lon, max_lat, max_lon] with min < max")
+    return [(min_lat, min_lon), (min_lat, max_lon), (max_lat, max_lon), (max_lat, min_lon)]
+
+
+def polygon_area_km2(polygon: Sequence[Tuple[float, float]]) -> float:
+    """Approximate polygon area (equirectangular projection + shoelace)"""
+    mean_lat = math.radians(sum(lat for lat, _ in polygon) / len(polygon))
+    xs = [math.radians(lon) * math.cos(mean_lat) * EARTH_RADIUS_KM for _, lon in polygon]
+    ys = [math.radians(lat) * EARTH_RADIUS_KM for lat, _ in polygon]
+
+    area = 0.0
+    for i in range(len(polygon)):
+        j = (i + 1) % len(polygon)
+        area += xs[i] * ys[j] - xs[j] * ys[i]
+    return abs(area) / 2
+
+
+def estimate_cell_count(polygon: Sequence[Tuple[float, float]], resolution: int) -> int:
+    """Cheap upper-bound-ish estimate of the cells needed to cover a polygon"""
+    return int(math.ceil(polygon_area_km2(polygon) / h3.average_hexagon_area(resolution, 'km^2')))
+
+
+def resolution_for_zoom(zoom: float, area_config: Dict) -> int:
+    """Map a web-map zoom level to an H3 resolution (zoom 14 -> res 8 by default)"""
+    resolution = int(round(zoom)) - area_config['zoom_resolution_offset']
+    return max(area_config['min_resolution'], min(area_config['max_resolution'], resolution))
+
+
+def cover_polygon(
+    polygon: Sequence[Tuple[float, float]],
+    resolution: Optional[int],
+    zoom: Optional[float],
+    area_config: Dict
+) -> Tuple[List[str], int]:
+    """
+    Enumerate the H3 cells covering a polygon, returned sorted so the same area
+    always yields the same cell list.
+
+    With an explicit resolution the area must fit in area.max_cells cells. With
+    a zoom level (or neither), the finest resolution that fits is chosen,
+    starting from the zoom's natural resolution.
+    """
+    max_cells = area_config['max_cells']
+    polygon = [(float(lat), float(lon)) for lat, lon in polygon]
+    if len(polygon) > 1 and polygon[0] == polygon[-1]:
+        polygon = polygon[:-1]
+    if len(polygon) < 3:
+        raise ValueError("polygon needs at least 3 distinct vertices")
+
+    if resolution is not None:
+        candidates = [resolution]
+    else:
+        start = resolution_for_zoom(zoom, area_config) if zoom is not None else area_config['default_resolution']
+        candidates = list(range(start, area_config['min_resolution'] - 1, -1))
+
+    shape = h3.LatLngPoly(polygon)
+    for res in candidates:
+        # Skip enumeration when the estimate is clearly over the cap
+        if estimate_cell_count(polygon, res) > max_cells * 1.5:
+            continue
+
+        cells = h3.polygon_to_cells(shape, res)
+        if not cells:
+            # Area smaller than a cell: use the cell containing its first vertex
+            cells = [h3.latlng_to_cell(polygon[0][0], polygon[0][1], res)]
+        if len(cells) <= max_cells:
+            return sorted(cells), res
+
+    raise AreaTooLargeError(
+        f"Area needs more than {max_cells} cells at resolution {candidates[-1]}; "
+        "use a smaller area or a coarser resolution"
+    )
+
+
+def lattice_cells(lats, lons, resolution: int, precision: int) -> Tuple[List[str], np.ndarray]:
+    """
+    H3 cells of many locations, computed once per distinct point of a lattice
+    of `precision` decimal degrees. Returns the distinct cells (one per lattice
+    point, possibly repeated) and, per location, its index into them.
+    """
+    scale = 10 ** precision
+    qlat = np.round(np.asarray(lats, dtype=np.float64) * scale).astype(np.int64)
+    qlon = np.round(np.asarray(lons, dtype=np.float64) * scale).astype(np.int64)
+    keys = (qlat + 90 * scale) * (360 * scale + 1) + (qlon + 180 * scale)
+
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    unique_lats = (unique_keys // (360 * scale + 1) - 90 * scale) / scale
+    unique_lons = (unique_keys % (360 * scale + 1) - 180 * scale) / scale
+    cells = [
+        h3.latlng_to_cell(lat, lon, resolution)
+        for lat, lon in zip(unique_lats.tolist(), unique_lons.tolist())
+    ]
+    return cells, inverse.reshape(-1)
+
+
+def area_id(cells: Sequence[str], resolution: int) -> str:
+    """Canonical identifier for a set of cells (independent of how it was requested)"""
+    digest = hashlib.sha1(f"{resolution}:{','.join(sorted(cells))}".encode()).hexdigest()
+    return digest[:16]
+
+
+class NeighbourIndex:
+    """
+    Precomputed k-ring adjacency over a fixed set of H3 cells (one region).
+
+    Neighbours are stored per ring distance in CSR form: for ring k,
+    indices[k][indptr[k][i]:indptr[k][i + 1]] are the offsets (into self.cells)
+    of the cells exactly k steps from cell i. Cells outside the set are dropped,
+    so lookups never touch h3 at query time.
+
+    The index can also carry a per-cell state matrix (latest observed values of
+    some columns), which is what inference aggregates over.
+    """
+
+    def __init__(self, cells: Sequence[str], k_max: int = 2):
+        """Build the index for a set of cells"""
+        self.k_max = k_max
+        self.cells = np.array(sorted(set(cells)))
+        self.cell_to_idx = {cell: i for i, cell in enumerate(self.cells.tolist())}
+        self.indptr = {}
+        self.indices = {}
+        self.state = None
+        self.state_observed = None
+        self.state_columns = []
+
+        for k in range(1, k_max + 1):
+            counts = np.zeros(len(self.cells) + 1, dtype=np.int64)
+            neighbours = []
+            for i, cell in enumerate(self.cells.tolist()):
+                ring = [self.cell_to_idx[c] for c in h3.grid_ring(cell, k) if c in self.cell_to_idx]
+                counts[i + 1] = len(ring)
+                neighbours.extend(ring)
+            self.indptr[k] = np.cumsum(counts)
+            self.indices[k] = np.array(neighbours, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def lookup(self, cells: Sequence[str]) -> np.ndarray:
+        """Offsets of cells in the index (-1 for cells outside it)"""
+        get = self.cell_to_idx.get
+        return np.fromiter((get(cell, -1) for cell in cells), dtype=np.int64, count=len(cells))
+
+    def expand(self, cell_idx: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        All (query row, neighbour offset) pairs within distance 1..k of each query cell.
+        Returns (rows, neighbours) as flat arrays; unknown cells (-1) have no pairs.
+        """
+        rows_parts, nbr_parts = [], []
+        known = np.flatnonzero(cell_idx >= 0)
+        cells = cell_idx[known]
+
+        for ring in range(1, k + 1):
+            indptr, indices = self.indptr[ring], self.indices[ring]
+            starts = indptr[cells]
+            counts = indptr[cells + 1] - starts
+            total = int(counts.sum())
+            if total == 0:
+                continue
+
+            # Vectorized concatenation of the CSR slices of every query cell
+            row_rep = np.repeat(known, counts)
+            within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            rows_parts.append(row_rep)
+            nbr_parts.append(indices[np.repeat(starts, counts) + within])
+
+        if not rows_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(rows_parts), np.concatenate(nbr_parts).astype(np.int64)
+
+    @staticmethod
+    def _mean_by_row(rows: np.ndarray, values: np.ndarray, n_rows: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Per-row mean of values (0 where a row has none) and per-row counts"""
+        counts = np.bincount(rows, minlength=n_rows)
+        sums = np.bincount(rows, weights=values, minlength=n_rows)
+        means = np.divide(sums, counts, out=np.zeros(n_rows), where=counts > 0)
+        return means, counts
+
+    def aggregate_asof(
+        self,
+        cell_idx: np.ndarray,
+        times: np.ndarray,
+        values: Dict[str, np.ndarray],
+        k: int,
+        chunk_rows: Optional[int] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Training-time neighbourhood features. For every row, average over the
+        neighbouring cells (distance 1..k) of each column's latest value
+        observed strictly before the row's time. times are int64 (e.g. seconds).
+        chunk_rows bounds the (row, neighbour) pair arrays, which otherwise
+        take a few hundred bytes per row at once.
+        """
+        n = len(cell_idx)
+        times = np.asarray(times, dtype=np.int64)
+        t_min = times.min() if n else 0
+
+        # Sort rows by (cell, time) under one composite int64 key
+        keys = (np.where(cell_idx >= 0, cell_idx, len(self.cells)) << 40) | (times - t_min)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        sorted_cells = sorted_keys >> 40
+        del keys
+
+        columns = {name: np.asarray(column, dtype=np.float64) for name, column in values.items()}
+        features = {name: np.zeros(n) for name in columns}
+        features['count'] = np.zeros(n, dtype=np.int64)
+        step = chunk_rows or max(n, 1)
+        for start in range(0, n, step):
+            end = min(start + step, n)
+            rows, nbrs = self.expand(cell_idx[start:end], k)
+            query = (nbrs << 40) | (times[start:end][rows] - t_min)
+            pos = np.searchsorted(sorted_keys, query, side='left') - 1
+            valid = pos >= 0
+            valid[valid] = sorted_cells[pos[valid]] == nbrs[valid]
+
+            rows, source = rows[valid], order[pos[valid]]
+            features['count'][start:end] = np.bincount(rows, minlength=end - start)
+            for name, column in columns.items():
+                features[name][start:end], _ = self._mean_by_row(rows, column[source], end - start)
+        return features
+
+    def aggregate_state(self, cell_idx: np.ndarray, k: int) -> Dict[str, np.ndarray]:
+        """
+        Inference-time neighbourhood features from the live per-cell state:
+        for every query row, the mean state of neighbouring cells (distance 1..k)
+        """
+        n = len(cell_idx)
+        rows, nbrs = self.expand(cell_idx, k)
+        observed = self.state_observed[nbrs]
+        rows, nbrs = rows[observed], nbrs[observed]
+
+        features = {}
+        counts = np.bincount(rows, minlength=n)
+        for j, name in enumerate(self.state_columns):
+            features[name], _ = self._mean_by_row(rows, self.state[nbrs, j].astype(np.float64), n)
+        features['count'] = counts
+        return features
+
+    def set_state(self, columns: List[str], cells: Sequence[str], values: np.ndarray):
+        """Replace the per-cell state with the given rows (later rows win)"""
+        self.state_columns = list(columns)
+        self.state = np.zeros((len(self.cells), len(columns)), dtype=np.float32)
+        self.state_observed = np.zeros(len(self.cells), dtype=bool)
+        self.update_state(cells, values)
+
+    def update_state(self, cells: Sequence[str], values: np.ndarray):
+        """Record new observations for cells in the index (others are ignored)"""
+        idx = self.lookup(cells)
+        known = idx >= 0
+        self.state[idx[known]] = np.asarray(values, dtype=np.float32)[known]
+        self.state_observed[idx[known]] = True
+
+    def save(self, path: str):
+        """Persist index (and state, if any) as a single .npz"""
+        arrays = {'cells': self.cells.astype('U'), 'k_max': np.array(self.k_max)}
+        for k in self.indptr:
+            arrays[f'indptr_{k}'] = self.indptr[k]
+            arrays[f'indices_{k}'] = self.indices[k]
+        if self.state is not None:
+            arrays['state'] = self.state
+            arrays['state_observed'] = self.state_observed
+            arrays['state_columns'] = np.array(self.state_columns, dtype='U')
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> 'NeighbourIndex':
+        """Load an index saved with save() without touching h3"""
+        data = np.load(path)
+        index = cls.__new__(cls)
+        index.k_max = int(data['k_max'])
+        index.cells = data['cells']
+        index.cell_to_idx = {cell: i for i, cell in enumerate(index.cells.tolist())}
+        index.indptr = {k: data[f'indptr_{k}'] for k in range(1, index.k_max + 1)}
+        index.indices = {k: data[f'indices_{k}'] for k in range(1, index.k_max + 1)}
+        index.state = data['state'] if 'state' in data else None
+        index.state_observed = data['state_observed'] if 'state_observed' in data else None
+        index.state_columns = data['state_columns'].tolist() if 'state_columns' in data else []
+        return index
@@ -0,0 +1,455 @@
+"""
+Live area subscriptions for CongestionAI
+Clients subscribe to an area and forecast horizon over WebSocket (/ws/area) or
+Server-Sent Events (/subscribe/area). Each (area, horizon) feed is computed
+once per refresh, however many clients watch it, and only cells whose score
+changed are pushed, as one pre-encoded delta shared by every subscriber.
+
+Load test with: python -m src.subscriptions loadtest --subscribers 100 1000 3000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from .serialization import encode_json
+
+SCORE_DECIMALS = 3  # scores are compared and sent at the precision the API responds with
+
+
+def _timed(func, *args):
+    """Call func and return (result, CPU seconds of the calling thread)"""
+    started = time.thread_time()
+    result = func(*args)
+    return result, time.thread_time() - started
+
+
+class Frame:
+    """One message, encoded once and sent as-is to every subscriber"""
+
+    __slots__ = ('event', 'text', 'sse')
+
+    def __init__(self, event: str, payload: Dict):
+        self.event = event
+        self.text = encode_json({'type': event, **payload}).decode()
+        self.sse = f"event: {event}\ndata: {self.text}\n\n".encode()
+
+
+class AreaFeed:
+    """Latest scores for one (area, horizon) and the queues of its subscribers"""
+
+    def __init__(self, area_id: str, cells: List[str], centers: np.ndarray, resolution: int, hours_ahead: int):
+        self.area_id = area_id
+        self.cells = cells
+        self.centers = centers
+        self.resolution = resolution
+        self.hours_ahead = hours_ahead
+        self.subscribers = set()
+        self.lock = asyncio.Lock()
+
+        self.codes = None  # scores in units of 10^-SCORE_DECIMALS
+        self.risk = None
+        self.seq = 0
+        self.timestamp = None
+        self.state = None  # (cache version, hour) the scores were computed for
+        self.updated_at = 0.0
+        self._snapshot = None
+
+    def update(self, scores: np.ndarray, risk: np.ndarray, timestamp: datetime, state: Tuple) -> Optional[Frame]:
+        """Store new scores; returns the delta frame if any cell (or the target hour) changed"""
+        codes = np.round(scores * 10 ** SCORE_DECIMALS).astype(np.int32)
+        first = self.codes is None
+        changed = None if first else np.flatnonzero((codes != self.codes) | (risk != self.risk))
+
+        new_hour = timestamp != self.timestamp
+        self.codes, self.risk = codes, risk.astype(np.int8)
+        self.state, self.updated_at, self.timestamp = state, time.monotonic(), timestamp
+        if first or not (len(changed) or new_hour):
+            return None
+
+        self.seq += 1
+        self._snapshot = None
+        return Frame('delta', {
+            'area_id': self.area_id,
+            'hours_ahead': self.hours_ahead,
+            'seq': self.seq,
+            'timestamp': timestamp.isoformat(),
+            'index': changed,
+            'score': codes[changed] / 10 ** SCORE_DECIMALS,
+            'risk': self.risk[changed],
+        })
+
+    def snapshot(self, risk_levels: List[str]) -> Frame:
+        """Full state for a new (or resynchronised) subscriber; built once per change"""
+        if self._snapshot is None:
+            self._snapshot = Frame('snapshot', {
+                'area_id': self.area_id,
+                'hours_ahead': self.hours_ahead,
+                'resolution': self.resolution,
+                'seq': self.seq,
+                'timestamp': self.timestamp.isoformat(),
+                'risk_levels': risk_levels,
+                'cells': self.cells,
+                'latitude': np.round(self.centers[:, 0], 6),
+                'longitude': np.round(self.centers[:, 1], 6),
+                'score': self.codes / 10 ** SCORE_DECIMALS,
+                'risk': self.risk,
+            })
+        return self._snapshot
+
+
+class SubscriptionHub:
+    """
+    Keeps one AreaFeed per subscribed (area, horizon) and refreshes them on a
+    background task. A feed is recomputed when the forecast cache version
+    changes (new model, forecast grid or observations), when its target hour
+    rolls over, or at least every refresh_interval seconds; notify() wakes the
+    task immediately. Scores come from predict_cells, so feeds that share
+    cells share the (cell, hour) cache.
+
+    Subscriber queues are bounded: a client that falls more than queue_size
+    messages behind has its queue replaced by one fresh snapshot.
+    """
+
+    def __init__(self, get_predictor: Callable, subscription_config: Optional[Dict] = None):
+        subscription_config = subscription_config or {}
+        self.get_predictor = get_predictor
+        self.check_interval = subscription_config.get('check_interval', 1.0)
+        self.refresh_interval = subscription_config.get('refresh_interval', 300)
+        self.queue_size = subscription_config.get('queue_size', 16)
+
+        self.feeds = {}  # (area_id, hours_ahead) -> AreaFeed
+        self._task = None
+        self._loop = None
+        self._wakeup = None
+
+        self.refreshes = 0
+        self.computations = 0
+        self.compute_seconds = 0.0
+        self.fanout_seconds = 0.0
+        self.messages = 0
+        self.deliveries = 0
+        self.bytes = 0
+        self.resyncs = 0
+
+    def _ensure_running(self):
+        """Start the refresh task on the current event loop (once per loop)"""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+
+    def notify(self):
+        """Ask for a refresh now (safe to call from any thread)"""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def subscribe(self, area_id: str, cells: List[str], centers: np.ndarray, resolution: int,
+                        hours_ahead: int) -> Tuple[AreaFeed, asyncio.Queue]:
+        """Join (or create) a feed; the queue starts with the feed's snapshot"""
+        self._ensure_running()
+        key = (area_id, hours_ahead)
+        feed = self.feeds.get(key)
+        if feed is None:
+            feed = self.feeds[key] = AreaFeed(area_id, cells, centers, resolution, hours_ahead)
+        if feed.codes is None:
+            pred = self.get_predictor()
+            await self.update_feed(feed, pred, pred.cache_version, datetime.now())
+
+        # No await between the snapshot and joining: no delta can slip in between
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        queue.put_nowait(feed.snapshot(self.get_predictor().RISK_LEVELS))
+        feed.subscribers.add(queue)
+        return feed, queue
+
+    def unsubscribe(self, feed: AreaFeed, queue: asyncio.Queue):
+        feed.subscribers.discard(queue)
+
+    async def update_feed(self, feed: AreaFeed, pred, version: str, now: datetime, force: bool = False):
+        """Recompute a feed if its inputs changed and push the delta"""
+        async with feed.lock:
+            timestamp = (now + timedelta(hours=feed.hours_ahead)).replace(minute=0, second=0, microsecond=0)
+            state = (version, timestamp)
+            if state == feed.state and not force:
+                return
+
+            scores, cpu_seconds = await run_in_threadpool(_timed, pred.predict_cells, feed.cells, timestamp)
+            frame = feed.update(scores, pred.get_risk_codes(scores), timestamp, state)
+            self.compute_seconds += cpu_seconds
+            self.computations += 1
+            if frame is not None:
+                self.publish(feed, frame)
+
+    def publish(self, feed: AreaFeed, frame: Frame):
+        """Queue a frame for every subscriber of a feed"""
+        started = time.perf_counter()
+        for queue in feed.subscribers:
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # Too far behind for deltas to be useful: start over from the current state
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(feed.snapshot(self.get_predictor().RISK_LEVELS))
+                self.resyncs += 1
+        self.messages += 1
+        self.deliveries += len(feed.subscribers)
+        self.bytes += len(frame.sse) * len(feed.subscribers)
+        self.fanout_seconds += time.perf_counter() - started
+
+    async def refresh(self):
+        """One refresh cycle over every feed that still has subscribers"""
+        pred = self.get_predictor()
+        version = pred.cache_version
+        now = datetime.now()
+        self.refreshes += 1
+        for key, feed in list(self.feeds.items()):
+            if not feed.subscribers:
+                if feed.codes is not None:
+                    del self.feeds[key]
+                continue
+            stale = time.monotonic() - feed.updated_at >= self.refresh_interval
+            await self.update_feed(feed, pred, version, now, force=stale)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.check_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"[WARNING] Subscription refresh failed: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            'feeds': len(self.feeds),
+            'subscribers': sum(len(feed.subscribers) for feed in self.feeds.values()),
+            'refreshes': self.refreshes,
+            'computations': self.computations,
+            'compute_seconds': round(self.compute_seconds, 3),
+            'fanout_seconds': round(self.fanout_seconds, 3),
+            'messages': self.messages,
+            'deliveries': self.deliveries,
+            'bytes': self.bytes,
+            'resyncs': self.resyncs,
+        }
+
+
+# --- Load test ---------------------------------------------------------------
+
+def process_cpu_seconds(pid: int) -> float:
+    """User + system CPU time of a local process (Linux /proc)"""
+    with open(f"/proc/{pid}/stat", 'r') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+class SSESubscriber:
+    """Minimal SSE client on a raw socket, so thousands fit in one process"""
+
+    def __init__(self, host: str, port: int, path: str):
+        self.host, self.port, self.path = host, port, path
+        self.seq = 0
+        self.cells = 0
+        self.centers = None
+        self.snapshot = asyncio.Event()
+        self.received = {}  # seq -> monotonic receive time
+        self.writer = None
+
+    async def run(self):
+        reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f"GET {self.path} HTTP/1.1\r\nHost: {self.host}\r\nAccept: text/event-stream\r\n\r\n".encode())
+        await self.writer.drain()
+        event = None
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            if line.startswith(b'event: '):
+                event = line[7:].strip().decode()
+            elif line.startswith(b'data: ') and event:
+                message = json.loads(line[6:])
+                self.seq = message['seq']
+                self.received[message['seq']] = time.monotonic()
+                if event == 'snapshot':
+                    self.cells = len(message['cells'])
+                    self.centers = list(zip(message['latitude'], message['longitude']))
+                    self.snapshot.set()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def _post_json(host: str, port: int, path: str, payload: Dict) -> Dict:
+    reader, writer = await asyncio.open_connection(host, port)
+    body = json.dumps(payload).encode()
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return json.loads(response.split(b'\r\n\r\n', 1)[1])
+
+
+async def _get_json(host: str, port: int, path: str) -> Dict:
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return json.loads(response.split(b'\r\n\r\n', 1)[1])
+
+
+async def measure_level(host: str, port: int, pid: Optional[int], n_subscribers: int, paths: List[str],
+                        rounds: int, timeout: float) -> Dict:
+    """Connect n subscribers over the feeds in paths, then time `rounds` observation-triggered updates"""
+    subscribers = [SSESubscriber(host, port, paths[i % len(paths)]) for i in range(n_subscribers)]
+    tasks = [asyncio.create_task(s.run()) for s in subscribers]
+    for i in range(0, n_subscribers, 200):  # connect in waves to stay under the listen backlog
+        await asyncio.wait_for(asyncio.gather(*(s.snapshot.wait() for s in subscribers[i:i + 200])), timeout)
+
+    rng = random.Random(n_subscribers)
+    centers = {s.path: s.centers for s in subscribers}
+    results = []
+    for _ in range(rounds):
+        before = await _get_json(host, port, '/health')
+        cpu_before = process_cpu_seconds(pid) if pid else None
+        seqs = [s.seq for s in subscribers]
+        observations = [
+            {'latitude': lat, 'longitude': lon, 'congestion_score': rng.random(),
+             'incident_count': rng.randint(0, 5), 'incident_rolling_mean_6h': rng.random() * 3}
+            for cells in centers.values() for lat, lon in cells
+        ]
+        sent = time.monotonic()
+        await _post_json(host, port, '/observations', {'observations': observations})
+
+        deadline = sent + timeout
+        while time.monotonic() < deadline and any(s.seq == seq for s, seq in zip(subscribers, seqs)):
+            await asyncio.sleep(0.01)
+        latencies = [s.received[s.seq] - sent for s, seq in zip(subscribers, seqs) if s.seq != seq]
+        after = await _get_json(host, port, '/health')
+
+        stats_before, stats_after = before['subscriptions'], after['subscriptions']
+        results.append({
+            'delivered': len(latencies),
+            'server_cpu_ms': (process_cpu_seconds(pid) - cpu_before) * 1000 if pid else None,
+            'compute_ms': (stats_after['compute_seconds'] - stats_before['compute_seconds']) * 1000,
+            'fanout_ms': (stats_after['fanout_seconds'] - stats_before['fanout_seconds']) * 1000,
+            'p50_ms': float(np.percentile(latencies, 50)) * 1000 if latencies else None,
+            'max_ms': max(latencies) * 1000 if latencies else None,
+        })
+
+    for s in subscribers:
+        s.close()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    def median(key):
+        values = [r[key] for r in results if r[key] is not None]
+        return round(float(np.median(values)), 1) if values else None
+
+    return {
+        'subscribers': n_subscribers,
+        'feeds': len(paths),
+        'delivered': min(r['delivered'] for r in results),
+        **{key: median(key) for key in ('server_cpu_ms', 'compute_ms', 'fanout_ms', 'p50_ms', 'max_ms')},
+    }
+
+
+def run_loadtest(levels: List[int], areas: List[Tuple[float, float]], horizons: List[int], zoom: float,
+                 rounds: int, port: int, url: Optional[str], timeout: float) -> List[Dict]:
+    """Start a local server (unless url is given) and measure each subscriber level"""
+    server = None
+    if url:
+        host, port = url.split('//')[-1].rstrip('/').split(':')
+        port, pid = int(port), None
+    else:
+        host = '127.0.0.1'
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'src.api:app', '--host', host, '--port', str(port),
+             '--log-level', 'warning', '--backlog', '4096', '--timeout-keep-alive', '600'],
+        )
+        pid = server.pid
+
+    paths = []
+    for lat, lon in areas:
+        bbox = f"{lat - 0.03},{lon - 0.03},{lat + 0.03},{lon + 0.03}"
+        paths += [f"/subscribe/area?bbox={bbox}&zoom={zoom}&hours_ahead={h}" for h in horizons]
+
+    try:
+        for _ in range(120):
+            try:
+                health = asyncio.run(_get_json(host, port, '/health'))
+                if health.get('status') == 'healthy':
+                    break
+            except OSError:
+                pass
+            time.sleep(1)
+        else:
+            raise RuntimeError("Server did not become healthy")
+
+        results = []
+        for n in levels:
+            print(f"[INFO] {n} subscribers...")
+            results.append(asyncio.run(measure_level(host, port, pid, n, paths, rounds, timeout)))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print("\n=== Subscriber fan-out (median per update) ===")
+    print(f"{'subs':>6} {'feeds':>6} {'delivered':>10} {'server CPU ms':>14} {'compute ms':>11} "
+          f"{'fan-out ms':>11} {'p50 ms':>8} {'max ms':>8}")
+    for r in results:
+        cpu = f"{r['server_cpu_ms']:.1f}" if r['server_cpu_ms'] is not None else '-'
+        print(f"{r['subscribers']:>6} {r['feeds']:>6} {r['delivered']:>10} {cpu:>14} {r['compute_ms']:>11.1f} "
+              f"{r['fanout_ms']:>11.1f} {r['p50_ms'] or 0:>8.1f} {r['max_ms'] or 0:>8.1f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CongestionAI live subscription tools")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    loadtest = sub.add_parser('loadtest', help="Measure server cost of pushing updates to many SSE subscribers")
+    loadtest.add_argument('--subscribers', type=int, nargs='+', default=[10, 100, 1000])
+    loadtest.add_argument('--areas', nargs='+', default=['37.7749,-122.4194', '37.8044,-122.2712'],
+                          help="Area centers as lat,lon (each a ~6 km box)")
+    loadtest.add_argument('--hours-ahead', type=int, nargs='+', default=[3, 6])
+    loadtest.add_argument('--zoom', type=float, default=14)
+    loadtest.add_argument('--rounds', type=int, default=5, help="Observation updates per level")
+    loadtest.add_argument('--port', type=int, default=8799)
+    loadtest.add_argument('--url', help="Target a running server (server CPU is then not measured)")
+    loadtest.add_argument('--timeout', type=float, default=60)
+    loadtest.add_argument('--output', help="Write the JSON report here")
+    args = parser.parse_args()
+
+    areas = [tuple(float(v) for v in area.split(',')) for area in args.areas]
+    results = run_loadtest(args.subscribers, areas, args.hours_ahead, args.zoom, args.rounds,
+                           args.port, args.url, args.timeout)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"[OK] Report saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,26 @@ Model Training for CongestionAI
 Train XGBoost model with SHAP explainability
 """
 
+import argparse
+import itertools
+import json
+import os
+import time
 import pandas as pd
 import numpy as np
 import pickle
 import yaml
 import shap
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict, List, Optional
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 from xgboost import XGBRegressor
 
+from .drift import build_profile
+from .memory_profile import MemoryProfiler
+
 # Try to import matplotlib, but continue without it if not available
 try:
     import matplotlib.pyplot as plt
@@ -21,9 +31,67 @@ except ImportError:
     MATPLOTLIB_AVAILABLE = False
     print("Warning: matplotlib not available. SHAP plots will be skipped.")
 
+# Target and metadata columns: never features (and not even loaded in the memory-lean mode)
+EXCLUDE_COLUMNS = ['congestion_score', 'timestamp', 'h3_cell', 'incident_count']
+
+
+def split_indices(n: int, test_size: float = 0.15, random_state: int = 42):
+    """
+    Train/validation/test row positions: the same partition as two
+    train_test_split calls on the frame, without copying it
+    """
+    temp_idx, test_idx = train_test_split(np.arange(n), test_size=test_size, random_state=random_state)
+    train_idx, val_idx = train_test_split(temp_idx, test_size=test_size, random_state=random_state)
+    return train_idx, val_idx, test_idx
+
+
+def quantile_params(model_config: Dict) -> Dict:
+    """
+    XGBoost params for model.params; with model.quantiles, a single booster
+    that predicts every quantile (one output column each) in the same pass
+    """
+    params = dict(model_config['params'])
+    quantiles = sorted(model_config.get('quantiles') or [])
+    if quantiles:
+        params.update(objective='reg:quantileerror', quantile_alpha=np.array(quantiles))
+    return params
+
+
+def median_prediction(y_pred: np.ndarray) -> np.ndarray:
+    """Point estimate: the middle quantile column of a multi-quantile prediction"""
+    return y_pred if y_pred.ndim == 1 else y_pred[:, y_pred.shape[1] // 2]
+
+
+def fit_candidate(params: Dict, early_stopping_rounds: int, X_train, y_train, X_val, y_val) -> Dict:
+    """Fit one search candidate with early stopping (runs in a worker process)"""
+    started = time.perf_counter()
+    model = XGBRegressor(**params, early_stopping_rounds=early_stopping_rounds)
+    model.fit(X_train, y_train, eval_set=[(X_val, y_val)], verbose=False)
+    y_pred = median_prediction(model.predict(X_val))
+    return {
+        'model': model,
+        'params': {name: params[name] for name in ('max_depth', 'n_estimators')},
+        'trees': model.best_iteration + 1,
+        'val_rmse': round(float(np.sqrt(mean_squared_error(y_val, y_pred))), 6),
+        'val_mae': round(float(mean_absolute_error(y_val, y_pred)), 6),
+        'train_seconds': round(time.perf_counter() - started, 2),
+    }
+
+
 class ModelTrainer:
-    def __init__(self, config_path: str = "configs/params.yaml"):
-        """Initialize model trainer"""
+    def __init__(
+        self,
+        config_path: str = "configs/params.yaml",
+        region: Optional[str] = None,
+        lean: Optional[bool] = None,
+        profile: Optional[bool] = None
+    ):
+        """
+        Initialize model trainer. With a region, trains on processed_path/<region>
+        (built with python -m src.data_pipeline --region) and saves the model to
+        model_router.models_dir/<region>/model.pkl. lean and profile override
+        memory.lean and memory.profile.
+        """
         with open(config_path, 'r') as f:
             self.config = yaml.safe_load(f)
         
@@ -32,29 +100,56 @@ class ModelTrainer:
         self.shap_values = None
         self.explainer = None
         
+        self.model_path = Path(self.config['model']['save_path'])
+        if region is not None:
+            self.config['data']['processed_path'] = str(Path(self.config['data']['processed_path']) / region)
+            self.model_path = Path(self.config['model_router']['models_dir']) / region / 'model.pkl'
+        
+        self.quantiles = sorted(self.config['model'].get('quantiles') or [])
+        self.interval_offset = 0.0  # conformal widening of the outer quantiles (see calibrate_interval)
+        self.calibration = {}  # calibration split size and coverage, for the training report
+        self.data_profile = None  # feature and score distributions for drift monitoring (see drift.py)
+        
+        # Memory-lean mode: float32 features only, one reordered frame split into slices
+        self.lean = self.config.get('memory', {}).get('lean', False) if lean is None else lean
+        self.profiler = MemoryProfiler.from_config(self.config, enabled=profile)
+        
         # Create models directory
-        Path("models").mkdir(exist_ok=True)
+        self.model_path.parent.mkdir(parents=True, exist_ok=True)
     
     def load_data(self) -> pd.DataFrame:
         """Load processed training data"""
         data_path = Path(self.config['data']['processed_path']) / self.config['data']['train_file']
         print(f"Loading data from {data_path}...")
         
-        df = pd.read_csv(data_path)
+        if self.lean:
+            # Only the feature and target columns, parsed straight to float32
+            columns = pd.read_csv(data_path, nrows=0).columns
+            usecols = [col for col in columns if col not in EXCLUDE_COLUMNS or col == 'congestion_score']
+            df = pd.read_csv(data_path, usecols=usecols, dtype={col: np.float32 for col in usecols})
+        else:
+            df = pd.read_csv(data_path)
         print(f"Loaded {len(df)} samples")
         
         return df
     
-    def prepare_features(self, df: pd.DataFrame):
-        """Prepare features and target for training"""
+    def prepare_features(self, df: pd.DataFrame, inplace: bool = False):
+        """
+        Prepare features and target for training. inplace turns df itself into
+        the feature frame (target and metadata columns removed) instead of copying it.
+        """
         print("Preparing features and target...")
         
         # Define feature columns (exclude target and metadata)
-        exclude_cols = ['congestion_score', 'timestamp', 'h3_cell', 'incident_count']
-        feature_cols = [col for col in df.columns if col not in exclude_cols]
+        feature_cols = [col for col in df.columns if col not in EXCLUDE_COLUMNS]
         
-        X = df[feature_cols]
-        y = df['congestion_score']
+        if inplace:
+            y = df.pop('congestion_score')
+            df.drop(columns=[col for col in EXCLUDE_COLUMNS if col in df.columns], inplace=True)
+            X = df
+        else:
+            X = df[feature_cols]
+            y = df['congestion_score']
         
         self.feature_names = feature_cols
         
@@ -67,26 +162,184 @@ class ModelTrainer:
         """Train XGBoost model"""
         print("\nTraining XGBoost model...")
         
-        model_params = self.config['model']['params']
+        model_params = quantile_params(self.config['model'])
+        if 'quantile_alpha' in model_params:
+            print(f"Quantiles: {', '.join(f'p{q * 100:g}' for q in model_params['quantile_alpha'])} (one booster)")
         
-        self.model = XGBRegressor(**model_params)
+        self.model = XGBRegressor(
+            **model_params,
+            early_stopping_rounds=self.config['model'].get('early_stopping_rounds')
+        )
         
-        # Train with early stopping
+        # Train with early stopping on the validation set (n_estimators is the cap)
         self.model.fit(
             X_train, y_train,
             eval_set=[(X_val, y_val)],
             verbose=50
         )
         
+        if getattr(self.model, 'best_iteration', None) is not None:
+            print(f"Early stopping kept {self.model.best_iteration + 1} of {model_params['n_estimators']} trees")
         print("[OK] Model training completed!")
         
         return self.model
     
+    def split_calibration(self, X_val, y_val):
+        """
+        (X_val, X_cal, y_val, y_cal): the tail of the (already shuffled) validation
+        rows is held out for calibrate_interval. Early stopping and the model
+        search pick the model on the rest, so the conformal offset is fitted on
+        rows that played no part in choosing it. Point models keep every row.
+        """
+        size = self.config['model'].get('calibration_size', 0.5)
+        if not self.quantiles or size <= 0:
+            return X_val, X_val.iloc[:0], y_val, y_val.iloc[:0]
+        split = len(X_val) - max(1, int(round(len(X_val) * size)))
+        return X_val.iloc[:split], X_val.iloc[split:], y_val.iloc[:split], y_val.iloc[split:]
+    
+    def calibrate_interval(self, X_cal, y_cal):
+        """
+        Conformalized quantile regression: quantile boosters tend to under-cover,
+        so the outer quantiles are widened by the calibration nonconformity score
+        that gives the interval its nominal coverage (e.g. 80% for p10-p90)
+        """
+        if not self.quantiles or len(X_cal) == 0:
+            return
+        
+        bands = self.model.predict(X_cal)
+        y_cal = np.asarray(y_cal)
+        scores = np.maximum(bands[:, 0] - y_cal, y_cal - bands[:, -1])
+        level = self.quantiles[-1] - self.quantiles[0]
+        n = len(scores)
+        self.interval_offset = float(np.quantile(scores, min(1.0, np.ceil((n + 1) * level) / n)))
+        
+        raw_coverage = (scores <= 0).mean() * 100
+        self.calibration = {
+            'rows': n,
+            'nominal_coverage': round(level * 100, 2),
+            'coverage_before': round(float(raw_coverage), 2),
+        }
+        print(f"Interval calibration: {raw_coverage:.1f}% coverage of {n} held-out rows before, "
+              f"bounds {'widened' if self.interval_offset >= 0 else 'narrowed'} by {abs(self.interval_offset):.4f}")
+    
+    @staticmethod
+    def measure_latency(model, X: pd.DataFrame, rows: int, repeats: int) -> float:
+        """Median predict() time in ms for a frame of `rows` rows (one warm-up call)"""
+        sample = X.iloc[:rows]
+        model.predict(sample)
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            model.predict(sample)
+            timings.append((time.perf_counter() - started) * 1000)
+        return float(np.median(timings))
+    
+    def search_model(self, X_train, y_train, X_val, y_val) -> List[Dict]:
+        """
+        Train every max_depth x n_estimators candidate of model.search with early
+        stopping, in parallel worker processes. Latency is measured afterwards in
+        this process, one candidate at a time, so training load does not skew it.
+        The most accurate candidate (validation RMSE) within the latency budget
+        becomes self.model; without any, the fastest one does.
+        """
+        search = self.config['model']['search']
+        budget = search['latency_budget_ms']
+        workers = search.get('workers') or os.cpu_count() or 1
+        
+        # Split the cores between workers instead of every worker using all of them
+        base_params = dict(quantile_params(self.config['model']), n_jobs=max(1, (os.cpu_count() or 1) // workers))
+        grid = [
+            dict(base_params, max_depth=depth, n_estimators=trees)
+            for depth, trees in itertools.product(search['max_depth'], search['n_estimators'])
+        ]
+        print(f"\nSearching {len(grid)} candidates with {workers} worker(s)...")
+        
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(fit_candidate, params, self.config['model']['early_stopping_rounds'],
+                            X_train, y_train, X_val, y_val)
+                for params in grid
+            ]
+            candidates = [future.result() for future in futures]
+        
+        repeats = search.get('latency_repeats', 30)
+        for candidate in candidates:
+            candidate['single_ms'] = round(self.measure_latency(candidate['model'], X_val, 1, repeats), 3)
+            candidate['batch_ms'] = round(self.measure_latency(candidate['model'], X_val, budget['batch_rows'], repeats), 3)
+            candidate['within_budget'] = (
+                candidate['single_ms'] <= budget['single'] and candidate['batch_ms'] <= budget['batch']
+            )
+        
+        print(f"\n{'depth':>5} {'cap':>5} {'trees':>5} {'val_rmse':>9} {'single_ms':>9} {'batch_ms':>9}  budget")
+        for c in candidates:
+            print(f"{c['params']['max_depth']:>5} {c['params']['n_estimators']:>5} {c['trees']:>5} "
+                  f"{c['val_rmse']:>9.4f} {c['single_ms']:>9.3f} {c['batch_ms']:>9.3f}  "
+                  f"{'ok' if c['within_budget'] else 'over'}")
+        
+        within = [c for c in candidates if c['within_budget']]
+        if within:
+            chosen = min(within, key=lambda c: c['val_rmse'])
+        else:
+            chosen = min(candidates, key=lambda c: c['batch_ms'])
+            print("[WARNING] No candidate meets the latency budget; using the fastest")
+        chosen['chosen'] = True
+        print(f"Chosen: max_depth={chosen['params']['max_depth']}, {chosen['trees']} trees "
+              f"(val RMSE {chosen['val_rmse']:.4f}, single {chosen['single_ms']:.2f}ms, "
+              f"batch[{budget['batch_rows']}] {chosen['batch_ms']:.2f}ms)")
+        
+        self.model = chosen['model']
+        return candidates
+    
+    def save_report(self, metrics: Dict, X_val: pd.DataFrame, candidates: Optional[List[Dict]] = None):
+        """Write the training report (metrics, latency, search candidates) next to the model"""
+        search = self.config['model'].get('search', {})
+        budget = search.get('latency_budget_ms', {})
+        batch_rows = budget.get('batch_rows', 1000)
+        
+        report = {
+            'model_path': str(self.model_path),
+            'trained_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'mode': 'search' if candidates else 'fixed',
+            'params': {
+                name: value for name, value in self.model.get_params().items()
+                if name in ('max_depth', 'n_estimators', 'learning_rate', 'early_stopping_rounds')
+            },
+            'trees': self.model.best_iteration + 1 if getattr(self.model, 'best_iteration', None) is not None
+                     else self.model.get_params()['n_estimators'],
+            'quantiles': self.quantiles,
+            'interval_offset': round(self.interval_offset, 6),
+            'calibration': dict(self.calibration, test_coverage=(
+                round(float(metrics['interval_coverage']), 2) if 'interval_coverage' in metrics else None
+            )) if self.calibration else None,
+            'test_metrics': {name: round(float(value), 4) for name, value in metrics.items()},
+            'latency_ms': {
+                'single': round(self.measure_latency(self.model, X_val, 1, 30), 3),
+                f'batch_{batch_rows}': round(self.measure_latency(self.model, X_val, batch_rows, 30), 3),
+            },
+            'latency_budget_ms': budget,
+        }
+        if candidates:
+            report['candidates'] = [
+                {name: value for name, value in c.items() if name != 'model'} for c in candidates
+            ]
+        
+        report_path = self.model_path.parent / self.config['model'].get('report_file', 'training_report.json')
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"[OK] Training report saved to {report_path}")
+    
+    def build_data_profile(self, X_train, X_val):
+        """Training data profile saved with the model: training feature distributions, validation scores"""
+        scores = np.clip(median_prediction(self.model.predict(X_val)), 0, 1)
+        self.data_profile = build_profile(X_train, scores, self.config.get('drift', {}).get('bins', 20))
+        print(f"[OK] Data profile of {len(self.feature_names)} features built")
+    
     def evaluate_model(self, X_test, y_test):
         """Evaluate model performance"""
         print("\n=== Model Evaluation ===")
         
-        y_pred = self.model.predict(X_test)
+        bands = self.model.predict(X_test)
+        y_pred = median_prediction(bands)
         
         mse = mean_squared_error(y_test, y_pred)
         rmse = np.sqrt(mse)
@@ -105,13 +358,24 @@ class ModelTrainer:
         print(f"Accuracy within ±0.1: {acc_10:.2f}%")
         print(f"Accuracy within ±0.2: {acc_20:.2f}%")
         
-        return {
+        metrics = {
             'rmse': rmse,
             'mae': mae,
             'r2': r2,
             'acc_10': acc_10,
             'acc_20': acc_20
         }
+        
+        # Interval quality: share of targets inside the outer quantiles (nominal: their spread)
+        if bands.ndim == 2:
+            lower, upper = bands[:, 0] - self.interval_offset, bands[:, -1] + self.interval_offset
+            metrics['interval_coverage'] = ((y_test >= lower) & (y_test <= upper)).mean() * 100
+            metrics['interval_width'] = (upper - lower).mean()
+            nominal = (self.quantiles[-1] - self.quantiles[0]) * 100
+            print(f"Interval coverage: {metrics['interval_coverage']:.2f}% (nominal {nominal:.0f}%)")
+            print(f"Mean interval width: {metrics['interval_width']:.4f}")
+        
+        return metrics
     
     def analyze_feature_importance(self, X_sample):
         """Analyze feature importance using SHAP"""
@@ -131,6 +395,9 @@ class ModelTrainer:
         print("\nCalculating SHAP values...")
         self.explainer = shap.TreeExplainer(self.model)
         self.shap_values = self.explainer.shap_values(X_sample)
+        if np.ndim(self.shap_values) == 3:
+            # Multi-quantile model: explain the median output
+            self.shap_values = self.shap_values[:, :, self.shap_values.shape[2] // 2]
         
         # Calculate mean absolute SHAP values
         shap_importance = pd.DataFrame({
@@ -145,11 +412,14 @@ class ModelTrainer:
     
     def save_model(self):
         """Save trained model and metadata"""
-        model_path = Path(self.config['model']['save_path'])
+        model_path = self.model_path
         
         model_data = {
             'model': self.model,
             'feature_names': self.feature_names,
+            'quantiles': self.quantiles,
+            'interval_offset': self.interval_offset,
+            'data_profile': self.data_profile,
             'config': self.config
         }
         
@@ -166,7 +436,7 @@ class ModelTrainer:
         
         print("\nGenerating SHAP plots...")
         
-        plots_dir = Path("models/plots")
+        plots_dir = self.model_path.parent / "plots"
         plots_dir.mkdir(exist_ok=True)
         
         try:
@@ -189,46 +459,88 @@ class ModelTrainer:
         except Exception as e:
             print(f"[WARNING] Could not save SHAP plots: {e}")
     
-    def run(self):
-        """Execute complete training pipeline"""
+    def split_lean(self, df: pd.DataFrame):
+        """
+        split_indices partition of a lean frame without copies: the rows are
+        reordered one column at a time (train, then validation, then test rows),
+        so each split is a slice of the same frame
+        """
+        train_idx, val_idx, test_idx = split_indices(len(df))
+        order = np.concatenate([train_idx, val_idx, test_idx])
+        for col in df.columns:
+            df[col] = df[col].to_numpy()[order]
+        df.index = pd.RangeIndex(len(df))
+        
+        X, y = self.prepare_features(df, inplace=True)
+        train_end, val_end = len(train_idx), len(train_idx) + len(val_idx)
+        return (X.iloc[:train_end], X.iloc[train_end:val_end], X.iloc[val_end:],
+                y.iloc[:train_end], y.iloc[train_end:val_end], y.iloc[val_end:])
+    
+    def run(self, search: bool = False):
+        """Execute complete training pipeline (search: pick the model size with search_model)"""
         print("=" * 60)
-        print("CongestionAI Model Training")
+        print(f"CongestionAI Model Training{' (memory-lean)' if self.lean else ''}")
         print("=" * 60)
+        stage = self.profiler.stage
         
         # Load data
-        df = self.load_data()
-        
-        # Prepare features
-        X, y = self.prepare_features(df)
-        
-        # Split data
-        X_temp, X_test, y_temp, y_test = train_test_split(
-            X, y, test_size=0.15, random_state=42
-        )
-        X_train, X_val, y_train, y_val = train_test_split(
-            X_temp, y_temp, test_size=0.15, random_state=42
-        )
+        with stage('load_data'):
+            df = self.load_data()
+        
+        # Prepare features and split data
+        with stage('split'):
+            if self.lean:
+                X_train, X_val, X_test, y_train, y_val, y_test = self.split_lean(df)
+            else:
+                X, y = self.prepare_features(df)
+                X_temp, X_test, y_temp, y_test = train_test_split(
+                    X, y, test_size=0.15, random_state=42
+                )
+                X_train, X_val, y_train, y_val = train_test_split(
+                    X_temp, y_temp, test_size=0.15, random_state=42
+                )
+        
+        X_val, X_cal, y_val, y_cal = self.split_calibration(X_val, y_val)
         
         print(f"\nTrain set: {len(X_train)} samples")
         print(f"Validation set: {len(X_val)} samples")
+        if len(X_cal):
+            print(f"Calibration set: {len(X_cal)} samples")
         print(f"Test set: {len(X_test)} samples")
         
         # Train model
-        self.train_model(X_train, y_train, X_val, y_val)
+        candidates = None
+        with stage('train'):
+            if search:
+                candidates = self.search_model(X_train, y_train, X_val, y_val)
+            else:
+                self.train_model(X_train, y_train, X_val, y_val)
+        with stage('calibrate_interval'):
+            self.calibrate_interval(X_cal, y_cal)
+        with stage('data_profile'):
+            self.build_data_profile(X_train, X_val)
         
         # Evaluate model
-        metrics = self.evaluate_model(X_test, y_test)
-        
-        # Analyze feature importance
-        X_sample = X_test.sample(min(1000, len(X_test)), random_state=42)
-        feature_importance, shap_importance = self.analyze_feature_importance(X_sample)
-        
-        # Save SHAP plots
-        self.save_shap_plots(X_sample)
+        with stage('evaluate'):
+            metrics = self.evaluate_model(X_test, y_test)
+        
+        # Analyze feature importance (test rows are already shuffled in the lean mode)
+        with stage('shap'):
+            if self.lean:
+                X_sample = X_test.iloc[:1000]
+            else:
+                X_sample = X_test.sample(min(1000, len(X_test)), random_state=42)
+            feature_importance, shap_importance = self.analyze_feature_importance(X_sample)
+            
+            # Save SHAP plots
+            self.save_shap_plots(X_sample)
         
-        # Save model
-        self.save_model()
+        # Save model and training report
+        with stage('save'):
+            self.save_model()
+            self.save_report(metrics, X_val, candidates)
         
+        self.profiler.report("Training memory")
         print("\n" + "=" * 60)
         print("[OK] Model training completed successfully!")
         print("=" * 60)
@@ -237,5 +549,15 @@ class ModelTrainer:
 
 
 if __name__ == "__main__":
-    trainer = ModelTrainer()
-    trainer.run()
+    parser = argparse.ArgumentParser(description="CongestionAI model training")
+    parser.add_argument('--region', help="Train a regional model (a key of regions in params.yaml)")
+    parser.add_argument('--search', action='store_true',
+                        help="Search model.search for the most accurate model within the latency budget")
+    parser.add_argument('--lean', action='store_true', default=None,
+                        help="Memory-lean mode (memory.lean): float32 features, copy-free splits")
+    parser.add_argument('--profile-memory', action='store_true', default=None,
+                        help="Print a per-stage peak memory report (memory.profile)")
+    args = parser.parse_args()
+    
+    trainer = ModelTrainer(region=args.region, lean=args.lean, profile=args.profile_memory)
+    trainer.run(search=args.search or trainer.config['model'].get('search', {}).get('enabled', False))
@@ -0,0 +1,430 @@
+"""
+Weather forecasts for CongestionAI
+Background prefetching of hourly forecasts for active H3 parent cells into a
+compact (cell x hour) grid, so inference reads weather with a vectorized
+gather and never calls the weather API on the request path.
+
+Run a prefetch round against the local stub server with:
+python -m src.weather check
+"""
+
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import h3
+import numpy as np
+import requests
+import yaml
+
+from .calendar_table import CalendarTable
+from .spatial import bbox_to_polygon, lattice_cells
+
+# Model feature order of the weather columns, and the values used without a forecast
+WEATHER_FEATURES = ['temperature', 'precipitation', 'visibility', 'wind_speed', 'humidity']
+WEATHER_DEFAULTS = {
+    'temperature': 20,
+    'precipitation': 0,
+    'visibility': 10,
+    'wind_speed': 10,
+    'humidity': 50,
+}
+
+
+def parse_forecast(payload: Dict, horizon_hours: int = 168) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    OpenWeatherMap /forecast response -> (hours, values). hours are local
+    wall-clock datetime64[h] (the API's UTC times shifted by city.timezone, to
+    match the wall-clock timestamps the model is queried with); values is a
+    float32 (n_hours, len(WEATHER_FEATURES)) array in model units.
+
+    3-hourly steps are expanded to hourly: continuous quantities are
+    interpolated, precipitation is spread evenly over its step.
+    """
+    steps = payload.get('list') or []
+    if not steps:
+        raise ValueError("forecast has no steps")
+    offset = payload.get('city', {}).get('timezone', 0)
+
+    step_hours = (np.array([step['dt'] for step in steps], dtype=np.int64) + offset) // 3600
+    precipitation = []
+    for step in steps:
+        rain = step.get('rain') or {}
+        precipitation.append(rain['1h'] if '1h' in rain else rain.get('3h', 0) / 3)
+    columns = {
+        'temperature': [step['main'].get('temp', WEATHER_DEFAULTS['temperature']) for step in steps],
+        'precipitation': precipitation,
+        'visibility': [step.get('visibility', 10000) / 1000 for step in steps],  # m -> km
+        'wind_speed': [step.get('wind', {}).get('speed', 0) * 3.6 for step in steps],  # m/s -> km/h
+        'humidity': [step['main'].get('humidity', WEATHER_DEFAULTS['humidity']) for step in steps],
+    }
+
+    # The last step covers as many hours as the step before it
+    step_length = int(step_hours[-1] - step_hours[-2]) if len(step_hours) > 1 else 1
+    hours = np.arange(step_hours[0], min(step_hours[-1] + step_length, step_hours[0] + horizon_hours))
+
+    values = np.empty((len(hours), len(WEATHER_FEATURES)), dtype=np.float32)
+    for j, name in enumerate(WEATHER_FEATURES):
+        column = np.asarray(columns[name], dtype=np.float64)
+        if name == 'precipitation':
+            values[:, j] = column[np.searchsorted(step_hours, hours, side='right') - 1]
+        else:
+            values[:, j] = np.interp(hours, step_hours, column)
+    return hours.astype('datetime64[h]'), values
+
+
+class WeatherClient:
+    """Hourly forecasts from an OpenWeatherMap-compatible API (or the local stub)"""
+
+    def __init__(self, api_url: str, api_key: str = '', timeout: float = 5, horizon_hours: int = 168):
+        self.api_url = api_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = timeout
+        self.horizon_hours = horizon_hours
+
+    def fetch_forecast(self, lat: float, lon: float) -> Tuple[np.ndarray, np.ndarray]:
+        """(hours, values) for a location; raises on HTTP or payload errors"""
+        params = {'lat': lat, 'lon': lon, 'units': 'metric'}
+        if self.api_key:
+            params['appid'] = self.api_key
+
+        response = requests.get(f"{self.api_url}/forecast", params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return parse_forecast(response.json(), self.horizon_hours)
+
+
+class WeatherGrid:
+    """
+    Immutable snapshot of hourly weather for a set of H3 cells:
+    values[cell, hour - base, feature] with observed[cell, hour - base] marking
+    hours a forecast covers. Readers keep whichever snapshot they picked up,
+    so the prefetcher can publish a new one at any time without locking.
+
+    Locations are mapped to cells through a lattice of `precision` decimal
+    degrees, so a batch needs one h3 call per distinct lattice point rather
+    than one per row.
+    """
+
+    def __init__(
+        self,
+        resolution: int,
+        cells: Sequence[str],
+        base: np.datetime64,
+        values: np.ndarray,
+        observed: np.ndarray,
+        version: int = 0,
+        precision: int = 2
+    ):
+        self.resolution = resolution
+        self.cells = list(cells)
+        self.cell_to_idx = {cell: i for i, cell in enumerate(self.cells)}
+        self.base = base
+        self.values = values
+        self.observed = observed
+        self.n_hours = observed.shape[1]
+        self.version = version
+        self.precision = precision
+        self.defaults = np.array([WEATHER_DEFAULTS[name] for name in WEATHER_FEATURES], dtype=np.float64)
+
+    @classmethod
+    def from_series(
+        cls,
+        resolution: int,
+        series: Dict[str, Tuple[np.ndarray, np.ndarray]],
+        version: int = 0,
+        precision: int = 2
+    ) -> 'WeatherGrid':
+        """Pack per-cell (hours, values) forecasts into one grid spanning all of them"""
+        cells = sorted(series)
+        if not cells:
+            return cls(resolution, [], np.datetime64(0, 'h'),
+                       np.zeros((0, 0, len(WEATHER_FEATURES)), dtype=np.float32),
+                       np.zeros((0, 0), dtype=bool), version, precision)
+
+        base = np.min([series[cell][0][0] for cell in cells])
+        end = np.max([series[cell][0][-1] for cell in cells])
+        n_hours = int((end - base).astype(np.int64)) + 1
+
+        values = np.zeros((len(cells), n_hours, len(WEATHER_FEATURES)), dtype=np.float32)
+        observed = np.zeros((len(cells), n_hours), dtype=bool)
+        for i, cell in enumerate(cells):
+            hours, cell_values = series[cell]
+            offsets = (hours - base).astype(np.int64)
+            values[i, offsets] = cell_values
+            observed[i, offsets] = True
+        return cls(resolution, cells, base, values, observed, version, precision)
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def parent_cells(self, lats, lons) -> Tuple[List[str], np.ndarray]:
+        """Distinct cells of the locations and, per location, its index into them"""
+        return lattice_cells(lats, lons, self.resolution, self.precision)
+
+    def gather(self, lats, lons, timestamps) -> Tuple[Dict[str, np.ndarray], List[str]]:
+        """
+        Weather features per row for locations at a shared datetime or one
+        timestamp per row. Rows without a forecast get WEATHER_DEFAULTS.
+        Also returns the distinct cells touched, for the prefetcher.
+        """
+        n = len(lats)
+        cells, inverse = self.parent_cells(lats, lons)
+        get = self.cell_to_idx.get
+        unique_idx = np.fromiter((get(cell, -1) for cell in cells), dtype=np.int64, count=len(cells))
+
+        out = np.tile(self.defaults, (n, 1))
+        if self.n_hours and n:
+            cell_idx = unique_idx[inverse]
+            offsets = (CalendarTable.to_hours(timestamps) - self.base).astype(np.int64)
+            offsets = np.broadcast_to(offsets, (n,)) if len(offsets) == 1 else offsets
+
+            valid = (cell_idx >= 0) & (offsets >= 0) & (offsets < self.n_hours)
+            rows = np.flatnonzero(valid)
+            covered = self.observed[cell_idx[rows], offsets[rows]]
+            rows = rows[covered]
+            out[rows] = self.values[cell_idx[rows], offsets[rows]]
+
+        return {name: out[:, j] for j, name in enumerate(WEATHER_FEATURES)}, sorted(set(cells))
+
+
+class WeatherPrefetcher:
+    """
+    Keeps a WeatherGrid of hourly forecasts for the active parent cells fresh.
+
+    Active cells are the configured areas plus every cell requested within
+    active_ttl seconds (capped at max_cells, most recent first). All active
+    cells are refreshed every update_interval seconds; cells requested for the
+    first time are fetched as soon as the background thread wakes, and until
+    then their rows use default weather.
+    """
+
+    def __init__(
+        self,
+        client: WeatherClient,
+        resolution: int = 5,
+        update_interval: float = 10800,
+        active_ttl: float = 86400,
+        max_cells: int = 500,
+        workers: int = 4,
+        precision: int = 2,
+        areas: Optional[List[List[float]]] = None
+    ):
+        self.client = client
+        self.resolution = resolution
+        self.update_interval = update_interval
+        self.active_ttl = active_ttl
+        self.max_cells = max_cells
+        self.workers = workers
+        self.precision = precision
+        self.area_cells = set()
+        for bbox in areas or []:
+            shape = h3.LatLngPoly(bbox_to_polygon(bbox))
+            self.area_cells.update(h3.polygon_to_cells(shape, resolution))
+
+        self.grid = WeatherGrid.from_series(resolution, {}, precision=precision)
+        self._series = {}
+        self._last_requested = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.fetches = 0
+        self.errors = 0
+        self.last_refresh = None
+
+    @classmethod
+    def from_config(cls, weather_config: Dict, api_url: str, api_key: str = '') -> 'WeatherPrefetcher':
+        """Prefetcher using the weather.prefetch section of params.yaml"""
+        prefetch = weather_config.get('prefetch', {})
+        client = WeatherClient(
+            api_url, api_key,
+            timeout=prefetch.get('timeout', 5),
+            horizon_hours=prefetch.get('horizon_hours', 168)
+        )
+        return cls(
+            client,
+            resolution=prefetch.get('h3_resolution', 5),
+            update_interval=weather_config.get('update_interval', 10800),
+            active_ttl=prefetch.get('active_ttl', 86400),
+            max_cells=prefetch.get('max_cells', 500),
+            workers=prefetch.get('workers', 4),
+            precision=prefetch.get('lookup_precision', 2),
+            areas=prefetch.get('areas')
+        )
+
+    def request(self, cells: Iterable[str]):
+        """Mark cells as active (cheap; called on the request path)"""
+        now = time.monotonic()
+        with self._lock:
+            for cell in cells:
+                self._last_requested[cell] = now
+                if cell not in self._series:
+                    self._pending.add(cell)
+            if self._pending:
+                self._wake.set()
+
+    def active_cells(self) -> List[str]:
+        """Area cells plus recently requested cells, within the max_cells budget"""
+        cutoff = time.monotonic() - self.active_ttl
+        with self._lock:
+            recent = [cell for cell, t in self._last_requested.items() if t >= cutoff]
+            recent.sort(key=self._last_requested.get, reverse=True)
+            for cell in set(self._last_requested) - set(recent):
+                del self._last_requested[cell]
+
+        active = sorted(self.area_cells)[:self.max_cells]
+        seen = set(active)
+        for cell in recent:
+            if len(active) >= self.max_cells:
+                break
+            if cell not in seen:
+                active.append(cell)
+                seen.add(cell)
+        return active
+
+    def _fetch(self, cell: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Forecast at a cell's center, or None (the cell keeps its previous forecast)"""
+        lat, lon = h3.cell_to_latlng(cell)
+        try:
+            return self.client.fetch_forecast(lat, lon)
+        except Exception as e:
+            self.errors += 1
+            print(f"[WARNING] Weather forecast for {cell} failed: {e}")
+            return None
+
+    def refresh(self, cells: Optional[List[str]] = None):
+        """
+        Fetch forecasts for cells (default: every active cell, dropping cells
+        that are no longer active) and publish a new grid
+        """
+        full = cells is None
+        if full:
+            cells = self.active_cells()
+            self.last_refresh = time.time()
+        if not cells:
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = list(pool.map(self._fetch, cells))
+        self.fetches += len(cells)
+
+        series = dict(self._series)
+        if full:
+            series = {cell: series[cell] for cell in cells if cell in series}
+        for cell, result in zip(cells, results):
+            if result is not None:
+                series[cell] = result
+        self._series = series
+        self.grid = WeatherGrid.from_series(self.resolution, series, self.grid.version + 1, self.precision)
+
+    def _run(self):
+        next_full = 0.0
+        while not self._stop.is_set():
+            if time.monotonic() >= next_full:
+                with self._lock:
+                    self._pending.clear()
+                self.refresh()
+                next_full = time.monotonic() + self.update_interval
+            else:
+                with self._lock:
+                    pending = sorted(self._pending)
+                    self._pending.clear()
+                budget = self.max_cells - len(self._series)
+                if pending and budget > 0:
+                    self.refresh(pending[:budget])
+
+            self._wake.wait(timeout=max(0.0, next_full - time.monotonic()))
+            self._wake.clear()
+
+    def start(self):
+        """Start the background refresh thread (first full refresh runs immediately)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="weather-prefetcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self) -> Dict:
+        grid = self.grid
+        return {
+            'cells': len(grid),
+            'hours': grid.n_hours,
+            'grid_version': grid.version,
+            'area_cells': len(self.area_cells),
+            'pending': len(self._pending),
+            'fetches': self.fetches,
+            'errors': self.errors,
+            'last_refresh': (
+                time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.last_refresh))
+                if self.last_refresh else None
+            ),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CongestionAI weather prefetcher")
+    parser.add_argument('--config', default="configs/params.yaml")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    check = sub.add_parser('check', help="Prefetch cells around the default location and time grid lookups")
+    check.add_argument('--url', help="Weather API URL (default: start the local stub server)")
+    check.add_argument('--rings', type=int, default=2, help="Parent-cell rings around the default location")
+    check.add_argument('--rows', type=int, default=100000)
+
+    args = parser.parse_args()
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+    weather_config = config['weather']
+
+    url = args.url
+    server = None
+    if url is None:
+        from .weather_stub import start_stub_server
+        server, url = start_stub_server()
+        print(f"Started stub weather server at {url}")
+
+    prefetcher = WeatherPrefetcher.from_config(weather_config, url)
+    lat, lon = config['spatial']['default_lat'], config['spatial']['default_lon']
+    cells = list(h3.grid_disk(h3.latlng_to_cell(lat, lon, prefetcher.resolution), args.rings))
+    prefetcher.request(cells)
+
+    started = time.perf_counter()
+    prefetcher.refresh()
+    grid = prefetcher.grid
+    print(f"Fetched {len(grid)} cells x {grid.n_hours} hours in {time.perf_counter() - started:.2f}s "
+          f"({prefetcher.errors} errors)")
+
+    # Random rows inside the fetched cells at random hours of the forecast window
+    rng = np.random.default_rng(0)
+    spread = 0.1 * (args.rings + 1)
+    lats = lat + rng.uniform(-spread, spread, args.rows)
+    lons = lon + rng.uniform(-spread, spread, args.rows)
+    times = grid.base + rng.integers(0, grid.n_hours, args.rows).astype('timedelta64[h]')
+
+    timings = []
+    for _ in range(5):
+        started = time.perf_counter()
+        features, touched = grid.gather(lats, lons, times)
+        timings.append((time.perf_counter() - started) * 1000)
+    covered = np.mean(features['temperature'] != WEATHER_DEFAULTS['temperature'])
+    print(f"gather {args.rows} rows: p50={np.median(timings):.1f}ms, "
+          f"{covered:.1%} rows with a forecast, {sum(cell not in grid.cell_to_idx for cell in touched)} cells outside the grid")
+    for name in WEATHER_FEATURES:
+        print(f"  {name:14s} min={features[name].min():8.2f}  max={features[name].max():8.2f}")
+
+    if server is not None:
+        print(f"Stub served {server.requests} requests")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
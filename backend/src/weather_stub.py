@@ -0,0 +1,119 @@
+"""
+Local stub weather server for CongestionAI
+Serves deterministic OpenWeatherMap-style /forecast and /weather responses so
+the weather prefetcher can be exercised without network access or an API key.
+
+Run with: python -m src.weather_stub --port 8765
+and point the API at it with WEATHER_API_URL=http://127.0.0.1:8765
+"""
+
+import argparse
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+STEP_SECONDS = 3 * 3600  # /forecast resolution, as in the OpenWeatherMap 5 day / 3 hour API
+
+
+def stub_conditions(lat: float, lon: float, epoch: int) -> Dict:
+    """Smooth, deterministic conditions for a place and time (UTC epoch seconds)"""
+    hours = epoch / 3600
+    local_hour = (hours + lon / 15) % 24
+    phase = math.sin(math.radians(lat * 7 + lon * 3) + hours / 17)
+
+    temp = 15 - abs(lat) / 6 + 6 * math.sin(2 * math.pi * (local_hour - 9) / 24) + 3 * phase
+    rain = max(0.0, 6 * math.sin(hours / 11 + lat) - 3)
+    conditions = {
+        'main': {'temp': round(temp, 2), 'humidity': round(60 + 25 * phase)},
+        'visibility': int(10000 - 700 * rain),
+        'wind': {'speed': round(4 + 3 * abs(phase), 2)},
+    }
+    if rain > 0:
+        conditions['rain'] = {'3h': round(3 * rain, 2)}
+    return conditions
+
+
+def forecast_payload(lat: float, lon: float, now: Optional[float] = None, count: int = 40) -> Dict:
+    """OpenWeatherMap /forecast response: count 3-hourly steps from the current step"""
+    start = int(now if now is not None else time.time()) // STEP_SECONDS * STEP_SECONDS
+    steps = []
+    for i in range(count):
+        epoch = start + i * STEP_SECONDS
+        steps.append({'dt': epoch, **stub_conditions(lat, lon, epoch)})
+    return {
+        'cod': '200',
+        'cnt': count,
+        'list': steps,
+        'city': {'coord': {'lat': lat, 'lon': lon}, 'timezone': int(round(lon / 15)) * 3600},
+    }
+
+
+class StubWeatherHandler(BaseHTTPRequestHandler):
+    """GET /forecast and /weather with lat/lon query parameters"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            lat, lon = float(query['lat'][0]), float(query['lon'][0])
+        except (KeyError, ValueError):
+            self._send(400, {'cod': '400', 'message': 'lat and lon are required'})
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.server.requests += 1
+
+        if url.path.endswith('/forecast'):
+            self._send(200, forecast_payload(lat, lon, count=int(query.get('cnt', ['40'])[0])))
+        elif url.path.endswith('/weather'):
+            epoch = int(time.time())
+            self._send(200, {'dt': epoch, 'coord': {'lat': lat, 'lon': lon}, **stub_conditions(lat, lon, epoch)})
+        else:
+            self._send(404, {'cod': '404', 'message': 'unknown endpoint'})
+
+    def _send(self, status: int, payload: Dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, latency: float = 0.0) -> Tuple[ThreadingHTTPServer, str]:
+    """Serve the stub on a background thread; returns (server, base URL). Port 0 picks a free port."""
+    server = ThreadingHTTPServer((host, port), StubWeatherHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CongestionAI stub weather server")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds of delay added to every response")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), StubWeatherHandler)
+    server.latency = args.latency
+    server.requests = 0
+    print(f"Stub weather server on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
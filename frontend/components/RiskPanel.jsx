@@ -132,7 +132,7 @@ export default function RiskPanel({ data, onClose }) {
             <div className="bg-gray-50/80 backdrop-blur-sm p-2 rounded-lg">
               <p className="text-xs text-gray-600 mb-0.5">Confidence</p>
               <p className="text-2xl font-bold text-primary">
-                {(data.confidence * 100).toFixed(0)}%
+                {data.confidence != null ? `${(data.confidence * 100).toFixed(0)}%` : '—'}
               </p>
             </div>
           </div>
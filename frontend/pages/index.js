@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import dynamic from 'next/dynamic';
 import Head from 'next/head';
 import { Card, CardContent } from '@/components/ui/card';
@@ -90,9 +90,43 @@ export default function Home() {
   const [searchQuery, setSearchQuery] = useState('');
   const [showAIAssistant, setShowAIAssistant] = useState(false);
 
+  const subscriptionRef = useRef(null);
+
+  // Live heatmap: subscribe once, then the server pushes only the cells that change
   useEffect(() => {
-    fetchPredictions();
-  }, [hoursAhead]);
+    const params = areaSubscription();
+    if (subscriptionRef.current) {
+      subscriptionRef.current.update(params);
+      return;
+    }
+    setLoading(true);
+    subscriptionRef.current = congestionAPI.subscribeArea(
+      params,
+      (rows) => {
+        setPredictions(rows);
+        setLoading(false);
+      },
+      () => {
+        // No WebSocket support on the backend: fall back to one-off batch requests
+        subscriptionRef.current = null;
+        fetchPredictions();
+      }
+    );
+  }, [hoursAhead, center]);
+
+  useEffect(() => () => subscriptionRef.current?.close(), []);
+
+  const areaSubscription = () => {
+    // Same extent as the batch grid below
+    const gridSize = viewMode === 'roads' ? 10 : 8;
+    const spacing = viewMode === 'roads' ? 0.006 : 0.02;
+    const half = (gridSize * spacing) / 2;
+    return {
+      bbox: [center[0] - half, center[1] - half, center[0] + half, center[1] + half],
+      zoom,
+      hours_ahead: hoursAhead,
+    };
+  };
 
   const fetchPredictions = async () => {
     setLoading(true);
@@ -132,7 +166,12 @@ export default function Home() {
   };
 
   const handleRefresh = () => {
-    fetchPredictions();
+    if (subscriptionRef.current) {
+      // Resubscribing returns a fresh snapshot
+      subscriptionRef.current.update(areaSubscription());
+    } else {
+      fetchPredictions();
+    }
   };
 
   const handleLocationSelect = (areaName) => {
@@ -299,10 +338,12 @@ export default function Home() {
                   setZoom(15); // Zoom in closer for destination
                   setSelectedArea(matchingArea);
                   
-                  // Fetch predictions for the new location
-                  setTimeout(() => {
-                    fetchPredictions();
-                  }, 500);
+                  // The live subscription follows the new center; otherwise fetch once
+                  if (!subscriptionRef.current) {
+                    setTimeout(() => {
+                      fetchPredictions();
+                    }, 500);
+                  }
                 } else {
                   console.log('Location not found in AREAS:', routeData.destination);
                 }
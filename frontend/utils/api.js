@@ -5,6 +5,7 @@
 import axios from 'axios';
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
+const WS_BASE_URL = API_BASE_URL.replace(/^http/, 'ws');
 
 export const api = axios.create({
   baseURL: API_BASE_URL,
@@ -96,6 +97,66 @@ export const congestionAPI = {
     return response.data;
   },
 
+  /**
+   * Live predictions for an area over WebSocket.
+   * params: { bbox: [minLat, minLon, maxLat, maxLon], zoom, hours_ahead }.
+   * The server sends a snapshot, then only the cells whose score changed;
+   * onUpdate receives the full list of predictions after each message.
+   * Returns { update(params), close() }; update switches area or horizon
+   * on the same connection.
+   */
+  subscribeArea: (params, onUpdate, onError) => {
+    const socket = new WebSocket(`${WS_BASE_URL}/ws/area`);
+    let current = params;
+    let rows = [];
+    let riskLevels = [];
+    let closed = false;
+
+    socket.onopen = () => socket.send(JSON.stringify(current));
+
+    socket.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      if (message.type === 'snapshot') {
+        riskLevels = message.risk_levels;
+        rows = message.cells.map((cell, i) => ({
+          congestion_score: message.score[i],
+          risk_level: riskLevels[message.risk[i]],
+          timestamp: message.timestamp,
+          location: { latitude: message.latitude[i], longitude: message.longitude[i], h3_cell: cell },
+        }));
+      } else if (message.type === 'delta') {
+        rows = rows.slice();
+        message.index.forEach((cellIndex, i) => {
+          rows[cellIndex] = {
+            ...rows[cellIndex],
+            congestion_score: message.score[i],
+            risk_level: riskLevels[message.risk[i]],
+            timestamp: message.timestamp,
+          };
+        });
+      } else {
+        console.error('Subscription error:', message.detail);
+        return;
+      }
+      onUpdate(rows);
+    };
+
+    socket.onerror = () => {
+      if (!closed && onError) onError();
+    };
+
+    return {
+      update: (newParams) => {
+        current = newParams;
+        if (socket.readyState === WebSocket.OPEN) socket.send(JSON.stringify(current));
+      },
+      close: () => {
+        closed = true;
+        socket.close();
+      },
+    };
+  },
+
   /**
    * Get global insights and statistics
    */